@@ -1,13 +1,32 @@
 import base64
 import json
+import os
+import re
 import uuid
-from typing import BinaryIO
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO
 
 import onnx
 import onnx.onnx_pb
 from google.protobuf.message import DecodeError
 from pydantic import ValidationError
 
+from aivmlib.json_scanner import exceeds_json_depth, iter_object_members
+from aivmlib.onnx_scanner import (
+    METADATA_LOCATOR_FIELD_NUMBER,
+    METADATA_PROPS_FIELD_NUMBER,
+    ExternalTensorReference,
+    ProtobufScanError,
+    ProtobufScanLimitError,
+    encode_metadata_locator,
+    encode_metadata_props,
+    read_metadata_props,
+    read_tail_metadata_props,
+    remove_top_level_fields,
+    scan_external_data_tensors,
+    scan_model_fields,
+)
 from aivmlib.schemas.aivm_manifest import (
     DEFAULT_AIVM_MANIFEST,
     AivmManifest,
@@ -19,11 +38,44 @@ from aivmlib.schemas.aivm_manifest import (
 )
 from aivmlib.schemas.aivm_manifest_constants import DEFAULT_ICON_DATA_URL
 from aivmlib.schemas.style_bert_vits2 import StyleBertVITS2HyperParameters
+from aivmlib.utils import get_file_size, pread
 
 
 # AIVM / AIVMX ファイルフォーマットの仕様は下記ドキュメントを参照のこと
 # ref: https://github.com/Aivis-Project/aivmlib#aivm-specification
 
+# AIVM ファイルのヘッダー JSON に __metadata__ を挿入する際に、その位置を特定するための正規表現
+_HEADER_OBJECT_START_PATTERN = re.compile(r'[ \t\n\r]*\{[ \t\n\r]*')
+
+
+@dataclass(frozen=True)
+class AivmParseLimits:
+    """
+    信頼できない AIVM / AIVMX ファイルを読み込む際の、パース処理のリソース上限
+    各上限はメモリの確保や JSON / Protobuf のパースを行う前に検査され、超過時は AivmLimitExceededError が発生する
+    """
+
+    # ヘッダーの最大バイト数 (AIVM: ヘッダー JSON 全体 / AIVMX: metadata_props の合計)
+    max_header_size: int = 16 * 1024 * 1024
+    # AIVM マニフェスト (JSON 文字列) の最大バイト数
+    max_manifest_size: int = 16 * 1024 * 1024
+    # ハイパーパラメータ (JSON 文字列) の最大バイト数
+    max_hyper_parameters_size: int = 1024 * 1024
+    # スタイルベクトル (Base64 文字列) の最大バイト数
+    max_style_vectors_size: int = 4 * 1024 * 1024
+    # アイコン画像・ボイスサンプル音声 1 つあたりの Data URL の最大バイト数
+    max_asset_size: int = 4 * 1024 * 1024
+    # 話者の最大数
+    max_speakers: int = 64
+    # 話者 1 人あたりのスタイルの最大数
+    max_styles_per_speaker: int = 32
+    # スタイル 1 つあたりのボイスサンプルの最大数
+    max_voice_samples_per_style: int = 16
+    # JSON のオブジェクト・配列の入れ子の深さの最大値
+    max_json_depth: int = 32
+    # AIVMX (ONNX) ファイルの ModelProto のトップレベルのフィールドの最大数
+    max_protobuf_fields: int = 1024
+
 
 def _load_and_validate_hyper_parameters_and_style_vectors(
     model_architecture: ModelArchitecture,
@@ -188,12 +240,16 @@ def generate_aivm_metadata(
             for speaker_name, speaker_index in hyper_parameters.data.spk2id.items()
         ]
 
-        return AivmMetadata(
+        aivm_metadata = AivmMetadata(
             manifest=manifest,
             hyper_parameters=hyper_parameters,
             style_vectors=style_vectors,
         )
 
+        # 生成したメタデータをそのまま書き込む場合に、書き込み時のバリデーションを省略できるよう、ここでバリデーションしておく
+        _seed_validated_snapshot(aivm_metadata)
+        return aivm_metadata
+
     raise AivmValidationError(f'Unsupported model architecture: {model_architecture}.')
 
 
@@ -314,7 +370,8 @@ def update_aivm_metadata(
                 # 更新された話者情報を追加
                 updated_speakers.append(
                     AivmManifestSpeaker(
-                        **existing_speaker.model_dump(),  # 既存の話者情報を維持
+                        # 既存の話者情報を維持 (更新する対応言語情報とスタイル情報は除く)
+                        **existing_speaker.model_dump(exclude={'supported_languages', 'styles'}),
                         supported_languages=supported_languages,  # 更新された対応言語情報
                         styles=updated_styles,  # 更新されたスタイル情報リスト
                     )
@@ -381,36 +438,51 @@ def update_aivm_metadata(
                     f"Update resulted in speaker '{speaker.name}' (ID: {speaker.local_id}) having no styles. Each speaker must have at least one style."
                 )
 
-        return AivmMetadata(
+        aivm_metadata = AivmMetadata(
             manifest=manifest,
             hyper_parameters=hyper_parameters,
             style_vectors=style_vectors,
-        ), warnings
+        )
+
+        # 更新したメタデータをそのまま書き込む場合に、書き込み時のバリデーションを省略できるよう、ここでバリデーションしておく
+        _seed_validated_snapshot(aivm_metadata)
+        return aivm_metadata, warnings
 
     raise AivmValidationError(f'Unsupported model architecture: {model_architecture}.')
 
 
-def validate_aivm_metadata(raw_metadata: dict[str, str]) -> AivmMetadata:
+def validate_aivm_metadata(raw_metadata: dict[str, str], limits: AivmParseLimits | None = None) -> AivmMetadata:
     """
     AIVM メタデータをバリデーションする
 
     Args:
         raw_metadata (dict[str, str]): 辞書形式の生のメタデータ
+        limits (AivmParseLimits | None): パース処理のリソース上限 (指定時は Pydantic でのバリデーションの前に検査する)
 
     Returns:
         AivmMetadata: バリデーションが完了した AIVM メタデータ
 
     Raises:
         AivmValidationError: AIVM メタデータのバリデーションに失敗した場合
+        AivmLimitExceededError: リソース上限を超えた場合
     """
 
     # AIVM マニフェストが存在しない場合
-    if not raw_metadata or not raw_metadata.get('aivm_manifest'):
+    if not raw_metadata or not isinstance(raw_metadata, dict) or not raw_metadata.get('aivm_manifest'):
         raise AivmValidationError('AIVM manifest not found.')
 
+    # リソース上限が指定されている場合は、Pydantic でのバリデーションを行う前に検査する
+    ## 検査のためにデコードした AIVM マニフェストの JSON は、そのままバリデーションに使い、2 回デコードしないようにする
+    decoded_manifest = None
+    if limits is not None:
+        decoded_manifest = _check_aivm_metadata_limits(raw_metadata, limits)
+
     # AIVM マニフェストのバリデーション
     try:
-        aivm_manifest = AivmManifest.model_validate_json(raw_metadata['aivm_manifest'])
+        if decoded_manifest is not None:
+            aivm_manifest = AivmManifest.model_validate(decoded_manifest)
+        else:
+            aivm_manifest = AivmManifest.model_validate_json(raw_metadata['aivm_manifest'])
     except ValidationError:
         raise AivmValidationError('Invalid AIVM manifest format.')
 
@@ -443,32 +515,106 @@ def validate_aivm_metadata(raw_metadata: dict[str, str]) -> AivmMetadata:
             raise AivmValidationError('Failed to decode style vectors.')
 
     # AivmMetadata オブジェクトを構築して返す
-    return AivmMetadata(
+    aivm_metadata = AivmMetadata(
         manifest=aivm_manifest,
         hyper_parameters=aivm_hyper_parameters,
         style_vectors=aivm_style_vectors,
     )
 
+    # バリデーションが完了した時点の内容を記録しておく
+    # 読み込んだメタデータを変更せずにそのまま書き込む場合、書き込み時のバリデーションを省略できる
+    aivm_metadata._validated_snapshot = _snapshot_aivm_metadata(aivm_metadata)
+
+    return aivm_metadata
 
-def read_aivm_metadata(aivm_file: BinaryIO) -> AivmMetadata:
+
+def _check_aivm_metadata_limits(raw_metadata: dict[str, str], limits: AivmParseLimits) -> object | None:
     """
-    AIVM ファイルから AIVM メタデータを読み込む
+    辞書形式の生のメタデータが、リソース上限を超えていないかを検査する内部メソッド
+    サイズ・入れ子の深さは JSON をデコードする前に、要素数・アセットのサイズはデコード直後に検査する
+    (サイズの上限によって、デコードにかかる時間とメモリは上限が保証される)
+
+    Returns:
+        object | None: 要素数の検査のためにデコードした AIVM マニフェストの JSON (デコードできなかった場合は None)
+
+    Raises:
+        AivmLimitExceededError: リソース上限を超えた場合
+    """
+
+    def check_size(key: str, limit: int) -> None:
+        value = raw_metadata.get(key)
+        if isinstance(value, str) and len(value.encode('utf-8')) > limit:
+            raise AivmLimitExceededError(f'Size of "{key}" exceeds the limit ({limit} bytes).')
+
+    def check_count(name: str, value: object, limit: int) -> None:
+        if isinstance(value, list) and len(value) > limit:
+            raise AivmLimitExceededError(f'The number of {name} ({len(value)}) exceeds the limit ({limit}).')
+
+    def check_asset(name: str, value: object) -> None:
+        if isinstance(value, str) and len(value) > limits.max_asset_size:
+            raise AivmLimitExceededError(f'Size of {name} exceeds the limit ({limits.max_asset_size} bytes).')
+
+    check_size('aivm_manifest', limits.max_manifest_size)
+    check_size('aivm_hyper_parameters', limits.max_hyper_parameters_size)
+    check_size('aivm_style_vectors', limits.max_style_vectors_size)
+
+    # 深くネストした JSON は、デコードする前に弾く
+    for key in ('aivm_manifest', 'aivm_hyper_parameters'):
+        value = raw_metadata.get(key)
+        try:
+            if isinstance(value, str) and exceeds_json_depth(value, limits.max_json_depth):
+                raise AivmLimitExceededError(
+                    f'JSON nesting depth of "{key}" exceeds the limit ({limits.max_json_depth}).'
+                )
+        except ValueError:
+            # JSON の書式が不正な場合は、後続の Pydantic でのバリデーションでエラーとする
+            pass
+
+    # 話者・スタイル・ボイスサンプルの数と、アイコン画像・ボイスサンプル音声のサイズを検査する
+    ## JSON の書式やスキーマが不正な場合は、後続の Pydantic でのバリデーションでエラーとする
+    try:
+        manifest = json.loads(raw_metadata['aivm_manifest'])
+    except (TypeError, ValueError):
+        return None
+    speakers = manifest.get('speakers') if isinstance(manifest, dict) else None
+    check_count('speakers', speakers, limits.max_speakers)
+    for speaker in speakers if isinstance(speakers, list) else []:
+        if not isinstance(speaker, dict):
+            continue
+        check_asset('speaker icon', speaker.get('icon'))
+        styles = speaker.get('styles')
+        check_count('styles', styles, limits.max_styles_per_speaker)
+        for style in styles if isinstance(styles, list) else []:
+            if not isinstance(style, dict):
+                continue
+            check_asset('style icon', style.get('icon'))
+            voice_samples = style.get('voice_samples')
+            check_count('voice samples', voice_samples, limits.max_voice_samples_per_style)
+            for voice_sample in voice_samples if isinstance(voice_samples, list) else []:
+                if isinstance(voice_sample, dict):
+                    check_asset('voice sample audio', voice_sample.get('audio'))
+    return manifest
+
+
+def _read_aivm_header_bytes(aivm_file: BinaryIO, limits: AivmParseLimits | None = None) -> bytes:
+    """
+    AIVM (Safetensors) ファイルからヘッダー部分 (JSON) のバイト列のみを読み取る内部メソッド
 
     Args:
         aivm_file (BinaryIO): AIVM ファイル
+        limits (AivmParseLimits | None): パース処理のリソース上限 (指定時はヘッダーを読み取る前にサイズを検査する)
 
     Returns:
-        AivmMetadata: AIVM メタデータ
+        bytes: ヘッダー部分のバイト列
 
     Raises:
-        AivmValidationError: AIVM ファイルのフォーマットが不正・AIVM メタデータのバリデーションに失敗した場合
+        AivmValidationError: AIVM ファイルのフォーマットが不正な場合
+        AivmLimitExceededError: ヘッダーサイズがリソース上限を超えている場合
     """
 
-    # 引数として受け取った BinaryIO のカーソルを先頭にシーク
-    aivm_file.seek(0)
-
     # 最初の8バイトを読み取ってヘッダーサイズを取得
-    header_size_bytes = aivm_file.read(8)
+    ## 引数として受け取った BinaryIO のカーソル位置は変更せず、オフセットを指定して読み取る
+    header_size_bytes = pread(aivm_file, 8, 0)
     if len(header_size_bytes) < 8:
         raise AivmValidationError('Failed to read header size. This file is not an AIVM (Safetensors) file.')
     header_size = int.from_bytes(header_size_bytes, 'little')
@@ -477,69 +623,153 @@ def read_aivm_metadata(aivm_file: BinaryIO) -> AivmMetadata:
     if header_size <= 0 or header_size > 100 * 1024 * 1024:  # 100MB を上限とする
         raise AivmValidationError('Invalid header size. This file is not an AIVM (Safetensors) file.')
 
+    # リソース上限が指定されている場合は、ヘッダー分のメモリを確保する前にサイズを検査する
+    if limits is not None and header_size > limits.max_header_size:
+        raise AivmLimitExceededError(
+            f'Header size ({header_size} bytes) exceeds the limit ({limits.max_header_size} bytes).'
+        )
+
     # ヘッダー部分のみを読み取る
     ## Safetensors 形式はヘッダー部分と Weight 部分で明確に分割されているので、
     ## ヘッダーのみを読み取る方が、巨大なモデルファイル全体を読み取るよりも遥かに効率が良い
-    header_bytes = aivm_file.read(header_size)
+    header_bytes = pread(aivm_file, header_size, 8)
     if len(header_bytes) < header_size:
         raise AivmValidationError('Failed to read header.')
 
-    # 引数として受け取った BinaryIO のカーソルを再度先頭に戻す
-    aivm_file.seek(0)
+    return header_bytes
+
+
+def read_aivm_metadata(aivm_file: BinaryIO, limits: AivmParseLimits | None = None) -> AivmMetadata:
+    """
+    AIVM ファイルから AIVM メタデータを読み込む
+    ファイルのカーソル位置は変更しないため、同一のファイルオブジェクトを複数のスレッドから同時に読み込んでもスレッドセーフに動作する
+
+    Args:
+        aivm_file (BinaryIO): AIVM ファイル
+        limits (AivmParseLimits | None): パース処理のリソース上限 (信頼できないファイルを読み込む場合に指定する)
+
+    Returns:
+        AivmMetadata: AIVM メタデータ
+
+    Raises:
+        AivmValidationError: AIVM ファイルのフォーマットが不正・AIVM メタデータのバリデーションに失敗した場合
+        AivmLimitExceededError: リソース上限を超えた場合
+    """
+
+    # AIVM ファイルのヘッダー部分のみを読み取る
+    header_bytes = _read_aivm_header_bytes(aivm_file, limits)
 
     # ヘッダーをデコードして JSON としてパース
-    try:
-        header_text = header_bytes.decode('utf-8')
-        header_json = json.loads(header_text)
-    except (UnicodeDecodeError, json.JSONDecodeError):
-        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.')
+    header_json = _decode_aivm_header(header_bytes, limits)
 
     # "__metadata__" キーから AIVM メタデータを取得
-    raw_metadata = header_json.get('__metadata__')
+    raw_metadata = header_json.get('__metadata__') if isinstance(header_json, dict) else None
 
     # バリデーションを行った上で、AivmMetadata オブジェクトを構築して返す
-    return validate_aivm_metadata(raw_metadata)
+    return validate_aivm_metadata(raw_metadata, limits)
 
 
-def read_aivmx_metadata(aivmx_file: BinaryIO) -> AivmMetadata:
+def _decode_aivm_header(header_bytes: bytes, limits: AivmParseLimits | None = None) -> object:
+    """
+    AIVM (Safetensors) ファイルのヘッダー部分のバイト列を、JSON としてデコードする内部メソッド
+
+    Args:
+        header_bytes (bytes): ヘッダー部分のバイト列
+        limits (AivmParseLimits | None): パース処理のリソース上限 (指定時はデコード前に JSON のネストの深さを検査する)
+
+    Returns:
+        object: デコードしたヘッダー JSON
+
+    Raises:
+        AivmValidationError: ヘッダーが JSON としてデコードできない場合
+        AivmLimitExceededError: JSON のネストの深さがリソース上限を超えている場合
+    """
+
+    try:
+        header_text = header_bytes.decode('utf-8')
+        if limits is not None and exceeds_json_depth(header_text, limits.max_json_depth):
+            raise AivmLimitExceededError(f'Header JSON nesting depth exceeds the limit ({limits.max_json_depth}).')
+        return json.loads(header_text)
+    except (UnicodeDecodeError, ValueError):
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.')
+
+
+def read_aivmx_metadata(
+    aivmx_file: BinaryIO,
+    external_data_dir: Path | None = None,
+    limits: AivmParseLimits | None = None,
+) -> AivmMetadata:
     """
     AIVMX ファイルから AIVM メタデータを読み込む
+    重みを外部データ (External Data) として別ファイルに保存した AIVMX ファイルの場合も、外部データファイルは読み込まない
+    ファイルのカーソル位置は変更しないため、同一のファイルオブジェクトを複数のスレッドから同時に読み込んでもスレッドセーフに動作する
 
     Args:
         aivmx_file (BinaryIO): AIVMX ファイル
+        external_data_dir (Path | None): 外部データファイルが配置されているディレクトリ
+            (指定時のみ、グラフ内に外部データを参照するテンソルが存在すれば、その参照が正しく解決できるかを検証する)
+            外部データを参照するテンソルの有無はグラフ内のフィールドのヘッダー部分のみを走査して判定するため、ONNX モデル全体はパースしない
+        limits (AivmParseLimits | None): パース処理のリソース上限 (信頼できないファイルを読み込む場合に指定する)
 
     Returns:
         AivmMetadata: AIVM メタデータ
 
     Raises:
-        AivmValidationError: AIVMX ファイルのフォーマットが不正・AIVM メタデータのバリデーションに失敗した場合
+        AivmValidationError: AIVMX ファイルのフォーマットが不正・外部データへの参照を解決できない・AIVM メタデータのバリデーションに失敗した場合
+        AivmLimitExceededError: リソース上限を超えた場合
     """
 
-    # 引数として受け取った BinaryIO のカーソルを先頭にシーク
-    aivmx_file.seek(0)
-
-    # ONNX モデル (Protobuf) をロード
+    # ONNX モデル (Protobuf) 全体はパースせず、トップレベルの metadata_props のみを読み取る
+    ## 巨大なグラフ (重み) を含むフィールドは読み飛ばされるため、ファイルサイズによらず高速に読み込める
     try:
-        model = onnx.load_model(aivmx_file, format='protobuf', load_external_data=False)
-    except DecodeError:
-        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+        # metadata_props がロケーターとともにファイル末尾に配置されている場合は、ファイル末尾のみを読み取る
+        raw_metadata = read_tail_metadata_props(
+            aivmx_file, max_size=limits.max_header_size if limits is not None else None
+        )
 
-    # 引数として受け取った BinaryIO のカーソルを再度先頭に戻す
-    aivmx_file.seek(0)
+        # ロケーターが存在しない・無効な場合は、トップレベルのフィールドを先頭から走査する
+        if raw_metadata is None:
+            fields = scan_model_fields(
+                aivmx_file, max_fields=limits.max_protobuf_fields if limits is not None else None
+            )
+
+            # リソース上限が指定されている場合は、metadata_props を読み込む前に合計サイズを検査する
+            if limits is not None:
+                metadata_props_size = sum(
+                    field.end - field.offset for field in fields if field.number == METADATA_PROPS_FIELD_NUMBER
+                )
+                if metadata_props_size > limits.max_header_size:
+                    raise AivmLimitExceededError(
+                        f'Metadata size ({metadata_props_size} bytes) exceeds the limit ({limits.max_header_size} bytes).'
+                    )
+
+            raw_metadata = read_metadata_props(aivmx_file, fields)
+    except ProtobufScanLimitError as ex:
+        raise AivmLimitExceededError(str(ex))
+    except ProtobufScanError:
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
 
-    # AIVM メタデータを取得
-    raw_metadata = {prop.key: prop.value for prop in model.metadata_props}
+    # 外部データへの参照が正しく解決できるかを検証
+    ## 外部データへの参照はグラフ内のテンソルに含まれるため、グラフ内のフィールドのヘッダー部分のみを走査して参照情報を取り出す
+    ## 外部データを参照するテンソルが存在しなければ、検証は何も行わない
+    if external_data_dir is not None:
+        references = _scan_aivmx_external_data(
+            aivmx_file, max_fields=limits.max_protobuf_fields if limits is not None else None
+        )
+        _validate_aivmx_external_data(references, external_data_dir)
 
     # バリデーションを行った上で、AivmMetadata オブジェクトを構築して返す
-    return validate_aivm_metadata(raw_metadata)
+    return validate_aivm_metadata(raw_metadata, limits)
 
 
-def serialize_aivm_metadata(aivm_metadata: AivmMetadata) -> dict[str, str]:
+def serialize_aivm_metadata(aivm_metadata: AivmMetadata, canonical: bool = False) -> dict[str, str]:
     """
     AIVM メタデータを生の辞書形式にシリアライズする
 
     Args:
         aivm_metadata (AivmMetadata): AIVM メタデータ
+        canonical (bool): True の場合、オブジェクトの構築方法 (辞書の挿入順など) によらず、
+            論理的に同一の AIVM メタデータからは常に同一の文字列が得られる正規形でシリアライズする
 
     Returns:
         dict[str, str]: シリアライズされた AIVM メタデータ（文字列から文字列へのマップ）
@@ -549,8 +779,14 @@ def serialize_aivm_metadata(aivm_metadata: AivmMetadata) -> dict[str, str]:
     # Safetensors / ONNX のメタデータ領域はネストなしの string から string への map でなければならないため、
     # すべてのメタデータを文字列にシリアライズして格納する
     raw_metadata = {}
-    raw_metadata['aivm_manifest'] = aivm_metadata.manifest.model_dump_json()
-    raw_metadata['aivm_hyper_parameters'] = aivm_metadata.hyper_parameters.model_dump_json()
+    if canonical:
+        raw_metadata['aivm_manifest'] = _dump_canonical_json(aivm_metadata.manifest.model_dump(mode='json'))
+        raw_metadata['aivm_hyper_parameters'] = _dump_canonical_json(
+            aivm_metadata.hyper_parameters.model_dump(mode='json')
+        )
+    else:
+        raw_metadata['aivm_manifest'] = aivm_metadata.manifest.model_dump_json()
+        raw_metadata['aivm_hyper_parameters'] = aivm_metadata.hyper_parameters.model_dump_json()
 
     # スタイルベクトルが存在する場合は Base64 エンコードして追加
     if aivm_metadata.style_vectors is not None:
@@ -559,50 +795,242 @@ def serialize_aivm_metadata(aivm_metadata: AivmMetadata) -> dict[str, str]:
     return raw_metadata
 
 
-def write_aivm_metadata(aivm_file: BinaryIO, aivm_metadata: AivmMetadata) -> bytes:
+def _dump_canonical_json(value: object) -> str:
     """
-    AIVM メタデータを AIVM ファイルに書き込む
+    値を正規形の JSON 文字列にシリアライズする内部メソッド
+    オブジェクトのキーは常にソートし、区切り文字の前後に空白を入れず、非 ASCII 文字はエスケープせずに出力する
+    """
+
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def _serialize_and_validate_aivm_metadata(aivm_metadata: AivmMetadata, canonical: bool = False) -> dict[str, str]:
+    """
+    AIVM メタデータを書き込む前にバリデーションした上で、シリアライズする内部メソッド
+    前回のバリデーション時から内容が変わっていない項目は、再度のバリデーションを省略する
 
     Args:
-        aivm_file (BinaryIO): AIVM ファイル
         aivm_metadata (AivmMetadata): AIVM メタデータ
+        canonical (bool): True の場合、正規形でシリアライズする
 
     Returns:
-        bytes: 書き込みが完了した AIVM ファイルのバイト列
+        dict[str, str]: シリアライズ・バリデーションが完了した AIVM メタデータ（文字列から文字列へのマップ）
 
     Raises:
-        AivmValidationError: AIVM ファイルのフォーマットが不正・スタイルベクトルが未指定の場合
+        AivmValidationError: AIVM メタデータのバリデーションに失敗した場合
     """
 
-    # モデル形式を Safetensors に設定
-    # AIVM ファイルのモデル形式は Safetensors のため、AIVM マニフェストにも明示的に反映する
-    aivm_metadata.manifest.model_format = ModelFormat.Safetensors
+    # メモリ上の Pydantic モデルを直接バリデーションする (シリアライズした JSON 文字列をパースし直すことはしない)
+    # スタイルベクトルはメモリ上のバイト列をエンコードするだけなので、デコードできることが保証されている
+    _validate_aivm_metadata_models(aivm_metadata)
+
+    # AIVM メタデータをシリアライズ
+    # ここでシリアライズした文字列は、そのままファイルへの書き込みに使われる
+    return serialize_aivm_metadata(aivm_metadata, canonical)
+
+
+def _snapshot_aivm_metadata(aivm_metadata: AivmMetadata) -> dict[str, dict[str, Any]]:
+    """
+    バリデーション済みかどうかを判定するために、AIVM マニフェストとハイパーパラメータの内容を辞書として取り出す内部メソッド
+    モデル形式は書き込み時に必ず書き込み先のファイル形式で上書きされるため、比較の対象から除外する
+    (辞書に取り出す際に文字列はコピーされないため、巨大な Data URL を含む場合でも低コストで取り出し・比較できる)
+    """
+
+    return {
+        'aivm_manifest': aivm_metadata.manifest.model_dump(exclude={'model_format'}),
+        'aivm_hyper_parameters': aivm_metadata.hyper_parameters.model_dump(),
+    }
+
+
+def _validate_aivm_metadata_models(aivm_metadata: AivmMetadata) -> None:
+    """
+    AIVM メタデータの AIVM マニフェストとハイパーパラメータを、JSON 文字列を経由せずにバリデーションする内部メソッド
+    前回のバリデーション時から内容が変わっていない項目は、再度のバリデーションを省略する
+    Pydantic モデルは属性への代入時にはバリデーションされないため、書き込む前にここで改めてバリデーションする
+
+    Args:
+        aivm_metadata (AivmMetadata): AIVM メタデータ
+
+    Raises:
+        AivmValidationError: AIVM メタデータのバリデーションに失敗した場合
+    """
+
+    snapshot = _snapshot_aivm_metadata(aivm_metadata)
+    validated_snapshot = aivm_metadata._validated_snapshot or {}
+
+    # AIVM マニフェストのバリデーション
+    # 前回バリデーションした時点から内容が変わっていなければ、正規表現でのチェックなどをやり直す必要はない
+    if snapshot['aivm_manifest'] != validated_snapshot.get('aivm_manifest'):
+        try:
+            AivmManifest.model_validate(
+                {**snapshot['aivm_manifest'], 'model_format': aivm_metadata.manifest.model_format}
+            )
+        except ValidationError:
+            raise AivmValidationError('Invalid AIVM manifest format.')
+
+    # ハイパーパラメータのバリデーション
+    if snapshot['aivm_hyper_parameters'] != validated_snapshot.get('aivm_hyper_parameters'):
+        if aivm_metadata.manifest.model_architecture not in [
+            ModelArchitecture.StyleBertVITS2,
+            ModelArchitecture.StyleBertVITS2JPExtra,
+        ]:
+            raise AivmValidationError(
+                f'Unsupported hyper-parameters for model architecture: {aivm_metadata.manifest.model_architecture}.'
+            )
+        try:
+            StyleBertVITS2HyperParameters.model_validate(snapshot['aivm_hyper_parameters'])
+        except ValidationError:
+            raise AivmValidationError('Invalid hyper-parameters format.')
+
+    # 次回の書き込み時にバリデーションを省略できるよう、バリデーション済みの内容を記録する
+    aivm_metadata._validated_snapshot = snapshot
+
+
+def _seed_validated_snapshot(aivm_metadata: AivmMetadata) -> None:
+    """
+    生成・更新した AIVM メタデータをバリデーションし、成功した場合はバリデーション済みの内容として記録する内部メソッド
+    バリデーションに失敗した場合は何も記録しない (呼び出し元で内容を修正してから書き込めるよう、ここではエラーとしない)
+    """
+
+    try:
+        _validate_aivm_metadata_models(aivm_metadata)
+    except AivmValidationError:
+        pass
+
+
+def _prepare_aivm_metadata_for_write(
+    aivm_metadata: AivmMetadata,
+    model_format: ModelFormat,
+    canonical: bool = False,
+) -> dict[str, str]:
+    """
+    AIVM メタデータを書き込む前の共通処理として、モデル形式とハイパーパラメータを反映した上でシリアライズ・バリデーションする内部メソッド
+
+    Args:
+        aivm_metadata (AivmMetadata): AIVM メタデータ
+        model_format (ModelFormat): 書き込み先のファイルのモデル形式
+        canonical (bool): True の場合、正規形でシリアライズする
+
+    Returns:
+        dict[str, str]: シリアライズ・バリデーションが完了した AIVM メタデータ（文字列から文字列へのマップ）
+
+    Raises:
+        AivmValidationError: AIVM メタデータのバリデーションに失敗した・スタイルベクトルが未指定の場合
+    """
+
+    # モデル形式を設定
+    # AIVM ファイルのモデル形式は Safetensors 、AIVMX ファイルのモデル形式は ONNX のため、AIVM マニフェストにも明示的に反映する
+    aivm_metadata.manifest.model_format = model_format
 
     # AIVM マニフェストの内容をハイパーパラメータにも反映する
     # 結果は AivmMetadata オブジェクトに直接 in-place で反映される
     apply_aivm_manifest_to_hyper_parameters(aivm_metadata)
 
     # AIVM メタデータをシリアライズした上で、書き込む前にバリデーションを行う
-    raw_metadata = serialize_aivm_metadata(aivm_metadata)
-    validate_aivm_metadata(raw_metadata)
+    return _serialize_and_validate_aivm_metadata(aivm_metadata, canonical)
 
-    # 引数として受け取った BinaryIO のカーソルを先頭にシーク
-    aivm_file.seek(0)
 
-    # AIVM ファイルの内容を一度に読み取る
-    aivm_file_buffer = aivm_file.read()
-    existing_header_size = int.from_bytes(aivm_file_buffer[:8], 'little')
-    existing_header_bytes = aivm_file_buffer[8 : 8 + existing_header_size]
-    existing_header_text = existing_header_bytes.decode('utf-8')
+def write_aivm_metadata(aivm_file: BinaryIO, aivm_metadata: AivmMetadata, canonical: bool = False) -> bytes:
+    """
+    AIVM メタデータを AIVM ファイルに書き込む
+    ファイル全体をメモリ上に構築して返すため、巨大なファイルの場合は aivmlib.writer.write_aivm_file() を用いること
+
+    Args:
+        aivm_file (BinaryIO): AIVM ファイル
+        aivm_metadata (AivmMetadata): AIVM メタデータ
+        canonical (bool): True の場合、論理的に同一の AIVM メタデータ・テンソルからは常に同一のバイト列が得られるよう、
+            AIVM メタデータとヘッダー JSON 全体を正規形でシリアライズする (既存のヘッダーのキーの順序や空白は保持されない)
+
+    Returns:
+        bytes: 書き込みが完了した AIVM ファイルのバイト列
+
+    Raises:
+        AivmValidationError: AIVM ファイルのフォーマットが不正・スタイルベクトルが未指定の場合
+    """
+
+    # AIVM メタデータをシリアライズした上で、書き込む前にバリデーションを行う
+    raw_metadata = _prepare_aivm_metadata_for_write(aivm_metadata, ModelFormat.Safetensors, canonical)
+
+    # AIVM メタデータを書き込んだ新しいヘッダーを構築
+    new_header, payload_offset = _build_aivm_header(aivm_file, raw_metadata, canonical)
+
+    # 新しい AIVM ファイルの内容を作成
+    ## ヘッダー以降の Weight 部分は、オフセットを指定してそのまま読み取る
+    payload_bytes = pread(aivm_file, get_file_size(aivm_file) - payload_offset, payload_offset)
+    new_aivm_file_content = new_header + payload_bytes
+
+    return new_aivm_file_content
+
+
+def _build_aivm_header(
+    aivm_file: BinaryIO,
+    raw_metadata: dict[str, str],
+    canonical: bool = False,
+) -> tuple[bytes, int]:
+    """
+    シリアライズ済みの AIVM メタデータを書き込んだ、新しい AIVM ファイルのヘッダー部分 (ヘッダーサイズを含む) を構築する内部メソッド
+    ヘッダー以降の Weight 部分は読み込まず、元の AIVM ファイル内での開始オフセットのみを返す
+
+    Args:
+        aivm_file (BinaryIO): AIVM ファイル
+        raw_metadata (dict[str, str]): シリアライズ・バリデーション済みの AIVM メタデータ
+        canonical (bool): True の場合、ヘッダー JSON 全体を正規形でシリアライズする
+
+    Returns:
+        tuple[bytes, int]: ヘッダーサイズとヘッダー JSON を連結したバイト列と、元の AIVM ファイルでの Weight 部分の開始オフセット
+
+    Raises:
+        AivmValidationError: AIVM ファイルのフォーマットが不正な場合
+    """
+
+    # AIVM ファイルのヘッダー部分を読み取る
+    ## 引数として受け取った BinaryIO のカーソル位置は変更しないため、このメソッドの終了後もカーソル位置はそのまま保たれる
+    existing_header_bytes = _read_aivm_header_bytes(aivm_file)
+    existing_header_size = len(existing_header_bytes)
+    try:
+        existing_header_text = existing_header_bytes.decode('utf-8')
+    except UnicodeDecodeError:
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.')
+
+    # ヘッダー JSON を UTF-8 にエンコード
+    new_header_bytes = _rebuild_aivm_header_text(existing_header_text, raw_metadata, canonical).encode('utf-8')
+
+    # ヘッダーサイズを 8 バイトの符号なし Little-Endian 64bit 整数に変換
+    new_header_size = len(new_header_bytes).to_bytes(8, 'little')
+
+    return new_header_size + new_header_bytes, 8 + existing_header_size
+
+
+def _rebuild_aivm_header_text(existing_header_text: str, raw_metadata: dict[str, str], canonical: bool = False) -> str:
+    """
+    既存のヘッダー JSON に、シリアライズ済みの AIVM メタデータを書き込んだ新しいヘッダー JSON を構築する内部メソッド
+
+    Args:
+        existing_header_text (str): 既存のヘッダー JSON
+        raw_metadata (dict[str, str]): シリアライズ・バリデーション済みの AIVM メタデータ
+        canonical (bool): True の場合、ヘッダー JSON 全体を正規形でシリアライズする
+
+    Returns:
+        str: 新しいヘッダー JSON
+
+    Raises:
+        AivmValidationError: ヘッダー JSON のフォーマットが不正な場合
+    """
+
+    # ヘッダー JSON のうち __metadata__ の値の部分のみを新しいメタデータに置き換える
+    ## ヘッダーの大半を占めるテンソル情報はデコード・再エンコードせず、元のバイト列のまま保持する
+    ## 正規形で書き込む場合は既存のヘッダーの書式を保持しないため、常にヘッダー JSON 全体をパースし直す
+    new_header_text = None if canonical else _splice_aivm_header_metadata(existing_header_text, raw_metadata)
+    if new_header_text is not None:
+        return new_header_text
+
+    # __metadata__ の位置を特定できない不規則なヘッダーの場合は、ヘッダー JSON 全体をパースし直して再エンコードする
     try:
         existing_header = json.loads(existing_header_text)
     except json.JSONDecodeError:
         raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.')
-
-    # 引数として受け取った BinaryIO のカーソルを再度先頭に戻す (重要)
-    # ファイルポインタを先頭に戻さないと、このメソッド終了後にユーザーがファイルを使用する際に
-    # カーソルが末尾にある状態となり、正しく読み書きできなくなる可能性がある
-    aivm_file.seek(0)
+    if not isinstance(existing_header, dict):
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.')
 
     # 既存の __metadata__ を取得または新規作成
     existing_metadata = existing_header.get('__metadata__', {})
@@ -612,59 +1040,130 @@ def write_aivm_metadata(aivm_file: BinaryIO, aivm_metadata: AivmMetadata) -> byt
     existing_metadata.update(raw_metadata)
     existing_header['__metadata__'] = existing_metadata
 
-    # ヘッダー JSON を UTF-8 にエンコード
-    new_header_text = json.dumps(existing_header)
-    new_header_bytes = new_header_text.encode('utf-8')
+    # ヘッダー JSON を再エンコード
+    if canonical:
+        return _dump_canonical_aivm_header(existing_header)
+    return json.dumps(existing_header)
 
-    # ヘッダーサイズを 8 バイトの符号なし Little-Endian 64bit 整数に変換
-    new_header_size = len(new_header_bytes).to_bytes(8, 'little')
 
-    # 新しい AIVM ファイルの内容を作成
-    new_aivm_file_content = new_header_size + new_header_bytes + aivm_file_buffer[8 + existing_header_size :]
+def _dump_canonical_aivm_header(header: dict) -> str:
+    """
+    AIVM ファイルのヘッダー JSON を正規形でシリアライズする内部メソッド
+    __metadata__ を先頭に置いた上で残りのテンソル情報を名前順に並べ、すべてのオブジェクトのキーをソートする
+    Safetensors の慣例に従い、Weight 部分の開始位置が 8 バイト境界に揃うよう、末尾を空白でパディングする
+    (テンソルの data_offsets は Weight 部分の先頭からの相対位置のため、ヘッダーサイズが変わっても影響しない)
+    """
 
-    return new_aivm_file_content
+    members = []
+    if '__metadata__' in header:
+        members.append('"__metadata__":' + _dump_canonical_json(header['__metadata__']))
+    for name in sorted(key for key in header if key != '__metadata__'):
+        members.append(_dump_canonical_json(name) + ':' + _dump_canonical_json(header[name]))
+    header_text = '{' + ','.join(members) + '}'
 
+    # ヘッダーサイズ (8 バイト) とヘッダー JSON の合計が 8 の倍数になるようにパディングする
+    padding = -len(header_text.encode('utf-8')) % 8
+    return header_text + ' ' * padding
 
-def write_aivmx_metadata(aivmx_file: BinaryIO, aivm_metadata: AivmMetadata) -> bytes:
+
+def _splice_aivm_header_metadata(header_text: str, raw_metadata: dict[str, str]) -> str | None:
+    """
+    ヘッダー JSON の __metadata__ の値の範囲のみを、新しいメタデータをマージした JSON に置き換える内部メソッド
+    __metadata__ はオブジェクト内のどの位置にあってもよく、存在しない場合はオブジェクトの先頭に挿入する
+
+    Args:
+        header_text (str): 既存のヘッダー JSON
+        raw_metadata (dict[str, str]): 書き込むメタデータ
+
+    Returns:
+        str | None: __metadata__ を置き換えたヘッダー JSON (__metadata__ が重複している・エスケープされたキーが含まれるなど、
+            ヘッダーが不規則で範囲を安全に特定できない場合は None)
+    """
+
+    # ヘッダーのトップレベルのメンバーを走査し、__metadata__ の値の範囲を特定する
+    ## テンソル情報の値はデコードせずに読み飛ばす
+    ## エスケープされたキー (ex: "\u005f_metadata__") が含まれる場合は、安全側に倒してヘッダー JSON 全体をパースし直す
+    metadata_span: tuple[int, int] | None = None
+    try:
+        for key, key_start, value_start, value_end in iter_object_members(header_text):
+            if '\\' in header_text[key_start:value_start]:
+                return None
+            if key == '__metadata__':
+                # キーが重複している場合、どちらの値が有効になるかはパーサーに依存するため置き換えない
+                if metadata_span is not None:
+                    return None
+                metadata_span = (value_start, value_end)
+    except ValueError:
+        return None
+
+    # __metadata__ がヘッダーのどこにも存在しない場合は、オブジェクトの開き括弧の直後に挿入する
+    if metadata_span is None:
+        object_match = _HEADER_OBJECT_START_PATTERN.match(header_text)
+        if object_match is None:
+            return None
+        separator = '' if header_text.startswith('}', object_match.end()) else ', '
+        metadata_member = '"__metadata__": ' + json.dumps(raw_metadata) + separator
+        return header_text[: object_match.end()] + metadata_member + header_text[object_match.end() :]
+
+    # 既存の __metadata__ の値のみをパースし、新しいメタデータをマージする
+    ## 既に存在するキーは上書きされる
+    value_start, value_end = metadata_span
+    try:
+        existing_metadata = json.loads(header_text[value_start:value_end])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(existing_metadata, dict):
+        return None
+    existing_metadata.update(raw_metadata)
+    return header_text[:value_start] + json.dumps(existing_metadata) + header_text[value_end:]
+
+
+def write_aivmx_metadata(
+    aivmx_file: BinaryIO,
+    aivm_metadata: AivmMetadata,
+    external_data_dir: Path | None = None,
+    canonical: bool = False,
+    tail_metadata: bool = False,
+) -> bytes:
     """
     AIVM メタデータを AIVMX ファイルに書き込む
+    重みを外部データ (External Data) として別ファイルに保存した AIVMX ファイルの場合、外部データファイルには一切触れず、
+    外部データへの参照を保持したままの小さな ONNX モデル (Protobuf) のみを返す
+    2GB を超える ONNX モデルは Protobuf の制約上単一ファイルに格納できないため、外部データ形式で保存する必要がある
+    ONNX モデル全体をメモリ上にロードするため、巨大なファイルの場合は aivmlib.writer.write_aivmx_file() を用いること
 
     Args:
         aivmx_file (BinaryIO): AIVMX ファイル
         aivm_metadata (AivmMetadata): AIVM メタデータ
+        external_data_dir (Path | None): 外部データファイルが配置されているディレクトリ
+            (省略時は aivmx_file のファイル名から推定し、推定できなければ外部データへの参照の検証を行わない)
+        canonical (bool): True の場合、論理的に同一の AIVM メタデータ・ONNX モデルからは常に同一のバイト列が得られるよう、
+            AIVM メタデータを正規形でシリアライズし、metadata_props をキー順に並べ直した上で決定的にシリアライズする
+        tail_metadata (bool): True の場合、metadata_props をファイル末尾に配置し、その位置を示す固定長のロケーターを付加する
+            read_aivmx_metadata() はファイル末尾のみを読み取って AIVM メタデータを取得できるようになる
+            (Protobuf のフィールドは任意の順序で出現でき、ロケーターは未知のフィールドとして無視されるため、有効な ONNX モデルのままとなる)
 
     Returns:
         bytes: 書き込みが完了した AIVMX ファイルのバイト列
 
     Raises:
-        AivmValidationError: AIVMX ファイルのフォーマットが不正・スタイルベクトルが未指定の場合
+        AivmValidationError: AIVMX ファイルのフォーマットが不正・外部データへの参照を解決できない・スタイルベクトルが未指定の場合
     """
 
-    # モデル形式を ONNX に設定
-    # AIVMX ファイルのモデル形式は ONNX のため、AIVM マニフェストにも明示的に反映する
-    aivm_metadata.manifest.model_format = ModelFormat.ONNX
-
-    # AIVM マニフェストの内容をハイパーパラメータにも反映する
-    # 結果は AivmMetadata オブジェクトに直接 in-place で反映される
-    apply_aivm_manifest_to_hyper_parameters(aivm_metadata)
-
     # AIVM メタデータをシリアライズした上で、書き込む前にバリデーションを行う
-    raw_metadata = serialize_aivm_metadata(aivm_metadata)
-    validate_aivm_metadata(raw_metadata)
-
-    # 引数として受け取った BinaryIO のカーソルを先頭にシーク
-    aivmx_file.seek(0)
+    raw_metadata = _prepare_aivm_metadata_for_write(aivm_metadata, ModelFormat.ONNX, canonical)
 
     # ONNX モデル (Protobuf) をロード
-    try:
-        model = onnx.load_model(aivmx_file, format='protobuf', load_external_data=False)
-    except DecodeError:
-        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+    model = _load_aivmx_model(aivmx_file)
 
-    # 引数として受け取った BinaryIO のカーソルを再度先頭に戻す (重要)
-    # ファイルポインタを先頭に戻さないと、このメソッド終了後にユーザーがファイルを使用する際に
-    # カーソルが末尾にある状態となり、正しく読み書きできなくなる可能性がある
-    aivmx_file.seek(0)
+    # 外部データへの参照が正しく解決できるかを検証
+    # ディレクトリが明示的に指定されていない場合は、AIVMX ファイル自身が置かれているディレクトリを基準とする
+    if external_data_dir is None:
+        aivmx_file_name = getattr(aivmx_file, 'name', None)
+        if isinstance(aivmx_file_name, str | os.PathLike):
+            external_data_dir = Path(aivmx_file_name).parent
+    if external_data_dir is not None:
+        _validate_aivmx_external_data(_scan_aivmx_external_data(aivmx_file), external_data_dir)
 
     # メタデータを ONNX モデルに追加
     for key, value in raw_metadata.items():
@@ -676,12 +1175,148 @@ def write_aivmx_metadata(aivmx_file: BinaryIO, aivm_metadata: AivmMetadata) -> b
         else:
             model.metadata_props.append(onnx.StringStringEntryProto(key=key, value=value))
 
+    # 正規形で書き込む場合は、metadata_props をキー順に並べ直す (同一のキーが重複している場合は後勝ちで 1 つにまとめる)
+    if canonical:
+        metadata_props = {prop.key: prop.value for prop in model.metadata_props}
+        del model.metadata_props[:]
+        for key in sorted(metadata_props):
+            model.metadata_props.append(onnx.StringStringEntryProto(key=key, value=metadata_props[key]))
+
+    # metadata_props をファイル末尾に配置する場合は、metadata_props を除いた ONNX モデルをシリアライズした後に連結する
+    tail_metadata_props: dict[str, str] = {}
+    if tail_metadata:
+        tail_metadata_props = {prop.key: prop.value for prop in model.metadata_props}
+        del model.metadata_props[:]
+
     # 新しい AIVMX ファイルの内容をシリアライズ
-    new_aivmx_file_content = model.SerializeToString()
+    ## deterministic=True を指定すると、map フィールドなどの順序に依存せず常に同一のバイト列が得られる
+    ## 以前にファイル末尾に配置したロケーターは未知のフィールドとして保持されているため、位置が無効になる前に取り除く
+    try:
+        new_aivmx_file_content = remove_top_level_fields(
+            model.SerializeToString(deterministic=canonical), METADATA_LOCATOR_FIELD_NUMBER
+        )
+    except ProtobufScanError:
+        raise AivmValidationError('Failed to serialize AIVMX (ONNX) model.')
+    if tail_metadata:
+        metadata_props_bytes = encode_metadata_props(tail_metadata_props)
+        new_aivmx_file_content = (
+            new_aivmx_file_content
+            + metadata_props_bytes
+            + encode_metadata_locator(metadata_props_bytes, len(new_aivmx_file_content))
+        )
 
     return new_aivmx_file_content
 
 
+def aivmx_uses_external_data(aivmx_file: BinaryIO) -> bool:
+    """
+    AIVMX ファイルが重みを外部データ (External Data) として別ファイルに保存しているかを判定する
+
+    Args:
+        aivmx_file (BinaryIO): AIVMX ファイル
+
+    Returns:
+        bool: 外部データを参照するテンソルが 1 つ以上存在する場合は True
+
+    Raises:
+        AivmValidationError: AIVMX ファイルのフォーマットが不正な場合
+    """
+
+    # ONNX モデル全体はパースせず、グラフ内のフィールドのヘッダー部分のみを走査して判定する
+    return len(_scan_aivmx_external_data(aivmx_file)) > 0
+
+
+def _scan_aivmx_external_data(aivmx_file: BinaryIO, max_fields: int | None = None) -> list[ExternalTensorReference]:
+    """
+    AIVMX ファイルのグラフ内で外部データを参照しているテンソルを、ONNX モデル全体をパースすることなく列挙する内部メソッド
+
+    Args:
+        aivmx_file (BinaryIO): AIVMX ファイル
+        max_fields (int | None): 走査するフィールド数の上限 (省略時は無制限)
+
+    Returns:
+        list[ExternalTensorReference]: 外部データを参照しているテンソルの参照情報のリスト
+
+    Raises:
+        AivmValidationError: AIVMX ファイルのフォーマットが不正な場合
+        AivmLimitExceededError: フィールド数・サブグラフの深さが上限を超えた場合
+    """
+
+    try:
+        return scan_external_data_tensors(aivmx_file, max_fields=max_fields)
+    except ProtobufScanLimitError as ex:
+        raise AivmLimitExceededError(str(ex))
+    except ProtobufScanError:
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+
+
+def _load_aivmx_model(aivmx_file: BinaryIO) -> onnx.ModelProto:
+    """
+    AIVMX ファイルを、外部データを読み込まずに ONNX モデル (Protobuf) としてロードする内部メソッド
+    ファイルのカーソル位置は変更せず、オフセットを指定してファイル全体を読み取る
+
+    Args:
+        aivmx_file (BinaryIO): AIVMX ファイル
+
+    Returns:
+        onnx.ModelProto: ONNX モデル
+
+    Raises:
+        AivmValidationError: AIVMX ファイルのフォーマットが不正な場合
+    """
+
+    try:
+        return onnx.load_model_from_string(pread(aivmx_file, get_file_size(aivmx_file), 0), format='protobuf')
+    except DecodeError:
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+
+
+def _validate_aivmx_external_data(references: list[ExternalTensorReference], external_data_dir: Path) -> None:
+    """
+    外部データを参照しているテンソルの参照先が、指定されたディレクトリ内で正しく解決できるかを検証する内部メソッド
+    外部データファイルの中身は読み込まず、ファイルの存在とサイズのみを確認する
+
+    Args:
+        references (list[ExternalTensorReference]): _scan_aivmx_external_data() で取得した外部データの参照情報のリスト
+        external_data_dir (Path): 外部データファイルが配置されているディレクトリ
+
+    Raises:
+        AivmValidationError: 外部データへの参照を解決できない場合
+    """
+
+    base_dir = external_data_dir.resolve()
+    file_sizes: dict[str, int] = {}
+
+    # サブグラフやノード属性に含まれるものも含め、外部データを参照しているすべてのテンソルを検証する
+    for reference in references:
+        # 外部データファイルのパスは、AIVMX ファイルからの相対パスでなければならない
+        # ディレクトリ外のファイルを参照するようなパスは、不正なファイルである可能性が高いため拒否する
+        if not reference.location or os.path.isabs(reference.location):
+            raise AivmValidationError(
+                f'Invalid external data location "{reference.location}" of tensor "{reference.name}". '
+                'It must be a relative path.'
+            )
+        if reference.location not in file_sizes:
+            external_data_path = (base_dir / reference.location).resolve()
+            if not external_data_path.is_relative_to(base_dir):
+                raise AivmValidationError(
+                    f'External data location "{reference.location}" of tensor "{reference.name}" '
+                    f'points outside of {base_dir}.'
+                )
+            if not external_data_path.is_file():
+                raise AivmValidationError(
+                    f'External data file "{reference.location}" of tensor "{reference.name}" is not found in {base_dir}.'
+                )
+            file_sizes[reference.location] = external_data_path.stat().st_size
+
+        # テンソルが参照するバイト範囲が外部データファイルのサイズに収まっているか確認
+        if reference.offset + reference.length > file_sizes[reference.location]:
+            raise AivmValidationError(
+                f'External data of tensor "{reference.name}" (offset: {reference.offset}, length: {reference.length}) '
+                f'exceeds the size of "{reference.location}" ({file_sizes[reference.location]} bytes).'
+            )
+
+
 def apply_aivm_manifest_to_hyper_parameters(aivm_metadata: AivmMetadata) -> None:
     """
     AIVM マニフェストの内容をハイパーパラメータにも反映する
@@ -762,3 +1397,11 @@ class AivmValidationError(Exception):
     """
 
     pass
+
+
+class AivmLimitExceededError(AivmValidationError):
+    """
+    AIVM / AIVMX ファイルの読み取り中に、AivmParseLimits で指定されたリソース上限を超えたときに発生する例外
+    """
+
+    pass
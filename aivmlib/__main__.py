@@ -1,20 +1,61 @@
 import re
 import traceback
+from collections.abc import Iterator
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Annotated
 
 import rich
 import typer
+from rich.progress import BarColumn, DownloadColumn, Progress, TextColumn, TimeRemainingColumn, TransferSpeedColumn
 from rich.rule import Rule
 from rich.style import Style
 
 import aivmlib
-from aivmlib.schemas.aivm_manifest import ModelArchitecture
+import aivmlib.catalog
+import aivmlib.container
+import aivmlib.extract
+import aivmlib.indexer
+import aivmlib.optimizer
+import aivmlib.patch
+import aivmlib.server
+import aivmlib.store
+import aivmlib.stub
+import aivmlib.transform
+import aivmlib.virtual
+import aivmlib.writer
+from aivmlib.schemas.aivm_manifest import ModelArchitecture, ModelFormat
 
 
 app = typer.Typer(help='Aivis Voice Model File (.aivm/.aivmx) Utility Library')
 
 
+@contextmanager
+def _write_progress_bar() -> Iterator[aivmlib.writer.ProgressCallback]:
+    """
+    書き込みの進捗を、スループットと残り時間付きのプログレスバーで表示するコールバック関数を提供する
+    """
+
+    with Progress(
+        TextColumn('{task.description:<8}'),
+        BarColumn(),
+        DownloadColumn(),
+        TransferSpeedColumn(),
+        TimeRemainingColumn(),
+    ) as progress:
+        task = progress.add_task('metadata', total=None)
+
+        def callback(write_progress: aivmlib.writer.AivmWriteProgress) -> None:
+            progress.update(
+                task,
+                description=str(write_progress.phase),
+                completed=write_progress.bytes_done,
+                total=write_progress.bytes_total or None,
+            )
+
+        yield callback
+
+
 @app.command()
 def show_metadata(file_path: Annotated[Path, typer.Argument(help='Path to the AIVM / AIVMX file')]):
     """
@@ -23,8 +64,11 @@ def show_metadata(file_path: Annotated[Path, typer.Argument(help='Path to the AI
 
     try:
         with file_path.open('rb') as file:
-            if file_path.suffix == '.aivmx':
-                metadata = aivmlib.read_aivmx_metadata(file)
+            # 圧縮コンテナの場合、先頭のヘッドフレームのみから AIVM メタデータを読み込む
+            if aivmlib.container.is_aivm_container(file):
+                metadata = aivmlib.container.AivmContainerReader(file).read_metadata()
+            elif file_path.suffix == '.aivmx':
+                metadata = aivmlib.read_aivmx_metadata(file, external_data_dir=file_path.parent)
             else:
                 metadata = aivmlib.read_aivm_metadata(file)
 
@@ -48,6 +92,36 @@ def show_metadata(file_path: Annotated[Path, typer.Argument(help='Path to the AI
         rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
 
 
+@app.command()
+def extract_assets(
+    file_path: Annotated[Path, typer.Argument(help='Path to the AIVM / AIVMX file')],
+    output_dir: Annotated[Path, typer.Option('-o', '--output', help='Path to the output directory')],
+    max_workers: Annotated[
+        int | None, typer.Option('-j', '--jobs', help='Number of parallel workers (optional)')
+    ] = None,
+):
+    """
+    指定されたパスの AIVM / AIVMX ファイル内に格納されているアイコン画像・ボイスサンプル音声を、並列にファイルとして書き出す
+    """
+
+    try:
+        with file_path.open('rb') as file:
+            if file_path.suffix == '.aivmx':
+                output_paths = aivmlib.extract.extract_aivmx_assets(file, output_dir, max_workers)
+            else:
+                output_paths = aivmlib.extract.extract_aivm_assets(file, output_dir, max_workers)
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'Extracted {len(output_paths)} assets to: {output_dir}')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error extracting assets from AIVM or AIVMX file: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
 @app.command()
 def create_aivm(
     output_path: Annotated[Path, typer.Option('-o', '--output', help='Path to the output AIVM file')],
@@ -61,10 +135,25 @@ def create_aivm(
     model_architecture: Annotated[
         ModelArchitecture, typer.Option('-a', '--model-architecture', help='Model architecture')
     ] = ModelArchitecture.StyleBertVITS2JPExtra,
+    cast_dtype: Annotated[
+        aivmlib.transform.TensorCastDtype | None,
+        typer.Option('--cast', help='Cast FP32 / FP64 tensors to this dtype (optional)'),
+    ] = None,
+    drop_patterns: Annotated[
+        list[str] | None,
+        typer.Option('--drop', help='Drop tensors whose whole name matches this regex (can be repeated)'),
+    ] = None,
+    max_memory: Annotated[
+        int | None,
+        typer.Option(
+            '--max-memory', help='Refuse to start if the estimated peak memory in bytes exceeds this (optional)'
+        ),
+    ] = None,
 ):
     """
     与えられたアーキテクチャ, 学習済みモデル, ハイパーパラメータ, スタイルベクトルから AIVM メタデータを生成した上で、
     それを書き込んだ仮の AIVM ファイルを生成する
+    --cast / --drop 指定時は、テンソルを半精度にキャスト・不要なテンソルを取り除きながら書き込む
     """
 
     # 拡張子チェック
@@ -78,6 +167,11 @@ def create_aivm(
         rich.print('[red]Output file must have a .aivm extension.[/red]')
         rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
         return
+    if max_memory is not None and (cast_dtype is not None or drop_patterns):
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print('[red]--max-memory cannot be combined with --cast / --drop.[/red]')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        return
 
     try:
         # アーキテクチャに合わせて未指定のファイルパスを自動設定
@@ -123,12 +217,29 @@ def create_aivm(
             metadata.manifest.training_steps = int(step_match.group(1))
 
         # AIVM ファイルを生成
-        with safetensors_model_path.open('rb') as safetensors_file:
-            new_aivm_file_content = aivmlib.write_aivm_metadata(safetensors_file, metadata)
-            with output_path.open('wb') as f:
-                f.write(new_aivm_file_content)
+        ## 書き込み途中のファイルは一時ファイルとして作成され、中断された場合は削除される
+        report = None
+        with safetensors_model_path.open('rb') as safetensors_file, _write_progress_bar() as progress_callback:
+            if cast_dtype is not None or drop_patterns:
+                # ヘッダーのみを差し替えた仮想ファイルから、テンソルをチャンクごとに変換しながら書き込む
+                virtual_file = aivmlib.virtual.create_virtual_aivm_file(safetensors_file, metadata)
+                with aivmlib.writer.atomic_output(output_path) as f:
+                    report = aivmlib.transform.transform_aivm_tensors(
+                        virtual_file, f, cast_dtype, drop_patterns or [], progress_callback=progress_callback
+                    )
+            else:
+                # Weight 部分をメモリ上に読み込むことなく、チャンクごとに書き込む
+                aivmlib.writer.write_aivm_file(
+                    safetensors_file, output_path, metadata, progress_callback=progress_callback, max_memory=max_memory
+                )
 
         rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        if report is not None:
+            rich.print(f'Cast tensors: {len(report.cast_tensors)}')
+            rich.print(f'Dropped tensors: {", ".join(report.dropped_tensors) or "(none)"}')
+            rich.print(f'Weight size: {report.payload_size_before} -> {report.payload_size_after} bytes')
+            for warning in report.warnings:
+                rich.print(f'[yellow]Warning: {warning}[/yellow]')
         rich.print(f'Generated AIVM file: {output_path}')
         rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
     except Exception as e:
@@ -152,6 +263,18 @@ def create_aivmx(
     model_architecture: Annotated[
         ModelArchitecture, typer.Option('-a', '--model-architecture', help='Model architecture')
     ] = ModelArchitecture.StyleBertVITS2JPExtra,
+    tail_metadata: Annotated[
+        bool,
+        typer.Option(
+            '--tail-metadata', help='Place the metadata at the end of the file so it can be read from the tail'
+        ),
+    ] = False,
+    max_memory: Annotated[
+        int | None,
+        typer.Option(
+            '--max-memory', help='Refuse to start if the estimated peak memory in bytes exceeds this (optional)'
+        ),
+    ] = None,
 ):
     """
     与えられたアーキテクチャ, 学習済みモデル, ハイパーパラメータ, スタイルベクトルから AIVM メタデータを生成した上で、
@@ -215,9 +338,32 @@ def create_aivmx(
 
         # AIVMX ファイルを生成
         with onnx_model_path.open('rb') as onnx_file:
-            new_aivmx_file_content = aivmlib.write_aivmx_metadata(onnx_file, metadata)
-            with output_path.open('wb') as f:
-                f.write(new_aivmx_file_content)
+            # 重みが外部データとして別ファイルに保存されている場合、外部データへの参照は AIVMX ファイルからの相対パスで解決されるため、
+            # 外部データファイルには一切手を加えず、AIVMX ファイルを ONNX モデルと同じディレクトリに出力する必要がある
+            ## 外部データを参照しているかは、グラフ内のフィールドのヘッダー部分のみを走査して判定する
+            external_data_dir = None
+            if aivmlib.aivmx_uses_external_data(onnx_file):
+                external_data_dir = onnx_model_path.parent
+                if output_path.resolve().parent != onnx_model_path.resolve().parent:
+                    rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+                    rich.print(
+                        '[red]ONNX model with external data must be output to the same directory as the ONNX model file.[/red]'
+                    )
+                    rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+                    return
+            # ONNX モデル全体をメモリ上に読み込むことなく、チャンクごとに書き込む
+            ## 外部データを参照する場合のみ、外部データへの参照が正しく解決できるかを検証する
+            ## 書き込み途中のファイルは一時ファイルとして作成され、中断された場合は削除される
+            with _write_progress_bar() as progress_callback:
+                aivmlib.writer.write_aivmx_file(
+                    onnx_file,
+                    output_path,
+                    metadata,
+                    external_data_dir=external_data_dir,
+                    tail_metadata=tail_metadata,
+                    progress_callback=progress_callback,
+                    max_memory=max_memory,
+                )
 
         rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
         rich.print(f'Generated AIVMX file: {output_path}')
@@ -230,5 +376,636 @@ def create_aivmx(
         rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
 
 
+@app.command()
+def replace_model(
+    file_path: Annotated[Path, typer.Argument(help='Path to the existing AIVM / AIVMX file')],
+    output_path: Annotated[Path, typer.Option('-o', '--output', help='Path to the output AIVM / AIVMX file')],
+    model_path: Annotated[
+        Path, typer.Option('-m', '--model', help='Path to the retrained Safetensors / ONNX model file')
+    ],
+    hyper_parameters_path: Annotated[
+        Path | None, typer.Option('-h', '--hyper-parameters', help='Path to the hyper parameters file (optional)')
+    ] = None,
+    style_vectors_path: Annotated[
+        Path | None, typer.Option('-s', '--style-vectors', help='Path to the style vectors file (optional)')
+    ] = None,
+    tail_metadata: Annotated[
+        bool,
+        typer.Option(
+            '--tail-metadata', help='Place the metadata at the end of the file so it can be read from the tail'
+        ),
+    ] = False,
+    max_memory: Annotated[
+        int | None,
+        typer.Option(
+            '--max-memory', help='Refuse to start if the estimated peak memory in bytes exceeds this (optional)'
+        ),
+    ] = None,
+):
+    """
+    既存の AIVM / AIVMX ファイルの AIVM メタデータを維持したまま、学習し直したモデルの重みに差し替えたファイルを生成する
+    既存の AIVM マニフェストは新しいハイパーパラメータとスタイルベクトルに合わせて更新され、重みはチャンクごとに書き込まれる
+    """
+
+    # 拡張子チェック
+    if model_path.suffix not in ('.safetensors', '.onnx'):
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print('[red]Model file must have a .safetensors or .onnx extension.[/red]')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        return
+    new_model_format = ModelFormat.Safetensors if model_path.suffix == '.safetensors' else ModelFormat.ONNX
+    expected_suffix = '.aivm' if new_model_format == ModelFormat.Safetensors else '.aivmx'
+    if output_path.suffix != expected_suffix:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Output file must have a {expected_suffix} extension.[/red]')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        return
+
+    try:
+        # 未指定のファイルパスは、モデルファイルと同じディレクトリから自動設定
+        model_dir = model_path.parent
+        if not hyper_parameters_path:
+            hyper_parameters_path = model_dir / 'config.json'
+        if not style_vectors_path:
+            style_vectors_path = model_dir / 'style_vectors.npy'
+
+        # 必要なファイルが存在しない場合はエラーを発生させる
+        if not hyper_parameters_path.exists():
+            rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+            rich.print(f'[red]Hyper parameters file not found: {hyper_parameters_path}[/red]')
+            rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+            return
+        if not style_vectors_path.exists():
+            rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+            rich.print(f'[red]Style vectors file not found: {style_vectors_path}[/red]')
+            rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+            return
+
+        # モデルファイル名からエポック数とステップ数を抽出
+        epoch_match = re.search(r'e(\d{2,})', model_path.name)  # "e" の後ろに2桁以上の数字
+        step_match = re.search(r's(\d{2,})', model_path.name)  # "s" の後ろに2桁以上の数字
+
+        existing_model_format = ModelFormat.ONNX if file_path.suffix == '.aivmx' else ModelFormat.Safetensors
+        with (
+            file_path.open('rb') as existing_file,
+            model_path.open('rb') as model_file,
+            hyper_parameters_path.open('rb') as hyper_parameters_file,
+            style_vectors_path.open('rb') as style_vectors_file,
+        ):
+            # 重みが外部データとして別ファイルに保存されている場合、外部データへの参照は AIVMX ファイルからの相対パスで解決されるため、
+            # AIVMX ファイルを ONNX モデルと同じディレクトリに出力する必要がある
+            ## 外部データを参照しているかは、新しいモデル全体をパースせず、グラフ内のフィールドのヘッダー部分のみを走査して判定する
+            external_data_dir = None
+            if new_model_format == ModelFormat.ONNX and aivmlib.aivmx_uses_external_data(model_file):
+                external_data_dir = model_path.parent
+                if output_path.resolve().parent != model_path.resolve().parent:
+                    rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+                    rich.print(
+                        '[red]ONNX model with external data must be output to the same directory as the ONNX model file.[/red]'
+                    )
+                    rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+                    return
+
+            # 既存のファイルのメタデータ部分のみを読み取ってマージし、新しい重みをチャンクごとに書き込む
+            ## 書き込み途中のファイルは一時ファイルとして作成されるため、既存のファイルを出力先に指定して上書きすることもできる
+            with _write_progress_bar() as progress_callback:
+                report = aivmlib.writer.replace_aivm_model(
+                    existing_file,
+                    existing_model_format,
+                    model_file,
+                    new_model_format,
+                    output_path,
+                    hyper_parameters_file,
+                    style_vectors_file,
+                    training_epochs=int(epoch_match.group(1)) if epoch_match else None,
+                    training_steps=int(step_match.group(1)) if step_match else None,
+                    external_data_dir=external_data_dir,
+                    tail_metadata=tail_metadata,
+                    progress_callback=progress_callback,
+                    max_memory=max_memory,
+                )
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        for warning in report.warnings:
+            rich.print(f'[yellow]Warning: {warning}[/yellow]')
+        rich.print(f'Replaced model saved to: {output_path}')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error replacing model: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def create_patch(
+    old_file_path: Annotated[Path, typer.Argument(help='Path to the original AIVM / AIVMX file')],
+    new_file_path: Annotated[Path, typer.Argument(help='Path to the updated AIVM / AIVMX file')],
+    output_path: Annotated[Path, typer.Option('-o', '--output', help='Path to the output metadata patch file')],
+):
+    """
+    重み部分が同一で AIVM メタデータのみが異なる 2 つの AIVM / AIVMX ファイルから、メタデータのみを更新するパッチファイルを作成する
+    """
+
+    try:
+        model_format = ModelFormat.ONNX if new_file_path.suffix == '.aivmx' else ModelFormat.Safetensors
+        with old_file_path.open('rb') as old_file, new_file_path.open('rb') as new_file:
+            patch = aivmlib.patch.create_metadata_patch(old_file, new_file, model_format)
+        patch_bytes = patch.to_bytes()
+        output_path.write_bytes(patch_bytes)
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'Replaced metadata keys: {", ".join(patch.metadata.keys()) or "(none)"}')
+        rich.print(f'Delta-patched metadata keys: {", ".join(patch.deltas.keys()) or "(none)"}')
+        rich.print(f'Metadata patch saved to: {output_path} ({len(patch_bytes)} bytes)')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error creating metadata patch: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def apply_patch(
+    file_path: Annotated[Path, typer.Argument(help='Path to the AIVM / AIVMX file to update')],
+    patch_path: Annotated[Path, typer.Argument(help='Path to the metadata patch file')],
+    output_path: Annotated[
+        Path | None,
+        typer.Option('-o', '--output', help='Path to the output file (optional, defaults to updating in place)'),
+    ] = None,
+):
+    """
+    メタデータパッチを AIVM / AIVMX ファイルに適用する (重み部分がパッチの作成元と一致する場合のみ適用される)
+    """
+
+    try:
+        patch = aivmlib.patch.AivmMetadataPatch.from_bytes(patch_path.read_bytes())
+        aivmlib.patch.apply_metadata_patch(file_path, patch, output_path)
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'Metadata patch applied to: {output_path or file_path}')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error applying metadata patch: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def optimize(
+    file_path: Annotated[Path, typer.Argument(help='Path to the AIVM / AIVMX file')],
+    output_path: Annotated[Path, typer.Option('-o', '--output', help='Path to the output AIVM / AIVMX file')],
+    max_metadata_size: Annotated[
+        int | None,
+        typer.Option('--max-metadata-size', help='Warn if the serialized metadata exceeds this size in bytes'),
+    ] = None,
+):
+    """
+    AIVM / AIVMX ファイルの AIVM マニフェストから冗長なアイコン画像・ボイスサンプル音声を取り除き、ヘッダーを小さくしたファイルを書き出す
+    """
+
+    if output_path.resolve() == file_path.resolve():
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print('[red]Output file must be different from the input file.[/red]')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        return
+
+    try:
+        with file_path.open('rb') as file:
+            if file_path.suffix == '.aivmx':
+                metadata = aivmlib.read_aivmx_metadata(file)
+            else:
+                metadata = aivmlib.read_aivm_metadata(file)
+            optimized_metadata, report = aivmlib.optimizer.optimize_aivm_metadata(metadata, max_metadata_size)
+
+            # 重み部分をメモリ上に読み込まず、ヘッダーのみを差し替えたファイルをストリーミングで書き出す
+            ## 書き込み途中のファイルは一時ファイルとして作成され、中断された場合は削除される
+            if file_path.suffix == '.aivmx':
+                virtual_file = aivmlib.virtual.create_virtual_aivmx_file(file, optimized_metadata)
+            else:
+                virtual_file = aivmlib.virtual.create_virtual_aivm_file(file, optimized_metadata)
+            with aivmlib.writer.atomic_output(output_path) as f:
+                for chunk in virtual_file.iter_chunks():
+                    f.write(chunk)
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        for field_name, saving in report.savings.items():
+            rich.print(f'{field_name}: -{saving} bytes')
+        rich.print(
+            f'Metadata size: {report.metadata_size_before} -> {report.metadata_size_after} bytes '
+            f'(-{report.total_savings} bytes)'
+        )
+        for warning in report.warnings:
+            rich.print(f'[yellow]Warning: {warning}[/yellow]')
+        rich.print(f'Optimized file saved to: {output_path}')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error optimizing AIVM or AIVMX file: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def pack(
+    file_path: Annotated[Path, typer.Argument(help='Path to the AIVM / AIVMX file')],
+    output_path: Annotated[Path, typer.Option('-o', '--output', help='Path to the output container file')],
+    codec: Annotated[
+        aivmlib.container.ContainerCodec, typer.Option('--codec', help='Compression codec')
+    ] = aivmlib.container.ContainerCodec.Zlib,
+    frame_size: Annotated[
+        int, typer.Option('--frame-size', help='Uncompressed size of each payload frame in bytes')
+    ] = aivmlib.container.DEFAULT_FRAME_SIZE,
+):
+    """
+    AIVM / AIVMX ファイルを、AIVM メタデータを伸長せずに即座に読み取れるシーク可能な圧縮コンテナに変換する
+    """
+
+    if output_path.resolve() == file_path.resolve():
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print('[red]Output file must be different from the input file.[/red]')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        return
+
+    try:
+        model_format = ModelFormat.ONNX if file_path.suffix == '.aivmx' else ModelFormat.Safetensors
+        with file_path.open('rb') as file, output_path.open('wb') as output_file:
+            aivmlib.container.pack_aivm_container(file, output_file, model_format, codec, frame_size)
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'Container size: {file_path.stat().st_size} -> {output_path.stat().st_size} bytes ({codec.value})')
+        rich.print(f'Container saved to: {output_path}')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error packing AIVM or AIVMX file: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def unpack(
+    file_path: Annotated[Path, typer.Argument(help='Path to the container file')],
+    output_path: Annotated[Path, typer.Option('-o', '--output', help='Path to the output AIVM / AIVMX file')],
+):
+    """
+    圧縮コンテナを伸長し、元の AIVM / AIVMX ファイルを復元する
+    """
+
+    if output_path.resolve() == file_path.resolve():
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print('[red]Output file must be different from the input file.[/red]')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        return
+
+    try:
+        with file_path.open('rb') as file, output_path.open('wb') as output_file:
+            aivmlib.container.AivmContainerReader(file).unpack(output_file)
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'Unpacked file saved to: {output_path}')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error unpacking container file: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def create_stub(
+    file_path: Annotated[Path, typer.Argument(help='Path to the AIVM / AIVMX file')],
+    output_path: Annotated[Path, typer.Option('-o', '--output', help='Path to the output stub file')],
+    source: Annotated[
+        str, typer.Option('--source', help='URL or path from which the original file can be fetched later')
+    ],
+):
+    """
+    AIVM / AIVMX ファイルから、AIVM メタデータのみを格納し重み部分の取得元を記録したスタブファイルを作成する
+    """
+
+    if output_path.resolve() == file_path.resolve():
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print('[red]Output file must be different from the input file.[/red]')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        return
+
+    try:
+        model_format = ModelFormat.ONNX if file_path.suffix == '.aivmx' else ModelFormat.Safetensors
+        with file_path.open('rb') as file, output_path.open('wb') as output_file:
+            reference = aivmlib.stub.create_aivm_stub(file, output_file, model_format, source)
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'Stub size: {reference.size} -> {output_path.stat().st_size} bytes')
+        rich.print(f'Payload SHA-256: {reference.payload_sha256}')
+        rich.print(f'Stub saved to: {output_path}')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error creating stub file: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def materialize(
+    stub_path: Annotated[Path, typer.Argument(help='Path to the stub file')],
+    output_path: Annotated[Path, typer.Option('-o', '--output', help='Path to the output AIVM / AIVMX file')],
+    source: Annotated[
+        str | None, typer.Option('--source', help='URL or path to fetch from instead of the one recorded in the stub')
+    ] = None,
+):
+    """
+    スタブファイルが参照する重み部分を取得し、元の AIVM / AIVMX ファイルを復元する (中断した場合は再実行で続きから取得する)
+    """
+
+    if output_path.resolve() == stub_path.resolve():
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print('[red]Output file must be different from the input file.[/red]')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        return
+
+    try:
+        aivmlib.stub.materialize_aivm_stub(stub_path, output_path, source)
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'Materialized file saved to: {output_path}')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error materializing stub file: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def store_add(
+    file_paths: Annotated[list[Path], typer.Argument(help='Paths to the AIVM / AIVMX files')],
+    store_path: Annotated[Path, typer.Option('--store', help='Path to the model store directory')],
+):
+    """
+    AIVM / AIVMX ファイルを、重み部分を重複させずにモデルストアに格納する
+    """
+
+    try:
+        store = aivmlib.store.AivmModelStore(store_path)
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        for file_path in file_paths:
+            model_format = ModelFormat.ONNX if file_path.suffix == '.aivmx' else ModelFormat.Safetensors
+            with file_path.open('rb') as file:
+                entry = store.add(file, model_format)
+            rich.print(f'{file_path}: {entry.entry_id} (payload: {entry.payload_sha256})')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error adding to model store: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def store_list(
+    store_path: Annotated[Path, typer.Option('--store', help='Path to the model store directory')],
+):
+    """
+    モデルストアに格納された AIVM / AIVMX ファイルと、ペイロードごとの参照数を表示する
+    """
+
+    try:
+        store = aivmlib.store.AivmModelStore(store_path)
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        for entry in store.entries():
+            manifest = store.read_metadata(entry.entry_id).manifest
+            rich.print(f'{entry.entry_id}  {entry.model_format}  {entry.size} bytes  {manifest.name} ({manifest.uuid})')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        for payload_sha256, count in store.reference_counts().items():
+            rich.print(f'Payload {payload_sha256}: {count} reference(s)')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error listing model store: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def store_export(
+    entry_id: Annotated[str, typer.Argument(help='ID of the stored file')],
+    store_path: Annotated[Path, typer.Option('--store', help='Path to the model store directory')],
+    output_path: Annotated[Path, typer.Option('-o', '--output', help='Path to the output AIVM / AIVMX file')],
+):
+    """
+    モデルストアに格納された AIVM / AIVMX ファイルを、元のファイルと同一の通常のファイルとして書き出す
+    """
+
+    try:
+        store = aivmlib.store.AivmModelStore(store_path)
+        store.export(entry_id, output_path)
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'Exported file saved to: {output_path}')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error exporting from model store: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def store_remove(
+    entry_ids: Annotated[list[str], typer.Argument(help='IDs of the stored files')],
+    store_path: Annotated[Path, typer.Option('--store', help='Path to the model store directory')],
+):
+    """
+    モデルストアから AIVM / AIVMX ファイルを削除する (参照されなくなった重み部分は store-gc で削除される)
+    """
+
+    try:
+        store = aivmlib.store.AivmModelStore(store_path)
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        for entry_id in entry_ids:
+            if store.remove(entry_id):
+                rich.print(f'Removed: {entry_id}')
+            else:
+                rich.print(f'[yellow]Not found: {entry_id}[/yellow]')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error removing from model store: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def store_gc(
+    store_path: Annotated[Path, typer.Option('--store', help='Path to the model store directory')],
+    min_age: Annotated[
+        float,
+        typer.Option('--min-age', help='Keep unreferenced payloads modified within this many seconds'),
+    ] = aivmlib.store.DEFAULT_GC_MIN_AGE,
+):
+    """
+    モデルストアから、どの AIVM / AIVMX ファイルからも参照されていない重み部分を削除する
+    """
+
+    try:
+        store = aivmlib.store.AivmModelStore(store_path)
+        report = store.gc(min_age)
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        for payload_sha256 in report.removed_payloads:
+            rich.print(f'Removed payload: {payload_sha256}')
+        rich.print(f'Freed: {report.freed_bytes} bytes')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error collecting model store garbage: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def index(
+    directory: Annotated[Path, typer.Argument(help='Path to the directory containing AIVM / AIVMX files')],
+    output_path: Annotated[Path, typer.Option('-o', '--output', help='Path to the output index JSON file')],
+    watch: Annotated[bool, typer.Option('--watch', help='Keep watching the directory and update the index')] = False,
+    interval: Annotated[float, typer.Option('--interval', help='Polling interval in seconds')] = 2.0,
+    settle_seconds: Annotated[
+        float, typer.Option('--settle', help='Seconds a changed file must stay unchanged before it is read')
+    ] = 1.0,
+):
+    """
+    指定されたディレクトリ内の AIVM / AIVMX ファイルの索引を作成する (--watch 指定時は変更に追従して差分更新し続ける)
+    """
+
+    if not directory.is_dir():
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Directory not found: {directory}[/red]')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        return
+
+    try:
+        # 既存の索引ファイルがあれば読み込み、前回から変更されたファイルのみを読み直す
+        model_index = aivmlib.indexer.AivmModelIndex(directory, settle_seconds=settle_seconds if watch else 0.0)
+        model_index.load(output_path)
+
+        if not watch:
+            changes = model_index.refresh()
+            model_index.save(output_path)
+            rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+            rich.print(
+                f'Indexed {len(model_index.entries)} models to: {output_path} '
+                f'(added: {len(changes.added)}, updated: {len(changes.updated)}, removed: {len(changes.removed)})'
+            )
+            rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+            return
+
+        def on_change(changes: aivmlib.indexer.AivmIndexChanges) -> None:
+            model_index.save(output_path)
+            for relative_path in changes.added:
+                rich.print(f'[green]Added:[/green] {relative_path}')
+            for relative_path in changes.updated:
+                rich.print(f'[yellow]Updated:[/yellow] {relative_path}')
+            for relative_path in changes.removed:
+                rich.print(f'[red]Removed:[/red] {relative_path}')
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'Watching {directory} and writing the index to: {output_path}')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        model_index.save(output_path)
+        try:
+            aivmlib.indexer.watch_model_index(model_index, on_change, interval=interval)
+        except KeyboardInterrupt:
+            pass
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error indexing AIVM or AIVMX files: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def build_catalog(
+    directory: Annotated[Path, typer.Argument(help='Path to the directory containing AIVM / AIVMX files')],
+    output_path: Annotated[Path, typer.Option('-o', '--output', help='Path to the output catalog file')],
+):
+    """
+    指定されたディレクトリ内の AIVM / AIVMX ファイルのパース済み AIVM メタデータを、ワーカープロセス間で mmap により共有できるカタログにまとめる
+    """
+
+    if not directory.is_dir():
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Directory not found: {directory}[/red]')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        return
+
+    try:
+        catalog = aivmlib.catalog.AivmMetadataCatalog.build_from_directory(directory)
+        catalog.save(output_path)
+
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(
+            f'Cataloged {len(catalog)} models to: {output_path} '
+            f'(version: {catalog.version}, {output_path.stat().st_size} bytes)'
+        )
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    except Exception as e:
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Error building metadata catalog: {e}[/red]')
+        rich.print(Rule(characters='-', style=Style(color='#41A2EC')))
+        rich.print(traceback.format_exc())
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+
+
+@app.command()
+def serve(
+    directory: Annotated[Path, typer.Argument(help='Path to the directory containing AIVM / AIVMX files')],
+    host: Annotated[str, typer.Option('--host', help='Host to listen on')] = '127.0.0.1',
+    port: Annotated[int, typer.Option('-p', '--port', help='Port to listen on')] = 8000,
+    max_cached_models: Annotated[
+        int, typer.Option('--cache-size', help='Maximum number of models to keep parsed in memory')
+    ] = 256,
+):
+    """
+    指定されたディレクトリ内の AIVM / AIVMX ファイルの AIVM メタデータ・アイコン画像・ボイスサンプル音声を HTTP で配信する
+    """
+
+    if not directory.is_dir():
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        rich.print(f'[red]Directory not found: {directory}[/red]')
+        rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+        return
+
+    server = aivmlib.server.create_metadata_server(directory, host, port, max_cached_models)
+    rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    rich.print(
+        f'Serving AIVM metadata of {directory} on http://{server.server_address[0]}:{server.server_address[1]}/models'
+    )
+    rich.print(Rule(characters='=', style=Style(color='#41A2EC')))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
 if __name__ == '__main__':
     app()
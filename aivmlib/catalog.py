@@ -0,0 +1,478 @@
+import mmap
+import os
+import struct
+import time
+from collections.abc import Iterator, Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from uuid import UUID
+
+from aivmlib import AivmValidationError, read_aivm_metadata, read_aivmx_metadata
+from aivmlib.indexer import AivmModelIndex
+from aivmlib.schemas.aivm_manifest import AivmManifest, AivmMetadata
+from aivmlib.schemas.style_bert_vits2 import StyleBertVITS2HyperParameters
+
+
+# 多数のワーカープロセスで構成される推論サーバー向けに、パース済みの AIVM メタデータを 1 つのバイト列に詰め込んだ読み取り専用のカタログ
+# 固定長のエントリ・パスの文字列テーブル・AIVM マニフェストなどの JSON を格納した Blob 領域から構成され、
+# ファイルを mmap で開くか multiprocessing.shared_memory に載せれば、全ワーカーで 1 つの物理メモリを共有できる
+# 起動時にはヘッダーのみを検証し、AIVM メタデータは参照されたエントリのみをその都度パースする
+# ヘッダーにはカタログを構築するたびに変わるバージョンを格納しており、再構築したカタログへの差し替えを検知できる
+
+# バイト列の先頭に格納するマジックナンバーとフォーマットバージョン
+_MAGIC = b'AIVMCT\x00\x01'
+
+# バイト列の各領域のレイアウト
+## ヘッダー: マジックナンバー, カタログのバージョン, エントリ数, 文字列テーブルのオフセット, Blob 領域のオフセット, カタログ全体のバイト数
+_HEADER_STRUCT = struct.Struct('<8sQIQQQ')
+## エントリ: パスの (オフセット, バイト数), モデル UUID, 更新日時 (ナノ秒), ファイルサイズ, スタイルベクトルの有無,
+##   AIVM マニフェストの JSON の (オフセット, バイト数), ハイパーパラメータの JSON の (オフセット, バイト数), スタイルベクトルの (オフセット, バイト数)
+## 文字列テーブル・Blob 領域内のオフセットは、それぞれの領域の先頭からの相対オフセットとする
+_ENTRY_STRUCT = struct.Struct('<QI16sqQ?3x6Q')
+## モデル UUID のインデックス: モデル UUID, エントリのインデックス (モデル UUID の昇順に並べる)
+_UUID_INDEX_STRUCT = struct.Struct('<16sI')
+
+
+@dataclass(frozen=True)
+class AivmCatalogEntry:
+    """カタログから取り出した、1 つの AIVM / AIVMX ファイルの AIVM メタデータ"""
+
+    # カタログ内でのファイルのパス (build_from_directory() で構築した場合は、ディレクトリからの相対パス)
+    path: str
+    # 音声合成モデルの UUID
+    model_uuid: UUID
+    # カタログ構築時点でのファイルの更新日時 (ナノ秒、不明な場合は 0)
+    mtime_ns: int
+    # カタログ構築時点でのファイルサイズ (不明な場合は 0)
+    size: int
+    # AIVM マニフェストの JSON
+    manifest_json: bytes
+    # ハイパーパラメータの JSON
+    hyper_parameters_json: bytes
+    # スタイルベクトル (存在しない場合は None)
+    style_vectors: bytes | None
+
+    def to_metadata(self) -> AivmMetadata:
+        """
+        エントリの JSON をパースし、AIVM メタデータを構築する
+
+        Returns:
+            AivmMetadata: AIVM メタデータ
+
+        Raises:
+            AivmValidationError: JSON のパース・バリデーションに失敗した場合
+        """
+
+        try:
+            return AivmMetadata(
+                manifest=AivmManifest.model_validate_json(self.manifest_json),
+                hyper_parameters=StyleBertVITS2HyperParameters.model_validate_json(self.hyper_parameters_json),
+                style_vectors=self.style_vectors,
+            )
+        except ValueError as ex:
+            raise AivmValidationError(f'Invalid catalog entry: {self.path}.') from ex
+
+
+class AivmMetadataCatalog:
+    """
+    パース済みの AIVM メタデータを、パスまたはモデル UUID から O(log n) で引けるようにしたイミュータブルなカタログ
+    カタログ全体は 1 つの連続したバイト列として保持され、to_bytes() で得たバイト列を from_bytes() に渡すか、
+    save() で保存したファイルを open() で開けば、別プロセスでもデシリアライズなしにそのまま参照できる
+    """
+
+    def __init__(self, buffer: bytes | bytearray | memoryview | mmap.mmap) -> None:
+        """
+        Args:
+            buffer (bytes | bytearray | memoryview | mmap.mmap): to_bytes() で得たカタログのバイト列
+
+        Raises:
+            AivmValidationError: バイト列のフォーマットが不正な場合
+        """
+
+        self._mmap: mmap.mmap | None = None
+        self._buffer = memoryview(buffer).cast('B')
+        if len(self._buffer) < _HEADER_STRUCT.size:
+            raise AivmValidationError('Invalid metadata catalog format.')
+        magic, version, entry_count, strings_offset, blobs_offset, total_size = _HEADER_STRUCT.unpack_from(
+            self._buffer, 0
+        )
+        if magic != _MAGIC:
+            raise AivmValidationError('Invalid metadata catalog format.')
+        self._version = version
+        self._entry_count = entry_count
+
+        # 各領域の開始オフセットを求める
+        self._entries_offset = _HEADER_STRUCT.size
+        self._uuid_index_offset = self._entries_offset + entry_count * _ENTRY_STRUCT.size
+        self._strings_offset = strings_offset
+        self._blobs_offset = blobs_offset
+        self._size = total_size
+        if (
+            strings_offset != self._uuid_index_offset + entry_count * _UUID_INDEX_STRUCT.size
+            or not strings_offset <= blobs_offset <= total_size
+            or len(self._buffer) < total_size
+        ):
+            raise AivmValidationError('Invalid metadata catalog format.')
+
+    @classmethod
+    def build(
+        cls,
+        models: Mapping[str, AivmMetadata],
+        file_stats: Mapping[str, tuple[int, int]] | None = None,
+        version: int | None = None,
+    ) -> 'AivmMetadataCatalog':
+        """
+        パスと AIVM メタデータの対応からカタログを構築する
+
+        Args:
+            models (Mapping[str, AivmMetadata]): パスと AIVM メタデータの対応
+            file_stats (Mapping[str, tuple[int, int]] | None): パスとファイルの (更新日時 (ナノ秒), ファイルサイズ) の対応
+            version (int | None): カタログのバージョン (省略時は現在時刻のナノ秒表現)
+
+        Returns:
+            AivmMetadataCatalog: カタログ
+        """
+
+        file_stats = file_stats or {}
+        if version is None:
+            version = time.time_ns()
+
+        # パスを UTF-8 のバイト列の昇順に並べる (UTF-8 のバイト列の順序は文字列のコードポイント順と一致する)
+        paths = sorted(models, key=lambda path: path.encode('utf-8'))
+
+        # 文字列テーブルと Blob 領域を構築する
+        strings = bytearray()
+        blobs = bytearray()
+        entries: list[bytes] = []
+        uuid_index: list[tuple[bytes, int]] = []
+        for index, path in enumerate(paths):
+            metadata = models[path]
+            path_bytes = path.encode('utf-8')
+            path_offset = len(strings)
+            strings += path_bytes
+
+            ranges: list[int] = []
+            for blob in (
+                metadata.manifest.model_dump_json().encode('utf-8'),
+                metadata.hyper_parameters.model_dump_json().encode('utf-8'),
+                metadata.style_vectors or b'',
+            ):
+                ranges += (len(blobs), len(blob))
+                blobs += blob
+
+            mtime_ns, size = file_stats.get(path, (0, 0))
+            model_uuid = metadata.manifest.uuid.bytes
+            entries.append(
+                _ENTRY_STRUCT.pack(
+                    path_offset,
+                    len(path_bytes),
+                    model_uuid,
+                    mtime_ns,
+                    size,
+                    metadata.style_vectors is not None,
+                    *ranges,
+                )
+            )
+            uuid_index.append((model_uuid, index))
+        uuid_index.sort()
+
+        strings_offset = _HEADER_STRUCT.size + len(entries) * (_ENTRY_STRUCT.size + _UUID_INDEX_STRUCT.size)
+        blobs_offset = strings_offset + len(strings)
+        total_size = blobs_offset + len(blobs)
+        buffer = bytearray(_HEADER_STRUCT.pack(_MAGIC, version, len(entries), strings_offset, blobs_offset, total_size))
+        buffer += b''.join(entries)
+        buffer += b''.join(_UUID_INDEX_STRUCT.pack(model_uuid, index) for model_uuid, index in uuid_index)
+        buffer += strings
+        buffer += blobs
+        return cls(bytes(buffer))
+
+    @classmethod
+    def build_from_directory(cls, directory: Path, version: int | None = None) -> 'AivmMetadataCatalog':
+        """
+        ディレクトリ内 (サブディレクトリも含む) の全ての AIVM / AIVMX ファイルを読み込み、カタログを構築する
+        読み込みに失敗したファイルはカタログに含めない
+
+        Args:
+            directory (Path): AIVM / AIVMX ファイルが配置されたディレクトリ
+            version (int | None): カタログのバージョン (省略時は現在時刻のナノ秒表現)
+
+        Returns:
+            AivmMetadataCatalog: ディレクトリからの相対パス (POSIX 形式) をキーとするカタログ
+        """
+
+        index = AivmModelIndex(directory)
+        models: dict[str, AivmMetadata] = {}
+        file_stats = index.scan()
+        for relative_path in file_stats:
+            try:
+                with (index.directory / relative_path).open('rb') as file:
+                    if relative_path.endswith('.aivmx'):
+                        models[relative_path] = read_aivmx_metadata(file)
+                    else:
+                        models[relative_path] = read_aivm_metadata(file)
+            except (OSError, AivmValidationError):
+                continue
+        return cls.build(models, file_stats, version)
+
+    @classmethod
+    def from_bytes(cls, buffer: bytes | bytearray | memoryview | mmap.mmap) -> 'AivmMetadataCatalog':
+        """
+        to_bytes() で得たバイト列から、コピーすることなくカタログを復元する
+        multiprocessing.shared_memory.SharedMemory.buf や mmap も指定できる
+
+        Args:
+            buffer (bytes | bytearray | memoryview | mmap.mmap): カタログのバイト列
+
+        Returns:
+            AivmMetadataCatalog: カタログ
+
+        Raises:
+            AivmValidationError: バイト列のフォーマットが不正な場合
+        """
+
+        return cls(buffer)
+
+    @classmethod
+    def open(cls, catalog_path: Path) -> 'AivmMetadataCatalog':
+        """
+        save() で保存したカタログファイルを mmap で開く
+        同一のファイルを開いた全てのプロセスで、ページキャッシュ上の 1 つの物理メモリが共有される
+        使い終えたら close() を呼び出すこと
+
+        Args:
+            catalog_path (Path): カタログファイルのパス
+
+        Returns:
+            AivmMetadataCatalog: カタログ
+
+        Raises:
+            AivmValidationError: カタログファイルのフォーマットが不正な場合
+        """
+
+        with catalog_path.open('rb') as file:
+            try:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # 空のファイルは mmap できない
+                raise AivmValidationError('Invalid metadata catalog format.')
+        try:
+            catalog = cls(mapped)
+        except AivmValidationError:
+            mapped.close()
+            raise
+        catalog._mmap = mapped
+        return catalog
+
+    def save(self, catalog_path: Path) -> None:
+        """
+        カタログをファイルに保存する
+        一時ファイルに書き込んでから置き換えるため、既にカタログファイルを開いているプロセスは置き換え前の内容を参照し続け、
+        書き込み途中の内容を読むことはない (差し替えは stale() で検知できる)
+
+        Args:
+            catalog_path (Path): カタログファイルのパス
+        """
+
+        temporary_path = catalog_path.with_name(f'.{catalog_path.name}.tmp')
+        with temporary_path.open('wb') as file:
+            file.write(self._buffer[: self._size])
+            # 置き換えた後に電源断などが発生しても、中身が空のカタログファイルが残らないよう、置き換える前にディスクへ書き出す
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, catalog_path)
+
+    def stale(self, catalog_path: Path) -> bool:
+        """
+        カタログファイルが、このカタログとは異なるバージョンのカタログに置き換えられているかを判定する
+        カタログファイルのヘッダーのみを読み取るため、ワーカーの定期的なチェックに用いても負荷は小さい
+
+        Args:
+            catalog_path (Path): カタログファイルのパス
+
+        Returns:
+            bool: カタログファイルのバージョンが異なる (または読み取れない) 場合は True
+        """
+
+        try:
+            with catalog_path.open('rb') as file:
+                header = file.read(_HEADER_STRUCT.size)
+        except OSError:
+            return True
+        if len(header) < _HEADER_STRUCT.size:
+            return True
+        magic, version, *_ = _HEADER_STRUCT.unpack(header)
+        return magic != _MAGIC or version != self._version
+
+    def close(self) -> None:
+        """
+        open() で開いたカタログファイルの mmap を解放する (以降、このカタログは参照できない)
+        """
+
+        self._buffer.release()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self) -> 'AivmMetadataCatalog':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def to_bytes(self) -> bytes:
+        """
+        カタログをバイト列として取得する
+
+        Returns:
+            bytes: カタログのバイト列
+        """
+
+        return bytes(self._buffer[: self._size])
+
+    @property
+    def version(self) -> int:
+        """カタログのバージョン (カタログを構築するたびに変わる)"""
+        return self._version
+
+    def __len__(self) -> int:
+        return self._entry_count
+
+    def __contains__(self, path: object) -> bool:
+        return isinstance(path, str) and self._find_path(path) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self._entry_count):
+            yield self._read_path(index)
+
+    def get(self, path: str) -> AivmCatalogEntry | None:
+        """
+        パスから、カタログのエントリを取得する
+
+        Args:
+            path (str): カタログ内でのファイルのパス
+
+        Returns:
+            AivmCatalogEntry | None: カタログのエントリ (存在しない場合は None)
+
+        Raises:
+            AivmValidationError: エントリのフォーマットが不正な場合
+        """
+
+        index = self._find_path(path)
+        if index is None:
+            return None
+        return self._build_entry(index)
+
+    def find_by_uuid(self, model_uuid: UUID) -> list[AivmCatalogEntry]:
+        """
+        モデル UUID から、カタログのエントリを取得する
+        同一のモデル UUID を持つファイル (異なるバージョンなど) が複数存在する場合は、全てのエントリを返す
+
+        Args:
+            model_uuid (UUID): 音声合成モデルの UUID
+
+        Returns:
+            list[AivmCatalogEntry]: カタログのエントリのリスト (パスの昇順)
+
+        Raises:
+            AivmValidationError: エントリのフォーマットが不正な場合
+        """
+
+        # モデル UUID のインデックスを二分探索し、最初に一致する位置を求める
+        key = model_uuid.bytes
+        low, high = 0, self._entry_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._uuid_key(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        indexes: list[int] = []
+        while low < self._entry_count:
+            uuid_bytes, index = self._uuid_key(low)
+            if uuid_bytes != key:
+                break
+            indexes.append(index)
+            low += 1
+        return [self._build_entry(index) for index in sorted(indexes)]
+
+    def _find_path(self, path: str) -> int | None:
+        """
+        パスに対応するエントリのインデックスを、二分探索で探す内部メソッド
+        """
+
+        key = path.encode('utf-8')
+        low, high = 0, self._entry_count
+        while low < high:
+            middle = (low + high) // 2
+            middle_key = self._read_path_bytes(middle)
+            if middle_key == key:
+                return middle
+            if middle_key < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def _uuid_key(self, position: int) -> tuple[bytes, int]:
+        return _UUID_INDEX_STRUCT.unpack_from(
+            self._buffer, self._uuid_index_offset + position * _UUID_INDEX_STRUCT.size
+        )
+
+    def _read_path_bytes(self, index: int) -> bytes:
+        """
+        エントリのパスを、文字列テーブルから UTF-8 のバイト列のまま読み取る内部メソッド
+        """
+
+        path_offset, path_length = _ENTRY_STRUCT.unpack_from(
+            self._buffer, self._entries_offset + index * _ENTRY_STRUCT.size
+        )[:2]
+        return self._slice(self._strings_offset, self._blobs_offset, path_offset, path_length)
+
+    def _read_path(self, index: int) -> str:
+        return self._read_path_bytes(index).decode('utf-8', errors='replace')
+
+    def _slice(self, region_start: int, region_end: int, offset: int, length: int) -> bytes:
+        """
+        領域内の相対オフセットで指定された範囲を、領域の境界を検証した上で読み取る内部メソッド
+        """
+
+        start = region_start + offset
+        if start + length > region_end:
+            raise AivmValidationError('Invalid metadata catalog format.')
+        return bytes(self._buffer[start : start + length])
+
+    def _build_entry(self, index: int) -> AivmCatalogEntry:
+        """
+        エントリのインデックスから AivmCatalogEntry を構築する内部メソッド
+        """
+
+        (
+            _,
+            _,
+            model_uuid_bytes,
+            mtime_ns,
+            size,
+            has_style_vectors,
+            manifest_offset,
+            manifest_length,
+            hyper_parameters_offset,
+            hyper_parameters_length,
+            style_vectors_offset,
+            style_vectors_length,
+        ) = _ENTRY_STRUCT.unpack_from(self._buffer, self._entries_offset + index * _ENTRY_STRUCT.size)
+        return AivmCatalogEntry(
+            path=self._read_path(index),
+            model_uuid=UUID(bytes=model_uuid_bytes),
+            mtime_ns=mtime_ns,
+            size=size,
+            manifest_json=self._slice(self._blobs_offset, self._size, manifest_offset, manifest_length),
+            hyper_parameters_json=self._slice(
+                self._blobs_offset, self._size, hyper_parameters_offset, hyper_parameters_length
+            ),
+            style_vectors=(
+                self._slice(self._blobs_offset, self._size, style_vectors_offset, style_vectors_length)
+                if has_style_vectors
+                else None
+            ),
+        )
@@ -0,0 +1,503 @@
+import bz2
+import io
+import lzma
+import struct
+import sys
+import threading
+import zlib
+from typing import BinaryIO, Protocol
+
+from aivmlib import (
+    AivmLimitExceededError,
+    AivmParseLimits,
+    AivmValidationError,
+    _read_aivm_header_bytes,
+    read_aivm_metadata,
+    read_aivmx_metadata,
+)
+from aivmlib.onnx_scanner import METADATA_PROPS_FIELD_NUMBER, ProtobufScanError, scan_model_fields
+from aivmlib.schemas.aivm_manifest import AivmMetadata, ModelFormat
+from aivmlib.utils import get_file_size, pread
+from aivmlib.virtual import AivmVirtualFile
+
+
+if sys.version_info >= (3, 11):
+    from enum import StrEnum
+else:
+    from aivmlib.utils import StrEnum
+
+
+# AIVM / AIVMX ファイルを圧縮して配布するための、ヘッダーを即座に読み取れるシーク可能な圧縮コンテナ
+# ファイル全体を伸長しなくても、先頭の小さなフレームのみから AIVM メタデータを読み込める
+#
+# コンテナの構造 (数値はすべて Little-Endian):
+#   プレリュード (固定長): マジックナンバー, バージョン, 圧縮方式, モデル形式, ペイロードフレームの伸長後のサイズ, ヘッドフレームの圧縮後のサイズ
+#   ヘッドフレーム: 元のファイルのうちヘッダー (AIVM) / metadata_props (AIVMX) の部分のみを、元のファイル内での位置とともに圧縮したもの
+#   ペイロードフレーム x N: ヘッド以外の部分 (重み) を一定サイズごとに区切り、フレームごとに独立して圧縮したもの
+#   フレームインデックス: 各ペイロードフレームのコンテナ内でのオフセット・圧縮後のサイズ・CRC-32
+#   フッター (固定長): フレームインデックスのオフセット, ペイロード全体の伸長後のサイズ, フレーム数, マジックナンバー
+
+# コンテナのマジックナンバーとバージョン
+CONTAINER_MAGIC = b'AIVMPACK'
+CONTAINER_VERSION = 1
+
+# ペイロードフレームの伸長後のサイズの既定値
+DEFAULT_FRAME_SIZE = 4 * 1024 * 1024
+
+# プレリュード: マジックナンバー, バージョン, 圧縮方式, モデル形式, ペイロードフレームのサイズ, ヘッドフレームの圧縮後のサイズ
+_PRELUDE_STRUCT = struct.Struct('<8sHBBIQ')
+# ペイロードフレームの先頭に置くヘッダー: 圧縮後のサイズ, 伸長後のデータの CRC-32
+_FRAME_HEADER_STRUCT = struct.Struct('<II')
+# フレームインデックスのエントリ: フレームヘッダーのオフセット, 圧縮後のサイズ, 伸長後のデータの CRC-32
+_INDEX_ENTRY_STRUCT = struct.Struct('<QII')
+# フッター: フレームインデックスのオフセット, ペイロード全体の伸長後のサイズ, フレーム数, マジックナンバー
+_FOOTER_STRUCT = struct.Struct('<QQI8s')
+# ヘッドフレームの伸長後の先頭: 元のファイルのサイズ, ヘッドに含まれる範囲の数
+_HEAD_STRUCT = struct.Struct('<QI')
+# ヘッドに含まれる範囲: 元のファイル内でのオフセット, バイト数
+_HEAD_RANGE_STRUCT = struct.Struct('<QQ')
+
+# AIVM メタデータの読み込み時に、1 回目の読み取りでまとめて読み取るコンテナ先頭のバイト数
+# ヘッドフレームが小さければ、プレリュードとヘッドフレームを 1 回の読み取りで取得できる
+_HEAD_READ_SIZE = 64 * 1024
+
+# ヘッドフレームの伸長後のサイズの上限の既定値 (AIVM ファイルのヘッダーサイズの上限と同一)
+_DEFAULT_MAX_HEAD_SIZE = 100 * 1024 * 1024
+
+
+class ContainerCodec(StrEnum):
+    # zlib (Deflate): 高速で、圧縮率は控えめ
+    Zlib = 'zlib'
+    # LZMA (xz): 低速だが、圧縮率が高い
+    Lzma = 'lzma'
+    # bzip2
+    Bz2 = 'bz2'
+
+
+# コンテナに記録する圧縮方式・モデル形式の ID
+_CODEC_IDS = {ContainerCodec.Zlib: 1, ContainerCodec.Lzma: 2, ContainerCodec.Bz2: 3}
+_MODEL_FORMAT_IDS = {ModelFormat.Safetensors: 1, ModelFormat.ONNX: 2}
+
+
+class _Decompressor(Protocol):
+    eof: bool
+
+    def decompress(self, data: bytes, max_length: int = -1) -> bytes: ...
+
+
+def pack_aivm_container(
+    source_file: BinaryIO,
+    output_file: BinaryIO,
+    model_format: ModelFormat,
+    codec: ContainerCodec = ContainerCodec.Zlib,
+    frame_size: int = DEFAULT_FRAME_SIZE,
+) -> None:
+    """
+    AIVM / AIVMX ファイルを圧縮コンテナに変換し、出力先に先頭から順に書き込む
+    重み部分はフレームごとに読み取り・圧縮するため、ファイル全体をメモリ上に読み込むことはない
+    出力先はシーク不可能なストリームでもよい
+
+    Args:
+        source_file (BinaryIO): 圧縮する AIVM / AIVMX ファイル
+        output_file (BinaryIO): 圧縮コンテナの書き込み先
+        model_format (ModelFormat): 圧縮するファイルのモデル形式
+        codec (ContainerCodec): 圧縮方式
+        frame_size (int): ペイロードフレームの伸長後のサイズ
+
+    Raises:
+        AivmValidationError: AIVM / AIVMX ファイルのフォーマットが不正な場合
+    """
+
+    if frame_size <= 0 or frame_size > 0xFFFFFFFF:
+        raise ValueError(f'Invalid frame size: {frame_size}')
+
+    # 元のファイルのうち、ヘッドフレームに格納する範囲 (AIVM: ヘッダー / AIVMX: metadata_props) を求める
+    source_size = get_file_size(source_file)
+    head_ranges = _get_head_ranges(source_file, model_format)
+
+    # ヘッドフレームを構築して圧縮し、プレリュードとともに書き込む
+    head = bytearray(_HEAD_STRUCT.pack(source_size, len(head_ranges)))
+    for offset, length in head_ranges:
+        head += _HEAD_RANGE_STRUCT.pack(offset, length)
+    for offset, length in head_ranges:
+        head += pread(source_file, length, offset)
+    compressed_head = _compress(codec, bytes(head))
+    prelude = _PRELUDE_STRUCT.pack(
+        CONTAINER_MAGIC,
+        CONTAINER_VERSION,
+        _CODEC_IDS[codec],
+        _MODEL_FORMAT_IDS[model_format],
+        frame_size,
+        len(compressed_head),
+    )
+    output_file.write(prelude)
+    output_file.write(compressed_head)
+    position = len(prelude) + len(compressed_head)
+
+    # ヘッド以外の範囲 (重み) を先頭から順に読み取り、一定サイズごとに独立したフレームとして圧縮して書き込む
+    index: list[bytes] = []
+    payload_size = 0
+    frame = bytearray()
+
+    def flush_frame() -> None:
+        nonlocal position
+        compressed_frame = _compress(codec, bytes(frame))
+        crc32 = zlib.crc32(frame)
+        output_file.write(_FRAME_HEADER_STRUCT.pack(len(compressed_frame), crc32))
+        output_file.write(compressed_frame)
+        index.append(_INDEX_ENTRY_STRUCT.pack(position, len(compressed_frame), crc32))
+        position += _FRAME_HEADER_STRUCT.size + len(compressed_frame)
+        frame.clear()
+
+    for offset, length in _get_payload_ranges(head_ranges, source_size):
+        end = offset + length
+        while offset < end:
+            chunk = pread(source_file, min(frame_size - len(frame), end - offset), offset)
+            if not chunk:
+                raise AivmValidationError('The source file was truncated while reading.')
+            frame += chunk
+            offset += len(chunk)
+            payload_size += len(chunk)
+            if len(frame) == frame_size:
+                flush_frame()
+    if frame:
+        flush_frame()
+
+    # フレームインデックスとフッターを書き込む
+    output_file.write(b''.join(index))
+    output_file.write(_FOOTER_STRUCT.pack(position, payload_size, len(index), CONTAINER_MAGIC))
+
+
+def is_aivm_container(file: BinaryIO) -> bool:
+    """
+    ファイルが圧縮コンテナかどうかを、先頭のマジックナンバーから判定する
+
+    Args:
+        file (BinaryIO): 判定するファイル
+
+    Returns:
+        bool: 圧縮コンテナの場合は True
+    """
+
+    return pread(file, len(CONTAINER_MAGIC), 0) == CONTAINER_MAGIC
+
+
+class AivmContainerReader:
+    """
+    圧縮コンテナから AIVM メタデータや元のファイルの内容を読み取るリーダー
+    初期化時にコンテナ先頭のプレリュードとヘッドフレームのみを読み取るため、AIVM メタデータの読み込みは小さな 1 回の読み取りで完了する
+    コンテナのカーソル位置は変更しないため、同一のファイルオブジェクトを複数のリーダーで共有できる
+    """
+
+    def __init__(self, container_file: BinaryIO, limits: AivmParseLimits | None = None) -> None:
+        """
+        Args:
+            container_file (BinaryIO): 圧縮コンテナ (リーダーを使い終えるまで閉じてはならない)
+            limits (AivmParseLimits | None): パース処理のリソース上限 (指定時はヘッドフレームの伸長後のサイズにも適用される)
+
+        Raises:
+            AivmValidationError: 圧縮コンテナのフォーマットが不正な場合
+            AivmLimitExceededError: ヘッドフレームの伸長後のサイズがリソース上限を超えた場合
+        """
+
+        self._container_file = container_file
+        self._limits = limits
+
+        # プレリュードとヘッドフレームをまとめて読み取る
+        buffer = pread(container_file, _HEAD_READ_SIZE, 0)
+        if len(buffer) < _PRELUDE_STRUCT.size:
+            raise AivmValidationError('This file is not an AIVM container.')
+        magic, version, codec_id, format_id, frame_size, compressed_head_size = _PRELUDE_STRUCT.unpack_from(buffer)
+        if magic != CONTAINER_MAGIC:
+            raise AivmValidationError('This file is not an AIVM container.')
+        if version != CONTAINER_VERSION:
+            raise AivmValidationError(f'Unsupported AIVM container version: {version}.')
+        codecs = {codec_id: codec for codec, codec_id in _CODEC_IDS.items()}
+        model_formats = {format_id: model_format for model_format, format_id in _MODEL_FORMAT_IDS.items()}
+        if codec_id not in codecs or format_id not in model_formats or frame_size == 0:
+            raise AivmValidationError('Invalid AIVM container prelude.')
+        self.codec: ContainerCodec = codecs[codec_id]
+        self.model_format: ModelFormat = model_formats[format_id]
+        self.frame_size: int = frame_size
+
+        # ヘッドフレームが 1 回目の読み取りに収まっていなければ、残りを読み取る
+        head_end = _PRELUDE_STRUCT.size + compressed_head_size
+        if head_end > len(buffer):
+            buffer += pread(container_file, head_end - len(buffer), len(buffer))
+        if len(buffer) < head_end:
+            raise AivmValidationError('The AIVM container is truncated.')
+        self._payload_offset = head_end
+
+        # ヘッドフレームを伸長する (伸長後のサイズに上限を設け、圧縮爆弾を防ぐ)
+        max_head_size = limits.max_header_size if limits is not None else _DEFAULT_MAX_HEAD_SIZE
+        head = _decompress(self.codec, buffer[_PRELUDE_STRUCT.size : head_end], max_head_size + _HEAD_STRUCT.size)
+        if len(head) < _HEAD_STRUCT.size:
+            raise AivmValidationError('Invalid AIVM container head frame.')
+        self.original_size, range_count = _HEAD_STRUCT.unpack_from(head)
+        ranges_end = _HEAD_STRUCT.size + range_count * _HEAD_RANGE_STRUCT.size
+        if len(head) < ranges_end:
+            raise AivmValidationError('Invalid AIVM container head frame.')
+
+        # ヘッドに含まれる範囲と、その内容を取り出す
+        self._head_parts: list[tuple[int, bytes]] = []
+        cursor = ranges_end
+        previous_end = 0
+        for index in range(range_count):
+            offset, length = _HEAD_RANGE_STRUCT.unpack_from(head, _HEAD_STRUCT.size + index * _HEAD_RANGE_STRUCT.size)
+            if offset < previous_end or offset + length > self.original_size or cursor + length > len(head):
+                raise AivmValidationError('Invalid AIVM container head frame.')
+            self._head_parts.append((offset, head[cursor : cursor + length]))
+            cursor += length
+            previous_end = offset + length
+
+        # フレームインデックスは、元のファイルの内容への読み取りが必要になった時点で読み込む
+        self._index: list[tuple[int, int, int]] | None = None
+        self._frame_cache: tuple[int, bytes] | None = None
+        self._lock = threading.Lock()
+
+    def read_metadata(self) -> AivmMetadata:
+        """
+        ヘッドフレームのみから AIVM メタデータを読み込む (ペイロードフレームは一切読み取らない)
+
+        Returns:
+            AivmMetadata: AIVM メタデータ
+
+        Raises:
+            AivmValidationError: AIVM メタデータのフォーマットが不正・バリデーションに失敗した場合
+            AivmLimitExceededError: リソース上限を超えた場合
+        """
+
+        # AIVM: ヘッドはファイル先頭のヘッダーサイズとヘッダー JSON そのものなので、AIVM ファイルとしてそのまま読み込める
+        # AIVMX: ヘッドは metadata_props のフィールドの列なので、metadata_props のみを含む ModelProto として読み込める
+        head = io.BytesIO(b''.join(data for _, data in self._head_parts))
+        if self.model_format == ModelFormat.Safetensors:
+            return read_aivm_metadata(head, self._limits)
+        return read_aivmx_metadata(head, limits=self._limits)
+
+    def open(self) -> AivmVirtualFile:
+        """
+        元の AIVM / AIVMX ファイルの内容を、必要なフレームのみを伸長しながら任意の位置から読み取れる仮想ファイルとして開く
+        read_aivm_metadata() などの既存の関数に、元のファイルの代わりにそのまま渡すことができる
+
+        Returns:
+            AivmVirtualFile: 元の AIVM / AIVMX ファイルの内容の仮想ファイル
+
+        Raises:
+            AivmValidationError: 圧縮コンテナのフォーマットが不正な場合
+        """
+
+        # ヘッドに含まれる範囲はメモリ上のバイト列、それ以外の範囲は伸長後のペイロード内の範囲として連結する
+        parts: list[bytes | tuple[int, int]] = []
+        payload_offset = 0
+        position = 0
+        for offset, data in self._head_parts:
+            if offset > position:
+                parts.append((payload_offset, offset - position))
+                payload_offset += offset - position
+            parts.append(data)
+            position = offset + len(data)
+        if self.original_size > position:
+            parts.append((payload_offset, self.original_size - position))
+        return AivmVirtualFile(_ContainerPayloadFile(self), parts)
+
+    def unpack(self, output_file: BinaryIO) -> None:
+        """
+        圧縮コンテナを伸長し、元の AIVM / AIVMX ファイルと同一のバイト列を出力先に先頭から順に書き込む
+        ペイロードフレームは 1 つずつ伸長するため、ファイル全体をメモリ上に展開することはない
+
+        Args:
+            output_file (BinaryIO): 元のファイルの書き込み先
+
+        Raises:
+            AivmValidationError: 圧縮コンテナのフォーマットが不正・フレームが破損している場合
+        """
+
+        virtual_file = self.open()
+        for chunk in virtual_file.iter_chunks(chunk_size=self.frame_size):
+            output_file.write(chunk)
+
+    def _read_payload_range(self, offset: int, size: int) -> bytes:
+        """
+        伸長後のペイロードの指定範囲を、該当するフレームのみを伸長して読み取る内部メソッド
+        """
+
+        chunks: list[bytes] = []
+        while size > 0:
+            frame_index, start_in_frame = divmod(offset, self.frame_size)
+            frame = self._read_frame(frame_index)
+            chunk = frame[start_in_frame : start_in_frame + size]
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def _read_frame(self, frame_index: int) -> bytes:
+        """
+        指定されたペイロードフレームを伸長して返す内部メソッド (直近に伸長したフレームはキャッシュする)
+        """
+
+        with self._lock:
+            if self._frame_cache is not None and self._frame_cache[0] == frame_index:
+                return self._frame_cache[1]
+            index = self._load_index()
+        if frame_index >= len(index):
+            return b''
+        frame_offset, compressed_size, crc32 = index[frame_index]
+        compressed_frame = pread(self._container_file, compressed_size, frame_offset + _FRAME_HEADER_STRUCT.size)
+        if len(compressed_frame) < compressed_size:
+            raise AivmValidationError('The AIVM container is truncated.')
+        frame = _decompress(self.codec, compressed_frame, self.frame_size)
+        payload_size = self.original_size - sum(len(data) for _, data in self._head_parts)
+        expected_size = min(self.frame_size, payload_size - frame_index * self.frame_size)
+        if len(frame) != expected_size or zlib.crc32(frame) != crc32:
+            raise AivmValidationError(f'Payload frame {frame_index} of the AIVM container is corrupted.')
+        with self._lock:
+            self._frame_cache = (frame_index, frame)
+        return frame
+
+    def _load_index(self) -> list[tuple[int, int, int]]:
+        """
+        コンテナ末尾のフッターとフレームインデックスを読み込む内部メソッド (呼び出し側でロックを取得していること)
+        """
+
+        if self._index is not None:
+            return self._index
+        container_size = get_file_size(self._container_file)
+        if container_size < self._payload_offset + _FOOTER_STRUCT.size:
+            raise AivmValidationError('The AIVM container is truncated.')
+        footer = pread(self._container_file, _FOOTER_STRUCT.size, container_size - _FOOTER_STRUCT.size)
+        index_offset, payload_size, frame_count, magic = _FOOTER_STRUCT.unpack(footer)
+        index_size = frame_count * _INDEX_ENTRY_STRUCT.size
+        if (
+            magic != CONTAINER_MAGIC
+            or index_offset + index_size + _FOOTER_STRUCT.size != container_size
+            or payload_size != self.original_size - sum(len(data) for _, data in self._head_parts)
+            or frame_count != -(-payload_size // self.frame_size)
+        ):
+            raise AivmValidationError('Invalid AIVM container footer.')
+        index_bytes = pread(self._container_file, index_size, index_offset)
+        self._index = list(_INDEX_ENTRY_STRUCT.iter_unpack(index_bytes))
+        return self._index
+
+
+class _ContainerPayloadFile(io.RawIOBase):
+    """
+    圧縮コンテナの伸長後のペイロードを、シーク可能な読み取り専用ファイルとして見せる内部クラス
+    AivmVirtualFile の元のファイルとして用いる
+    """
+
+    def __init__(self, reader: AivmContainerReader) -> None:
+        super().__init__()
+        self._reader = reader
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('Only SEEK_SET is supported.')
+        self._position = offset
+        return offset
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            payload_size = self._reader.original_size - sum(len(data) for _, data in self._reader._head_parts)
+            size = max(payload_size - self._position, 0)
+        data = self._reader._read_payload_range(self._position, size)
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:  # type: ignore[override]
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def _get_head_ranges(source_file: BinaryIO, model_format: ModelFormat) -> list[tuple[int, int]]:
+    """
+    元のファイルのうち、ヘッドフレームに格納する範囲 (オフセット, バイト数) を求める内部メソッド
+    """
+
+    # AIVM: 先頭のヘッダーサイズとヘッダー JSON
+    if model_format == ModelFormat.Safetensors:
+        return [(0, 8 + len(_read_aivm_header_bytes(source_file)))]
+
+    # AIVMX: metadata_props のフィールド (隣接するものは 1 つにまとめる)
+    try:
+        fields = scan_model_fields(source_file)
+    except ProtobufScanError:
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+    ranges: list[tuple[int, int]] = []
+    for field in fields:
+        if field.number != METADATA_PROPS_FIELD_NUMBER:
+            continue
+        if ranges and ranges[-1][0] + ranges[-1][1] == field.offset:
+            ranges[-1] = (ranges[-1][0], field.end - ranges[-1][0])
+        else:
+            ranges.append((field.offset, field.end - field.offset))
+    return ranges
+
+
+def _get_payload_ranges(head_ranges: list[tuple[int, int]], source_size: int) -> list[tuple[int, int]]:
+    """
+    元のファイルのうち、ヘッドフレームに含まれない範囲 (オフセット, バイト数) を求める内部メソッド
+    """
+
+    ranges: list[tuple[int, int]] = []
+    position = 0
+    for offset, length in head_ranges:
+        if offset > position:
+            ranges.append((position, offset - position))
+        position = offset + length
+    if source_size > position:
+        ranges.append((position, source_size - position))
+    return ranges
+
+
+def _compress(codec: ContainerCodec, data: bytes) -> bytes:
+    """
+    指定された圧縮方式でバイト列を圧縮する内部メソッド
+    """
+
+    if codec == ContainerCodec.Lzma:
+        return lzma.compress(data)
+    if codec == ContainerCodec.Bz2:
+        return bz2.compress(data)
+    return zlib.compress(data)
+
+
+def _decompress(codec: ContainerCodec, data: bytes, max_size: int) -> bytes:
+    """
+    指定された圧縮方式でバイト列を伸長する内部メソッド
+    伸長後のサイズが上限を超える場合は、上限を超えた時点で伸長を打ち切ってエラーとする
+
+    Raises:
+        AivmValidationError: 圧縮データが破損している場合
+        AivmLimitExceededError: 伸長後のサイズが上限を超えた場合
+    """
+
+    decompressor: _Decompressor
+    if codec == ContainerCodec.Lzma:
+        decompressor = lzma.LZMADecompressor()
+    elif codec == ContainerCodec.Bz2:
+        decompressor = bz2.BZ2Decompressor()
+    else:
+        decompressor = zlib.decompressobj()
+    try:
+        result = decompressor.decompress(data, max_size + 1)
+    except (zlib.error, lzma.LZMAError, OSError, EOFError):
+        raise AivmValidationError('The AIVM container frame is corrupted.')
+    if len(result) > max_size:
+        raise AivmLimitExceededError(f'Decompressed frame size exceeds the limit ({max_size} bytes).')
+    if not decompressor.eof:
+        raise AivmValidationError('The AIVM container frame is truncated.')
+    return result
@@ -0,0 +1,253 @@
+import base64
+import binascii
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from aivmlib import AivmValidationError, _read_aivm_header_bytes
+from aivmlib.json_scanner import parse_json_path, scan_json_paths
+from aivmlib.onnx_scanner import ProtobufScanError, read_metadata_props, scan_model_fields
+
+
+# AIVM マニフェスト全体をパース・バリデーションすることなく、必要なフィールドのみを取り出すためのユーティリティ
+# Safetensors のヘッダー JSON や AIVMX の aivm_manifest 文字列を先頭から 1 度だけ走査し、対象外の値は読み飛ばす
+
+# AIVM マニフェストに格納されうる Data URL の MIME タイプと、書き出し時のファイル拡張子の対応
+DATA_URL_MIME_TYPE_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'audio/wav': '.wav',
+    'audio/mp4': '.m4a',
+}
+
+_DATA_URL_PATTERN = re.compile(r'data:(image/jpeg|image/png|audio/wav|audio/mp4);base64,')
+_CONCRETE_PATH_PATTERN = re.compile(r'speakers\[(\d+)\](?:\.styles\[(\d+)\])?(?:\.voice_samples\[(\d+)\])?')
+
+# extract_aivm_assets() / extract_aivmx_assets() で取り出すフィールドのパス
+_ASSET_PATHS = [
+    'speakers[*].uuid',
+    'speakers[*].icon',
+    'speakers[*].styles[*].local_id',
+    'speakers[*].styles[*].icon',
+    'speakers[*].styles[*].voice_samples[*].audio',
+]
+
+
+def extract_aivm_manifest_fields(aivm_file: BinaryIO, paths: list[str]) -> dict[str, list[tuple[str, Any]]]:
+    """
+    AIVM ファイルの AIVM マニフェストから、指定されたパスに一致するフィールドの値のみを取り出す
+    AIVM マニフェストのバリデーションは行わないため、取り出した値の妥当性は呼び出し側で確認する必要がある
+
+    Args:
+        aivm_file (BinaryIO): AIVM ファイル
+        paths (list[str]): 取り出すフィールドのパスのリスト (ex: `speakers[*].styles[*].voice_samples[*].audio`)
+
+    Returns:
+        dict[str, list[tuple[str, Any]]]: パスごとの、一致したフィールドの具体的なパス (ex: `speakers[0].icon`) と値のリスト
+
+    Raises:
+        AivmValidationError: AIVM ファイルのフォーマットが不正・AIVM マニフェストが存在しない場合
+        ValueError: パスの書式が不正な場合
+    """
+
+    return _scan_aivm_manifest(_read_aivm_manifest_text(aivm_file), paths)
+
+
+def extract_aivmx_manifest_fields(aivmx_file: BinaryIO, paths: list[str]) -> dict[str, list[tuple[str, Any]]]:
+    """
+    AIVMX ファイルの AIVM マニフェストから、指定されたパスに一致するフィールドの値のみを取り出す
+    AIVM マニフェストのバリデーションは行わないため、取り出した値の妥当性は呼び出し側で確認する必要がある
+
+    Args:
+        aivmx_file (BinaryIO): AIVMX ファイル
+        paths (list[str]): 取り出すフィールドのパスのリスト (ex: `speakers[*].styles[*].voice_samples[*].audio`)
+
+    Returns:
+        dict[str, list[tuple[str, Any]]]: パスごとの、一致したフィールドの具体的なパス (ex: `speakers[0].icon`) と値のリスト
+
+    Raises:
+        AivmValidationError: AIVMX ファイルのフォーマットが不正・AIVM マニフェストが存在しない場合
+        ValueError: パスの書式が不正な場合
+    """
+
+    return _scan_aivm_manifest(_read_aivmx_manifest_text(aivmx_file), paths)
+
+
+def extract_aivm_assets(aivm_file: BinaryIO, output_dir: Path, max_workers: int | None = None) -> list[Path]:
+    """
+    AIVM ファイルの AIVM マニフェストに含まれるアイコン画像・ボイスサンプル音声をデコードし、並列にファイルとして書き出す
+    書き出し先は `{話者 UUID}/icon.jpg`・`{話者 UUID}/styles/{スタイル ID}/voice_samples/0.m4a` のような構成となる
+
+    Args:
+        aivm_file (BinaryIO): AIVM ファイル
+        output_dir (Path): 書き出し先のディレクトリ
+        max_workers (int | None): 並列に処理するスレッド数 (省略時は ThreadPoolExecutor の既定値)
+
+    Returns:
+        list[Path]: 書き出したファイルのパスのリスト
+
+    Raises:
+        AivmValidationError: AIVM ファイルのフォーマットが不正・Data URL のデコードに失敗した場合
+    """
+
+    return _save_manifest_assets(_read_aivm_manifest_text(aivm_file), output_dir, max_workers)
+
+
+def extract_aivmx_assets(aivmx_file: BinaryIO, output_dir: Path, max_workers: int | None = None) -> list[Path]:
+    """
+    AIVMX ファイルの AIVM マニフェストに含まれるアイコン画像・ボイスサンプル音声をデコードし、並列にファイルとして書き出す
+    書き出し先は `{話者 UUID}/icon.jpg`・`{話者 UUID}/styles/{スタイル ID}/voice_samples/0.m4a` のような構成となる
+
+    Args:
+        aivmx_file (BinaryIO): AIVMX ファイル
+        output_dir (Path): 書き出し先のディレクトリ
+        max_workers (int | None): 並列に処理するスレッド数 (省略時は ThreadPoolExecutor の既定値)
+
+    Returns:
+        list[Path]: 書き出したファイルのパスのリスト
+
+    Raises:
+        AivmValidationError: AIVMX ファイルのフォーマットが不正・Data URL のデコードに失敗した場合
+    """
+
+    return _save_manifest_assets(_read_aivmx_manifest_text(aivmx_file), output_dir, max_workers)
+
+
+def decode_data_url(data_url: str) -> tuple[str, bytes]:
+    """
+    AIVM マニフェストに格納されている Base64 形式の Data URL をデコードする
+
+    Args:
+        data_url (str): Data URL
+
+    Returns:
+        tuple[str, bytes]: MIME タイプとデコードされたバイト列
+
+    Raises:
+        AivmValidationError: サポートされていない MIME タイプ・Base64 のデコードに失敗した場合
+    """
+
+    match = _DATA_URL_PATTERN.match(data_url)
+    if match is None:
+        raise AivmValidationError('Unsupported Data URL format.')
+    try:
+        return match.group(1), base64.b64decode(data_url[match.end() :], validate=True)
+    except binascii.Error:
+        raise AivmValidationError('Failed to decode Data URL.')
+
+
+def _read_aivm_manifest_text(aivm_file: BinaryIO) -> str:
+    """
+    AIVM ファイルのヘッダー JSON から、AIVM マニフェストの JSON 文字列のみを取り出す内部メソッド
+    テンソル情報や他のメタデータの値はデコードせずに読み飛ばす
+    """
+
+    header_bytes = _read_aivm_header_bytes(aivm_file)
+    try:
+        header_text = header_bytes.decode('utf-8')
+        results = scan_json_paths(header_text, ['__metadata__.aivm_manifest'])
+    except (UnicodeDecodeError, ValueError):
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.')
+
+    # 同一のキーが複数存在する場合は、json.loads() と同様に後勝ちとする
+    values = results['__metadata__.aivm_manifest']
+    if not values or not isinstance(values[-1][1], str) or not values[-1][1]:
+        raise AivmValidationError('AIVM manifest not found.')
+    return values[-1][1]
+
+
+def _read_aivmx_manifest_text(aivmx_file: BinaryIO) -> str:
+    """
+    AIVMX ファイルの metadata_props から、AIVM マニフェストの JSON 文字列のみを取り出す内部メソッド
+    ONNX モデル全体はパースせず、グラフや他のメタデータの値は読み飛ばす
+    """
+
+    try:
+        fields = scan_model_fields(aivmx_file)
+        metadata_props = read_metadata_props(aivmx_file, fields, keys={'aivm_manifest'})
+    except ProtobufScanError:
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+
+    if not metadata_props.get('aivm_manifest'):
+        raise AivmValidationError('AIVM manifest not found.')
+    return metadata_props['aivm_manifest']
+
+
+def _scan_aivm_manifest(manifest_text: str, paths: list[str]) -> dict[str, list[tuple[str, Any]]]:
+    """
+    AIVM マニフェストの JSON 文字列から、指定されたパスに一致するフィールドの値のみを取り出す内部メソッド
+    """
+
+    # パスの書式が不正な場合は、AIVM マニフェストを走査する前に ValueError をそのまま送出する
+    for path in paths:
+        parse_json_path(path)
+
+    try:
+        return scan_json_paths(manifest_text, paths)
+    except ValueError:
+        raise AivmValidationError('Invalid AIVM manifest format.')
+
+
+def _save_manifest_assets(manifest_text: str, output_dir: Path, max_workers: int | None) -> list[Path]:
+    """
+    AIVM マニフェストの JSON 文字列に含まれるアイコン画像・ボイスサンプル音声を、並列にファイルとして書き出す内部メソッド
+    """
+
+    fields = _scan_aivm_manifest(manifest_text, _ASSET_PATHS)
+
+    # 書き出し先のパスに利用する話者 UUID とスタイル ID を、配列のインデックスから引けるようにしておく
+    # 話者 UUID とスタイル ID はパスの一部となるため、書き出し先ディレクトリの外を指さないよう厳密に検証する
+    speaker_uuids: dict[str, str] = {}
+    for path, value in fields['speakers[*].uuid']:
+        try:
+            speaker_uuids[_CONCRETE_PATH_PATTERN.match(path).group(1)] = str(uuid.UUID(str(value)))
+        except ValueError:
+            raise AivmValidationError(f'Invalid speaker UUID at {path}.')
+    style_local_ids: dict[tuple[str, str], int] = {}
+    for path, value in fields['speakers[*].styles[*].local_id']:
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise AivmValidationError(f'Invalid style local ID at {path}.')
+        match = _CONCRETE_PATH_PATTERN.match(path)
+        style_local_ids[(match.group(1), match.group(2))] = value
+
+    # 書き出すファイルの相対パスと Data URL の組を列挙する
+    assets: list[tuple[Path, str]] = []
+    asset_fields = (
+        fields['speakers[*].icon']
+        + fields['speakers[*].styles[*].icon']
+        + fields['speakers[*].styles[*].voice_samples[*].audio']
+    )
+    for path, value in asset_fields:
+        # 省略されたスタイルのアイコン画像は書き出さない
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            raise AivmValidationError(f'Invalid Data URL at {path}.')
+        match = _CONCRETE_PATH_PATTERN.match(path)
+        speaker_index, style_index, sample_index = match.groups()
+        if speaker_index not in speaker_uuids:
+            raise AivmValidationError(f'Speaker UUID not found for {path}.')
+        relative_path = Path(speaker_uuids[speaker_index])
+        if style_index is not None:
+            if (speaker_index, style_index) not in style_local_ids:
+                raise AivmValidationError(f'Style local ID not found for {path}.')
+            relative_path = relative_path / 'styles' / str(style_local_ids[(speaker_index, style_index)])
+        if sample_index is not None:
+            relative_path = relative_path / 'voice_samples' / sample_index
+        else:
+            relative_path = relative_path / 'icon'
+        assets.append((relative_path, value))
+
+    def save_asset(asset: tuple[Path, str]) -> Path:
+        relative_path, data_url = asset
+        mime_type, data = decode_data_url(data_url)
+        output_path = output_dir / relative_path.with_suffix(DATA_URL_MIME_TYPE_EXTENSIONS[mime_type])
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_bytes(data)
+        return output_path
+
+    # Base64 のデコードとファイルへの書き出しをアセットごとに並列に行う
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(save_asset, assets))
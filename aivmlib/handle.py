@@ -0,0 +1,472 @@
+import os
+import stat
+import sys
+import tempfile
+from abc import ABC, abstractmethod
+from collections.abc import Iterable
+from pathlib import Path
+from typing import BinaryIO, TypeVar
+
+from aivmlib import (
+    AivmLimitExceededError,
+    AivmParseLimits,
+    AivmValidationError,
+    _decode_aivm_header,
+    _prepare_aivm_metadata_for_write,
+    _read_aivm_header_bytes,
+    _rebuild_aivm_header_text,
+    _splice_aivm_header_metadata,
+    serialize_aivm_metadata,
+    validate_aivm_metadata,
+    write_aivmx_metadata,
+)
+from aivmlib.onnx_scanner import (
+    METADATA_LOCATOR_FIELD_NUMBER,
+    METADATA_PROPS_FIELD_NUMBER,
+    ProtobufField,
+    ProtobufScanError,
+    ProtobufScanLimitError,
+    encode_metadata_locator,
+    encode_metadata_props,
+    read_metadata_props,
+    scan_model_fields,
+)
+from aivmlib.schemas.aivm_manifest import AivmMetadata, ModelFormat
+from aivmlib.utils import get_file_size
+from aivmlib.virtual import AivmVirtualFile
+
+
+if sys.version_info >= (3, 11):
+    from enum import StrEnum
+else:
+    from aivmlib.utils import StrEnum
+
+
+# AIVM / AIVMX ファイルを開いたまま、AIVM メタデータの読み込み・変更・書き込みを繰り返すためのハンドル
+# ヘッダー (AIVM) / トップレベルのフィールド (AIVMX) は開いた時点で一度だけパースし、AIVM メタデータとバイト位置を保持し続ける
+# 書き込み時は前回の書き込み (または読み込み) 時点から変更された項目のみを書き込み、ファイルの状態に応じて最も安価な方法を選ぶ
+
+
+class AivmWriteStrategy(StrEnum):
+    # Weight 部分に触れず、既存のファイルのメタデータ部分のみを上書きする
+    # (AIVM: 新しいヘッダーが既存のヘッダーの領域に収まる場合 / AIVMX: metadata_props がファイル末尾にまとまっている場合)
+    # ファイルを直接書き換えるため、書き込み中に中断するとファイルが破損する可能性がある
+    InPlace = 'in-place'
+    # 新しいメタデータ部分と元のファイルの Weight 部分のバイト範囲を連結した一時ファイルを書き出し、アトミックに置き換える
+    Splice = 'splice'
+    # ヘッダー JSON 全体 (AIVM) / ONNX モデル全体 (AIVMX) をシリアライズし直した一時ファイルを書き出し、アトミックに置き換える
+    Rewrite = 'rewrite'
+
+
+_AivmFileHandleT = TypeVar('_AivmFileHandleT', bound='_AivmFileHandle')
+
+
+class _AivmFileHandle(ABC):
+    """AIVM / AIVMX ファイルのハンドルの共通部分"""
+
+    # ハンドルが扱うファイルのモデル形式
+    model_format: ModelFormat
+
+    def __init__(self, path: Path, limits: AivmParseLimits | None = None) -> None:
+        """
+        ファイルを開き、AIVM メタデータを読み込む
+
+        Args:
+            path (Path): ファイルのパス
+            limits (AivmParseLimits | None): パース処理のリソース上限 (信頼できないファイルを開く場合に指定する)
+
+        Raises:
+            AivmValidationError: ファイルのフォーマットが不正・AIVM メタデータのバリデーションに失敗した場合
+            AivmLimitExceededError: リソース上限を超えた場合
+        """
+
+        # ファイルのパス
+        self.path = path
+        # 読み込んだ AIVM メタデータ (直接変更した上で commit() を呼ぶと、変更された項目のみがファイルに書き込まれる)
+        self.metadata: AivmMetadata
+        # 前回の書き込み (または読み込み) 時点の AIVM メタデータのシリアライズ結果 (変更された項目の検出に使う)
+        self._committed_metadata: dict[str, str] = {}
+
+        self._file: BinaryIO = path.open('rb')
+        try:
+            self._load(limits)
+        except BaseException:
+            self._file.close()
+            raise
+
+    def __enter__(self: _AivmFileHandleT) -> _AivmFileHandleT:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    @property
+    def closed(self) -> bool:
+        """ハンドルが閉じられているかどうか"""
+        return self._file.closed
+
+    @property
+    def dirty_keys(self) -> list[str]:
+        """
+        前回の書き込み (または読み込み) 時点から変更された AIVM メタデータのキーのリスト
+        判定のため、AIVM メタデータをシリアライズ・バリデーションする (AIVM マニフェストの内容はハイパーパラメータにも反映される)
+        """
+        raw_metadata = _prepare_aivm_metadata_for_write(self.metadata, self.model_format)
+        return [key for key, value in raw_metadata.items() if self._committed_metadata.get(key) != value]
+
+    def close(self) -> None:
+        """
+        ハンドルを閉じる (変更を書き込むには、事前に commit() を呼ぶ必要がある)
+        """
+
+        self._file.close()
+
+    @abstractmethod
+    def _load(self, limits: AivmParseLimits | None) -> None:
+        """
+        開いたファイルから AIVM メタデータとバイト位置を読み込む内部メソッド (サブクラスで実装する)
+
+        Args:
+            limits (AivmParseLimits | None): パース処理のリソース上限
+
+        Raises:
+            AivmValidationError: ファイルのフォーマットが不正・AIVM メタデータのバリデーションに失敗した場合
+            AivmLimitExceededError: リソース上限を超えた場合
+        """
+
+    @abstractmethod
+    def commit(self, canonical: bool = False, allow_in_place: bool = True) -> AivmWriteStrategy | None:
+        """
+        前回の書き込み (または読み込み) 時点から変更された AIVM メタデータの項目のみを、最も安価な方法でファイルに書き込む (サブクラスで実装する)
+
+        Args:
+            canonical (bool): True の場合、変更の有無によらずメタデータ全体を正規形で書き込む
+            allow_in_place (bool): False の場合、上書きできる場合でも常に一時ファイル経由でアトミックに置き換える
+
+        Returns:
+            AivmWriteStrategy | None: 書き込みに用いた方法 (変更がなく書き込まなかった場合は None)
+        """
+
+    @abstractmethod
+    def _write_metadata(
+        self, changed_metadata: dict[str, str], canonical: bool = False, allow_in_place: bool = True
+    ) -> AivmWriteStrategy:
+        """
+        シリアライズ済みのメタデータのうち、指定されたキーの値のみを最も安価な方法でファイルに書き込む内部メソッド (サブクラスで実装する)
+        """
+
+    def _get_changed_metadata(self, canonical: bool) -> tuple[dict[str, str], dict[str, str]]:
+        """
+        AIVM メタデータをシリアライズ・バリデーションし、(シリアライズ結果, 書き込むべきメタデータ) を返す内部メソッド
+        正規形で書き込む場合は、変更の有無によらずすべての項目を正規形で書き込む
+        """
+
+        if self._file.closed:
+            raise ValueError('I/O operation on closed AIVM file handle.')
+        raw_metadata = _prepare_aivm_metadata_for_write(self.metadata, self.model_format)
+        if canonical:
+            return raw_metadata, serialize_aivm_metadata(self.metadata, canonical=True)
+        changed_metadata = {
+            key: value for key, value in raw_metadata.items() if self._committed_metadata.get(key) != value
+        }
+        return raw_metadata, changed_metadata
+
+    def _overwrite(self, offset: int, data: bytes, truncate: bool = False) -> None:
+        """
+        ファイルの指定オフセットからバイト列で上書きする内部メソッド (truncate が True の場合は、その末尾でファイルを切り詰める)
+        """
+
+        with self.path.open('r+b') as output_file:
+            output_file.seek(offset)
+            output_file.write(data)
+            if truncate:
+                output_file.truncate()
+            output_file.flush()
+            os.fsync(output_file.fileno())
+
+    def _replace(self, chunks: Iterable[bytes]) -> None:
+        """
+        同一ディレクトリの一時ファイルに書き出してからファイルを置き換え、置き換え後のファイルを開き直す内部メソッド
+        """
+
+        # 書き出し途中のファイルが読まれないよう、一時ファイルに書き出してから置き換える
+        with tempfile.NamedTemporaryFile(dir=self.path.parent, prefix=f'.{self.path.name}.', delete=False) as temp:
+            try:
+                for chunk in chunks:
+                    temp.write(chunk)
+                temp.flush()
+                os.fsync(temp.fileno())
+                # 一時ファイルは所有者のみ読み書き可能な権限で作成されるため、元のファイルの権限を引き継ぐ
+                os.chmod(temp.name, stat.S_IMODE(os.stat(self.path).st_mode))
+            except BaseException:
+                temp.close()
+                os.unlink(temp.name)
+                raise
+
+        # 元のファイルを閉じてから置き換える (Windows では開いているファイルを置き換えられないため)
+        self._file.close()
+        os.replace(temp.name, self.path)
+        self._file = self.path.open('rb')
+
+
+class AivmFile(_AivmFileHandle):
+    """
+    AIVM ファイルを開いたまま、AIVM メタデータの読み込み・変更・書き込みを繰り返すためのハンドル
+    ヘッダーは開いた時点で一度だけ読み込み、以降の書き込みではファイルを読み直さない
+
+    使用例:
+        with AivmFile(Path('model.aivm')) as aivm_file:
+            aivm_file.metadata.manifest.name = 'New Name'
+            aivm_file.commit()
+    """
+
+    model_format = ModelFormat.Safetensors
+
+    def _load(self, limits: AivmParseLimits | None) -> None:
+        header_bytes = _read_aivm_header_bytes(self._file, limits)
+        header_json = _decode_aivm_header(header_bytes, limits)
+        raw_metadata = header_json.get('__metadata__') if isinstance(header_json, dict) else None
+        self.metadata = validate_aivm_metadata(raw_metadata, limits)
+        self._committed_metadata = serialize_aivm_metadata(self.metadata)
+
+        # ヘッダー JSON (ヘッダーサイズを変えずに上書きできる領域) と Weight 部分の位置
+        self._header_text = header_bytes.decode('utf-8')
+        self._header_capacity = len(header_bytes)
+        self._payload_size = get_file_size(self._file) - self.payload_offset
+
+    @property
+    def payload_offset(self) -> int:
+        """ファイル内での Weight 部分の開始オフセット"""
+        return 8 + self._header_capacity
+
+    @property
+    def payload_ranges(self) -> list[tuple[int, int]]:
+        """ファイルのうち、Weight 部分のバイト範囲 (オフセット, バイト数) のリスト"""
+        return [(self.payload_offset, self._payload_size)]
+
+    def commit(
+        self,
+        canonical: bool = False,
+        allow_in_place: bool = True,
+        header_reserve: int = 0,
+    ) -> AivmWriteStrategy | None:
+        """
+        前回の書き込み (または読み込み) 時点から変更された AIVM メタデータの項目のみを、最も安価な方法でファイルに書き込む
+        新しいヘッダーが既存のヘッダーの領域に収まる場合は、末尾を空白でパディングしてヘッダーのみを上書きする
+        収まらない場合は、新しいヘッダーと Weight 部分を一時ファイルに書き出してアトミックに置き換える
+
+        Args:
+            canonical (bool): True の場合、write_aivm_metadata() と同様に、変更の有無によらずヘッダー JSON 全体を正規形で書き込む
+            allow_in_place (bool): False の場合、ヘッダーが収まる場合でも上書きせず、常に一時ファイル経由でアトミックに置き換える
+            header_reserve (int): ファイルを置き換える場合に、以降の変更をその場で上書きできるよう、ヘッダー JSON の末尾に
+                確保しておく余白のバイト数 (指定時は、Weight 部分の開始位置が 8 バイト境界に揃うようにパディングする)
+
+        Returns:
+            AivmWriteStrategy | None: 書き込みに用いた方法 (変更がなく書き込まなかった場合は None)
+
+        Raises:
+            AivmValidationError: AIVM メタデータのバリデーションに失敗した・スタイルベクトルが未指定の場合
+        """
+
+        raw_metadata, changed_metadata = self._get_changed_metadata(canonical)
+        if not changed_metadata:
+            return None
+        strategy = self._write_metadata(changed_metadata, canonical, allow_in_place, header_reserve)
+        self._committed_metadata = raw_metadata
+        return strategy
+
+    def _write_metadata(
+        self,
+        changed_metadata: dict[str, str],
+        canonical: bool = False,
+        allow_in_place: bool = True,
+        header_reserve: int = 0,
+    ) -> AivmWriteStrategy:
+        """
+        シリアライズ済みのメタデータのうち、指定されたキーの値のみを最も安価な方法でファイルに書き込む内部メソッド
+        AIVM メタデータ以外のキーもそのまま書き込めるため、メタデータパッチの適用にも用いる
+        """
+
+        # ヘッダー JSON のうち __metadata__ の値の部分のみを置き換え、置き換えられない場合はヘッダー JSON 全体を構築し直す
+        strategy = AivmWriteStrategy.Splice
+        new_header_text = None if canonical else _splice_aivm_header_metadata(self._header_text, changed_metadata)
+        if new_header_text is None:
+            new_header_text = _rebuild_aivm_header_text(self._header_text, changed_metadata, canonical)
+            strategy = AivmWriteStrategy.Rewrite
+        # 以前の書き込みでパディングした末尾の空白は、新しいヘッダーに含めずに改めてパディングし直す
+        ## 正規形のヘッダーは末尾の空白も含めて正規形のため、そのまま保持する
+        if not canonical:
+            new_header_text = new_header_text.rstrip(' \t\n\r')
+        new_header_bytes = new_header_text.encode('utf-8')
+
+        # 新しいヘッダーが既存のヘッダーの領域に収まる場合は、ヘッダーサイズを変えずに末尾を空白でパディングして上書きする
+        ## 正規形で書き込む場合は、write_aivm_metadata() と同一のバイト列にするためパディングしない
+        if allow_in_place and not canonical and len(new_header_bytes) <= self._header_capacity:
+            new_header_bytes += b' ' * (self._header_capacity - len(new_header_bytes))
+            self._overwrite(8, new_header_bytes)
+            self._header_text = new_header_bytes.decode('utf-8')
+            return AivmWriteStrategy.InPlace
+
+        # ヘッダーが収まらない場合は、新しいヘッダーと元の Weight 部分を連結したファイルに置き換える
+        if header_reserve > 0:
+            new_header_bytes += b' ' * (header_reserve + -(len(new_header_bytes) + header_reserve) % 8)
+        virtual_file = AivmVirtualFile(
+            self._file,
+            [len(new_header_bytes).to_bytes(8, 'little') + new_header_bytes, (self.payload_offset, self._payload_size)],
+        )
+        self._replace(virtual_file.iter_chunks())
+        self._header_text = new_header_bytes.decode('utf-8')
+        self._header_capacity = len(new_header_bytes)
+        return strategy
+
+
+class AivmxFile(_AivmFileHandle):
+    """
+    AIVMX ファイルを開いたまま、AIVM メタデータの読み込み・変更・書き込みを繰り返すためのハンドル
+    トップレベルのフィールドの位置と metadata_props は開いた時点で一度だけ読み込み、ONNX モデル全体はパースしない
+
+    使用例:
+        with AivmxFile(Path('model.aivmx')) as aivmx_file:
+            aivmx_file.metadata.manifest.name = 'New Name'
+            aivmx_file.commit()
+    """
+
+    model_format = ModelFormat.ONNX
+
+    def _load(self, limits: AivmParseLimits | None) -> None:
+        try:
+            self._fields = scan_model_fields(
+                self._file, max_fields=limits.max_protobuf_fields if limits is not None else None
+            )
+
+            # リソース上限が指定されている場合は、metadata_props を読み込む前に合計サイズを検査する
+            if limits is not None:
+                metadata_props_size = sum(
+                    field.end - field.offset for field in self._fields if field.number == METADATA_PROPS_FIELD_NUMBER
+                )
+                if metadata_props_size > limits.max_header_size:
+                    raise AivmLimitExceededError(
+                        f'Metadata size ({metadata_props_size} bytes) exceeds the limit ({limits.max_header_size} bytes).'
+                    )
+
+            # AIVM メタデータ以外のキーも含む、すべての metadata_props
+            self._metadata_props = read_metadata_props(self._file, self._fields)
+        except ProtobufScanLimitError as ex:
+            raise AivmLimitExceededError(str(ex))
+        except ProtobufScanError:
+            raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+
+        self.metadata = validate_aivm_metadata(self._metadata_props, limits)
+        self._committed_metadata = serialize_aivm_metadata(self.metadata)
+
+    @property
+    def payload_ranges(self) -> list[tuple[int, int]]:
+        """ファイルのうち、metadata_props とロケーター以外のフィールドのバイト範囲 (オフセット, バイト数) のリスト"""
+        ranges: list[tuple[int, int]] = []
+        for field in self._fields:
+            if _is_metadata_field(field):
+                continue
+            # 隣接するバイト範囲は 1 つにまとめ、元のファイルからの読み取り回数を減らす
+            if ranges and ranges[-1][0] + ranges[-1][1] == field.offset:
+                ranges[-1] = (ranges[-1][0], field.end - ranges[-1][0])
+            else:
+                ranges.append((field.offset, field.end - field.offset))
+        return ranges
+
+    def commit(self, canonical: bool = False, allow_in_place: bool = True) -> AivmWriteStrategy | None:
+        """
+        前回の書き込み (または読み込み) 時点から変更された AIVM メタデータの項目のみを、最も安価な方法でファイルに書き込む
+        metadata_props (とロケーター) がファイル末尾にまとまっている場合は、その部分のみを新しい metadata_props で上書きする
+        そうでない場合は、metadata_props を末尾に集めたファイルを一時ファイルに書き出してアトミックに置き換える
+        いずれの場合も metadata_props の位置を示すロケーターを付加するため、以降の書き込みはその場での上書きとなる
+
+        Args:
+            canonical (bool): True の場合、write_aivmx_metadata() と同様に、変更の有無によらず ONNX モデル全体を正規形で書き込む
+                (ONNX モデル全体をメモリ上にロードするため、巨大なモデルでは時間がかかる)
+            allow_in_place (bool): False の場合、上書きできる場合でも常に一時ファイル経由でアトミックに置き換える
+
+        Returns:
+            AivmWriteStrategy | None: 書き込みに用いた方法 (変更がなく書き込まなかった場合は None)
+
+        Raises:
+            AivmValidationError: AIVM メタデータのバリデーションに失敗した・スタイルベクトルが未指定・
+                外部データへの参照を解決できない (正規形で書き込む場合のみ) 場合
+        """
+
+        raw_metadata, changed_metadata = self._get_changed_metadata(canonical)
+        if not changed_metadata:
+            return None
+        strategy = self._write_metadata(changed_metadata, canonical, allow_in_place)
+        self._committed_metadata = raw_metadata
+        return strategy
+
+    def _write_metadata(
+        self,
+        changed_metadata: dict[str, str],
+        canonical: bool = False,
+        allow_in_place: bool = True,
+    ) -> AivmWriteStrategy:
+        """
+        シリアライズ済みのメタデータのうち、指定されたキーの値のみを最も安価な方法でファイルに書き込む内部メソッド
+        AIVM メタデータ以外のキーもそのまま書き込めるため、メタデータパッチの適用にも用いる
+        """
+
+        metadata_props = {**self._metadata_props, **changed_metadata}
+
+        if canonical:
+            # ONNX モデル全体をシリアライズし直す (ロケーターの有無は元のファイルに合わせる)
+            has_locator = any(field.number == METADATA_LOCATOR_FIELD_NUMBER for field in self._fields)
+            self._replace([write_aivmx_metadata(self._file, self.metadata, canonical=True, tail_metadata=has_locator)])
+            strategy = AivmWriteStrategy.Rewrite
+        else:
+            metadata_offset = self._get_tail_metadata_offset()
+            if allow_in_place and metadata_offset is not None:
+                # ファイル末尾の metadata_props とロケーターのみを上書きする
+                metadata_props_bytes = encode_metadata_props(metadata_props)
+                self._overwrite(
+                    metadata_offset,
+                    metadata_props_bytes + encode_metadata_locator(metadata_props_bytes, metadata_offset),
+                    truncate=True,
+                )
+                strategy = AivmWriteStrategy.InPlace
+            else:
+                # metadata_props 以外のフィールドの後に、すべての metadata_props とロケーターを連結したファイルに置き換える
+                ## Protobuf の repeated フィールドはメッセージ内のどこに出現してもよいため、ONNX モデルとしては同一の内容となる
+                payload_ranges = self.payload_ranges
+                metadata_props_bytes = encode_metadata_props(metadata_props)
+                locator_bytes = encode_metadata_locator(
+                    metadata_props_bytes, sum(length for _, length in payload_ranges)
+                )
+                virtual_file = AivmVirtualFile(self._file, [*payload_ranges, metadata_props_bytes, locator_bytes])
+                self._replace(virtual_file.iter_chunks())
+                strategy = AivmWriteStrategy.Splice
+
+        # フィールドの位置はフィールドのヘッダーのみを読み取って走査し直す (metadata_props の値は読み込まない)
+        try:
+            self._fields = scan_model_fields(self._file)
+        except ProtobufScanError:
+            raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+        self._metadata_props = metadata_props
+        return strategy
+
+    def _get_tail_metadata_offset(self) -> int | None:
+        """
+        すべての metadata_props とロケーターがファイル末尾に連続して配置されている場合に、その開始オフセットを返す内部メソッド
+        """
+
+        offset = get_file_size(self._file)
+        for field in reversed(self._fields):
+            if not _is_metadata_field(field):
+                break
+            offset = field.offset
+        if any(_is_metadata_field(field) for field in self._fields if field.offset < offset):
+            return None
+        return offset
+
+
+def _is_metadata_field(field: ProtobufField) -> bool:
+    """
+    トップレベルのフィールドが metadata_props またはロケーターかどうかを返す内部メソッド
+    """
+
+    return field.number in (METADATA_PROPS_FIELD_NUMBER, METADATA_LOCATOR_FIELD_NUMBER)
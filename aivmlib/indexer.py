@@ -0,0 +1,456 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from aivmlib import AivmValidationError, read_aivm_metadata, read_aivmx_metadata
+from aivmlib.schemas.aivm_manifest import AivmManifest
+
+
+# AIVM / AIVMX ファイルが配置されたディレクトリの索引 (カタログ) を、ファイルの追加・更新・削除に追従して差分更新するためのユーティリティ
+# ファイルの更新日時とサイズが変わったファイルのヘッダーのみを読み直すため、I/O コストは変更されたファイルの数に比例する
+# Linux では inotify でファイルの変更を検知し、それ以外の環境では更新日時とサイズのポーリングで検知する
+
+# 索引ファイルのフォーマットのバージョン
+INDEX_FORMAT_VERSION = 1
+
+# 索引の対象とするファイルの拡張子
+_MODEL_FILE_SUFFIXES = ('.aivm', '.aivmx')
+
+
+@dataclass
+class AivmIndexEntry:
+    """索引に登録された 1 つの AIVM / AIVMX ファイルの情報"""
+
+    # 索引対象ディレクトリからの相対パス (POSIX 形式)
+    path: str
+    # 読み込み時点でのファイルの更新日時 (ナノ秒)
+    mtime_ns: int
+    # 読み込み時点でのファイルサイズ
+    size: int
+    # アイコン画像やボイスサンプル音声を除いた AIVM マニフェストの概要 (読み込みに失敗した場合は None)
+    manifest: dict[str, Any] | None = None
+    # 読み込みに失敗した場合のエラーメッセージ
+    error: str | None = None
+
+
+@dataclass
+class AivmIndexChanges:
+    """1 回の索引の更新で発生した変更"""
+
+    # 新たに索引に追加されたファイルの相対パス
+    added: list[str] = field(default_factory=list)
+    # 内容が更新されたファイルの相対パス
+    updated: list[str] = field(default_factory=list)
+    # 索引から削除されたファイルの相対パス
+    removed: list[str] = field(default_factory=list)
+    # 書き込み途中の可能性があるため、読み込みを保留しているファイルの相対パス
+    pending: list[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.updated or self.removed)
+
+
+def summarize_aivm_manifest(manifest: AivmManifest) -> dict[str, Any]:
+    """
+    アイコン画像やボイスサンプル音声を除いた、AIVM マニフェストの概要を返す
+
+    Args:
+        manifest (AivmManifest): AIVM マニフェスト
+
+    Returns:
+        dict[str, Any]: JSON としてシリアライズ可能な AIVM マニフェストの概要
+    """
+
+    return {
+        'uuid': str(manifest.uuid),
+        'name': manifest.name,
+        'description': manifest.description,
+        'version': manifest.version,
+        'model_architecture': str(manifest.model_architecture),
+        'model_format': str(manifest.model_format),
+        'speakers': [
+            {
+                'uuid': str(speaker.uuid),
+                'name': speaker.name,
+                'local_id': speaker.local_id,
+                'styles': [{'name': style.name, 'local_id': style.local_id} for style in speaker.styles],
+            }
+            for speaker in manifest.speakers
+        ],
+    }
+
+
+class AivmModelIndex:
+    """
+    AIVM / AIVMX ファイルが配置されたディレクトリの索引
+    refresh() を呼び出すたびに、前回から更新日時・サイズが変わったファイルのヘッダーのみを読み直して索引を差分更新する
+    """
+
+    def __init__(self, directory: Path, settle_seconds: float = 0.0) -> None:
+        """
+        Args:
+            directory (Path): AIVM / AIVMX ファイルが配置されたディレクトリ (サブディレクトリも対象となる)
+            settle_seconds (float): 変更を検知したファイルを読み込むまでに、更新日時とサイズが変わらないことを確認する秒数
+                (アップロード中など、書き込み途中のファイルを読み込まないようにするためのデバウンス)
+        """
+
+        self.directory = Path(os.path.abspath(directory))
+        self.settle_seconds = settle_seconds
+        self.entries: dict[str, AivmIndexEntry] = {}
+        # 変更を検知したものの、まだ読み込んでいないファイルの (更新日時, サイズ, 最初に観測した時刻)
+        self._pending: dict[str, tuple[int, int, float]] = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, paths: Iterable[Path] | None = None) -> AivmIndexChanges:
+        """
+        索引を差分更新する
+
+        Args:
+            paths (Iterable[Path] | None): 変更された可能性のあるファイルのパス
+                (省略時はディレクトリ全体を走査する。指定時も、読み込みを保留しているファイルは再確認される)
+
+        Returns:
+            AivmIndexChanges: 索引に発生した変更
+        """
+
+        with self._lock:
+            if paths is None:
+                # ディレクトリ全体を走査し、索引にあるが存在しなくなったファイルも削除対象とする
+                stats = self.scan()
+                candidates = set(stats) | set(self.entries) | set(self._pending)
+            else:
+                candidates = {self._relative_path(path) for path in paths} | set(self._pending)
+                candidates.discard(None)
+                stats = {}
+                for relative_path in candidates:
+                    stat = self._stat(relative_path)
+                    if stat is not None:
+                        stats[relative_path] = stat
+
+            changes = AivmIndexChanges()
+            now = time.monotonic()
+            for relative_path in sorted(candidates):
+                stat = stats.get(relative_path)
+
+                # 削除されたファイル
+                if stat is None:
+                    self._pending.pop(relative_path, None)
+                    if self.entries.pop(relative_path, None) is not None:
+                        changes.removed.append(relative_path)
+                    continue
+
+                # 更新日時とサイズが索引と一致していれば、ファイルは変更されていない
+                entry = self.entries.get(relative_path)
+                if entry is not None and (entry.mtime_ns, entry.size) == stat:
+                    self._pending.pop(relative_path, None)
+                    continue
+
+                # 書き込み途中のファイルを読み込まないよう、更新日時とサイズが settle_seconds 以上変わらないことを確認する
+                if self.settle_seconds > 0:
+                    pending = self._pending.get(relative_path)
+                    if pending is None or pending[:2] != stat:
+                        self._pending[relative_path] = (*stat, now)
+                        changes.pending.append(relative_path)
+                        continue
+                    if now - pending[2] < self.settle_seconds:
+                        changes.pending.append(relative_path)
+                        continue
+                self._pending.pop(relative_path, None)
+
+                # ヘッダーのみを読み込んで索引を更新する
+                self.entries[relative_path] = self._read_entry(relative_path, stat)
+                (changes.updated if entry is not None else changes.added).append(relative_path)
+
+            return changes
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        索引を JSON としてシリアライズ可能な辞書に変換する
+
+        Returns:
+            dict[str, Any]: 索引の辞書
+        """
+
+        with self._lock:
+            return {
+                'version': INDEX_FORMAT_VERSION,
+                'models': {
+                    relative_path: {
+                        'mtime_ns': entry.mtime_ns,
+                        'size': entry.size,
+                        'manifest': entry.manifest,
+                        'error': entry.error,
+                    }
+                    for relative_path, entry in sorted(self.entries.items())
+                },
+            }
+
+    def save(self, index_path: Path) -> None:
+        """
+        索引を JSON ファイルに保存する
+        一時ファイルに書き込んでから置き換えるため、索引ファイルを読み込む側が書き込み途中の内容を読むことはない
+
+        Args:
+            index_path (Path): 索引ファイルのパス
+        """
+
+        temporary_path = index_path.with_name(f'.{index_path.name}.tmp')
+        temporary_path.write_text(json.dumps(self.to_dict(), ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(temporary_path, index_path)
+
+    def load(self, index_path: Path) -> None:
+        """
+        以前に保存した索引ファイルを読み込む
+        続けて refresh() を呼び出すと、前回の保存以降に変更されたファイルのみが読み直される
+
+        Args:
+            index_path (Path): 索引ファイルのパス
+        """
+
+        try:
+            index = json.loads(index_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            # 索引ファイルが存在しない・壊れている場合は、空の索引から作り直す
+            return
+        if not isinstance(index, dict) or index.get('version') != INDEX_FORMAT_VERSION:
+            return
+
+        try:
+            entries = {
+                relative_path: AivmIndexEntry(
+                    path=relative_path,
+                    mtime_ns=model['mtime_ns'],
+                    size=model['size'],
+                    manifest=model.get('manifest'),
+                    error=model.get('error'),
+                )
+                for relative_path, model in index.get('models', {}).items()
+            }
+        except (KeyError, TypeError, AttributeError):
+            # 不正なエントリを含む索引ファイルは壊れているものとして扱い、空の索引から作り直す (refresh() でディレクトリ全体を読み直す)
+            return
+        with self._lock:
+            self.entries = entries
+
+    def scan(self) -> dict[str, tuple[int, int]]:
+        """
+        ディレクトリ内の AIVM / AIVMX ファイルの更新日時とサイズを、ファイルを開くことなく列挙する
+        索引は更新しない (索引を更新するには refresh() を呼び出す)
+
+        Returns:
+            dict[str, tuple[int, int]]: ディレクトリからの相対パス (POSIX 形式) をキーとする (更新日時 (ナノ秒), サイズ) の辞書
+        """
+
+        stats: dict[str, tuple[int, int]] = {}
+        directories = [self.directory]
+        while directories:
+            directory = directories.pop()
+            try:
+                with os.scandir(directory) as iterator:
+                    for dir_entry in iterator:
+                        if dir_entry.is_dir(follow_symlinks=False):
+                            directories.append(Path(dir_entry.path))
+                        elif dir_entry.name.endswith(_MODEL_FILE_SUFFIXES) and dir_entry.is_file():
+                            stat = dir_entry.stat()
+                            relative_path = Path(dir_entry.path).relative_to(self.directory).as_posix()
+                            stats[relative_path] = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                continue
+        return stats
+
+    def _stat(self, relative_path: str) -> tuple[int, int] | None:
+        """
+        ファイルの更新日時とサイズを取得する内部メソッド (ファイルが存在しない場合は None)
+        """
+
+        try:
+            stat = (self.directory / relative_path).stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _relative_path(self, path: Path) -> str | None:
+        """
+        パスを索引対象ディレクトリからの相対パスに変換する内部メソッド (索引の対象外のパスの場合は None)
+        """
+
+        if path.suffix not in _MODEL_FILE_SUFFIXES:
+            return None
+        try:
+            return Path(os.path.abspath(path)).relative_to(self.directory).as_posix()
+        except ValueError:
+            return None
+
+    def _read_entry(self, relative_path: str, stat: tuple[int, int]) -> AivmIndexEntry:
+        """
+        AIVM / AIVMX ファイルのヘッダーを読み込み、索引のエントリを構築する内部メソッド
+        """
+
+        entry = AivmIndexEntry(path=relative_path, mtime_ns=stat[0], size=stat[1])
+        try:
+            with (self.directory / relative_path).open('rb') as file:
+                if relative_path.endswith('.aivmx'):
+                    metadata = read_aivmx_metadata(file)
+                else:
+                    metadata = read_aivm_metadata(file)
+            entry.manifest = summarize_aivm_manifest(metadata.manifest)
+        except (OSError, AivmValidationError) as ex:
+            entry.error = str(ex)
+        return entry
+
+
+def watch_model_index(
+    index: AivmModelIndex,
+    on_change: Callable[[AivmIndexChanges], None],
+    interval: float = 2.0,
+    stop_event: threading.Event | None = None,
+) -> None:
+    """
+    索引対象ディレクトリを監視し、ファイルの追加・更新・削除があるたびに索引を差分更新し続ける
+    Linux では inotify でファイルの変更を検知し、inotify が利用できない環境では interval 秒ごとのポーリングで検知する
+    stop_event がセットされるまで (省略時は KeyboardInterrupt などで中断されるまで) 戻らない
+
+    Args:
+        index (AivmModelIndex): 監視する索引
+        on_change (Callable[[AivmIndexChanges], None]): 索引に変更があったときに呼び出されるコールバック
+        interval (float): ポーリング間隔・inotify のイベント待機のタイムアウト (秒)
+        stop_event (threading.Event | None): 監視を終了するためのイベント
+    """
+
+    stop_event = stop_event or threading.Event()
+
+    # 起動時点のディレクトリの状態を索引に反映する
+    changes = index.refresh()
+    if changes:
+        on_change(changes)
+
+    watcher = _InotifyWatcher.create(index.directory)
+    try:
+        while not stop_event.is_set():
+            if watcher is not None:
+                # inotify のイベントで変更されたパスのみを確認する
+                # イベントキューが溢れた場合は、取りこぼしを防ぐためディレクトリ全体を走査する
+                changed_paths = watcher.read_events(interval)
+                changes = index.refresh(changed_paths)
+            else:
+                stop_event.wait(interval)
+                changes = index.refresh()
+            if changes:
+                on_change(changes)
+    finally:
+        if watcher is not None:
+            watcher.close()
+
+
+class _InotifyWatcher:
+    """
+    ctypes 経由で Linux の inotify を利用し、ディレクトリツリー内のファイルの変更を検知する内部クラス
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    _WATCH_MASK = (
+        IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    )
+    _EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, libc: ctypes.CDLL, fd: int) -> None:
+        self._libc = libc
+        self._fd = fd
+        self._watches: dict[int, Path] = {}
+
+    @classmethod
+    def create(cls, directory: Path) -> '_InotifyWatcher | None':
+        """
+        ディレクトリツリーを監視する inotify インスタンスを作成する (inotify が利用できない環境では None を返す)
+        """
+
+        if not sys.platform.startswith('linux'):
+            return None
+        library_name = ctypes.util.find_library('c')
+        if library_name is None:
+            return None
+        try:
+            libc = ctypes.CDLL(library_name, use_errno=True)
+            fd = libc.inotify_init1(cls.IN_NONBLOCK | cls.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        watcher = cls(libc, fd)
+        for root, _, _ in os.walk(directory):
+            watcher._add_watch(Path(root))
+        return watcher
+
+    def read_events(self, timeout: float) -> set[Path] | None:
+        """
+        イベントを待機し、変更された可能性のあるファイルのパスを返す
+        イベントキューが溢れてイベントを取りこぼした可能性がある場合は None を返す
+        """
+
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed_paths: set[Path] = set()
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            position = 0
+            while position + self._EVENT_HEADER.size <= len(buffer):
+                wd, mask, _, name_length = self._EVENT_HEADER.unpack_from(buffer, position)
+                position += self._EVENT_HEADER.size
+                name = buffer[position : position + name_length].split(b'\0', 1)[0]
+                position += name_length
+                if mask & self.IN_Q_OVERFLOW:
+                    return None
+                directory = self._watches.get(wd)
+                if directory is None:
+                    continue
+                path = directory / os.fsdecode(name) if name else directory
+                # 新たに作成・移動されたサブディレクトリも監視対象に加え、その中のファイルも確認する
+                if mask & self.IN_ISDIR:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        for root, _, files in os.walk(path):
+                            self._add_watch(Path(root))
+                            changed_paths.update(Path(root) / file for file in files)
+                    elif mask & self.IN_MOVED_FROM:
+                        # ディレクトリごと移動されたファイルは個別のイベントが届かないため、全体を走査させる
+                        return None
+                    continue
+                if mask & self.IN_DELETE_SELF:
+                    self._watches.pop(wd, None)
+                    continue
+                changed_paths.add(path)
+        return changed_paths
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+    def _add_watch(self, directory: Path) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self._WATCH_MASK)
+        if wd >= 0:
+            self._watches[wd] = directory
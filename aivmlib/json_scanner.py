@@ -0,0 +1,320 @@
+# JSON 文字列全体をデコードすることなく、指定されたパスの値のみを取り出すためのインクリメンタルな JSON スキャナー
+# 対象外の値 (特に巨大な Base64 文字列や Safetensors のテンソル情報) は、中身を Python オブジェクトに変換せずに正規表現で読み飛ばす
+
+import json
+import re
+from collections.abc import Iterator
+from typing import Any
+
+
+# パス中でワイルドカード ([*]) を表すトークン
+WILDCARD = None
+
+# JSON の値を読み飛ばすための正規表現
+_WHITESPACE_PATTERN = re.compile(r'[ \t\n\r]*')
+_SCALAR_PATTERN = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null')
+_STRUCTURE_PATTERN = re.compile(r'["{}\[\]]')
+_PATH_TOKEN_PATTERN = re.compile(r'([^.\[\]]+)|\[(\*|\d+)\]')
+
+_decoder = json.JSONDecoder()
+
+
+def parse_json_path(path: str) -> tuple[str | int | None, ...]:
+    """
+    `speakers[*].styles[0].icon` のようなパス文字列をトークンのタプルに変換する
+    オブジェクトのキーは str 、配列のインデックスは int 、ワイルドカード ([*]) は WILDCARD (None) で表される
+
+    Args:
+        path (str): パス文字列
+
+    Returns:
+        tuple[str | int | None, ...]: パスのトークン
+
+    Raises:
+        ValueError: パス文字列の書式が不正な場合
+    """
+
+    tokens: list[str | int | None] = []
+    position = 0
+    while position < len(path):
+        if path[position] == '.' and tokens:
+            position += 1
+        match = _PATH_TOKEN_PATTERN.match(path, position)
+        if match is None:
+            raise ValueError(f'Invalid JSON path: {path}')
+        if match.group(1) is not None:
+            tokens.append(match.group(1))
+        elif match.group(2) == '*':
+            tokens.append(WILDCARD)
+        else:
+            tokens.append(int(match.group(2)))
+        position = match.end()
+    if not tokens:
+        raise ValueError(f'Invalid JSON path: {path}')
+    return tuple(tokens)
+
+
+def skip_json_value(text: str, position: int) -> int:
+    """
+    指定位置から始まる JSON の値を、Python オブジェクトに変換することなく読み飛ばす
+
+    Args:
+        text (str): JSON 文字列
+        position (int): 値の開始位置 (空白は含まない)
+
+    Returns:
+        int: 値の直後の位置
+
+    Raises:
+        ValueError: JSON の書式が不正な場合
+    """
+
+    if position >= len(text):
+        raise ValueError('Unexpected end of JSON.')
+    char = text[position]
+
+    # 文字列
+    # 巨大な Base64 文字列を高速に読み飛ばせるよう、正規表現ではなく str.find() で終端のダブルクオートを探す
+    if char == '"':
+        cursor = position + 1
+        while True:
+            end = text.find('"', cursor)
+            if end < 0:
+                raise ValueError(f'Unterminated string at position {position}.')
+            # 直前に連続するバックスラッシュが奇数個なら、エスケープされたダブルクオートなので読み飛ばす
+            backslash_start = end
+            while text[backslash_start - 1] == '\\':
+                backslash_start -= 1
+            if (end - backslash_start) % 2 == 0:
+                return end + 1
+            cursor = end + 1
+
+    # オブジェクト・配列
+    # 文字列の中身以外の括弧の対応のみを追跡し、区切り文字や数値などはまとめて読み飛ばす
+    if char in '{[':
+        depth = 0
+        cursor = position
+        while True:
+            match = _STRUCTURE_PATTERN.search(text, cursor)
+            if match is None:
+                raise ValueError(f'Unterminated container at position {position}.')
+            token = match.group()
+            if token == '"':
+                cursor = skip_json_value(text, match.start())
+                continue
+            depth += 1 if token in '{[' else -1
+            cursor = match.end()
+            if depth == 0:
+                return cursor
+
+    # 数値・真偽値・null
+    match = _SCALAR_PATTERN.match(text, position)
+    if match is None:
+        raise ValueError(f'Unexpected character {char!r} at position {position}.')
+    return match.end()
+
+
+def exceeds_json_depth(text: str, max_depth: int) -> bool:
+    """
+    JSON 文字列のオブジェクト・配列の入れ子の深さが上限を超えているかを、Python オブジェクトに変換することなく判定する
+    深くネストした不正な JSON をデコードする前に弾くことで、デコード時の再帰によるスタックの消費や処理時間の増大を防ぐ
+    上限を超えた時点で走査を打ち切るため、最悪でも JSON 文字列の長さに比例した時間で終了する
+
+    Args:
+        text (str): JSON 文字列
+        max_depth (int): 入れ子の深さの上限 (トップレベルのオブジェクト・配列の深さを 1 とする)
+
+    Returns:
+        bool: 入れ子の深さが上限を超えている場合は True
+
+    Raises:
+        ValueError: JSON 文字列中の文字列が終端していない場合
+    """
+
+    depth = 0
+    cursor = 0
+    while True:
+        match = _STRUCTURE_PATTERN.search(text, cursor)
+        if match is None:
+            return False
+        token = match.group()
+        if token == '"':
+            cursor = skip_json_value(text, match.start())
+            continue
+        if token in '{[':
+            depth += 1
+            if depth > max_depth:
+                return True
+        else:
+            depth -= 1
+        cursor = match.end()
+
+
+def iter_object_members(text: str) -> Iterator[tuple[str, int, int, int]]:
+    """
+    トップレベルが JSON オブジェクトである JSON 文字列を先頭から 1 度だけ走査し、各メンバーのキーと位置を出現順に返す
+    メンバーの値は Python オブジェクトに変換せずに読み飛ばすため、巨大なオブジェクトから特定のメンバーの範囲のみを特定する場合に高速に動作する
+
+    Args:
+        text (str): JSON 文字列
+
+    Yields:
+        tuple[str, int, int, int]: エスケープを解釈した後のキー・キーの開始位置 (ダブルクオートの位置)・値の開始位置・値の直後の位置
+
+    Raises:
+        ValueError: JSON の書式が不正・トップレベルがオブジェクトでない場合
+    """
+
+    position = _WHITESPACE_PATTERN.match(text, 0).end()
+    if text[position : position + 1] != '{':
+        raise ValueError(f'Expected object at position {position}.')
+    position = _WHITESPACE_PATTERN.match(text, position + 1).end()
+    if text[position : position + 1] != '}':
+        while True:
+            if text[position : position + 1] != '"':
+                raise ValueError(f'Expected object key at position {position}.')
+            key_start = position
+            key, position = json.decoder.scanstring(text, position + 1)
+            position = _WHITESPACE_PATTERN.match(text, position).end()
+            if text[position : position + 1] != ':':
+                raise ValueError(f'Expected ":" at position {position}.')
+            value_start = _WHITESPACE_PATTERN.match(text, position + 1).end()
+            position = skip_json_value(text, value_start)
+            yield key, key_start, value_start, position
+            position = _WHITESPACE_PATTERN.match(text, position).end()
+            separator = text[position : position + 1]
+            if separator == '}':
+                break
+            if separator != ',':
+                raise ValueError(f'Expected "," or "}}" at position {position}.')
+            position = _WHITESPACE_PATTERN.match(text, position + 1).end()
+    position += 1
+    if _WHITESPACE_PATTERN.match(text, position).end() != len(text):
+        raise ValueError(f'Extra data at position {position}.')
+
+
+def scan_json_paths(text: str, paths: list[str]) -> dict[str, list[tuple[str, Any]]]:
+    """
+    JSON 文字列を先頭から 1 度だけ走査し、指定されたパスに一致する値のみをデコードして返す
+    パスに一致しない値は読み飛ばすため、巨大な JSON から一部の値のみを取り出す場合に高速に動作する
+
+    Args:
+        text (str): JSON 文字列
+        paths (list[str]): 取り出す値のパスのリスト (ex: `speakers[*].styles[*].voice_samples[*].audio`)
+
+    Returns:
+        dict[str, list[tuple[str, Any]]]: パスごとの、一致した値の具体的なパス (ex: `speakers[0].styles[1].icon`) と値のリスト
+            (一致する値が存在しない場合は空のリスト)
+
+    Raises:
+        ValueError: パス文字列や JSON の書式が不正な場合
+    """
+
+    matchers = [(path, parse_json_path(path)) for path in paths]
+    results: dict[str, list[tuple[str, Any]]] = {path: [] for path in paths}
+    position = _WHITESPACE_PATTERN.match(text, 0).end()
+    position = _scan_value(text, position, [(path, tokens, 0) for path, tokens in matchers], '', results)
+    if _WHITESPACE_PATTERN.match(text, position).end() != len(text):
+        raise ValueError(f'Extra data at position {position}.')
+    return results
+
+
+def _scan_value(
+    text: str,
+    position: int,
+    matchers: list[tuple[str, tuple[str | int | None, ...], int]],
+    current_path: str,
+    results: dict[str, list[tuple[str, Any]]],
+) -> int:
+    """
+    指定位置から始まる JSON の値を走査し、パスに一致する値を results に追加する内部メソッド
+
+    Returns:
+        int: 値の直後の位置
+    """
+
+    # この値を必要とするパスが存在しなければ、値全体を読み飛ばす
+    if not matchers:
+        return skip_json_value(text, position)
+
+    # この値そのものがパスに一致する場合は、値全体をデコードする
+    # 一致したパスの下位の値を求める別のパスがあれば、デコード済みの値から取り出す
+    if any(depth == len(tokens) for _, tokens, depth in matchers):
+        value, end = _decoder.raw_decode(text, position)
+        for path, tokens, depth in matchers:
+            _collect_from_object(value, tokens[depth:], current_path, results[path])
+        return end
+
+    char = text[position : position + 1]
+
+    # オブジェクトの場合、パスに一致するキーのみを再帰的に走査する
+    if char == '{':
+        position = _WHITESPACE_PATTERN.match(text, position + 1).end()
+        if text[position : position + 1] == '}':
+            return position + 1
+        while True:
+            if text[position : position + 1] != '"':
+                raise ValueError(f'Expected object key at position {position}.')
+            key, position = json.decoder.scanstring(text, position + 1)
+            position = _WHITESPACE_PATTERN.match(text, position).end()
+            if text[position : position + 1] != ':':
+                raise ValueError(f'Expected ":" at position {position}.')
+            position = _WHITESPACE_PATTERN.match(text, position + 1).end()
+            child_matchers = [(path, tokens, depth + 1) for path, tokens, depth in matchers if tokens[depth] == key]
+            child_path = f'{current_path}.{key}' if current_path else key
+            position = _scan_value(text, position, child_matchers, child_path, results)
+            position = _WHITESPACE_PATTERN.match(text, position).end()
+            separator = text[position : position + 1]
+            if separator == '}':
+                return position + 1
+            if separator != ',':
+                raise ValueError(f'Expected "," or "}}" at position {position}.')
+            position = _WHITESPACE_PATTERN.match(text, position + 1).end()
+
+    # 配列の場合、パスに一致するインデックスの要素のみを再帰的に走査する
+    if char == '[':
+        position = _WHITESPACE_PATTERN.match(text, position + 1).end()
+        if text[position : position + 1] == ']':
+            return position + 1
+        index = 0
+        while True:
+            child_matchers = [
+                (path, tokens, depth + 1)
+                for path, tokens, depth in matchers
+                if tokens[depth] is WILDCARD or tokens[depth] == index
+            ]
+            position = _scan_value(text, position, child_matchers, f'{current_path}[{index}]', results)
+            position = _WHITESPACE_PATTERN.match(text, position).end()
+            separator = text[position : position + 1]
+            if separator == ']':
+                return position + 1
+            if separator != ',':
+                raise ValueError(f'Expected "," or "]" at position {position}.')
+            position = _WHITESPACE_PATTERN.match(text, position + 1).end()
+            index += 1
+
+    # スカラー値はパスのこれ以上の階層を持たないため、読み飛ばす
+    return skip_json_value(text, position)
+
+
+def _collect_from_object(
+    value: Any,
+    tokens: tuple[str | int | None, ...],
+    current_path: str,
+    results: list[tuple[str, Any]],
+) -> None:
+    """
+    デコード済みの値から、残りのパスに一致する値を results に追加する内部メソッド
+    """
+
+    if not tokens:
+        results.append((current_path, value))
+        return
+    token = tokens[0]
+    if isinstance(value, dict) and isinstance(token, str) and token in value:
+        child_path = f'{current_path}.{token}' if current_path else token
+        _collect_from_object(value[token], tokens[1:], child_path, results)
+    elif isinstance(value, list) and not isinstance(token, str):
+        for index, item in enumerate(value):
+            if token is WILDCARD or token == index:
+                _collect_from_object(item, tokens[1:], f'{current_path}[{index}]', results)
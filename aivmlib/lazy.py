@@ -0,0 +1,366 @@
+import base64
+import os
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from pydantic import ConfigDict, Field, field_serializer
+
+from aivmlib import AivmValidationError, _decode_aivm_header, _read_aivm_header_bytes, validate_aivm_metadata
+from aivmlib.onnx_scanner import (
+    METADATA_PROPS_FIELD_NUMBER,
+    WIRE_TYPE_LEN,
+    ProtobufField,
+    ProtobufScanError,
+    decode_string_string_entry,
+    read_metadata_prop_key,
+    read_metadata_props,
+    scan_model_fields,
+)
+from aivmlib.schemas.aivm_manifest import (
+    AivmManifest,
+    AivmManifestSpeaker,
+    AivmManifestSpeakerStyle,
+    AivmManifestVoiceSample,
+    AivmMetadata,
+)
+from aivmlib.utils import pread
+
+
+# AIVM マニフェストに埋め込まれたアイコン画像・ボイスサンプル音声 (Data URL) を、メモリ上の文字列ではなく
+# 元のファイル内のバイト範囲を指すハンドルとして保持する、省メモリな読み込みモード
+# 数千件以上のモデルの AIVM マニフェストを常駐させるカタログ用途を想定しており、アセットは必要になった時点で元のファイルから読み取る
+
+# AIVM ファイルのヘッダー部分の開始オフセット (先頭 8 バイトはヘッダーサイズ)
+_AIVM_HEADER_OFFSET = 8
+
+
+@dataclass(frozen=True, slots=True)
+class _AssetSource:
+    """アセットの読み取り元のファイルと、読み込み時点でのファイルの状態"""
+
+    # 読み取り元の AIVM / AIVMX ファイルのパス
+    path: Path
+    # 読み込み時点でのファイルの更新日時 (ナノ秒)
+    mtime_ns: int
+    # 読み込み時点でのファイルサイズ
+    size: int
+
+
+@dataclass(frozen=True, slots=True)
+class AivmAssetHandle:
+    """AIVM / AIVMX ファイル内に埋め込まれたアイコン画像・ボイスサンプル音声 (Data URL) への軽量なハンドル"""
+
+    # 読み取り元のファイル (同一ファイル内のハンドル間で共有される)
+    source: _AssetSource
+    # Data URL の Base64 部分の、ファイル内での開始オフセット
+    offset: int
+    # Data URL の Base64 部分のバイト数
+    length: int
+    # アセットの MIME タイプ (ex: image/jpeg, audio/mp4)
+    mime_type: str
+    # ファイル内に Data URL がそのままの形で見つからなかった場合のみ、Base64 部分をメモリ上に保持する
+    inline_base64: str | None = None
+
+    @property
+    def path(self) -> Path:
+        """読み取り元の AIVM / AIVMX ファイルのパス"""
+        return self.source.path
+
+    def read_base64(self) -> str:
+        """
+        アセットの Base64 文字列を読み取る
+
+        Returns:
+            str: Base64 文字列
+
+        Raises:
+            AivmValidationError: 読み込み時点から読み取り元のファイルが変更されている場合
+        """
+
+        if self.inline_base64 is not None:
+            return self.inline_base64
+
+        # 読み込み時点から読み取り元のファイルが変更されていれば、バイト範囲が無効になっているためエラーにする
+        stat_result = os.stat(self.source.path)
+        if stat_result.st_mtime_ns != self.source.mtime_ns or stat_result.st_size != self.source.size:
+            raise AivmValidationError(f'{self.source.path} has been modified since its metadata was read.')
+        with self.source.path.open('rb') as file:
+            data = pread(file, self.length, self.offset)
+        if len(data) < self.length:
+            raise AivmValidationError(f'{self.source.path} has been truncated since its metadata was read.')
+        return data.decode('ascii')
+
+    def read(self) -> bytes:
+        """
+        アセットを読み取り、Base64 をデコードしたバイナリを返す
+
+        Returns:
+            bytes: アイコン画像・ボイスサンプル音声のバイナリ
+
+        Raises:
+            AivmValidationError: 読み込み時点から読み取り元のファイルが変更されている場合
+        """
+
+        return base64.b64decode(self.read_base64())
+
+    def to_data_url(self) -> str:
+        """
+        アセットを読み取り、AIVM マニフェストに格納されていた形式の Data URL を返す
+
+        Returns:
+            str: Data URL
+
+        Raises:
+            AivmValidationError: 読み込み時点から読み取り元のファイルが変更されている場合
+        """
+
+        return f'data:{self.mime_type};base64,{self.read_base64()}'
+
+
+class AivmLazyManifestVoiceSample(AivmManifestVoiceSample):
+    """音声ファイルをハンドルとして保持する、AIVM マニフェストのボイスサンプル情報"""
+
+    # ボイスサンプルの音声ファイルへのハンドル
+    audio: AivmAssetHandle  # type: ignore[assignment]
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @field_serializer('audio')
+    def _serialize_audio(self, audio: AivmAssetHandle) -> str:
+        return audio.to_data_url()
+
+
+class AivmLazyManifestSpeakerStyle(AivmManifestSpeakerStyle):
+    """アイコン画像をハンドルとして保持する、AIVM マニフェストの話者スタイル情報"""
+
+    # スタイルのアイコン画像へのハンドル (省略時は None)
+    icon: AivmAssetHandle | None = None  # type: ignore[assignment]
+    # スタイルごとのボイスサンプル
+    voice_samples: list[AivmLazyManifestVoiceSample] = Field(default_factory=list)  # type: ignore[assignment]
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @field_serializer('icon')
+    def _serialize_icon(self, icon: AivmAssetHandle | None) -> str | None:
+        return icon.to_data_url() if icon is not None else None
+
+
+class AivmLazyManifestSpeaker(AivmManifestSpeaker):
+    """アイコン画像をハンドルとして保持する、AIVM マニフェストの話者情報"""
+
+    # 話者のアイコン画像へのハンドル
+    icon: AivmAssetHandle  # type: ignore[assignment]
+    # 話者のスタイル情報
+    styles: list[AivmLazyManifestSpeakerStyle]  # type: ignore[assignment]
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @field_serializer('icon')
+    def _serialize_icon(self, icon: AivmAssetHandle) -> str:
+        return icon.to_data_url()
+
+
+class AivmLazyManifest(AivmManifest):
+    """
+    アイコン画像・ボイスサンプル音声をハンドルとして保持する AIVM マニフェスト
+    AivmManifest のサブクラスのため、アセット以外のフィールドは AivmManifest と同様に参照できる
+    model_dump_json() でシリアライズした場合は、ハンドルから読み取った Data URL を含む元の AIVM マニフェストと同一の内容になる
+    """
+
+    # 音声合成モデルの話者情報
+    speakers: list[AivmLazyManifestSpeaker]  # type: ignore[assignment]
+
+    model_config = ConfigDict(arbitrary_types_allowed=True, protected_namespaces=())
+
+    def materialize(self) -> AivmManifest:
+        """
+        すべてのハンドルからアセットを読み取り、通常の AivmManifest に変換する
+
+        Returns:
+            AivmManifest: アセットを Data URL として保持する AIVM マニフェスト
+
+        Raises:
+            AivmValidationError: 読み込み時点から読み取り元のファイルが変更されている場合
+        """
+
+        return AivmManifest.model_validate_json(self.model_dump_json())
+
+
+def read_aivm_metadata_lazy(aivm_path: Path) -> AivmMetadata:
+    """
+    AIVM ファイルから、アイコン画像・ボイスサンプル音声をハンドルとして保持する AIVM メタデータを読み込む
+    返される AivmMetadata の manifest は AivmLazyManifest となり、アセットは必要になった時点で元のファイルから読み取られる
+
+    Args:
+        aivm_path (Path): AIVM ファイルのパス
+
+    Returns:
+        AivmMetadata: AIVM メタデータ
+
+    Raises:
+        AivmValidationError: AIVM ファイルのフォーマットが不正・AIVM メタデータのバリデーションに失敗した場合
+    """
+
+    with aivm_path.open('rb') as aivm_file:
+        stat_result = os.fstat(aivm_file.fileno())
+        header_bytes = _read_aivm_header_bytes(aivm_file)
+
+    header_json = _decode_aivm_header(header_bytes)
+    raw_metadata = header_json.get('__metadata__') if isinstance(header_json, dict) else None
+    aivm_metadata = validate_aivm_metadata(raw_metadata)
+
+    # AIVM マニフェストはヘッダー内に JSON 文字列としてエスケープされて格納されているが、
+    # Data URL に含まれる文字はエスケープの対象外のため、ヘッダーのバイト列内にそのままの形で現れる
+    source = _AssetSource(path=aivm_path, mtime_ns=stat_result.st_mtime_ns, size=stat_result.st_size)
+    return _replace_assets_with_handles(aivm_metadata, source, header_bytes, _AIVM_HEADER_OFFSET)
+
+
+def read_aivmx_metadata_lazy(aivmx_path: Path) -> AivmMetadata:
+    """
+    AIVMX ファイルから、アイコン画像・ボイスサンプル音声をハンドルとして保持する AIVM メタデータを読み込む
+    返される AivmMetadata の manifest は AivmLazyManifest となり、アセットは必要になった時点で元のファイルから読み取られる
+
+    Args:
+        aivmx_path (Path): AIVMX ファイルのパス
+
+    Returns:
+        AivmMetadata: AIVM メタデータ
+
+    Raises:
+        AivmValidationError: AIVMX ファイルのフォーマットが不正・AIVM メタデータのバリデーションに失敗した場合
+    """
+
+    with aivmx_path.open('rb') as aivmx_file:
+        stat_result = os.fstat(aivmx_file.fileno())
+        try:
+            fields = scan_model_fields(aivmx_file)
+            raw_metadata = read_metadata_props(aivmx_file, fields)
+            # AIVM マニフェストを格納した metadata_props のエントリを探す (同一キーが複数ある場合は後勝ち)
+            manifest_field: ProtobufField | None = None
+            for field in fields:
+                if field.number == METADATA_PROPS_FIELD_NUMBER and field.wire_type == WIRE_TYPE_LEN:
+                    key = read_metadata_prop_key(aivmx_file, field)
+                    if key is None:
+                        key, _ = decode_string_string_entry(
+                            pread(aivmx_file, field.end - field.value_offset, field.value_offset)
+                        )
+                    if key == 'aivm_manifest':
+                        manifest_field = field
+            entry_bytes = b''
+            if manifest_field is not None:
+                entry_bytes = pread(
+                    aivmx_file, manifest_field.end - manifest_field.value_offset, manifest_field.value_offset
+                )
+        except ProtobufScanError:
+            raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+
+    aivm_metadata = validate_aivm_metadata(raw_metadata)
+
+    # metadata_props の値は AIVM マニフェストの JSON がそのまま UTF-8 で格納されている
+    source = _AssetSource(path=aivmx_path, mtime_ns=stat_result.st_mtime_ns, size=stat_result.st_size)
+    base_offset = manifest_field.value_offset if manifest_field is not None else 0
+    return _replace_assets_with_handles(aivm_metadata, source, entry_bytes, base_offset)
+
+
+def _replace_assets_with_handles(
+    aivm_metadata: AivmMetadata,
+    source: _AssetSource,
+    region: bytes,
+    region_offset: int,
+) -> AivmMetadata:
+    """
+    バリデーション済みの AIVM メタデータのアセットを、ファイル内のバイト範囲を指すハンドルに置き換える内部メソッド
+    アセット以外の繰り返し現れる短い文字列は intern し、同一内容のアセットは 1 つのハンドルを共有する
+    """
+
+    # アセットは AIVM マニフェスト内の出現順に並んでいるため、前回見つかった位置の直後から順に探すことで全体を線形時間で走査できる
+    ## 万が一異なる位置で一致したとしても、同一のバイト列を指すため読み取り結果は変わらない
+    cursor = 0
+    handles: dict[str, AivmAssetHandle] = {}
+
+    def to_handle(data_url: str) -> AivmAssetHandle:
+        nonlocal cursor
+        handle = handles.get(data_url)
+        if handle is not None:
+            return handle
+        header, base64_string = data_url.split(',', 1)
+        mime_type = sys.intern(header.removeprefix('data:').removesuffix(';base64'))
+        position = region.find(data_url.encode('ascii'), cursor)
+        if position < 0:
+            position = region.find(data_url.encode('ascii'))
+        if position >= 0:
+            cursor = position + len(data_url)
+            handle = AivmAssetHandle(
+                source=source,
+                offset=region_offset + position + len(header) + 1,
+                length=len(base64_string),
+                mime_type=mime_type,
+            )
+        else:
+            # "/" が "\/" にエスケープされているなど、ファイル内にそのままの形で見つからない場合はメモリ上に保持する
+            handle = AivmAssetHandle(
+                source=source, offset=0, length=0, mime_type=mime_type, inline_base64=base64_string
+            )
+        handles[data_url] = handle
+        return handle
+
+    manifest = aivm_metadata.manifest
+    speakers: list[AivmLazyManifestSpeaker] = []
+    for speaker in manifest.speakers:
+        speaker_icon = to_handle(speaker.icon)
+        styles: list[AivmLazyManifestSpeakerStyle] = []
+        for style in speaker.styles:
+            style_icon = to_handle(style.icon) if style.icon is not None else None
+            voice_samples = [
+                AivmLazyManifestVoiceSample.model_construct(
+                    audio=to_handle(voice_sample.audio),
+                    transcript=voice_sample.transcript,
+                )
+                for voice_sample in style.voice_samples
+            ]
+            styles.append(
+                AivmLazyManifestSpeakerStyle.model_construct(
+                    **_interned_fields(style, exclude={'icon', 'voice_samples'}),
+                    icon=style_icon,
+                    voice_samples=voice_samples,
+                )
+            )
+        speakers.append(
+            AivmLazyManifestSpeaker.model_construct(
+                **_interned_fields(speaker, exclude={'icon', 'styles'}),
+                icon=speaker_icon,
+                styles=styles,
+            )
+        )
+    lazy_manifest = AivmLazyManifest.model_construct(
+        **_interned_fields(manifest, exclude={'speakers'}),
+        speakers=speakers,
+    )
+
+    # バリデーション済みのシリアライズ結果のキャッシュは AIVM マニフェスト全体の文字列を保持しているため、引き継がない
+    return AivmMetadata(
+        manifest=lazy_manifest,
+        hyper_parameters=aivm_metadata.hyper_parameters,
+        style_vectors=aivm_metadata.style_vectors,
+    )
+
+
+def _interned_fields(model: Any, exclude: set[str]) -> dict[str, Any]:
+    """
+    Pydantic モデルのフィールドを、文字列 (および文字列のリスト) を intern した上で辞書として取り出す内部メソッド
+    話者名・スタイル名・対応言語などは多数のモデル間で繰り返し現れるため、intern することで同一の文字列オブジェクトを共有できる
+    """
+
+    fields: dict[str, Any] = {}
+    for name in type(model).model_fields:
+        if name in exclude:
+            continue
+        value = getattr(model, name)
+        if type(value) is str:
+            value = sys.intern(value)
+        elif isinstance(value, list):
+            value = [sys.intern(item) if type(item) is str else item for item in value]
+        fields[name] = value
+    return fields
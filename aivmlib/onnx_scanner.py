@@ -0,0 +1,649 @@
+# ONNX モデル (Protobuf) のルートである ModelProto メッセージを、全体をパースすることなく走査するためのユーティリティ
+# ModelProto のトップレベルのフィールドのバイト範囲だけを読み取ることで、巨大なグラフ (重み) を含むフィールドを丸ごと読み飛ばせる
+# ref: https://protobuf.dev/programming-guides/encoding/
+# ref: https://github.com/onnx/onnx/blob/main/onnx/onnx.proto
+
+import struct
+import zlib
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import BinaryIO
+
+from aivmlib.utils import get_file_size, pread
+
+
+# ModelProto.metadata_props のフィールド番号
+METADATA_PROPS_FIELD_NUMBER = 14
+
+# ファイル末尾に配置した metadata_props の位置を示すロケーターのフィールド番号
+# ONNX の仕様で使われることのない大きなフィールド番号を用いており、標準的な ONNX パーサーは未知のフィールドとして読み飛ばす
+METADATA_LOCATOR_FIELD_NUMBER = 536870000
+
+# スタブファイルの末尾に配置する、重み部分の参照情報のフィールド番号 (ロケーターと同様に、標準的な ONNX パーサーは読み飛ばす)
+STUB_REFERENCE_FIELD_NUMBER = 536870001
+
+# Protobuf のワイヤータイプ
+WIRE_TYPE_VARINT = 0
+WIRE_TYPE_I64 = 1
+WIRE_TYPE_LEN = 2
+WIRE_TYPE_I32 = 5
+
+# フィールドのタグと長さを読み取るのに十分なバイト数 (Varint は最大 10 バイト)
+_FIELD_HEADER_MAX_SIZE = 20
+
+# ロケーターの値の形式 (マジックナンバー, metadata_props の開始オフセット, バイト数, CRC-32)
+_LOCATOR_MAGIC = b'AIVMXLOC'
+_LOCATOR_STRUCT = struct.Struct('<8sQQI')
+
+# ファイル末尾に metadata_props を配置した場合に、1 回目の読み取りでまとめて読み取るファイル末尾のバイト数
+# AIVM マニフェストが小さいファイルであれば、ロケーターと metadata_props を 1 回の読み取りで取得できる
+_TAIL_READ_SIZE = 64 * 1024
+
+# 外部データを参照するテンソルを探す際に、グラフ内の小さなフィールドの走査をまとめて行うための読み取り単位
+_SCAN_WINDOW_SIZE = 64 * 1024
+
+# 外部データを参照するテンソルを探す際に、辿るサブグラフの深さの上限
+_MAX_GRAPH_DEPTH = 64
+
+# ModelProto.graph のフィールド番号
+_MODEL_GRAPH_FIELD_NUMBER = 7
+
+# テンソル (TensorProto) を含みうるメッセージごとの、子メッセージのフィールド番号とその種類
+## GraphProto: node (1) / initializer (5) / sparse_initializer (15)
+## NodeProto: attribute (5)
+## AttributeProto: t (5) / g (6) / tensors (10) / graphs (11) / sparse_tensor (22) / sparse_tensors (23)
+## SparseTensorProto: values (1) / indices (2)
+_CHILD_MESSAGE_TYPES: dict[str, dict[int, str]] = {
+    'graph': {1: 'node', 5: 'tensor', 15: 'sparse_tensor'},
+    'node': {5: 'attribute'},
+    'attribute': {5: 'tensor', 6: 'graph', 10: 'tensor', 11: 'graph', 22: 'sparse_tensor', 23: 'sparse_tensor'},
+    'sparse_tensor': {1: 'tensor', 2: 'tensor'},
+}
+
+# TensorProto の name / external_data / data_location のフィールド番号
+_TENSOR_NAME_FIELD_NUMBER = 8
+_TENSOR_EXTERNAL_DATA_FIELD_NUMBER = 13
+_TENSOR_DATA_LOCATION_FIELD_NUMBER = 14
+
+# TensorProto.DataLocation.EXTERNAL の値
+_DATA_LOCATION_EXTERNAL = 1
+
+
+class ProtobufScanError(ValueError):
+    """
+    Protobuf のフレーミングが不正で、ModelProto を走査できなかったときに発生する例外
+    """
+
+    pass
+
+
+class ProtobufScanLimitError(ProtobufScanError):
+    """
+    ModelProto の走査中に、指定された上限 (フィールド数など) を超えたときに発生する例外
+    """
+
+    pass
+
+
+@dataclass(frozen=True)
+class ProtobufField:
+    """ModelProto のトップレベルに存在する 1 つのフィールドの位置情報"""
+
+    # フィールド番号
+    number: int
+    # ワイヤータイプ
+    wire_type: int
+    # タグを含むフィールド全体の開始オフセット
+    offset: int
+    # フィールドの値 (LEN 型の場合は長さプレフィックスの直後) の開始オフセット
+    value_offset: int
+    # フィールド全体の終了オフセット (このオフセット自体は含まない)
+    end: int
+
+
+@dataclass(frozen=True)
+class ExternalTensorReference:
+    """外部データ (External Data) を参照する 1 つのテンソルの参照情報"""
+
+    # テンソル名
+    name: str
+    # 外部データファイルのパス (ONNX ファイルからの相対パス)
+    location: str
+    # 外部データファイル内での開始オフセット
+    offset: int
+    # 外部データファイル内でのバイト数
+    length: int
+
+
+def decode_varint(buffer: bytes, position: int) -> tuple[int, int]:
+    """
+    バイト列の指定位置から Varint をデコードする
+
+    Args:
+        buffer (bytes): バイト列
+        position (int): デコードを開始する位置
+
+    Returns:
+        tuple[int, int]: デコードした値と、Varint の直後の位置
+
+    Raises:
+        ProtobufScanError: Varint が途中で途切れている・10 バイトを超える場合
+    """
+
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(buffer) or shift >= 70:
+            raise ProtobufScanError('Truncated or malformed varint.')
+        byte = buffer[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def encode_varint(value: int) -> bytes:
+    """
+    非負整数を Varint にエンコードする
+
+    Args:
+        value (int): エンコードする値
+
+    Returns:
+        bytes: エンコードされたバイト列
+    """
+
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def parse_field_header(buffer: bytes, position: int, offset: int) -> ProtobufField:
+    """
+    バイト列の指定位置からフィールドのタグ (と LEN 型の場合は長さ) を読み取り、フィールドの位置情報を返す
+
+    Args:
+        buffer (bytes): フィールドの先頭を含むバイト列
+        position (int): バイト列内でのフィールドの開始位置
+        offset (int): ファイル内でのフィールドの開始オフセット
+
+    Returns:
+        ProtobufField: フィールドの位置情報
+
+    Raises:
+        ProtobufScanError: タグやワイヤータイプが不正な場合
+    """
+
+    tag, cursor = decode_varint(buffer, position)
+    number = tag >> 3
+    wire_type = tag & 0x07
+    if number == 0:
+        raise ProtobufScanError(f'Invalid field number 0 at offset {offset}.')
+
+    if wire_type == WIRE_TYPE_VARINT:
+        _, value_end = decode_varint(buffer, cursor)
+        value_offset = offset + (cursor - position)
+        end = offset + (value_end - position)
+    elif wire_type == WIRE_TYPE_I64:
+        value_offset = offset + (cursor - position)
+        end = value_offset + 8
+    elif wire_type == WIRE_TYPE_LEN:
+        length, value_start = decode_varint(buffer, cursor)
+        value_offset = offset + (value_start - position)
+        end = value_offset + length
+    elif wire_type == WIRE_TYPE_I32:
+        value_offset = offset + (cursor - position)
+        end = value_offset + 4
+    else:
+        # グループ (ワイヤータイプ 3, 4) は ONNX では使われないため、不正なファイルとみなす
+        raise ProtobufScanError(f'Unsupported wire type {wire_type} at offset {offset}.')
+
+    return ProtobufField(number=number, wire_type=wire_type, offset=offset, value_offset=value_offset, end=end)
+
+
+def scan_model_fields(file: BinaryIO, max_fields: int | None = None) -> list[ProtobufField]:
+    """
+    ONNX ファイルの ModelProto のトップレベルのフィールドを、値を読み込むことなく列挙する
+    各フィールドのヘッダー部分 (タグと長さ) のみを読み取り、値の部分は読み飛ばす
+    ファイルのカーソル位置は変更しないため、同一のファイルオブジェクトを複数のスレッドから同時に走査できる
+
+    Args:
+        file (BinaryIO): ONNX ファイル
+        max_fields (int | None): 走査するフィールド数の上限 (省略時は無制限)
+            小さなフィールドを大量に並べた不正なファイルで、走査に時間がかかりすぎるのを防ぐために指定する
+
+    Returns:
+        list[ProtobufField]: ファイル内での出現順に並べたフィールドの位置情報のリスト
+
+    Raises:
+        ProtobufScanError: Protobuf のフレーミングが不正な場合
+        ProtobufScanLimitError: フィールド数が上限を超えた場合
+    """
+
+    # カーソル位置を変更せずにファイルサイズを取得
+    file_size = get_file_size(file)
+
+    fields: list[ProtobufField] = []
+    offset = 0
+    while offset < file_size:
+        if max_fields is not None and len(fields) >= max_fields:
+            raise ProtobufScanLimitError(f'The number of top-level fields exceeds the limit ({max_fields}).')
+        field = parse_field_header(pread(file, _FIELD_HEADER_MAX_SIZE, offset), 0, offset)
+        if field.end > file_size:
+            raise ProtobufScanError(f'Field {field.number} at offset {offset} exceeds the end of the file.')
+        fields.append(field)
+        offset = field.end
+
+    return fields
+
+
+def read_metadata_props(
+    file: BinaryIO,
+    fields: list[ProtobufField],
+    keys: set[str] | None = None,
+) -> dict[str, str]:
+    """
+    走査済みのフィールドのうち metadata_props (StringStringEntryProto) のみを読み取り、辞書として返す
+    keys を指定した場合、キーが一致しないエントリの値は読み込まずに読み飛ばす
+    ファイルのカーソル位置は変更しないため、同一のファイルオブジェクトを複数のスレッドから同時に読み取れる
+
+    Args:
+        file (BinaryIO): ONNX ファイル
+        fields (list[ProtobufField]): scan_model_fields() で取得したフィールドの位置情報のリスト
+        keys (set[str] | None): 読み込むキーの集合 (省略時はすべてのキーを読み込む)
+
+    Returns:
+        dict[str, str]: metadata_props のキーと値の辞書 (同一キーが複数ある場合は後勝ち)
+
+    Raises:
+        ProtobufScanError: metadata_props のエントリが不正な場合
+    """
+
+    metadata_props: dict[str, str] = {}
+    for field in fields:
+        if field.number != METADATA_PROPS_FIELD_NUMBER or field.wire_type != WIRE_TYPE_LEN:
+            continue
+
+        # キーが一致しないエントリは、値を読み込まずに読み飛ばす
+        if keys is not None:
+            key = read_metadata_prop_key(file, field)
+            if key is not None and key not in keys:
+                continue
+
+        # エントリ全体を読み込んでデコードする
+        entry_key, entry_value = decode_string_string_entry(
+            pread(file, field.end - field.value_offset, field.value_offset)
+        )
+        if keys is None or entry_key in keys:
+            metadata_props[entry_key] = entry_value
+
+    return metadata_props
+
+
+def read_metadata_prop_key(file: BinaryIO, field: ProtobufField) -> str | None:
+    """
+    metadata_props のエントリ (StringStringEntryProto) の先頭から、値を読み込まずにキーのみを読み取る
+
+    Args:
+        file (BinaryIO): ONNX ファイル
+        field (ProtobufField): metadata_props フィールドの位置情報
+
+    Returns:
+        str | None: エントリのキー (キーがエントリの先頭に格納されていない場合は None)
+
+    Raises:
+        ProtobufScanError: キーが UTF-8 としてデコードできない場合
+    """
+
+    # StringStringEntryProto は key (1) と value (2) のみを持つため、まずはエントリの先頭にあるはずのキーのみを読み取る
+    entry_head = pread(file, min(field.end - field.value_offset, 1024), field.value_offset)
+    if entry_head[:1] != b'\x0a':
+        return None
+    key_length, key_start = decode_varint(entry_head, 1)
+    if key_start + key_length > len(entry_head):
+        return None
+    try:
+        return entry_head[key_start : key_start + key_length].decode('utf-8')
+    except UnicodeDecodeError:
+        raise ProtobufScanError('metadata_props entry is not valid UTF-8.')
+
+
+def decode_string_string_entry(buffer: bytes) -> tuple[str, str]:
+    """
+    StringStringEntryProto のシリアライズ済みバイト列から、キーと値をデコードする
+
+    Args:
+        buffer (bytes): StringStringEntryProto のバイト列
+
+    Returns:
+        tuple[str, str]: キーと値
+
+    Raises:
+        ProtobufScanError: エントリのフォーマットが不正な場合
+    """
+
+    values = {1: '', 2: ''}
+    position = 0
+    while position < len(buffer):
+        field = parse_field_header(buffer, position, position)
+        if field.end > len(buffer):
+            raise ProtobufScanError('Truncated metadata_props entry.')
+        if field.number in values:
+            if field.wire_type != WIRE_TYPE_LEN:
+                raise ProtobufScanError('Invalid metadata_props entry.')
+            try:
+                values[field.number] = buffer[field.value_offset : field.end].decode('utf-8')
+            except UnicodeDecodeError:
+                raise ProtobufScanError('metadata_props entry is not valid UTF-8.')
+        position = field.end
+
+    return values[1], values[2]
+
+
+def scan_external_data_tensors(
+    file: BinaryIO,
+    fields: list[ProtobufField] | None = None,
+    max_fields: int | None = None,
+) -> list[ExternalTensorReference]:
+    """
+    ONNX ファイルのグラフ内で外部データ (External Data) を参照しているテンソルを、ONNX モデル全体をパースすることなく列挙する
+    initializer・ノード属性のテンソルとサブグラフを辿り、各フィールドのヘッダー部分のみを読み取って raw_data などの値は読み飛ばす
+    onnx.external_data_helper と同様に、data_location が EXTERNAL のテンソルのみを外部データを参照するテンソルとみなす
+    ファイルのカーソル位置は変更しないため、同一のファイルオブジェクトを複数のスレッドから同時に走査できる
+
+    Args:
+        file (BinaryIO): ONNX ファイル
+        fields (list[ProtobufField] | None): scan_model_fields() で取得したトップレベルのフィールドの位置情報のリスト (省略時は走査する)
+        max_fields (int | None): 走査するフィールド数の上限 (トップレベルのフィールドを含む・省略時は無制限)
+
+    Returns:
+        list[ExternalTensorReference]: 外部データを参照しているテンソルの参照情報のリスト
+
+    Raises:
+        ProtobufScanError: Protobuf のフレーミング・外部データの参照情報が不正な場合
+        ProtobufScanLimitError: フィールド数・サブグラフの深さが上限を超えた場合
+    """
+
+    if fields is None:
+        fields = scan_model_fields(file, max_fields)
+    reader = _WindowedReader(file)
+    field_count = len(fields)
+
+    def iterate_fields(start: int, end: int) -> Iterator[ProtobufField]:
+        nonlocal field_count
+        offset = start
+        while offset < end:
+            field_count += 1
+            if max_fields is not None and field_count > max_fields:
+                raise ProtobufScanLimitError(f'The number of fields exceeds the limit ({max_fields}).')
+            field = parse_field_header(reader.read(offset, _FIELD_HEADER_MAX_SIZE), 0, offset)
+            if field.end > end:
+                raise ProtobufScanError(f'Field {field.number} at offset {offset} exceeds the end of the message.')
+            yield field
+            offset = field.end
+
+    # 再帰の深さが入力に依存しないよう、走査するメッセージをスタックに積んで辿る
+    references: list[ExternalTensorReference] = []
+    stack: list[tuple[str, int, int, int]] = [
+        ('graph', field.value_offset, field.end, 1)
+        for field in reversed(fields)
+        if field.number == _MODEL_GRAPH_FIELD_NUMBER and field.wire_type == WIRE_TYPE_LEN
+    ]
+    while stack:
+        message_type, start, end, depth = stack.pop()
+        if depth > _MAX_GRAPH_DEPTH:
+            raise ProtobufScanLimitError(f'The nesting depth of subgraphs exceeds the limit ({_MAX_GRAPH_DEPTH}).')
+
+        # テンソルの場合は、外部データの参照情報に関係するフィールドのみを読み取る
+        if message_type == 'tensor':
+            reference = _read_external_tensor_reference(reader, iterate_fields(start, end))
+            if reference is not None:
+                references.append(reference)
+            continue
+
+        children: list[tuple[str, int, int, int]] = []
+        for field in iterate_fields(start, end):
+            child_type = _CHILD_MESSAGE_TYPES[message_type].get(field.number)
+            if child_type is None or field.wire_type != WIRE_TYPE_LEN:
+                continue
+            children.append((child_type, field.value_offset, field.end, depth + (child_type == 'graph')))
+        stack.extend(reversed(children))
+
+    return references
+
+
+def _read_external_tensor_reference(
+    reader: '_WindowedReader',
+    fields: Iterator[ProtobufField],
+) -> ExternalTensorReference | None:
+    """
+    TensorProto のフィールドから、外部データを参照している場合のみその参照情報を読み取る内部メソッド
+
+    Args:
+        reader (_WindowedReader): ONNX ファイルの読み取りに用いるリーダー
+        fields (Iterator[ProtobufField]): TensorProto のフィールドの位置情報
+
+    Returns:
+        ExternalTensorReference | None: 外部データの参照情報 (外部データを参照していない場合は None)
+
+    Raises:
+        ProtobufScanError: 外部データの参照情報が不正な場合
+    """
+
+    name = ''
+    data_location = 0
+    external_data: dict[str, str] = {}
+    for field in fields:
+        if field.number == _TENSOR_NAME_FIELD_NUMBER and field.wire_type == WIRE_TYPE_LEN:
+            try:
+                name = reader.read(field.value_offset, field.end - field.value_offset).decode('utf-8')
+            except UnicodeDecodeError:
+                raise ProtobufScanError('Tensor name is not valid UTF-8.')
+        elif field.number == _TENSOR_EXTERNAL_DATA_FIELD_NUMBER and field.wire_type == WIRE_TYPE_LEN:
+            key, value = decode_string_string_entry(reader.read(field.value_offset, field.end - field.value_offset))
+            external_data[key] = value
+        elif field.number == _TENSOR_DATA_LOCATION_FIELD_NUMBER and field.wire_type == WIRE_TYPE_VARINT:
+            data_location, _ = decode_varint(reader.read(field.value_offset, field.end - field.value_offset), 0)
+
+    if data_location != _DATA_LOCATION_EXTERNAL:
+        return None
+
+    # オフセットとバイト数は、onnx.external_data_helper.ExternalDataInfo と同様に 10 進数の文字列として格納されている
+    try:
+        offset = int(external_data.get('offset') or 0)
+        length = int(external_data.get('length') or 0)
+    except ValueError:
+        raise ProtobufScanError(f'Invalid external data offset or length of tensor "{name}".')
+    return ExternalTensorReference(name=name, location=external_data.get('location', ''), offset=offset, length=length)
+
+
+class _WindowedReader:
+    """
+    ファイルの一部をまとめて読み取ってキャッシュし、小さなフィールドが連続する範囲を少ない読み取り回数で走査するための内部クラス
+    キャッシュはインスタンスごとに保持し、ファイルのカーソル位置は変更しない
+    """
+
+    def __init__(self, file: BinaryIO) -> None:
+        self.file = file
+        self.window_start = 0
+        self.window = b''
+
+    def read(self, offset: int, size: int) -> bytes:
+        """
+        指定されたオフセットから指定されたバイト数を読み取る (ファイル末尾に達した場合は短いバイト列を返す)
+
+        Args:
+            offset (int): 読み取りを開始するオフセット
+            size (int): 読み取るバイト数
+
+        Returns:
+            bytes: 読み取ったバイト列
+        """
+
+        window_end = self.window_start + len(self.window)
+        if offset < self.window_start or offset + size > window_end:
+            self.window = pread(self.file, max(size, _SCAN_WINDOW_SIZE), offset)
+            self.window_start = offset
+        return self.window[offset - self.window_start : offset - self.window_start + size]
+
+
+def read_tail_metadata_props(file: BinaryIO, max_size: int | None = None) -> dict[str, str] | None:
+    """
+    ファイル末尾のロケーターを読み取り、ファイル末尾に配置された metadata_props を先頭から走査することなく読み込む
+    ロケーターが存在しない・ロケーターの指す範囲が末尾の metadata_props と一致しない (別のツールで書き換えられたなど) 場合は None を返すため、
+    呼び出し側は scan_model_fields() による走査にフォールバックする必要がある
+
+    Args:
+        file (BinaryIO): ONNX ファイル
+        max_size (int | None): 読み込む metadata_props の合計バイト数の上限 (省略時は無制限)
+
+    Returns:
+        dict[str, str] | None: metadata_props のキーと値の辞書 (ロケーターが無効な場合は None)
+
+    Raises:
+        ProtobufScanError: ロケーターの指す metadata_props のエントリが不正な場合
+        ProtobufScanLimitError: metadata_props の合計バイト数が上限を超えた場合
+    """
+
+    # ファイル末尾をまとめて読み取り、末尾のロケーターを検証する
+    file_size = get_file_size(file)
+    locator_prefix = _get_locator_prefix()
+    locator_size = len(locator_prefix) + _LOCATOR_STRUCT.size
+    if file_size < locator_size:
+        return None
+    tail_size = min(file_size, _TAIL_READ_SIZE)
+    tail_start = file_size - tail_size
+    tail = pread(file, tail_size, tail_start)
+    locator = tail[-locator_size:]
+    if len(tail) < tail_size or not locator.startswith(locator_prefix + _LOCATOR_MAGIC):
+        return None
+    _, offset, length, crc32 = _LOCATOR_STRUCT.unpack_from(locator, len(locator_prefix))
+
+    # ロケーターが指す範囲は、ロケーターの直前まで連続している必要がある
+    locator_offset = file_size - locator_size
+    if offset + length != locator_offset:
+        return None
+    if max_size is not None and length > max_size:
+        raise ProtobufScanLimitError(f'Metadata size ({length} bytes) exceeds the limit ({max_size} bytes).')
+
+    # metadata_props が 1 回目に読み取った範囲に収まっていなければ、改めて読み取る
+    if offset >= tail_start:
+        region = tail[offset - tail_start : locator_offset - tail_start]
+    else:
+        region = pread(file, length, offset)
+        if len(region) < length:
+            return None
+    if zlib.crc32(region) != crc32:
+        return None
+
+    # 範囲内のすべてのフィールドが metadata_props であることを確認しながらデコードする
+    metadata_props: dict[str, str] = {}
+    position = 0
+    while position < length:
+        field = parse_field_header(region, position, offset + position)
+        if field.number != METADATA_PROPS_FIELD_NUMBER or field.wire_type != WIRE_TYPE_LEN:
+            return None
+        if field.end > locator_offset:
+            raise ProtobufScanError(f'Field {field.number} at offset {field.offset} exceeds the metadata region.')
+        key, value = decode_string_string_entry(region[field.value_offset - offset : field.end - offset])
+        metadata_props[key] = value
+        position = field.end - offset
+
+    return metadata_props
+
+
+def encode_metadata_locator(metadata_props_bytes: bytes, offset: int) -> bytes:
+    """
+    ファイル末尾に配置した metadata_props の位置を示すロケーターを、ModelProto のトップレベルのフィールドとしてエンコードする
+    ロケーターは常に固定長で、metadata_props の直後 (ファイルの末尾) に配置する必要がある
+
+    Args:
+        metadata_props_bytes (bytes): encode_metadata_props() でエンコードした metadata_props のバイト列
+        offset (int): ファイル内での metadata_props の開始オフセット
+
+    Returns:
+        bytes: ロケーターのフィールド (タグと長さを含む) のバイト列
+    """
+
+    return _get_locator_prefix() + _LOCATOR_STRUCT.pack(
+        _LOCATOR_MAGIC, offset, len(metadata_props_bytes), zlib.crc32(metadata_props_bytes)
+    )
+
+
+def remove_top_level_fields(buffer: bytes, field_number: int) -> bytes:
+    """
+    シリアライズ済みの ModelProto から、指定されたフィールド番号のトップレベルのフィールドを取り除く
+
+    Args:
+        buffer (bytes): シリアライズ済みの ModelProto のバイト列
+        field_number (int): 取り除くフィールドの番号
+
+    Returns:
+        bytes: フィールドを取り除いたバイト列 (該当するフィールドが存在しない場合は元のバイト列)
+
+    Raises:
+        ProtobufScanError: Protobuf のフレーミングが不正な場合
+    """
+
+    kept_ranges: list[tuple[int, int]] = []
+    removed = False
+    position = 0
+    while position < len(buffer):
+        field = parse_field_header(buffer, position, position)
+        if field.end > len(buffer):
+            raise ProtobufScanError(f'Field {field.number} at offset {position} exceeds the end of the buffer.')
+        if field.number == field_number:
+            removed = True
+        else:
+            kept_ranges.append((field.offset, field.end))
+        position = field.end
+
+    if not removed:
+        return buffer
+    return b''.join(buffer[start:end] for start, end in kept_ranges)
+
+
+def _get_locator_prefix() -> bytes:
+    """
+    ロケーターのフィールドのタグと長さ (固定) のバイト列を返す内部メソッド
+    """
+
+    return encode_varint(METADATA_LOCATOR_FIELD_NUMBER << 3 | WIRE_TYPE_LEN) + encode_varint(_LOCATOR_STRUCT.size)
+
+
+def encode_metadata_props(metadata_props: dict[str, str]) -> bytes:
+    """
+    キーと値の辞書を、ModelProto のトップレベルに追記できる metadata_props フィールドの列にエンコードする
+    Protobuf の repeated フィールドはメッセージ内のどこに出現してもよいため、既存の ModelProto の末尾にそのまま連結できる
+
+    Args:
+        metadata_props (dict[str, str]): metadata_props のキーと値の辞書
+
+    Returns:
+        bytes: metadata_props フィールド (タグと長さを含む) を連結したバイト列
+    """
+
+    encoded = bytearray()
+    for key, value in metadata_props.items():
+        key_bytes = key.encode('utf-8')
+        value_bytes = value.encode('utf-8')
+        # StringStringEntryProto: key (1) と value (2) を LEN 型で格納する
+        entry = (
+            encode_varint(1 << 3 | WIRE_TYPE_LEN)
+            + encode_varint(len(key_bytes))
+            + key_bytes
+            + encode_varint(2 << 3 | WIRE_TYPE_LEN)
+            + encode_varint(len(value_bytes))
+            + value_bytes
+        )
+        encoded += encode_varint(METADATA_PROPS_FIELD_NUMBER << 3 | WIRE_TYPE_LEN)
+        encoded += encode_varint(len(entry))
+        encoded += entry
+    return bytes(encoded)
@@ -0,0 +1,139 @@
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+
+from aivmlib import serialize_aivm_metadata
+from aivmlib.schemas.aivm_manifest import AivmManifestVoiceSample, AivmMetadata
+
+
+# AIVM メタデータを書き込む前に、AIVM マニフェストの意味を変えずにサイズを削減する最適化パス (オプトイン)
+# AIVM マニフェストはヘッダー (metadata_props) に格納され、AIVM メタデータを読み込むたびに全体を読み取り・パースする必要があるため、
+# 冗長なアイコン画像・ボイスサンプル音声を取り除くことで、あらゆる読み込み処理が高速になる
+
+# 削減バイト数を集計するフィールドの名前
+FIELD_STYLE_ICON = 'speakers[*].styles[*].icon'
+FIELD_VOICE_SAMPLES = 'speakers[*].styles[*].voice_samples'
+
+
+@dataclass
+class AivmManifestOptimizationReport:
+    """AIVM マニフェストの最適化の結果"""
+
+    # 最適化前のシリアライズ済み AIVM メタデータ全体のバイト数
+    metadata_size_before: int
+    # 最適化後のシリアライズ済み AIVM メタデータ全体のバイト数
+    metadata_size_after: int
+    # フィールドごとの削減バイト数
+    savings: dict[str, int] = field(default_factory=dict)
+    # 警告メッセージのリスト
+    warnings: list[str] = field(default_factory=list)
+
+    @property
+    def total_savings(self) -> int:
+        """最適化による削減バイト数の合計"""
+        return self.metadata_size_before - self.metadata_size_after
+
+
+def optimize_aivm_metadata(
+    aivm_metadata: AivmMetadata,
+    max_metadata_size: int | None = None,
+) -> tuple[AivmMetadata, AivmManifestOptimizationReport]:
+    """
+    AIVM マニフェストの意味を変えずに、シリアライズ後のサイズを削減した AIVM メタデータを返す
+    引数として受け取った AIVM メタデータは変更しない
+
+    - 話者のアイコン画像と同一のスタイルのアイコン画像は、省略 (None) して話者のアイコン画像を継承させる
+    - 同一スタイル内で音声ファイル・書き起こし文ともに同一のボイスサンプルは、1 つにまとめる
+
+    スタイル間で重複するボイスサンプルや、非圧縮の WAV 形式のボイスサンプルは、意味が変わる・エンコーダーが必要になるため
+    自動では変更せず、警告メッセージとして報告する
+
+    Args:
+        aivm_metadata (AivmMetadata): AIVM メタデータ
+        max_metadata_size (int | None): シリアライズ済み AIVM メタデータ全体のバイト数の目安 (超過した場合は警告する)
+
+    Returns:
+        tuple[AivmMetadata, AivmManifestOptimizationReport]: 最適化された AIVM メタデータと最適化の結果
+    """
+
+    metadata_size_before = _get_serialized_size(aivm_metadata)
+    manifest = aivm_metadata.manifest.model_copy(deep=True)
+    savings = {FIELD_STYLE_ICON: 0, FIELD_VOICE_SAMPLES: 0}
+    warnings: list[str] = []
+
+    for speaker in manifest.speakers:
+        for style in speaker.styles:
+            # 話者のアイコン画像と同一のスタイルのアイコン画像は省略する
+            if style.icon is not None and style.icon == speaker.icon:
+                savings[FIELD_STYLE_ICON] += _get_json_size(style.icon) - _get_json_size(None)
+                style.icon = None
+
+            # 同一スタイル内で完全に同一のボイスサンプルは 1 つにまとめる (最初に出現したものを残す)
+            seen_voice_samples: set[tuple[str, str]] = set()
+            voice_samples: list[AivmManifestVoiceSample] = []
+            for voice_sample in style.voice_samples:
+                voice_sample_key = (voice_sample.audio, voice_sample.transcript)
+                if voice_sample_key in seen_voice_samples:
+                    # 配列の区切り文字 (,) の分も削減される
+                    savings[FIELD_VOICE_SAMPLES] += len(voice_sample.model_dump_json().encode('utf-8')) + 1
+                    continue
+                seen_voice_samples.add(voice_sample_key)
+                voice_samples.append(voice_sample)
+            style.voice_samples = voice_samples
+
+    # スタイル間で重複するボイスサンプル・非圧縮の WAV 形式のボイスサンプルを報告する
+    audio_counter = Counter(
+        voice_sample.audio
+        for speaker in manifest.speakers
+        for style in speaker.styles
+        for voice_sample in {sample.audio: sample for sample in style.voice_samples}.values()
+    )
+    duplicated_audio_size = sum(len(audio) * (count - 1) for audio, count in audio_counter.items() if count > 1)
+    if duplicated_audio_size > 0:
+        warnings.append(
+            f'複数のスタイルで同一の音声ファイルがボイスサンプルとして使われています (重複分: {duplicated_audio_size} バイト)。'
+        )
+    wav_audio_size = sum(len(audio) for audio in audio_counter if audio.startswith('data:audio/wav;'))
+    if wav_audio_size > 0:
+        warnings.append(
+            f'非圧縮の WAV 形式のボイスサンプルが含まれています ({wav_audio_size} バイト)。M4A (AAC-LC) 形式に変換するとサイズを大幅に削減できます。'
+        )
+
+    optimized_metadata = AivmMetadata(
+        manifest=manifest,
+        # AIVM メタデータの書き込み時にハイパーパラメータが AIVM マニフェストに合わせて書き換えられるため、
+        # 引数として受け取った AIVM メタデータと共有しないようコピーする
+        hyper_parameters=aivm_metadata.hyper_parameters.model_copy(deep=True),
+        style_vectors=aivm_metadata.style_vectors,
+    )
+    metadata_size_after = _get_serialized_size(optimized_metadata)
+
+    # シリアライズ済み AIVM メタデータ全体のバイト数が目安を超えている場合は警告する
+    if max_metadata_size is not None and metadata_size_after > max_metadata_size:
+        warnings.append(
+            f'AIVM メタデータのサイズ ({metadata_size_after} バイト) が目安 ({max_metadata_size} バイト) を超えています。'
+        )
+
+    return optimized_metadata, AivmManifestOptimizationReport(
+        metadata_size_before=metadata_size_before,
+        metadata_size_after=metadata_size_after,
+        savings=savings,
+        warnings=warnings,
+    )
+
+
+def _get_serialized_size(aivm_metadata: AivmMetadata) -> int:
+    """
+    シリアライズ済み AIVM メタデータ全体 (キーと値の合計) のバイト数を求める内部メソッド
+    """
+
+    raw_metadata = serialize_aivm_metadata(aivm_metadata)
+    return sum(len(key.encode('utf-8')) + len(value.encode('utf-8')) for key, value in raw_metadata.items())
+
+
+def _get_json_size(value: str | None) -> int:
+    """
+    値を JSON としてシリアライズした際のバイト数を求める内部メソッド
+    """
+
+    return len(json.dumps(value, ensure_ascii=False).encode('utf-8'))
@@ -0,0 +1,426 @@
+import gzip
+import hashlib
+import json
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from pydantic import BaseModel, ValidationError
+
+from aivmlib import AivmValidationError, _read_aivm_header_bytes, validate_aivm_metadata
+from aivmlib.handle import AivmFile, AivmWriteStrategy, AivmxFile
+from aivmlib.json_scanner import iter_object_members, scan_json_paths
+from aivmlib.onnx_scanner import (
+    METADATA_LOCATOR_FIELD_NUMBER,
+    METADATA_PROPS_FIELD_NUMBER,
+    ProtobufScanError,
+    read_metadata_props,
+    scan_model_fields,
+)
+from aivmlib.schemas.aivm_manifest import AivmManifest, ModelFormat
+from aivmlib.schemas.style_bert_vits2 import StyleBertVITS2HyperParameters
+from aivmlib.utils import get_file_size, pread
+from aivmlib.virtual import AivmVirtualFile, _assemble_virtual_aivm_file, _assemble_virtual_aivmx_file
+from aivmlib.writer import atomic_output
+
+
+# 重み (Weight) 部分を変更せずに AIVM メタデータのみを更新した AIVM / AIVMX ファイルを、差分のみで配布するためのメタデータパッチ
+# パッチには変更されたメタデータ (AIVM マニフェストなどは JSON の差分) と、適用先のファイルの重み部分のダイジェスト (SHA-256) が前提条件として含まれる
+# 適用時は重み部分のダイジェストを検証した上で、ヘッダー (metadata_props) のみを上書き・差し替える
+
+# メタデータパッチのフォーマット名とバージョン
+PATCH_FORMAT = 'aivm-metadata-patch'
+PATCH_FORMAT_VERSION = 1
+
+# 重み部分のダイジェストを計算する際に、1 回に読み取るバイト数
+_DIGEST_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+# JSON の差分 (変更箇所のみ) として配布できるメタデータのキーと、差分の適用後に正規の文字列へ再シリアライズするためのスキーマ
+# AIVM マニフェストは Base64 のアイコン画像やボイスサンプル音声を含み巨大になりがちなため、誤字の修正程度であれば差分の方が遥かに小さい
+_JSON_DELTA_SCHEMAS: dict[str, type[BaseModel]] = {
+    'aivm_manifest': AivmManifest,
+    'aivm_hyper_parameters': StyleBertVITS2HyperParameters,
+}
+
+
+@dataclass(frozen=True)
+class AivmMetadataPatch:
+    """AIVM / AIVMX ファイルの AIVM メタデータのみを更新するためのメタデータパッチ"""
+
+    # 適用先のファイルのモデル形式 (Safetensors: AIVM / ONNX: AIVMX)
+    model_format: ModelFormat
+    # 適用先のファイルの重み部分の SHA-256 ダイジェスト (16 進数)
+    payload_sha256: str
+    # 値全体を置き換えるメタデータのキーと、更新後の値
+    metadata: dict[str, str]
+    # JSON の差分として更新するメタデータのキーと、差分の操作のリスト
+    # 操作は {"op": "replace", "path": [...], "value": ...} または {"op": "remove", "path": [...]} の形式
+    deltas: dict[str, list[dict[str, Any]]]
+    # パッチの適用によって変更されるメタデータ (更新後の値) 全体の SHA-256 ダイジェスト (16 進数)
+    # 差分の適用結果が作成元と完全に一致するかの検証に用いる
+    result_sha256: str
+
+    def to_bytes(self) -> bytes:
+        """
+        メタデータパッチを、gzip で圧縮した JSON 形式のバイト列にシリアライズする
+
+        Returns:
+            bytes: メタデータパッチのバイト列
+        """
+
+        patch_json = json.dumps(
+            {
+                'format': PATCH_FORMAT,
+                'version': PATCH_FORMAT_VERSION,
+                'model_format': self.model_format.value,
+                'payload_sha256': self.payload_sha256,
+                'result_sha256': self.result_sha256,
+                'metadata': self.metadata,
+                'deltas': self.deltas,
+            },
+            ensure_ascii=False,
+        )
+        # 再現性のあるバイト列となるよう、gzip ヘッダーの更新日時は 0 に固定する
+        return gzip.compress(patch_json.encode('utf-8'), mtime=0)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'AivmMetadataPatch':
+        """
+        gzip で圧縮した JSON 形式のバイト列からメタデータパッチを復元する
+
+        Args:
+            data (bytes): メタデータパッチのバイト列
+
+        Returns:
+            AivmMetadataPatch: メタデータパッチ
+
+        Raises:
+            AivmValidationError: メタデータパッチのフォーマットが不正な場合
+        """
+
+        try:
+            patch = json.loads(gzip.decompress(data).decode('utf-8'))
+        except (OSError, EOFError, zlib.error, UnicodeDecodeError, json.JSONDecodeError):
+            raise AivmValidationError('Failed to decode metadata patch.')
+        if not isinstance(patch, dict) or patch.get('format') != PATCH_FORMAT:
+            raise AivmValidationError('This file is not an AIVM metadata patch.')
+        if patch.get('version') != PATCH_FORMAT_VERSION:
+            raise AivmValidationError(f'Unsupported metadata patch version: {patch.get("version")}.')
+        try:
+            model_format = ModelFormat(patch.get('model_format'))
+        except ValueError:
+            raise AivmValidationError(f'Unsupported model format: {patch.get("model_format")}.')
+        metadata = patch.get('metadata')
+        deltas = patch.get('deltas')
+        if (
+            not isinstance(metadata, dict)
+            or not all(isinstance(value, str) for value in metadata.values())
+            or not isinstance(deltas, dict)
+            or not all(
+                key in _JSON_DELTA_SCHEMAS and isinstance(operations, list) for key, operations in deltas.items()
+            )
+            or not _is_sha256(patch.get('payload_sha256'))
+            or not _is_sha256(patch.get('result_sha256'))
+        ):
+            raise AivmValidationError('Invalid metadata patch format.')
+        return cls(
+            model_format=model_format,
+            payload_sha256=patch['payload_sha256'],
+            metadata=metadata,
+            deltas=deltas,
+            result_sha256=patch['result_sha256'],
+        )
+
+
+def compute_payload_digest(file: BinaryIO, model_format: ModelFormat) -> str:
+    """
+    AIVM / AIVMX ファイルの、AIVM メタデータ以外の部分 (重み部分) の SHA-256 ダイジェストを計算する
+    AIVM ファイルの場合はヘッダーのうち __metadata__ 以外のテンソル情報 (dtype・shape・data_offsets) とヘッダー以降のすべてのバイト列、
+    AIVMX ファイルの場合は metadata_props (とそのロケーター) 以外のすべてのトップレベルのフィールドが対象となる
+
+    Args:
+        file (BinaryIO): AIVM / AIVMX ファイル
+        model_format (ModelFormat): ファイルのモデル形式
+
+    Returns:
+        str: 重み部分の SHA-256 ダイジェスト (16 進数)
+
+    Raises:
+        AivmValidationError: ファイルのフォーマットが不正な場合
+    """
+
+    digest = _new_payload_digest(file, model_format)
+    for offset, length in _get_payload_ranges(file, model_format):
+        end = offset + length
+        while offset < end:
+            chunk = pread(file, min(_DIGEST_CHUNK_SIZE, end - offset), offset)
+            if not chunk:
+                raise AivmValidationError('The file was truncated while reading.')
+            digest.update(chunk)
+            offset += len(chunk)
+    return digest.hexdigest()
+
+
+def create_metadata_patch(old_file: BinaryIO, new_file: BinaryIO, model_format: ModelFormat) -> AivmMetadataPatch:
+    """
+    重み部分が同一で AIVM メタデータのみが異なる 2 つのバージョンの AIVM / AIVMX ファイルから、メタデータパッチを作成する
+
+    Args:
+        old_file (BinaryIO): 更新前の AIVM / AIVMX ファイル
+        new_file (BinaryIO): 更新後の AIVM / AIVMX ファイル
+        model_format (ModelFormat): ファイルのモデル形式
+
+    Returns:
+        AivmMetadataPatch: メタデータパッチ
+
+    Raises:
+        AivmValidationError: ファイルのフォーマットが不正・重み部分が異なる・更新後の AIVM メタデータのバリデーションに失敗した場合
+    """
+
+    # 重み部分が異なる場合は、メタデータのみのパッチでは更新できない
+    payload_sha256 = compute_payload_digest(old_file, model_format)
+    if compute_payload_digest(new_file, model_format) != payload_sha256:
+        raise AivmValidationError('The model payloads differ. A metadata-only patch cannot be created.')
+
+    # 更新後の AIVM メタデータが正しいことを確認する
+    old_metadata = _read_raw_metadata(old_file, model_format)
+    new_metadata = _read_raw_metadata(new_file, model_format)
+    validate_aivm_metadata(new_metadata)
+
+    # 変更されたキーと値のみをパッチに含める
+    changed_metadata = {key: value for key, value in new_metadata.items() if old_metadata.get(key) != value}
+
+    # AIVM マニフェストとハイパーパラメータは、可能であれば JSON の差分としてパッチに含める
+    ## 差分を適用して再シリアライズした結果が更新後の値と完全に一致しない場合は、値全体をパッチに含める
+    metadata: dict[str, str] = {}
+    deltas: dict[str, list[dict[str, Any]]] = {}
+    for key, value in changed_metadata.items():
+        if key in _JSON_DELTA_SCHEMAS and key in old_metadata:
+            try:
+                operations = _diff_json(json.loads(old_metadata[key]), json.loads(value))
+                if _apply_json_delta(key, old_metadata[key], operations) == value:
+                    deltas[key] = operations
+                    continue
+            except (json.JSONDecodeError, AivmValidationError):
+                pass
+        metadata[key] = value
+
+    return AivmMetadataPatch(
+        model_format=model_format,
+        payload_sha256=payload_sha256,
+        metadata=metadata,
+        deltas=deltas,
+        result_sha256=_hash_metadata(changed_metadata),
+    )
+
+
+def apply_metadata_patch(
+    model_path: Path,
+    patch: AivmMetadataPatch,
+    output_path: Path | None = None,
+) -> AivmWriteStrategy:
+    """
+    AIVM / AIVMX ファイルにメタデータパッチを適用する
+    重み部分のダイジェストがパッチの前提条件と一致することを検証した上で、変更されたメタデータのみを書き込む
+    出力先を省略した場合は AivmFile / AivmxFile と同様に、メタデータ部分のみの上書きか、重み部分のバイト範囲を連結した
+    一時ファイルによるアトミックな置き換えのうち、最も安価な方法で model_path を更新する
+    出力先を指定した場合は、メタデータ部分のみを差し替えたファイルを重み部分をメモリ上に読み込むことなく書き出す
+
+    Args:
+        model_path (Path): 適用先の AIVM / AIVMX ファイルのパス
+        patch (AivmMetadataPatch): メタデータパッチ
+        output_path (Path | None): 書き出し先のパス (省略時は model_path を更新する)
+
+    Returns:
+        AivmWriteStrategy: 書き込みに用いた方法
+
+    Raises:
+        AivmValidationError: ファイルのフォーマットが不正・重み部分のダイジェストが一致しない・
+            適用後の AIVM メタデータのバリデーションに失敗した場合
+    """
+
+    with model_path.open('rb') as model_file:
+        # 重み部分がパッチの作成元と同一であることを検証する
+        if compute_payload_digest(model_file, patch.model_format) != patch.payload_sha256:
+            raise AivmValidationError('The model payload does not match the metadata patch.')
+
+        # パッチの差分を適用し、変更されるメタデータの更新後の値を求める
+        metadata = _read_raw_metadata(model_file, patch.model_format)
+        changed_metadata = dict(patch.metadata)
+        for key, operations in patch.deltas.items():
+            if key not in metadata:
+                raise AivmValidationError(f'Metadata "{key}" to be patched is not found.')
+            changed_metadata[key] = _apply_json_delta(key, metadata[key], operations)
+        if _hash_metadata(changed_metadata) != patch.result_sha256:
+            raise AivmValidationError('The patched metadata does not match the metadata patch.')
+
+        # パッチを適用した後の AIVM メタデータが正しいことを、書き出す前に確認する
+        metadata.update(changed_metadata)
+        validate_aivm_metadata(metadata)
+
+        # 出力先を指定した場合は、変更されたキーのみを差し替えた仮想ファイルを一時ファイルに書き出してから置き換える
+        if output_path is not None:
+            virtual_file: AivmVirtualFile
+            if patch.model_format == ModelFormat.Safetensors:
+                virtual_file = _assemble_virtual_aivm_file(model_file, changed_metadata)
+            else:
+                virtual_file = _assemble_virtual_aivmx_file(model_file, changed_metadata)
+            with atomic_output(output_path) as output_file:
+                for chunk in virtual_file.iter_chunks():
+                    output_file.write(chunk)
+            return AivmWriteStrategy.Splice
+
+    # 出力先を省略した場合は、ハンドルを介して変更されたキーのみを書き込む
+    ## シリアライズ済みの値をそのまま書き込むため、パッチの作成元と同一のメタデータのバイト列となる
+    handle = AivmFile(model_path) if patch.model_format == ModelFormat.Safetensors else AivmxFile(model_path)
+    with handle:
+        return handle._write_metadata(changed_metadata)
+
+
+def _get_payload_ranges(file: BinaryIO, model_format: ModelFormat) -> list[tuple[int, int]]:
+    """
+    AIVM / AIVMX ファイルの、AIVM メタデータ以外の部分のバイト範囲 (オフセット, バイト数) を列挙する内部メソッド
+    """
+
+    if model_format == ModelFormat.Safetensors:
+        payload_offset = 8 + len(_read_aivm_header_bytes(file))
+        return [(payload_offset, get_file_size(file) - payload_offset)]
+
+    try:
+        fields = scan_model_fields(file)
+    except ProtobufScanError:
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+    # metadata_props の位置を示すロケーターは、メタデータの更新によって変わるため対象外とする
+    return [
+        (field.offset, field.end - field.offset)
+        for field in fields
+        if field.number not in (METADATA_PROPS_FIELD_NUMBER, METADATA_LOCATOR_FIELD_NUMBER)
+    ]
+
+
+def _new_payload_digest(file: BinaryIO, model_format: ModelFormat) -> 'hashlib._Hash':
+    """
+    重み部分のダイジェストを計算するための SHA-256 オブジェクトを、重み部分のバイト列を与える前の状態で返す内部メソッド
+    AIVM ファイルの Weight 部分はヘッダーのテンソル情報と組み合わせて初めて意味を持つため、テンソル情報を先に与えておく
+    (AIVMX ファイルはグラフ自体が重み部分のバイト範囲に含まれるため、何も与えない)
+    """
+
+    digest = hashlib.sha256()
+    if model_format == ModelFormat.Safetensors:
+        try:
+            header_text = _read_aivm_header_bytes(file).decode('utf-8')
+        except UnicodeDecodeError:
+            raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.')
+        digest.update(_encode_tensor_table(header_text))
+    return digest
+
+
+def _encode_tensor_table(header_text: str) -> bytes:
+    """
+    AIVM ファイルのヘッダー JSON のうち __metadata__ 以外のテンソル情報を、書式やキーの順序によらない正規形のバイト列にエンコードする内部メソッド
+    後続の Weight 部分のバイト列との境界が曖昧にならないよう、先頭にバイト数を付加する
+    """
+
+    try:
+        tensors = {
+            key: json.loads(header_text[value_start:value_end])
+            for key, _, value_start, value_end in iter_object_members(header_text)
+            if key != '__metadata__'
+        }
+    except ValueError:
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.')
+    tensor_table = json.dumps(tensors, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return len(tensor_table).to_bytes(8, 'little') + tensor_table
+
+
+def _read_raw_metadata(file: BinaryIO, model_format: ModelFormat) -> dict[str, str]:
+    """
+    AIVM / AIVMX ファイルから、シリアライズされたままのメタデータ (文字列から文字列へのマップ) を読み込む内部メソッド
+    """
+
+    if model_format == ModelFormat.Safetensors:
+        try:
+            header_text = _read_aivm_header_bytes(file).decode('utf-8')
+            values = scan_json_paths(header_text, ['__metadata__'])['__metadata__']
+        except (UnicodeDecodeError, ValueError):
+            raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.')
+        metadata = values[-1][1] if values else {}
+        if not isinstance(metadata, dict) or not all(isinstance(value, str) for value in metadata.values()):
+            raise AivmValidationError('Invalid AIVM metadata format.')
+        return metadata
+
+    try:
+        return read_metadata_props(file, scan_model_fields(file))
+    except ProtobufScanError:
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+
+
+def _diff_json(old: Any, new: Any, path: list[str | int] | None = None) -> list[dict[str, Any]]:
+    """
+    2 つの JSON 値の差分を、パスを指定した置換・削除の操作のリストとして求める内部メソッド
+    オブジェクトはキーごとに、要素数が同じ配列は要素ごとに再帰的に比較し、それ以外の変更は値全体の置換とする
+    """
+
+    path = [] if path is None else path
+    if isinstance(old, dict) and isinstance(new, dict):
+        operations: list[dict[str, Any]] = []
+        for key in old:
+            if key not in new:
+                operations.append({'op': 'remove', 'path': [*path, key]})
+        for key, value in new.items():
+            if key not in old:
+                operations.append({'op': 'replace', 'path': [*path, key], 'value': value})
+            elif old[key] != value:
+                operations.extend(_diff_json(old[key], value, [*path, key]))
+        return operations
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        operations = []
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            if old_item != new_item:
+                operations.extend(_diff_json(old_item, new_item, [*path, index]))
+        return operations
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+def _apply_json_delta(key: str, value: str, operations: list[dict[str, Any]]) -> str:
+    """
+    メタデータの値 (JSON 文字列) に差分の操作を適用し、スキーマに沿って正規の文字列へ再シリアライズする内部メソッド
+    """
+
+    try:
+        document: Any = json.loads(value)
+        for operation in operations:
+            path = operation['path']
+            if not path:
+                document = operation['value']
+                continue
+            parent = document
+            for token in path[:-1]:
+                parent = parent[token]
+            if operation['op'] == 'replace':
+                parent[path[-1]] = operation['value']
+            elif operation['op'] == 'remove':
+                del parent[path[-1]]
+            else:
+                raise AivmValidationError(f'Unsupported metadata patch operation: {operation["op"]}.')
+        return _JSON_DELTA_SCHEMAS[key].model_validate(document).model_dump_json()
+    except (json.JSONDecodeError, KeyError, IndexError, TypeError, ValidationError):
+        raise AivmValidationError(f'Failed to apply metadata patch to "{key}".')
+
+
+def _is_sha256(value: Any) -> bool:
+    """
+    値が 16 進数表記の SHA-256 ダイジェストかどうかを判定する内部メソッド
+    """
+
+    return isinstance(value, str) and len(value) == 64 and all(char in '0123456789abcdef' for char in value)
+
+
+def _hash_metadata(metadata: dict[str, str]) -> str:
+    """
+    メタデータの SHA-256 ダイジェストを、キーの順序によらず一意に計算する内部メソッド
+    """
+
+    return hashlib.sha256(json.dumps(metadata, sort_keys=True).encode('utf-8')).hexdigest()
@@ -0,0 +1,375 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from aivmlib import (
+    AivmValidationError,
+    _decode_aivm_header,
+    _read_aivm_header_bytes,
+    read_aivmx_metadata,
+    validate_aivm_metadata,
+)
+from aivmlib.onnx_scanner import ProtobufScanError, scan_model_fields
+from aivmlib.schemas.aivm_manifest import AivmMetadata
+
+
+# 多数の AIVM / AIVMX ファイルを切り替えながら推論するワーカー向けに、重み (Weight) 部分をページキャッシュに先読みしておくモデルプール
+# ヘッダーのパース結果から重みのバイト範囲を求め、バックグラウンドのスレッドで posix_fadvise(POSIX_FADV_WILLNEED) による先読みを要求した上で、
+# 重みを実際に読み取ってページキャッシュに載せる (先読みの完了時点で、重みがページキャッシュに載っていることを保証する)
+# 先読みした重みの合計バイト数が上限を超えた場合は、最も長く使われていないモデルから posix_fadvise(POSIX_FADV_DONTNEED) で解放する
+
+# ModelProto.graph のフィールド番号 (重みは graph.initializer に格納される)
+_GRAPH_FIELD_NUMBER = 7
+
+# 重みをページキャッシュに載せるために、1 回に読み取るバイト数
+_PREFETCH_READ_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class AivmPooledModel:
+    """モデルプールに格納された、AIVM / AIVMX ファイル 1 つ分の情報"""
+
+    # AIVM / AIVMX ファイルのパス
+    path: Path
+    # プールへの追加時点でのファイルの更新日時 (ナノ秒)
+    mtime_ns: int
+    # プールへの追加時点でのファイルサイズ
+    size: int
+    # パース済みの AIVM メタデータ
+    metadata: AivmMetadata
+    # ファイル内の重みのバイト範囲 (オフセット, バイト数) のリスト
+    payload_ranges: tuple[tuple[int, int], ...]
+
+    @property
+    def payload_size(self) -> int:
+        """重みの合計バイト数"""
+        return sum(length for _, length in self.payload_ranges)
+
+
+@dataclass(frozen=True)
+class AivmModelPoolStats:
+    """モデルプールの統計情報"""
+
+    # プールに格納済みのモデルを取得できた回数
+    hits: int
+    # プールに格納されておらず、ファイルを読み込んだ回数
+    misses: int
+    # 先読みバイト数の上限を超えたためにプールから解放したモデルの数
+    evictions: int
+    # 完了した先読みの回数
+    prefetches: int
+    # 先読みにかかった時間 (重みをすべて読み取ってページキャッシュに載せ終えるまでの時間) の合計 (秒)
+    prefetch_seconds_total: float
+    # 先読みにかかった時間 (重みをすべて読み取ってページキャッシュに載せ終えるまでの時間) の最大値 (秒)
+    prefetch_seconds_max: float
+    # プールに格納されているモデルの数
+    model_count: int
+    # プールに格納されているモデルの重みの合計バイト数
+    resident_bytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        """プールに格納済みのモデルを取得できた割合"""
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    @property
+    def prefetch_seconds_average(self) -> float:
+        """先読みにかかった時間の平均値 (秒)"""
+        return self.prefetch_seconds_total / self.prefetches if self.prefetches > 0 else 0.0
+
+
+class AivmModelPool:
+    """
+    AIVM / AIVMX ファイルの AIVM メタデータと重みのバイト範囲を保持し、重みをページキャッシュに先読みするモデルプール
+    先読みした重みの合計バイト数が max_resident_bytes を超えた場合は、LRU で古いモデルからページキャッシュを解放する (スレッドセーフ)
+    重みを外部データ (External Data) として別ファイルに保存した AIVMX ファイルの場合、外部データファイルは先読みの対象外となる
+    """
+
+    def __init__(self, max_resident_bytes: int, max_workers: int = 4) -> None:
+        """
+        Args:
+            max_resident_bytes (int): ページキャッシュに先読みしておく重みの合計バイト数の上限
+            max_workers (int): 先読みを並列に行うスレッド数
+        """
+
+        self.max_resident_bytes = max_resident_bytes
+        self._models: OrderedDict[Path, AivmPooledModel] = OrderedDict()
+        self._prefetch_futures: dict[Path, Future[AivmPooledModel]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='aivmlib-pool')
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._prefetches = 0
+        self._prefetch_seconds_total = 0.0
+        self._prefetch_seconds_max = 0.0
+
+    def get(self, path: Path) -> AivmPooledModel:
+        """
+        指定されたファイルをモデルプールから取得する
+        プールに格納されていない・ファイルが更新されている場合は、ファイルを読み込んでプールに追加し、重みの先読みを開始する
+        先読みの完了は待たずに返る
+
+        Args:
+            path (Path): AIVM / AIVMX ファイルのパス
+
+        Returns:
+            AivmPooledModel: モデルプールに格納されたモデルの情報
+
+        Raises:
+            AivmValidationError: AIVM / AIVMX ファイルのフォーマットが不正・AIVM メタデータのバリデーションに失敗した場合
+            OSError: ファイルが存在しない・読み込めない場合
+        """
+
+        model, _ = self._get_with_future(path)
+        return model
+
+    def prefetch(self, path: Path) -> Future[AivmPooledModel]:
+        """
+        指定されたファイルをモデルプールに追加し、重みの先読みを開始する
+        次に使われることが分かっているモデルを、切り替えより前に温めておく用途を想定している
+        ヘッダーのパースのみ呼び出し元のスレッドで行い、重みの先読みはバックグラウンドで行う
+
+        Args:
+            path (Path): AIVM / AIVMX ファイルのパス
+
+        Returns:
+            Future[AivmPooledModel]: 重みの先読みが完了すると、モデルプールに格納されたモデルの情報が設定される Future
+
+        Raises:
+            AivmValidationError: AIVM / AIVMX ファイルのフォーマットが不正・AIVM メタデータのバリデーションに失敗した場合
+            OSError: ファイルが存在しない・読み込めない場合
+        """
+
+        _, future = self._get_with_future(path)
+        return future
+
+    def wait(self, path: Path, timeout: float | None = None) -> None:
+        """
+        指定されたファイルの重みの先読みが完了するまで待機する (プールに格納されていない場合は何もしない)
+
+        Args:
+            path (Path): AIVM / AIVMX ファイルのパス
+            timeout (float | None): 待機する最大秒数 (省略時は無制限)
+        """
+
+        path = Path(os.path.abspath(path))
+        with self._lock:
+            future = self._prefetch_futures.get(path)
+        if future is not None:
+            future.result(timeout=timeout)
+
+    def evict(self, path: Path) -> None:
+        """
+        指定されたファイルをモデルプールから取り除き、重みをページキャッシュから解放する
+
+        Args:
+            path (Path): AIVM / AIVMX ファイルのパス
+        """
+
+        path = Path(os.path.abspath(path))
+        with self._lock:
+            model = self._models.pop(path, None)
+            self._prefetch_futures.pop(path, None)
+        if model is not None:
+            _advise_ranges(model, willneed=False)
+
+    def stats(self) -> AivmModelPoolStats:
+        """
+        モデルプールの統計情報を取得する
+
+        Returns:
+            AivmModelPoolStats: モデルプールの統計情報
+        """
+
+        with self._lock:
+            return AivmModelPoolStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                prefetches=self._prefetches,
+                prefetch_seconds_total=self._prefetch_seconds_total,
+                prefetch_seconds_max=self._prefetch_seconds_max,
+                model_count=len(self._models),
+                resident_bytes=sum(model.payload_size for model in self._models.values()),
+            )
+
+    def close(self) -> None:
+        """
+        先読み用のスレッドを停止する (ページキャッシュはそのまま残る)
+        """
+
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> 'AivmModelPool':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def _get_with_future(self, path: Path) -> tuple[AivmPooledModel, Future[AivmPooledModel]]:
+        """
+        モデルプールからモデルを取得し (格納されていなければ追加し)、その重みの先読みの Future とともに返す内部メソッド
+        モデルと Future は同じロックの中で取り出すため、並行して他のモデルが追加され解放された場合でも、両者は常に対応する
+        """
+
+        path = Path(os.path.abspath(path))
+        stat = path.stat()
+        with self._lock:
+            model = self._models.get(path)
+            if model is not None and model.mtime_ns == stat.st_mtime_ns and model.size == stat.st_size:
+                self._models.move_to_end(path)
+                self._hits += 1
+                return model, self._prefetch_futures[path]
+            self._misses += 1
+
+        # ロックの外でヘッダーをパースし、プールに追加する
+        model = _load_pooled_model(path, stat.st_mtime_ns, stat.st_size)
+        return model, self._admit(model)
+
+    def _admit(self, model: AivmPooledModel) -> Future[AivmPooledModel]:
+        """
+        モデルをプールに追加して重みの先読みを開始し、上限を超えた分の古いモデルを解放する内部メソッド
+        追加したモデルの重みの先読みの Future を返す
+        """
+
+        evicted: list[AivmPooledModel] = []
+        with self._lock:
+            self._models[model.path] = model
+            self._models.move_to_end(model.path)
+            # 追加したモデル自体は、単体で上限を超える場合でも解放しない
+            resident_bytes = sum(pooled.payload_size for pooled in self._models.values())
+            while resident_bytes > self.max_resident_bytes and len(self._models) > 1:
+                _, oldest = self._models.popitem(last=False)
+                self._prefetch_futures.pop(oldest.path, None)
+                resident_bytes -= oldest.payload_size
+                evicted.append(oldest)
+                self._evictions += 1
+            future = self._executor.submit(self._prefetch, model)
+            self._prefetch_futures[model.path] = future
+
+        for oldest in evicted:
+            _advise_ranges(oldest, willneed=False)
+        return future
+
+    def _prefetch(self, model: AivmPooledModel) -> AivmPooledModel:
+        """
+        重みをすべて読み取ってページキャッシュに載せ、かかった時間を統計情報に記録する内部メソッド
+        """
+
+        start = time.perf_counter()
+        _advise_ranges(model, willneed=True)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._prefetches += 1
+            self._prefetch_seconds_total += elapsed
+            self._prefetch_seconds_max = max(self._prefetch_seconds_max, elapsed)
+        return model
+
+
+def _load_pooled_model(path: Path, mtime_ns: int, size: int) -> AivmPooledModel:
+    """
+    AIVM / AIVMX ファイルのヘッダーのみをパースし、AIVM メタデータと重みのバイト範囲を取得する内部メソッド
+    """
+
+    with path.open('rb') as file:
+        if path.suffix == '.aivmx':
+            metadata = read_aivmx_metadata(file)
+            # 重み (graph.initializer) を含む ModelProto.graph フィールドの範囲を重みのバイト範囲とする
+            try:
+                fields = scan_model_fields(file)
+            except ProtobufScanError:
+                raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+            ranges = [
+                (field.value_offset, field.end - field.value_offset)
+                for field in fields
+                if field.number == _GRAPH_FIELD_NUMBER
+            ]
+        else:
+            # ヘッダーを 1 度だけパースし、AIVM メタデータとテンソルのバイト範囲の両方を取り出す
+            header_bytes = _read_aivm_header_bytes(file)
+            header = _decode_aivm_header(header_bytes)
+            if not isinstance(header, dict):
+                raise AivmValidationError(
+                    'Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.'
+                )
+            metadata = validate_aivm_metadata(header.get('__metadata__'))
+            payload_offset = 8 + len(header_bytes)
+            ranges = []
+            for name, tensor in header.items():
+                if name == '__metadata__':
+                    continue
+                try:
+                    begin, end = tensor['data_offsets']
+                except (TypeError, KeyError, ValueError):
+                    raise AivmValidationError(f'Invalid tensor entry: {name}.')
+                # bool は int のサブクラスのため、明示的に除外する
+                if (
+                    not isinstance(begin, int)
+                    or not isinstance(end, int)
+                    or isinstance(begin, bool)
+                    or isinstance(end, bool)
+                    or not 0 <= begin <= end
+                ):
+                    raise AivmValidationError(f'Invalid tensor entry: {name}.')
+                ranges.append((payload_offset + begin, end - begin))
+
+    return AivmPooledModel(
+        path=path,
+        mtime_ns=mtime_ns,
+        size=size,
+        metadata=metadata,
+        payload_ranges=_merge_ranges(ranges),
+    )
+
+
+def _merge_ranges(ranges: list[tuple[int, int]]) -> tuple[tuple[int, int], ...]:
+    """
+    バイト範囲 (オフセット, バイト数) のリストをオフセット順に並べ、隣接・重複する範囲を 1 つにまとめる内部メソッド
+    """
+
+    merged: list[tuple[int, int]] = []
+    for offset, length in sorted(range_ for range_ in ranges if range_[1] > 0):
+        if merged and offset <= merged[-1][0] + merged[-1][1]:
+            last_offset, last_length = merged[-1]
+            merged[-1] = (last_offset, max(last_length, offset + length - last_offset))
+        else:
+            merged.append((offset, length))
+    return tuple(merged)
+
+
+def _advise_ranges(model: AivmPooledModel, willneed: bool) -> None:
+    """
+    重みのバイト範囲をページキャッシュに載せる (willneed=True) または解放する内部メソッド
+    先読みの場合は、posix_fadvise(POSIX_FADV_WILLNEED) ですべての範囲の非同期な先読みを要求してカーネルに並列に読み込ませた上で、
+    重みを実際に読み取り、戻った時点ですべての範囲がページキャッシュに載っているようにする
+    """
+
+    try:
+        fd = os.open(model.path, os.O_RDONLY)
+    except OSError:
+        # 既にファイルが削除されている場合などは、先読み・解放の対象がないため何もしない
+        return
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            advice = os.POSIX_FADV_WILLNEED if willneed else os.POSIX_FADV_DONTNEED
+            for offset, length in model.payload_ranges:
+                os.posix_fadvise(fd, offset, length, advice)
+        if willneed:
+            buffer = bytearray(_PREFETCH_READ_SIZE)
+            with os.fdopen(fd, 'rb', buffering=0, closefd=False) as file:
+                for offset, length in model.payload_ranges:
+                    file.seek(offset)
+                    remaining = length
+                    while remaining > 0:
+                        read_size = file.readinto(memoryview(buffer)[: min(remaining, len(buffer))])
+                        if not read_size:
+                            break
+                        remaining -= read_size
+    finally:
+        os.close(fd)
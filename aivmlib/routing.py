@@ -0,0 +1,437 @@
+import hashlib
+import struct
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from uuid import UUID
+
+from aivmlib import AivmValidationError
+from aivmlib.schemas.aivm_manifest import AivmMetadata
+
+
+# 推論サーバー向けに、(モデル UUID, 話者 UUID, スタイルのローカル ID) から spk2id / style2id の ID とスタイルベクトルの行を引くためのルーティングテーブル
+# 読み込んだ全モデルの話者・スタイルを 1 つのバイト列に詰め込み、ハッシュテーブルも含めて配列として保持する
+# バイト列をそのまま共有メモリや mmap に載せれば、ワーカープロセス間でデシリアライズすることなく共有できる
+
+# グローバルスタイル ID の下位ビットに格納するスタイルのローカル ID のビット数 (AivmManifestSpeakerStyle.local_id は 0 ~ 31)
+STYLE_LOCAL_ID_BITS = 5
+
+# グローバルスタイル ID の上位ビットに格納する、話者 UUID のハッシュ値のビット数
+# グローバルスタイル ID 全体が JSON 経由で受け渡しても (JavaScript の Number でも) 正確に表現できる 53 ビットに収まるよう、53 - 5 = 48 ビットとする
+## 異なる話者のハッシュ値が衝突する確率は、話者数 n に対しておよそ n^2 / 2^49 となる (1 万話者で約 2 × 10^-7、100 万話者でも約 0.2 %)
+## 32bit に収まる 26 ビットでは、1 万話者程度で衝突する確率が約 50 % に達してしまう
+SPEAKER_HASH_BITS = 48
+
+# バイト列の先頭に格納するマジックナンバーとフォーマットバージョン
+_MAGIC = b'AIVMRT\x00\x02'
+
+# バイト列の各領域のレイアウト
+## ヘッダー: マジックナンバー, モデル数, 話者数, スタイル数, 話者ハッシュテーブルのスロット数, スタイルハッシュテーブルのスロット数
+_HEADER_STRUCT = struct.Struct('<8s5I')
+## モデル: モデル UUID
+_MODEL_STRUCT = struct.Struct('<16s')
+## 話者: 話者 UUID, モデルのインデックス, 話者のローカル ID (spk2id の ID), 話者 UUID のハッシュ値
+_SPEAKER_STRUCT = struct.Struct('<16sIIQ')
+## スタイル: グローバルスタイル ID, 話者のインデックス, スタイルのローカル ID (style2id の ID), スタイルベクトルの行
+_STYLE_STRUCT = struct.Struct('<QIII')
+## ハッシュテーブルのスロット: 話者またはスタイルのインデックス (空きスロットは 0xFFFFFFFF)
+_SLOT_STRUCT = struct.Struct('<I')
+_EMPTY_SLOT = 0xFFFFFFFF
+
+
+@dataclass(frozen=True)
+class AivmStyleRoute:
+    """ルーティングテーブルから引いた、1 つのスタイルの推論に必要な情報"""
+
+    # グローバルスタイル ID (読み込んだ全モデルを通して一意な、安定したスタイル ID)
+    global_style_id: int
+    # 音声合成モデルの UUID
+    model_uuid: UUID
+    # 話者の UUID
+    speaker_uuid: UUID
+    # 話者のローカル ID (ハイパーパラメータの spk2id の ID)
+    speaker_local_id: int
+    # スタイルのローカル ID (ハイパーパラメータの style2id の ID)
+    style_local_id: int
+    # スタイルベクトルの行のインデックス
+    style_vector_row: int
+
+
+def compute_global_style_id(speaker_uuid: UUID, style_local_id: int) -> int:
+    """
+    話者 UUID とスタイルのローカル ID から、グローバルスタイル ID を算出する
+    話者 UUID の SHA-256 ハッシュ値の下位 48 ビットを上位に、スタイルのローカル ID を下位 5 ビットに格納した、
+    53 ビットの非負整数となる (プロセスや実行環境によらず常に同じ値となる)
+
+    Args:
+        speaker_uuid (UUID): 話者の UUID
+        style_local_id (int): スタイルのローカル ID (0 ~ 31)
+
+    Returns:
+        int: グローバルスタイル ID
+    """
+
+    if not 0 <= style_local_id < (1 << STYLE_LOCAL_ID_BITS):
+        raise ValueError(f'Style local ID must be between 0 and {(1 << STYLE_LOCAL_ID_BITS) - 1}.')
+    return _hash_speaker_uuid(speaker_uuid) << STYLE_LOCAL_ID_BITS | style_local_id
+
+
+class AivmRoutingTable:
+    """
+    読み込んだ全モデルの話者・スタイルを、O(1) で引けるようにしたイミュータブルなルーティングテーブル
+    テーブル全体は 1 つの連続したバイト列 (オープンアドレス法のハッシュテーブルを含む) として保持され、
+    to_bytes() で得たバイト列を from_bytes() に渡せば、別プロセスでもデシリアライズなしにそのまま参照できる
+    """
+
+    def __init__(self, buffer: bytes | bytearray | memoryview) -> None:
+        """
+        Args:
+            buffer (bytes | bytearray | memoryview): to_bytes() で得たルーティングテーブルのバイト列
+
+        Raises:
+            AivmValidationError: バイト列のフォーマットが不正な場合
+        """
+
+        self._buffer = memoryview(buffer).cast('B')
+        if len(self._buffer) < _HEADER_STRUCT.size:
+            raise AivmValidationError('Invalid routing table format.')
+        magic, model_count, speaker_count, style_count, speaker_slot_count, style_slot_count = (
+            _HEADER_STRUCT.unpack_from(self._buffer, 0)
+        )
+        if magic != _MAGIC:
+            raise AivmValidationError('Invalid routing table format.')
+        self._model_count = model_count
+        self._speaker_count = speaker_count
+        self._style_count = style_count
+        self._speaker_slot_count = speaker_slot_count
+        self._style_slot_count = style_slot_count
+
+        # 各領域の開始オフセットを求める
+        self._models_offset = _HEADER_STRUCT.size
+        self._speakers_offset = self._models_offset + model_count * _MODEL_STRUCT.size
+        self._styles_offset = self._speakers_offset + speaker_count * _SPEAKER_STRUCT.size
+        self._speaker_slots_offset = self._styles_offset + style_count * _STYLE_STRUCT.size
+        self._style_slots_offset = self._speaker_slots_offset + speaker_slot_count * _SLOT_STRUCT.size
+        end = self._style_slots_offset + style_slot_count * _SLOT_STRUCT.size
+        if (
+            len(self._buffer) < end
+            or not _is_power_of_two(speaker_slot_count)
+            or not _is_power_of_two(style_slot_count)
+        ):
+            raise AivmValidationError('Invalid routing table format.')
+        if speaker_slot_count <= speaker_count or style_slot_count <= style_count:
+            raise AivmValidationError('Invalid routing table format.')
+
+    @classmethod
+    def build(cls, metadata_list: Iterable[AivmMetadata]) -> 'AivmRoutingTable':
+        """
+        AIVM メタデータのリストからルーティングテーブルを構築する
+
+        Args:
+            metadata_list (Iterable[AivmMetadata]): 読み込んだ音声合成モデルの AIVM メタデータ
+
+        Returns:
+            AivmRoutingTable: ルーティングテーブル
+
+        Raises:
+            AivmValidationError: モデル UUID や話者 UUID が重複している・異なる話者のグローバルスタイル ID が衝突した場合
+        """
+
+        model_uuids: list[UUID] = []
+        speakers: list[tuple[UUID, int, int, int]] = []
+        styles: list[tuple[int, int, int, int]] = []
+        speaker_indexes_by_hash: dict[int, int] = {}
+
+        for metadata in metadata_list:
+            manifest = metadata.manifest
+            if manifest.uuid in model_uuids:
+                raise AivmValidationError(f'Duplicate model UUID: {manifest.uuid}.')
+            model_index = len(model_uuids)
+            model_uuids.append(manifest.uuid)
+
+            for speaker in manifest.speakers:
+                speaker_hash = _hash_speaker_uuid(speaker.uuid)
+                # 同一の話者 UUID が複数のモデルに含まれる場合や、異なる話者 UUID のハッシュ値が衝突した場合は、
+                # グローバルスタイル ID から話者を一意に特定できなくなるためエラーとする
+                if speaker_hash in speaker_indexes_by_hash:
+                    other_uuid = speakers[speaker_indexes_by_hash[speaker_hash]][0]
+                    if other_uuid == speaker.uuid:
+                        raise AivmValidationError(f'Duplicate speaker UUID: {speaker.uuid}.')
+                    raise AivmValidationError(
+                        f'Global style ID collision between speakers {other_uuid} and {speaker.uuid}.'
+                    )
+                speaker_index = len(speakers)
+                speaker_indexes_by_hash[speaker_hash] = speaker_index
+                speakers.append((speaker.uuid, model_index, speaker.local_id, speaker_hash))
+
+                style_local_ids: set[int] = set()
+                for style in speaker.styles:
+                    if style.local_id in style_local_ids:
+                        raise AivmValidationError(
+                            f'Duplicate style local ID {style.local_id} in speaker {speaker.uuid}.'
+                        )
+                    style_local_ids.add(style.local_id)
+                    # Style-Bert-VITS2 系のモデルでは、スタイルベクトルの行はスタイルのローカル ID (style2id の ID) と一致する
+                    styles.append(
+                        (
+                            speaker_hash << STYLE_LOCAL_ID_BITS | style.local_id,
+                            speaker_index,
+                            style.local_id,
+                            style.local_id,
+                        )
+                    )
+
+        # ハッシュテーブルのスロット数は、負荷率が 0.5 以下となる 2 の累乗とする
+        speaker_slot_count = _slot_count_for(len(speakers))
+        style_slot_count = _slot_count_for(len(styles))
+
+        buffer = bytearray(
+            _HEADER_STRUCT.size
+            + len(model_uuids) * _MODEL_STRUCT.size
+            + len(speakers) * _SPEAKER_STRUCT.size
+            + len(styles) * _STYLE_STRUCT.size
+            + (speaker_slot_count + style_slot_count) * _SLOT_STRUCT.size
+        )
+        _HEADER_STRUCT.pack_into(
+            buffer, 0, _MAGIC, len(model_uuids), len(speakers), len(styles), speaker_slot_count, style_slot_count
+        )
+        offset = _HEADER_STRUCT.size
+        for model_uuid in model_uuids:
+            _MODEL_STRUCT.pack_into(buffer, offset, model_uuid.bytes)
+            offset += _MODEL_STRUCT.size
+        for speaker_uuid, model_index, local_id, speaker_hash in speakers:
+            _SPEAKER_STRUCT.pack_into(buffer, offset, speaker_uuid.bytes, model_index, local_id, speaker_hash)
+            offset += _SPEAKER_STRUCT.size
+        for style in styles:
+            _STYLE_STRUCT.pack_into(buffer, offset, *style)
+            offset += _STYLE_STRUCT.size
+
+        # 話者 UUID のハッシュ値・グローバルスタイル ID をキーとするハッシュテーブルを構築する
+        speaker_slots_offset = offset
+        style_slots_offset = speaker_slots_offset + speaker_slot_count * _SLOT_STRUCT.size
+        buffer[speaker_slots_offset:] = b'\xff' * (len(buffer) - speaker_slots_offset)
+        for index, (_, _, _, speaker_hash) in enumerate(speakers):
+            _insert_slot(buffer, speaker_slots_offset, speaker_slot_count, speaker_hash, index)
+        for index, (global_style_id, _, _, _) in enumerate(styles):
+            _insert_slot(buffer, style_slots_offset, style_slot_count, global_style_id, index)
+
+        return cls(bytes(buffer))
+
+    @classmethod
+    def from_bytes(cls, buffer: bytes | bytearray | memoryview) -> 'AivmRoutingTable':
+        """
+        to_bytes() で得たバイト列から、コピーすることなくルーティングテーブルを復元する
+        multiprocessing.shared_memory.SharedMemory.buf や mmap も指定できる
+
+        Args:
+            buffer (bytes | bytearray | memoryview): ルーティングテーブルのバイト列
+
+        Returns:
+            AivmRoutingTable: ルーティングテーブル
+
+        Raises:
+            AivmValidationError: バイト列のフォーマットが不正な場合
+        """
+
+        return cls(buffer)
+
+    def to_bytes(self) -> bytes:
+        """
+        ルーティングテーブルをバイト列として取得する
+
+        Returns:
+            bytes: ルーティングテーブルのバイト列
+        """
+
+        return bytes(self._buffer[: self._style_slots_offset + self._style_slot_count * _SLOT_STRUCT.size])
+
+    def __len__(self) -> int:
+        return self._style_count
+
+    @property
+    def model_count(self) -> int:
+        """ルーティングテーブルに含まれる音声合成モデルの数"""
+        return self._model_count
+
+    @property
+    def speaker_count(self) -> int:
+        """ルーティングテーブルに含まれる話者の数"""
+        return self._speaker_count
+
+    def get_speaker_local_id(self, speaker_uuid: UUID) -> int | None:
+        """
+        話者 UUID から、話者のローカル ID (ハイパーパラメータの spk2id の ID) を取得する
+
+        Args:
+            speaker_uuid (UUID): 話者の UUID
+
+        Returns:
+            int | None: 話者のローカル ID (話者が存在しない場合は None)
+        """
+
+        speaker_index = self._find_speaker(speaker_uuid)
+        if speaker_index is None:
+            return None
+        return _SPEAKER_STRUCT.unpack_from(self._buffer, self._speakers_offset + speaker_index * _SPEAKER_STRUCT.size)[
+            2
+        ]
+
+    def get_style(self, global_style_id: int) -> AivmStyleRoute | None:
+        """
+        グローバルスタイル ID から、スタイルの推論に必要な情報を取得する
+
+        Args:
+            global_style_id (int): グローバルスタイル ID
+
+        Returns:
+            AivmStyleRoute | None: スタイルの推論に必要な情報 (スタイルが存在しない場合は None)
+        """
+
+        if not 0 <= global_style_id < (1 << (SPEAKER_HASH_BITS + STYLE_LOCAL_ID_BITS)):
+            return None
+        style_index = self._find_slot(
+            self._style_slots_offset, self._style_slot_count, global_style_id, self._style_key, self._style_count
+        )
+        if style_index is None:
+            return None
+        return self._build_route(style_index)
+
+    def resolve(self, model_uuid: UUID, speaker_uuid: UUID, style_local_id: int) -> AivmStyleRoute | None:
+        """
+        (モデル UUID, 話者 UUID, スタイルのローカル ID) から、スタイルの推論に必要な情報を取得する
+
+        Args:
+            model_uuid (UUID): 音声合成モデルの UUID
+            speaker_uuid (UUID): 話者の UUID
+            style_local_id (int): スタイルのローカル ID
+
+        Returns:
+            AivmStyleRoute | None: スタイルの推論に必要な情報 (指定したモデルに該当する話者・スタイルが存在しない場合は None)
+        """
+
+        if not 0 <= style_local_id < (1 << STYLE_LOCAL_ID_BITS):
+            return None
+        route = self.get_style(compute_global_style_id(speaker_uuid, style_local_id))
+        if route is None or route.speaker_uuid != speaker_uuid or route.model_uuid != model_uuid:
+            return None
+        return route
+
+    def __iter__(self) -> Iterator[AivmStyleRoute]:
+        for style_index in range(self._style_count):
+            yield self._build_route(style_index)
+
+    def _find_speaker(self, speaker_uuid: UUID) -> int | None:
+        """
+        話者 UUID に対応する話者のインデックスを、ハッシュテーブルから探す内部メソッド
+        """
+
+        speaker_hash = _hash_speaker_uuid(speaker_uuid)
+        speaker_index = self._find_slot(
+            self._speaker_slots_offset, self._speaker_slot_count, speaker_hash, self._speaker_key, self._speaker_count
+        )
+        if speaker_index is None:
+            return None
+        offset = self._speakers_offset + speaker_index * _SPEAKER_STRUCT.size
+        if bytes(self._buffer[offset : offset + 16]) != speaker_uuid.bytes:
+            return None
+        return speaker_index
+
+    def _find_slot(
+        self,
+        slots_offset: int,
+        slot_count: int,
+        key: int,
+        key_of: Callable[[int], int],
+        count: int,
+    ) -> int | None:
+        """
+        オープンアドレス法 (線形探索) のハッシュテーブルから、キーに対応するインデックスを探す内部メソッド
+        """
+
+        slot = _slot_of(key, slot_count)
+        # 不正なバイト列で無限ループに陥らないよう、探索回数はスロット数までに制限する
+        for _ in range(slot_count):
+            (index,) = _SLOT_STRUCT.unpack_from(self._buffer, slots_offset + slot * _SLOT_STRUCT.size)
+            if index == _EMPTY_SLOT or index >= count:
+                return None
+            if key_of(index) == key:
+                return index
+            slot = (slot + 1) & (slot_count - 1)
+        return None
+
+    def _speaker_key(self, speaker_index: int) -> int:
+        return _SPEAKER_STRUCT.unpack_from(self._buffer, self._speakers_offset + speaker_index * _SPEAKER_STRUCT.size)[
+            3
+        ]
+
+    def _style_key(self, style_index: int) -> int:
+        return _STYLE_STRUCT.unpack_from(self._buffer, self._styles_offset + style_index * _STYLE_STRUCT.size)[0]
+
+    def _build_route(self, style_index: int) -> AivmStyleRoute:
+        """
+        スタイルのインデックスから AivmStyleRoute を構築する内部メソッド
+        """
+
+        global_style_id, speaker_index, style_local_id, style_vector_row = _STYLE_STRUCT.unpack_from(
+            self._buffer, self._styles_offset + style_index * _STYLE_STRUCT.size
+        )
+        speaker_uuid_bytes, model_index, speaker_local_id, _ = _SPEAKER_STRUCT.unpack_from(
+            self._buffer, self._speakers_offset + speaker_index * _SPEAKER_STRUCT.size
+        )
+        (model_uuid_bytes,) = _MODEL_STRUCT.unpack_from(
+            self._buffer, self._models_offset + model_index * _MODEL_STRUCT.size
+        )
+        return AivmStyleRoute(
+            global_style_id=global_style_id,
+            model_uuid=UUID(bytes=model_uuid_bytes),
+            speaker_uuid=UUID(bytes=speaker_uuid_bytes),
+            speaker_local_id=speaker_local_id,
+            style_local_id=style_local_id,
+            style_vector_row=style_vector_row,
+        )
+
+
+def _hash_speaker_uuid(speaker_uuid: UUID) -> int:
+    """
+    話者 UUID から、グローバルスタイル ID の上位ビットに格納する 48 ビットのハッシュ値を算出する内部メソッド
+    """
+
+    digest = hashlib.sha256(speaker_uuid.bytes).digest()
+    return int.from_bytes(digest[:8], 'little') & ((1 << SPEAKER_HASH_BITS) - 1)
+
+
+def _slot_of(key: int, slot_count: int) -> int:
+    """
+    キーからハッシュテーブルの初期スロットを求める内部メソッド (Fibonacci hashing)
+    """
+
+    return ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> (64 - (slot_count.bit_length() - 1)) & (slot_count - 1)
+
+
+def _slot_count_for(count: int) -> int:
+    """
+    要素数から、負荷率が 0.5 以下となる 2 の累乗のスロット数を求める内部メソッド
+    """
+
+    slot_count = 2
+    while slot_count < count * 2:
+        slot_count *= 2
+    return slot_count
+
+
+def _insert_slot(buffer: bytearray, slots_offset: int, slot_count: int, key: int, index: int) -> None:
+    """
+    オープンアドレス法 (線形探索) のハッシュテーブルに、キーに対応するインデックスを挿入する内部メソッド
+    """
+
+    slot = _slot_of(key, slot_count)
+    while _SLOT_STRUCT.unpack_from(buffer, slots_offset + slot * _SLOT_STRUCT.size)[0] != _EMPTY_SLOT:
+        slot = (slot + 1) & (slot_count - 1)
+    _SLOT_STRUCT.pack_into(buffer, slots_offset + slot * _SLOT_STRUCT.size, index)
+
+
+def _is_power_of_two(value: int) -> bool:
+    """
+    値が 2 の累乗かどうかを判定する内部メソッド
+    """
+
+    return value > 0 and value & (value - 1) == 0
@@ -1,8 +1,8 @@
 from __future__ import annotations
 
 import sys
-from dataclasses import dataclass
-from typing import Annotated, Literal
+from dataclasses import dataclass, field
+from typing import Annotated, Any, Literal
 from uuid import UUID
 
 from pydantic import BaseModel, ConfigDict, Field, StringConstraints
@@ -41,6 +41,9 @@ class AivmMetadata:
     hyper_parameters: StyleBertVITS2HyperParameters
     # スタイルベクトルの情報
     style_vectors: bytes | None = None
+    # 最後にバリデーションが完了した時点での AIVM マニフェスト・ハイパーパラメータの内容 (内部キャッシュ)
+    # 書き込み時、内容がこのキャッシュと完全に一致する項目はバリデーションを省略できる
+    _validated_snapshot: dict[str, dict[str, Any]] | None = field(default=None, init=False, repr=False, compare=False)
 
 
 class AivmManifest(BaseModel):
@@ -0,0 +1,415 @@
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+from aivmlib import (
+    AivmValidationError,
+    _read_aivm_header_bytes,
+    read_aivm_metadata,
+    read_aivmx_metadata,
+    serialize_aivm_metadata,
+)
+from aivmlib.extract import decode_data_url
+from aivmlib.indexer import summarize_aivm_manifest
+from aivmlib.schemas.aivm_manifest import AivmMetadata
+
+
+# AIVM / AIVMX ファイルが配置されたディレクトリの AIVM メタデータを HTTP で配信する、標準ライブラリのみで動作するサーバー
+# パース済みの AIVM メタデータはメモリ上に LRU キャッシュし、ファイルの更新日時とサイズが変わった場合のみ読み直す
+# 配信するエンドポイントは以下の通り (GET / HEAD のみ):
+# - /models : ディレクトリ内の全モデルの概要
+# - /models/{ファイル名}/manifest : AIVM マニフェスト (JSON)
+# - /models/{ファイル名}/hyper-parameters : ハイパーパラメータ (JSON)
+# - /models/{ファイル名}/speakers/{話者 UUID}/icon : 話者のアイコン画像
+# - /models/{ファイル名}/speakers/{話者 UUID}/styles/{スタイル ID}/icon : スタイルのアイコン画像 (省略時は話者のアイコン画像)
+# - /models/{ファイル名}/speakers/{話者 UUID}/styles/{スタイル ID}/voice-samples/{インデックス} : ボイスサンプル音声
+
+_ASSET_ROUTE_PATTERN = re.compile(
+    r'^/speakers/(?P<speaker_uuid>[0-9a-fA-F-]{36})'
+    r'(?:/styles/(?P<style_local_id>\d+))?'
+    r'/(?:icon|voice-samples/(?P<voice_sample_index>\d+))$'
+)
+_RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+@dataclass(frozen=True)
+class CachedAivmMetadata:
+    """キャッシュされた、パース済みの AIVM メタデータ"""
+
+    # AIVM / AIVMX ファイルのパス
+    path: Path
+    # パース時点でのファイルの更新日時 (ナノ秒)
+    mtime_ns: int
+    # パース時点でのファイルサイズ
+    size: int
+    # ヘッダー (AIVMX の場合はメタデータ) のフィンガープリントから算出した ETag
+    etag: str
+    # パース済みの AIVM メタデータ
+    metadata: AivmMetadata
+    # AIVM マニフェストの JSON
+    manifest_json: bytes
+    # ハイパーパラメータの JSON
+    hyper_parameters_json: bytes
+
+
+class AivmMetadataCache:
+    """
+    AIVM / AIVMX ファイルのパス単位で、パース済みの AIVM メタデータを保持する LRU キャッシュ
+    ファイルの更新日時とサイズが変わっていればキャッシュを無効化して読み直す (スレッドセーフ)
+    """
+
+    def __init__(self, max_entries: int = 256) -> None:
+        """
+        Args:
+            max_entries (int): キャッシュする AIVM メタデータの最大数
+        """
+
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Path, CachedAivmMetadata] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: Path) -> CachedAivmMetadata:
+        """
+        指定されたファイルのパース済みの AIVM メタデータを取得する
+        キャッシュが存在しない・ファイルが更新されている場合はファイルを読み込んでキャッシュする
+
+        Args:
+            path (Path): AIVM / AIVMX ファイルのパス
+
+        Returns:
+            CachedAivmMetadata: キャッシュされた AIVM メタデータ
+
+        Raises:
+            FileNotFoundError: ファイルが存在しない場合
+            AivmValidationError: AIVM / AIVMX ファイルのフォーマットが不正な場合
+        """
+
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self.invalidate(path)
+            raise
+
+        # ファイルの更新日時とサイズが変わっていなければ、キャッシュをそのまま返す
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+                self._entries.move_to_end(path)
+                return entry
+
+        # ロックの外でファイルを読み込んでパースし、キャッシュに追加する
+        entry = self._load(path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, path: Path) -> None:
+        """
+        指定されたファイルのキャッシュを破棄する
+
+        Args:
+            path (Path): AIVM / AIVMX ファイルのパス
+        """
+
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def _load(self, path: Path, mtime_ns: int, size: int) -> CachedAivmMetadata:
+        """
+        AIVM / AIVMX ファイルを読み込み、キャッシュするエントリを構築する内部メソッド
+        """
+
+        with path.open('rb') as file:
+            if path.suffix == '.aivmx':
+                metadata = read_aivmx_metadata(file)
+                # AIVMX ファイルはメタデータ以外の領域も含めてシリアライズされているため、メタデータの内容からフィンガープリントを算出する
+                fingerprint_source = json.dumps(serialize_aivm_metadata(metadata), sort_keys=True).encode('utf-8')
+            else:
+                metadata = read_aivm_metadata(file)
+                fingerprint_source = _read_aivm_header_bytes(file)
+
+        return CachedAivmMetadata(
+            path=path,
+            mtime_ns=mtime_ns,
+            size=size,
+            etag='"' + hashlib.sha256(fingerprint_source).hexdigest()[:32] + '"',
+            metadata=metadata,
+            manifest_json=metadata.manifest.model_dump_json().encode('utf-8'),
+            hyper_parameters_json=metadata.hyper_parameters.model_dump_json().encode('utf-8'),
+        )
+
+
+class AivmMetadataServer(ThreadingHTTPServer):
+    """
+    AIVM / AIVMX ファイルが配置されたディレクトリの AIVM メタデータを配信する HTTP サーバー
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address: tuple[str, int], directory: Path, max_cached_models: int = 256) -> None:
+        """
+        Args:
+            server_address (tuple[str, int]): 待ち受けるホストとポート (ポートに 0 を指定すると空いているポートを自動で割り当てる)
+            directory (Path): AIVM / AIVMX ファイルが配置されたディレクトリ
+            max_cached_models (int): キャッシュする AIVM メタデータの最大数
+        """
+
+        self.directory = directory
+        self.cache = AivmMetadataCache(max_cached_models)
+        super().__init__(server_address, AivmMetadataRequestHandler)
+
+    def resolve_model_path(self, file_name: str) -> Path | None:
+        """
+        URL に含まれるファイル名から、ディレクトリ内の AIVM / AIVMX ファイルのパスを解決する
+
+        Args:
+            file_name (str): ファイル名
+
+        Returns:
+            Path | None: ファイルのパス (ディレクトリ外を指す・存在しない・AIVM / AIVMX ファイルでない場合は None)
+        """
+
+        if not file_name or '/' in file_name or '\\' in file_name or file_name in ('.', '..'):
+            return None
+        path = self.directory / file_name
+        if path.suffix not in ('.aivm', '.aivmx') or not path.is_file():
+            return None
+        return path
+
+    def list_model_paths(self) -> list[Path]:
+        """
+        ディレクトリ内の AIVM / AIVMX ファイルのパスを、ファイル名順に列挙する
+
+        Returns:
+            list[Path]: AIVM / AIVMX ファイルのパスのリスト
+        """
+
+        return sorted(
+            path for path in self.directory.iterdir() if path.suffix in ('.aivm', '.aivmx') and path.is_file()
+        )
+
+
+class AivmMetadataRequestHandler(BaseHTTPRequestHandler):
+    """
+    AivmMetadataServer のリクエストハンドラー
+    """
+
+    server: AivmMetadataServer
+
+    def do_GET(self) -> None:
+        self._handle(send_body=True)
+
+    def do_HEAD(self) -> None:
+        self._handle(send_body=False)
+
+    def _handle(self, send_body: bool) -> None:
+        """
+        リクエストパスに応じてレスポンスを返す内部メソッド
+        """
+
+        path = unquote(urlsplit(self.path).path)
+        try:
+            # モデル一覧
+            if path in ('/models', '/models/'):
+                models = []
+                etags = []
+                for model_path in self.server.list_model_paths():
+                    try:
+                        entry = self.server.cache.get(model_path)
+                    except (OSError, AivmValidationError):
+                        # 不正なファイルや読み込み中に削除されたファイル・読み取り権限のないファイルは一覧に含めない
+                        continue
+                    models.append({'file_name': model_path.name, **summarize_aivm_manifest(entry.metadata.manifest)})
+                    etags.append(entry.etag)
+                etag = '"' + hashlib.sha256(''.join(etags).encode('utf-8')).hexdigest()[:32] + '"'
+                self._send(json.dumps(models, ensure_ascii=False).encode('utf-8'), 'application/json', etag, send_body)
+                return
+
+            # 個別のモデル
+            match = re.match(r'^/models/(?P<file_name>[^/]+)(?P<rest>/.*)$', path)
+            model_path = self.server.resolve_model_path(match.group('file_name')) if match else None
+            if match is None or model_path is None:
+                self._send_error(HTTPStatus.NOT_FOUND, send_body)
+                return
+            entry = self.server.cache.get(model_path)
+            rest = match.group('rest')
+
+            if rest == '/manifest':
+                self._send(entry.manifest_json, 'application/json', entry.etag, send_body)
+                return
+            if rest == '/hyper-parameters':
+                self._send(entry.hyper_parameters_json, 'application/json', entry.etag, send_body)
+                return
+
+            asset_match = _ASSET_ROUTE_PATTERN.match(rest)
+            data_url = _find_asset_data_url(entry.metadata, asset_match) if asset_match else None
+            if data_url is None:
+                self._send_error(HTTPStatus.NOT_FOUND, send_body)
+                return
+            mime_type, data = decode_data_url(data_url)
+            self._send(data, mime_type, entry.etag, send_body)
+
+        except FileNotFoundError:
+            self._send_error(HTTPStatus.NOT_FOUND, send_body)
+        except PermissionError:
+            self._send_error(HTTPStatus.FORBIDDEN, send_body)
+        except AivmValidationError:
+            self._send_error(HTTPStatus.UNPROCESSABLE_ENTITY, send_body)
+        except OSError:
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, send_body)
+
+    def _send(self, body: bytes, content_type: str, etag: str, send_body: bool) -> None:
+        """
+        ETag による条件付きリクエストと Range リクエストを考慮してレスポンスを返す内部メソッド
+        """
+
+        # If-None-Match に一致すれば 304 Not Modified を返す
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+            if '*' in candidates or etag in candidates or f'W/{etag}' in candidates:
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                return
+
+        # Range リクエストの場合は指定された範囲のみを返す (単一の範囲のみ対応)
+        # If-Range が指定されていて ETag と一致しない場合や、解釈できない・対応していない Range (複数の範囲など) の場合は、
+        # RFC 7233 に従い Range を無視して全体を返す
+        status = HTTPStatus.OK
+        content_range = None
+        range_header = self.headers.get('Range')
+        if range_header is not None and self.headers.get('If-Range', etag) == etag:
+            try:
+                byte_range = _parse_range(range_header, len(body))
+            except _RangeNotSatisfiableError:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if byte_range is not None:
+                start, end = byte_range
+                content_range = f'bytes {start}-{end - 1}/{len(body)}'
+                body = body[start:end]
+                status = HTTPStatus.PARTIAL_CONTENT
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Accept-Ranges', 'bytes')
+        if content_range is not None:
+            self.send_header('Content-Range', content_range)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _send_error(self, status: HTTPStatus, send_body: bool) -> None:
+        """
+        JSON 形式のエラーレスポンスを返す内部メソッド
+        """
+
+        body = json.dumps({'detail': status.phrase}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+
+def create_metadata_server(
+    directory: Path,
+    host: str = '127.0.0.1',
+    port: int = 8000,
+    max_cached_models: int = 256,
+) -> AivmMetadataServer:
+    """
+    AIVM / AIVMX ファイルが配置されたディレクトリの AIVM メタデータを配信する HTTP サーバーを作成する
+    serve_forever() を呼び出すまでリクエストは処理されない
+
+    Args:
+        directory (Path): AIVM / AIVMX ファイルが配置されたディレクトリ
+        host (str): 待ち受けるホスト
+        port (int): 待ち受けるポート (0 を指定すると空いているポートを自動で割り当てる)
+        max_cached_models (int): キャッシュする AIVM メタデータの最大数
+
+    Returns:
+        AivmMetadataServer: HTTP サーバー
+    """
+
+    return AivmMetadataServer((host, port), directory, max_cached_models)
+
+
+def _find_asset_data_url(metadata: AivmMetadata, asset_match: re.Match[str]) -> str | None:
+    """
+    リクエストパスに対応するアイコン画像・ボイスサンプル音声の Data URL を AIVM マニフェストから探す内部メソッド
+    """
+
+    speaker = next(
+        (s for s in metadata.manifest.speakers if str(s.uuid) == asset_match.group('speaker_uuid').lower()),
+        None,
+    )
+    if speaker is None:
+        return None
+    if asset_match.group('style_local_id') is None:
+        # ボイスサンプルは必ずスタイルに属する
+        return speaker.icon if asset_match.group('voice_sample_index') is None else None
+
+    style = next((s for s in speaker.styles if s.local_id == int(asset_match.group('style_local_id'))), None)
+    if style is None:
+        return None
+    if asset_match.group('voice_sample_index') is None:
+        # スタイルのアイコン画像が省略されている場合は話者のアイコン画像を返す
+        return style.icon or speaker.icon
+    voice_sample_index = int(asset_match.group('voice_sample_index'))
+    if voice_sample_index >= len(style.voice_samples):
+        return None
+    return style.voice_samples[voice_sample_index].audio
+
+
+def _parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """
+    Range ヘッダーを解析し、返すべきバイト範囲 (開始位置と終了位置) を返す内部メソッド
+    解釈できない・対応していない Range の場合は、Range を無視すべきことを示す None を返す
+    範囲の指定自体は正しいが範囲を満たせない場合は、_RangeNotSatisfiableError を送出する
+    """
+
+    match = _RANGE_PATTERN.match(range_header.strip())
+    if match is None or (not match.group(1) and not match.group(2)):
+        return None
+    if not match.group(1):
+        # bytes=-N : 末尾 N バイト
+        suffix_length = int(match.group(2))
+        if suffix_length == 0:
+            raise _RangeNotSatisfiableError
+        return max(size - suffix_length, 0), size
+    start = int(match.group(1))
+    # 終了位置が開始位置より前にある指定は、構文上不正な Range として無視する
+    if match.group(2) and int(match.group(2)) < start:
+        return None
+    if start >= size:
+        raise _RangeNotSatisfiableError
+    end = int(match.group(2)) + 1 if match.group(2) else size
+    return start, min(end, size)
+
+
+class _RangeNotSatisfiableError(Exception):
+    """
+    Range ヘッダーで指定された範囲を満たせないときに発生する内部例外
+    """
+
+    pass
@@ -0,0 +1,561 @@
+import hashlib
+import json
+import os
+import struct
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+from aivmlib import AivmValidationError, _prepare_aivm_metadata_for_write, read_aivm_metadata, read_aivmx_metadata
+from aivmlib.patch import _get_payload_ranges, _is_sha256, _new_payload_digest, compute_payload_digest
+from aivmlib.schemas.aivm_manifest import AivmMetadata, ModelFormat
+from aivmlib.stub import _complement_ranges, read_stub_reference
+from aivmlib.utils import get_file_size, pread
+from aivmlib.virtual import AivmVirtualFile, _assemble_virtual_aivm_file, _assemble_virtual_aivmx_file
+from aivmlib.writer import atomic_output
+
+
+# 重みが同一で AIVM メタデータのみが異なる多数の AIVM / AIVMX ファイルを、重み部分を重複させずに格納するコンテンツアドレス型のストア
+# 格納するファイルは、重み部分以外 (AIVM: ヘッダー / AIVMX: metadata_props とロケーター) を元のバイト列のまま保持する「レコード」と、
+# 重み部分のバイト列を連結した「ペイロード」に分割し、ペイロードは aivmlib.patch.compute_payload_digest() のダイジェストをキーとして 1 つだけ保持する
+# 格納したファイルは、レコードのメタデータ部分とペイロードの範囲読み取りを連結した仮想ファイルとして、元のファイルと同一のバイト列で読み取れる
+# 同じペイロードを参照するファイルはすべてペイロードのファイルを読み取るため、ディスク使用量もページキャッシュも重みの種類の数にのみ比例する
+#
+# ストアのディレクトリ構造:
+#   records/{ID の先頭 2 文字}/{ID}: レコード ([記述子の JSON のバイト数] [記述子の JSON] [メタデータ部分のバイト列])
+#   payloads/{ダイジェストの先頭 2 文字}/{ダイジェスト}: ペイロード
+# レコードの ID は記述子の JSON とメタデータ部分のバイト列の SHA-256 ダイジェストで、元のファイルの内容のみから決まる
+#
+# 注意: AIVMX ファイルが外部データ (External Data) として別ファイルに保存している重みは、ストアには格納されない
+
+# レコードのフォーマットバージョン
+RECORD_FORMAT_VERSION = 1
+
+# レコードの先頭に格納する、記述子の JSON のバイト数
+_RECORD_HEADER_STRUCT = struct.Struct('<Q')
+# 記述子の JSON のバイト数の上限
+_MAX_DESCRIPTOR_SIZE = 1024 * 1024
+
+# ペイロードを書き込む際に、1 回に読み取るバイト数
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+# ガベージコレクションの際に、最終更新日時からこの秒数が経過していない参照されていないペイロードを削除せずに残す既定値
+## 格納処理はペイロードを書き込んで (既存のペイロードの場合は最終更新日時を更新して) からレコードを書き込むため、
+## 格納中のファイルのペイロードを削除しないための猶予となる
+DEFAULT_GC_MIN_AGE = 3600.0
+
+
+@dataclass(frozen=True)
+class AivmStoreEntry:
+    """ストアに格納された 1 つの AIVM / AIVMX ファイルの情報"""
+
+    # レコードの ID (記述子の JSON とメタデータ部分のバイト列の SHA-256 ダイジェスト)
+    entry_id: str
+    # 元のファイルのモデル形式
+    model_format: ModelFormat
+    # 元のファイル全体のバイト数
+    size: int
+    # 参照するペイロードのダイジェスト (aivmlib.patch.compute_payload_digest() と同一の値)
+    payload_sha256: str
+    # 元のファイルのうち、レコードに格納したメタデータ部分のバイト範囲 (オフセット, バイト数) のリスト
+    head_ranges: tuple[tuple[int, int], ...]
+
+    @property
+    def payload_ranges(self) -> list[tuple[int, int]]:
+        """元のファイルのうち、ペイロードに格納した重み部分のバイト範囲 (オフセット, バイト数) のリスト"""
+        return _complement_ranges(self.head_ranges, self.size)
+
+
+@dataclass(frozen=True)
+class AivmStoreCollectionReport:
+    """ガベージコレクションの結果"""
+
+    # 削除したペイロードのダイジェストのリスト
+    removed_payloads: list[str]
+    # 削除したファイルの合計バイト数
+    freed_bytes: int
+
+
+class AivmModelStore:
+    """
+    AIVM / AIVMX ファイルを、重み部分を重複させずに格納するコンテンツアドレス型のストア
+    格納したファイルは open() で元のファイルと同一のバイト列の仮想ファイルとして読み取れるため、
+    read_aivm_metadata() / read_aivmx_metadata() や aivmlib.virtual の関数などにそのまま渡せる
+    """
+
+    def __init__(self, root: Path) -> None:
+        """
+        Args:
+            root (Path): ストアのディレクトリ (存在しない場合は作成する)
+        """
+
+        self.root = root
+        self._records_dir = root / 'records'
+        self._payloads_dir = root / 'payloads'
+        self._records_dir.mkdir(parents=True, exist_ok=True)
+        self._payloads_dir.mkdir(parents=True, exist_ok=True)
+
+    def add(self, file: BinaryIO, model_format: ModelFormat) -> AivmStoreEntry:
+        """
+        AIVM / AIVMX ファイルをストアに格納する
+        同一の重み部分のペイロードが既に格納されている場合は、重み部分のダイジェストの計算のために元のファイルを一度読み取るのみで、
+        新たに書き込むのはメタデータ部分のレコードのみとなる
+        同一の内容のファイルを格納した場合は、既存のレコードの情報をそのまま返す
+
+        Args:
+            file (BinaryIO): AIVM / AIVMX ファイル
+            model_format (ModelFormat): ファイルのモデル形式
+
+        Returns:
+            AivmStoreEntry: 格納したファイルの情報
+
+        Raises:
+            AivmValidationError: ファイルのフォーマットが不正な場合・ファイルがスタブファイルの場合・格納中にファイルが変更された場合
+        """
+
+        if read_stub_reference(file) is not None:
+            raise AivmValidationError('Stub files cannot be added to the store. Materialize them first.')
+
+        # 重み部分以外のバイト範囲をメタデータ部分としてレコードに格納する
+        size = get_file_size(file)
+        payload_ranges = _get_payload_ranges(file, model_format)
+        head_ranges = _complement_ranges(payload_ranges, size)
+        head = b''.join(pread(file, length, offset) for offset, length in head_ranges)
+        payload_sha256 = compute_payload_digest(file, model_format)
+
+        # ペイロードが格納済みの場合はガベージコレクションの対象とならないよう最終更新日時を更新し、未格納の場合のみ重み部分を書き込む
+        ## 存在の確認と最終更新日時の更新を 1 回の操作で行い、その間にガベージコレクションで削除される隙を作らない
+        payload_path = self._payload_path(payload_sha256)
+        try:
+            os.utime(payload_path)
+        except FileNotFoundError:
+            self._write_payload(file, model_format, payload_ranges, payload_path, payload_sha256)
+
+        descriptor = _encode_descriptor(model_format, size, payload_sha256, head_ranges)
+        entry_id = _compute_entry_id(descriptor, head)
+        record_path = self._record_path(entry_id)
+        if not record_path.exists():
+            record_path.parent.mkdir(exist_ok=True)
+            with atomic_output(record_path) as record_file:
+                record_file.write(_RECORD_HEADER_STRUCT.pack(len(descriptor)))
+                record_file.write(descriptor)
+                record_file.write(head)
+
+        return AivmStoreEntry(
+            entry_id=entry_id,
+            model_format=model_format,
+            size=size,
+            payload_sha256=payload_sha256,
+            head_ranges=tuple(head_ranges),
+        )
+
+    def add_with_metadata(
+        self, file: BinaryIO, model_format: ModelFormat, aivm_metadata: AivmMetadata
+    ) -> AivmStoreEntry:
+        """
+        AIVM メタデータを書き込んだ AIVM / AIVMX ファイルを、ファイル全体を書き出すことなくストアに直接格納する
+        write_aivm_metadata() / write_aivmx_metadata() で書き出したファイルを add() で格納するのと同等だが、
+        ライセンスや名前のみを変えた派生ファイルの格納で、重み部分を新たに書き込むことはない
+
+        Args:
+            file (BinaryIO): 重み部分の元となる AIVM / AIVMX ファイル (または Safetensors / ONNX ファイル)
+            model_format (ModelFormat): ファイルのモデル形式
+            aivm_metadata (AivmMetadata): 書き込む AIVM メタデータ
+
+        Returns:
+            AivmStoreEntry: 格納したファイルの情報
+
+        Raises:
+            AivmValidationError: ファイルのフォーマットが不正・スタイルベクトルが未指定の場合
+        """
+
+        raw_metadata = _prepare_aivm_metadata_for_write(aivm_metadata, model_format)
+        if model_format == ModelFormat.Safetensors:
+            virtual_file = _assemble_virtual_aivm_file(file, raw_metadata)
+        else:
+            virtual_file = _assemble_virtual_aivmx_file(file, raw_metadata)
+        return self.add(virtual_file, model_format)
+
+    def get(self, entry_id: str) -> AivmStoreEntry | None:
+        """
+        ストアに格納されたファイルの情報を取得する
+
+        Args:
+            entry_id (str): レコードの ID
+
+        Returns:
+            AivmStoreEntry | None: 格納されたファイルの情報 (存在しない場合は None)
+
+        Raises:
+            AivmValidationError: レコードが不正な場合
+        """
+
+        if not _is_sha256(entry_id):
+            return None
+        record_path = self._record_path(entry_id)
+        try:
+            with record_path.open('rb') as record_file:
+                return _read_record_entry(entry_id, record_file)
+        except FileNotFoundError:
+            return None
+
+    def entries(self) -> Iterator[AivmStoreEntry]:
+        """
+        ストアに格納されたすべてのファイルの情報を列挙する
+
+        Yields:
+            AivmStoreEntry: 格納されたファイルの情報
+        """
+
+        for record_path in sorted(self._records_dir.glob('??/*')):
+            # 書き込み途中の一時ファイルは、先頭が "." で始まる名前となるため除外する
+            if record_path.name.startswith('.'):
+                continue
+            entry = self.get(record_path.name)
+            if entry is not None:
+                yield entry
+
+    def __contains__(self, entry_id: object) -> bool:
+        return isinstance(entry_id, str) and _is_sha256(entry_id) and self._record_path(entry_id).exists()
+
+    @contextmanager
+    def open(self, entry_id: str) -> Iterator[AivmVirtualFile]:
+        """
+        ストアに格納されたファイルを、元のファイルと同一のバイト列の読み取り専用の仮想ファイルとして開くコンテキストマネージャー
+        メタデータ部分のみをメモリ上に保持し、重み部分はペイロードのファイルからその都度読み取る
+
+        Args:
+            entry_id (str): レコードの ID
+
+        Yields:
+            AivmVirtualFile: 元のファイルと同一のバイト列の仮想ファイル (コンテキストマネージャーを抜けると読み取れなくなる)
+
+        Raises:
+            KeyError: 指定された ID のレコードが存在しない場合
+            AivmValidationError: レコードが不正・ペイロードが存在しない場合
+        """
+
+        entry, head = self._read_record(entry_id)
+        try:
+            payload_file = self._payload_path(entry.payload_sha256).open('rb')
+        except FileNotFoundError:
+            raise AivmValidationError(f'Payload {entry.payload_sha256} referenced by {entry_id} is missing.')
+        with payload_file:
+            yield AivmVirtualFile(payload_file, _build_parts(entry, head))
+
+    def read_metadata(self, entry_id: str) -> AivmMetadata:
+        """
+        ストアに格納されたファイルから、AIVM メタデータを読み込む
+        AIVM メタデータはすべてレコードに格納されているため、ペイロードは読み取らない
+
+        Args:
+            entry_id (str): レコードの ID
+
+        Returns:
+            AivmMetadata: AIVM メタデータ
+
+        Raises:
+            KeyError: 指定された ID のレコードが存在しない場合
+            AivmValidationError: レコードが不正・AIVM メタデータが不正な場合
+        """
+
+        entry = self.get(entry_id)
+        if entry is None:
+            raise KeyError(entry_id)
+        with self.open(entry_id) as file:
+            if entry.model_format == ModelFormat.Safetensors:
+                return read_aivm_metadata(file)
+            return read_aivmx_metadata(file)
+
+    def export(self, entry_id: str, output_path: Path) -> None:
+        """
+        ストアに格納されたファイルを、元のファイルと同一のバイト列の通常のファイルとして書き出す
+        重み部分は os.copy_file_range() でカーネル内でコピーするため、Btrfs や XFS などのリフリンクに対応したファイルシステムで
+        ストアと同一のファイルシステムに書き出す場合は、ファイルシステムがペイロードとデータブロックを共有できる
+
+        Args:
+            entry_id (str): レコードの ID
+            output_path (Path): 出力先のパス (書き込み途中のファイルは一時ファイルとして作成され、完了時に置き換えられる)
+
+        Raises:
+            KeyError: 指定された ID のレコードが存在しない場合
+            AivmValidationError: レコードが不正・ペイロードが存在しない場合
+        """
+
+        entry, head = self._read_record(entry_id)
+        try:
+            payload_file = self._payload_path(entry.payload_sha256).open('rb')
+        except FileNotFoundError:
+            raise AivmValidationError(f'Payload {entry.payload_sha256} referenced by {entry_id} is missing.')
+        with payload_file, atomic_output(output_path) as output_file:
+            for part in _build_parts(entry, head):
+                if isinstance(part, bytes):
+                    output_file.write(part)
+                else:
+                    _copy_file_range(payload_file, output_file, part[0], part[1])
+
+    def remove(self, entry_id: str) -> bool:
+        """
+        ストアからレコードを削除する
+        参照されなくなったペイロードは、gc() を呼ぶまで削除されない
+
+        Args:
+            entry_id (str): レコードの ID
+
+        Returns:
+            bool: レコードを削除した場合は True (存在しない場合は False)
+        """
+
+        if not _is_sha256(entry_id):
+            return False
+        try:
+            self._record_path(entry_id).unlink()
+        except FileNotFoundError:
+            return False
+        return True
+
+    def reference_counts(self) -> dict[str, int]:
+        """
+        ストアに格納された各ペイロードを参照しているレコードの数を数える
+
+        Returns:
+            dict[str, int]: ペイロードのダイジェストから参照しているレコードの数へのマップ (参照されていないペイロードは 0)
+        """
+
+        counts = {payload_path.name: 0 for payload_path in self._iter_payload_paths()}
+        for entry in self.entries():
+            counts[entry.payload_sha256] = counts.get(entry.payload_sha256, 0) + 1
+        return counts
+
+    def gc(self, min_age: float = DEFAULT_GC_MIN_AGE) -> AivmStoreCollectionReport:
+        """
+        どのレコードからも参照されていないペイロードと、中断された書き込みの一時ファイルを削除する
+        格納中のファイルのペイロードを削除しないよう、最終更新日時から min_age 秒が経過していないものは削除しない
+
+        Args:
+            min_age (float): 削除の対象とする、最終更新日時からの経過秒数の下限
+
+        Returns:
+            AivmStoreCollectionReport: ガベージコレクションの結果
+        """
+
+        # 参照を数える前にペイロードの最終更新日時を取得し、数えている間に格納されたファイルのペイロードを削除しないようにする
+        threshold = time.time() - min_age
+        candidates = [path for path in self._iter_payload_paths() if path.stat().st_mtime <= threshold]
+        referenced = {entry.payload_sha256 for entry in self.entries()}
+
+        removed_payloads: list[str] = []
+        freed_bytes = 0
+        for payload_path in candidates:
+            if payload_path.name in referenced:
+                continue
+            # 参照を数えている間に、同一のペイロードを持つファイルが格納された (最終更新日時が更新された) 可能性があるため、
+            # 削除する直前に最終更新日時を取得し直し、新しくなっていれば削除しない
+            try:
+                stat = payload_path.stat()
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime > threshold:
+                continue
+            freed_bytes += stat.st_size
+            payload_path.unlink(missing_ok=True)
+            removed_payloads.append(payload_path.name)
+
+        # 中断された書き込みで残った一時ファイルを削除する
+        for directory in (self._records_dir, self._payloads_dir):
+            for temporary_path in directory.glob('??/.*'):
+                try:
+                    stat = temporary_path.stat()
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime <= threshold:
+                    freed_bytes += stat.st_size
+                    temporary_path.unlink(missing_ok=True)
+
+        return AivmStoreCollectionReport(removed_payloads=removed_payloads, freed_bytes=freed_bytes)
+
+    def _record_path(self, entry_id: str) -> Path:
+        return self._records_dir / entry_id[:2] / entry_id
+
+    def _payload_path(self, payload_sha256: str) -> Path:
+        return self._payloads_dir / payload_sha256[:2] / payload_sha256
+
+    def _iter_payload_paths(self) -> Iterator[Path]:
+        for payload_path in sorted(self._payloads_dir.glob('??/*')):
+            if _is_sha256(payload_path.name):
+                yield payload_path
+
+    def _read_record(self, entry_id: str) -> tuple[AivmStoreEntry, bytes]:
+        """
+        レコードから、格納されたファイルの情報とメタデータ部分のバイト列を読み込む内部メソッド
+        """
+
+        if not _is_sha256(entry_id):
+            raise KeyError(entry_id)
+        try:
+            with self._record_path(entry_id).open('rb') as record_file:
+                entry = _read_record_entry(entry_id, record_file)
+                head_size = sum(length for _, length in entry.head_ranges)
+                head = pread(record_file, head_size, get_file_size(record_file) - head_size)
+        except FileNotFoundError:
+            raise KeyError(entry_id)
+        return entry, head
+
+    def _write_payload(
+        self,
+        file: BinaryIO,
+        model_format: ModelFormat,
+        payload_ranges: list[tuple[int, int]],
+        payload_path: Path,
+        payload_sha256: str,
+    ) -> None:
+        """
+        重み部分のバイト範囲を連結してペイロードとして書き込む内部メソッド
+        書き込みながらダイジェストを計算し直し、計算済みのダイジェストと一致しない場合は書き込みを取り消す
+        """
+
+        payload_path.parent.mkdir(exist_ok=True)
+        digest = _new_payload_digest(file, model_format)
+        with atomic_output(payload_path) as payload_file:
+            for offset, length in payload_ranges:
+                end = offset + length
+                while offset < end:
+                    chunk = pread(file, min(_COPY_CHUNK_SIZE, end - offset), offset)
+                    if not chunk:
+                        raise AivmValidationError('The file was truncated while reading.')
+                    digest.update(chunk)
+                    payload_file.write(chunk)
+                    offset += len(chunk)
+            if digest.hexdigest() != payload_sha256:
+                raise AivmValidationError('The file was modified while being added to the store.')
+
+
+def _encode_descriptor(
+    model_format: ModelFormat, size: int, payload_sha256: str, head_ranges: list[tuple[int, int]]
+) -> bytes:
+    """
+    レコードの記述子を JSON にエンコードする内部メソッド
+    同一の内容のファイルから同一の ID が得られるよう、キーの順序と区切り文字を固定する
+    """
+
+    return json.dumps(
+        {
+            'version': RECORD_FORMAT_VERSION,
+            'model_format': str(model_format),
+            'size': size,
+            'payload_sha256': payload_sha256,
+            'head_ranges': [list(head_range) for head_range in head_ranges],
+        },
+        sort_keys=True,
+        separators=(',', ':'),
+    ).encode('utf-8')
+
+
+def _compute_entry_id(descriptor: bytes, head: bytes) -> str:
+    """
+    記述子の JSON とメタデータ部分のバイト列から、レコードの ID を計算する内部メソッド
+    """
+
+    digest = hashlib.sha256()
+    digest.update(_RECORD_HEADER_STRUCT.pack(len(descriptor)))
+    digest.update(descriptor)
+    digest.update(head)
+    return digest.hexdigest()
+
+
+def _read_record_entry(entry_id: str, record_file: BinaryIO) -> AivmStoreEntry:
+    """
+    レコードの記述子を読み込み、格納されたファイルの情報を返す内部メソッド
+    """
+
+    record_size = get_file_size(record_file)
+    if record_size < _RECORD_HEADER_STRUCT.size:
+        raise AivmValidationError(f'Invalid store record: {entry_id}')
+    (descriptor_size,) = _RECORD_HEADER_STRUCT.unpack(pread(record_file, _RECORD_HEADER_STRUCT.size, 0))
+    if descriptor_size > min(_MAX_DESCRIPTOR_SIZE, record_size - _RECORD_HEADER_STRUCT.size):
+        raise AivmValidationError(f'Invalid store record: {entry_id}')
+
+    try:
+        raw_descriptor = json.loads(pread(record_file, descriptor_size, _RECORD_HEADER_STRUCT.size))
+        entry = AivmStoreEntry(
+            entry_id=entry_id,
+            model_format=ModelFormat(raw_descriptor['model_format']),
+            size=raw_descriptor['size'],
+            payload_sha256=raw_descriptor['payload_sha256'],
+            head_ranges=tuple((offset, length) for offset, length in raw_descriptor['head_ranges']),
+        )
+    except (UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise AivmValidationError(f'Invalid store record: {entry_id}')
+    if (
+        raw_descriptor.get('version') != RECORD_FORMAT_VERSION
+        or not isinstance(entry.size, int)
+        or not _is_sha256(entry.payload_sha256)
+    ):
+        raise AivmValidationError(f'Invalid store record: {entry_id}')
+
+    # メタデータ部分の範囲が、元のファイル内で昇順に重ならず並んでいて、その合計がレコードの残りの部分と一致することを確認する
+    position = 0
+    for offset, length in entry.head_ranges:
+        if not isinstance(offset, int) or not isinstance(length, int) or offset < position or length < 0:
+            raise AivmValidationError(f'Invalid store record: {entry_id}')
+        position = offset + length
+    head_size = sum(length for _, length in entry.head_ranges)
+    if position > entry.size or head_size != record_size - _RECORD_HEADER_STRUCT.size - descriptor_size:
+        raise AivmValidationError(f'Invalid store record: {entry_id}')
+
+    return entry
+
+
+def _build_parts(entry: AivmStoreEntry, head: bytes) -> list[bytes | tuple[int, int]]:
+    """
+    元のファイルのバイト範囲を先頭から並べ、メタデータ部分のバイト列とペイロード内の (オフセット, バイト数) のリストに変換する内部メソッド
+    """
+
+    ranges = [(offset, length, True) for offset, length in entry.head_ranges]
+    ranges += [(offset, length, False) for offset, length in entry.payload_ranges]
+    ranges.sort()
+
+    parts: list[bytes | tuple[int, int]] = []
+    head_position = 0
+    payload_position = 0
+    for _, length, is_head in ranges:
+        if is_head:
+            parts.append(head[head_position : head_position + length])
+            head_position += length
+        else:
+            parts.append((payload_position, length))
+            payload_position += length
+    return parts
+
+
+def _copy_file_range(source: BinaryIO, output_file: BinaryIO, offset: int, length: int) -> None:
+    """
+    元のファイルの指定範囲を、書き込み先のファイルの現在位置にコピーする内部メソッド
+    os.copy_file_range() が利用できない・失敗した場合は、読み取りと書き込みを繰り返してコピーする
+    """
+
+    # バッファに残っている未書き込みのデータを反映してから、書き込み先のファイルディスクリプタに直接コピーする
+    output_file.flush()
+    output_offset = output_file.tell()
+    end = offset + length
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < end:
+                copied = os.copy_file_range(source.fileno(), output_file.fileno(), end - offset, offset, output_offset)
+                if copied == 0:
+                    raise AivmValidationError('The payload file was truncated while reading.')
+                offset += copied
+                output_offset += copied
+        except OSError:
+            pass
+        output_file.seek(output_offset)
+
+    while offset < end:
+        chunk = pread(source, min(_COPY_CHUNK_SIZE, end - offset), offset)
+        if not chunk:
+            raise AivmValidationError('The payload file was truncated while reading.')
+        output_file.write(chunk)
+        offset += len(chunk)
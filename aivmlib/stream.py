@@ -0,0 +1,348 @@
+import hashlib
+from dataclasses import dataclass
+
+from aivmlib import (
+    AivmLimitExceededError,
+    AivmParseLimits,
+    AivmValidationError,
+    _decode_aivm_header,
+    validate_aivm_metadata,
+)
+from aivmlib.onnx_scanner import (
+    _FIELD_HEADER_MAX_SIZE,
+    METADATA_LOCATOR_FIELD_NUMBER,
+    METADATA_PROPS_FIELD_NUMBER,
+    WIRE_TYPE_LEN,
+    WIRE_TYPE_VARINT,
+    ProtobufField,
+    ProtobufScanError,
+    decode_string_string_entry,
+    parse_field_header,
+)
+from aivmlib.patch import _encode_tensor_table
+from aivmlib.schemas.aivm_manifest import AivmMetadata, ModelFormat
+
+
+# アップロード中のファイルなど、チャンク単位で届くバイト列を先頭から順に受け取りながら AIVM / AIVMX ファイルを検証するパーサー
+# ファイル全体をバッファリングすることなく、AIVM: ヘッダーサイズとヘッダー JSON / AIVMX: Protobuf のフレーミングをその場で検証するため、
+# 不正なファイルは最初の数 KB を受け取った時点で拒否できる
+# I/O を一切行わないため、同期コード・非同期コードのどちらからでも、受け取ったチャンクをそのまま feed() に渡して利用できる
+
+# AIVM ファイルのヘッダーサイズ・AIVMX ファイルの metadata_props の合計サイズの上限 (リソース上限を指定しない場合)
+_DEFAULT_MAX_HEADER_SIZE = 100 * 1024 * 1024
+
+# ModelProto の既知のフィールド番号と、そのワイヤータイプ
+# ref: https://github.com/onnx/onnx/blob/main/onnx/onnx.proto
+_MODEL_PROTO_WIRE_TYPES = {
+    1: WIRE_TYPE_VARINT,  # ir_version
+    2: WIRE_TYPE_LEN,  # producer_name
+    3: WIRE_TYPE_LEN,  # producer_version
+    4: WIRE_TYPE_LEN,  # domain
+    5: WIRE_TYPE_VARINT,  # model_version
+    6: WIRE_TYPE_LEN,  # doc_string
+    7: WIRE_TYPE_LEN,  # graph
+    8: WIRE_TYPE_LEN,  # opset_import
+    14: WIRE_TYPE_LEN,  # metadata_props
+    20: WIRE_TYPE_LEN,  # training_info
+    25: WIRE_TYPE_LEN,  # functions
+    METADATA_LOCATOR_FIELD_NUMBER: WIRE_TYPE_LEN,
+}
+
+
+@dataclass(frozen=True)
+class AivmStreamParseResult:
+    """ストリームとして受け取った AIVM / AIVMX ファイルのパースの結果"""
+
+    # AIVM メタデータ
+    metadata: AivmMetadata
+    # 受け取ったファイル全体のバイト数
+    total_size: int
+    # AIVM メタデータ以外の部分の SHA-256 ハッシュ値 (aivmlib.patch.compute_payload_digest() と同一の値、算出しない場合は None)
+    payload_sha256: str | None
+
+
+class AivmStreamParser:
+    """
+    チャンク単位で届く AIVM / AIVMX ファイルを、先頭から順に受け取りながら検証するプッシュ型のパーサー
+    feed() でチャンクを渡し、全てのチャンクを渡し終えたら close() を呼び出す
+    不正なファイルの場合は、不正な箇所を含むチャンクを渡した時点で例外が発生する (以降の feed() / close() も同じ例外となる)
+    """
+
+    def __init__(
+        self,
+        model_format: ModelFormat,
+        limits: AivmParseLimits | None = None,
+        hash_payload: bool = False,
+    ) -> None:
+        """
+        Args:
+            model_format (ModelFormat): 受け取るファイルのモデル形式
+            limits (AivmParseLimits | None): パース処理のリソース上限 (信頼できないファイルを受け取る場合に指定する)
+            hash_payload (bool): True の場合、AIVM メタデータ以外の部分の SHA-256 ハッシュ値を受け取りながら算出する
+        """
+
+        self.model_format = model_format
+        self.limits = limits
+        self._max_header_size = limits.max_header_size if limits is not None else _DEFAULT_MAX_HEADER_SIZE
+        self._payload_hash = hashlib.sha256() if hash_payload else None
+        self._metadata: AivmMetadata | None = None
+        self._error: AivmValidationError | None = None
+        self._closed = False
+        # これまでに受け取ったバイト数
+        self._total_size = 0
+        # ヘッダーサイズ / フィールドのタグと長さなど、解釈するのに十分なバイト数がまだ届いていない部分
+        self._pending = bytearray()
+
+        # AIVM: ヘッダーサイズ (未確定の場合は None) と、ヘッダー JSON から求めた Weight 部分の最小のバイト数
+        self._header_size: int | None = None
+        self._expected_payload_size = 0
+        self._payload_size = 0
+
+        # AIVMX: フィールドとして消費済みのバイト数、受け取り中のフィールドとその残りのバイト数、受け取ったフィールドの数
+        self._field_offset = 0
+        self._field: ProtobufField | None = None
+        self._field_remaining = 0
+        self._field_count = 0
+        # AIVMX: 受け取り中の metadata_props のエントリのバイト列と、受け取り済みの metadata_props
+        self._metadata_props_buffer: bytearray | None = None
+        self._metadata_props: dict[str, str] = {}
+        self._metadata_props_size = 0
+
+    @property
+    def metadata(self) -> AivmMetadata | None:
+        """
+        検証済みの AIVM メタデータ (まだ確定していない場合は None)
+        AIVM ファイルではヘッダーを受け取り終えた時点で確定する
+        AIVMX ファイルでは metadata_props がファイル内のどこにでも配置できるため、close() を呼び出した時点で確定する
+        """
+        return self._metadata
+
+    def feed(self, chunk: bytes | bytearray | memoryview) -> AivmMetadata | None:
+        """
+        ファイルの続きのチャンクを受け取って検証する
+
+        Args:
+            chunk (bytes | bytearray | memoryview): ファイルの続きのチャンク
+
+        Returns:
+            AivmMetadata | None: 検証済みの AIVM メタデータ (まだ確定していない場合は None)
+
+        Raises:
+            AivmValidationError: ファイルのフォーマットが不正・AIVM メタデータのバリデーションに失敗した場合
+            AivmLimitExceededError: リソース上限を超えた場合
+        """
+
+        if self._error is not None:
+            raise self._error
+        if self._closed:
+            raise ValueError('The parser is already closed.')
+
+        data = memoryview(chunk).cast('B')
+        self._total_size += len(data)
+        try:
+            if self.model_format == ModelFormat.Safetensors:
+                self._feed_aivm(data)
+            else:
+                self._feed_aivmx(data)
+        except AivmValidationError as ex:
+            self._error = ex
+            raise
+        return self._metadata
+
+    def close(self) -> AivmStreamParseResult:
+        """
+        ファイルの終端に達したことを通知し、パースの結果を返す
+
+        Returns:
+            AivmStreamParseResult: パースの結果
+
+        Raises:
+            AivmValidationError: ファイルが途中で途切れている・AIVM メタデータのバリデーションに失敗した場合
+            AivmLimitExceededError: リソース上限を超えた場合
+        """
+
+        if self._error is not None:
+            raise self._error
+        self._closed = True
+        try:
+            if self.model_format == ModelFormat.Safetensors:
+                if self._metadata is None:
+                    raise AivmValidationError('Failed to read header. This file is not an AIVM (Safetensors) file.')
+                if self._payload_size < self._expected_payload_size:
+                    raise AivmValidationError(
+                        f'The file is truncated ({self._payload_size} of {self._expected_payload_size} weight bytes).'
+                    )
+            else:
+                if self._pending or self._field is not None:
+                    raise AivmValidationError('Failed to decode AIVM metadata. The AIVMX (ONNX) file is truncated.')
+                self._metadata = validate_aivm_metadata(self._metadata_props, self.limits)
+        except AivmValidationError as ex:
+            self._error = ex
+            raise
+
+        return AivmStreamParseResult(
+            metadata=self._metadata,
+            total_size=self._total_size,
+            payload_sha256=self._payload_hash.hexdigest() if self._payload_hash is not None else None,
+        )
+
+    def _feed_aivm(self, data: memoryview) -> None:
+        """
+        AIVM (Safetensors) ファイルのチャンクを処理する内部メソッド
+        """
+
+        # ヘッダーを受け取り終えた後は、Weight 部分のバイト数を数えてハッシュ値を更新するのみ
+        if self._metadata is not None:
+            self._payload_size += len(data)
+            if self._payload_hash is not None:
+                self._payload_hash.update(data)
+            return
+
+        self._pending += data
+
+        # 先頭 8 バイトからヘッダーサイズを取得し、ヘッダー分のバイト列を受け取る前に検査する
+        if self._header_size is None:
+            if len(self._pending) < 8:
+                return
+            header_size = int.from_bytes(self._pending[:8], 'little')
+            if header_size <= 0 or header_size > _DEFAULT_MAX_HEADER_SIZE:
+                raise AivmValidationError('Invalid header size. This file is not an AIVM (Safetensors) file.')
+            if header_size > self._max_header_size:
+                raise AivmLimitExceededError(
+                    f'Header size ({header_size} bytes) exceeds the limit ({self._max_header_size} bytes).'
+                )
+            self._header_size = header_size
+
+        # ヘッダー JSON の先頭は (空白を除いて) オブジェクトの開き括弧でなければならない
+        header_head = bytes(self._pending[8 : 8 + min(self._header_size, 64)]).lstrip(b' \t\n\r')
+        if header_head and not header_head.startswith(b'{'):
+            raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.')
+
+        # ヘッダー全体を受け取り終えたら、AIVM メタデータを検証する
+        header_end = 8 + self._header_size
+        if len(self._pending) < header_end:
+            return
+        header_bytes = bytes(self._pending[8:header_end])
+        header_json = _decode_aivm_header(header_bytes, self.limits)
+        raw_metadata = header_json.get('__metadata__') if isinstance(header_json, dict) else None
+        self._metadata = validate_aivm_metadata(raw_metadata, self.limits)
+
+        # compute_payload_digest() と同様に、Weight 部分の前にヘッダーのテンソル情報をハッシュ値に含める
+        if self._payload_hash is not None:
+            self._payload_hash.update(_encode_tensor_table(header_bytes.decode('utf-8')))
+
+        # ファイルが途中で途切れていないかを close() で検査できるよう、テンソルが必要とする Weight 部分のバイト数を求める
+        assert isinstance(header_json, dict)
+        for name, info in header_json.items():
+            if name == '__metadata__' or not isinstance(info, dict):
+                continue
+            data_offsets = info.get('data_offsets')
+            if isinstance(data_offsets, list) and len(data_offsets) == 2 and isinstance(data_offsets[1], int):
+                self._expected_payload_size = max(self._expected_payload_size, data_offsets[1])
+
+        # ヘッダー以降に受け取り済みのバイト列は Weight 部分として扱う
+        payload = memoryview(self._pending)[header_end:]
+        self._pending = bytearray()
+        self._payload_size += len(payload)
+        if self._payload_hash is not None:
+            self._payload_hash.update(payload)
+
+    def _feed_aivmx(self, data: memoryview) -> None:
+        """
+        AIVMX (ONNX) ファイルのチャンクを、ModelProto のトップレベルのフィールド単位で処理する内部メソッド
+        """
+
+        position = 0
+        while position < len(data):
+            # 受け取り中のフィールドの値を、フィールドの終端まで消費する
+            if self._field is not None:
+                length = min(self._field_remaining, len(data) - position)
+                self._consume_field(data[position : position + length])
+                position += length
+                continue
+
+            # 次のフィールドのタグと長さを、解釈できるだけのバイト数が揃うまで蓄積する
+            needed = _FIELD_HEADER_MAX_SIZE - len(self._pending)
+            self._pending += data[position : position + needed]
+            position += min(needed, len(data) - position)
+            field = self._parse_pending_field_header()
+            if field is None:
+                continue
+
+            # 蓄積したバイト列のうち、フィールドに属する部分を消費し、残りは次のフィールドのために戻す
+            self._start_field(field)
+            pending = memoryview(bytes(self._pending))
+            self._pending = bytearray()
+            length = min(field.end - field.offset, len(pending))
+            self._consume_field(pending[:length])
+            if length < len(pending):
+                position -= len(pending) - length
+
+    def _parse_pending_field_header(self) -> ProtobufField | None:
+        """
+        蓄積したバイト列からフィールドのタグと長さを読み取る内部メソッド (まだバイト数が足りない場合は None)
+        """
+
+        try:
+            return parse_field_header(bytes(self._pending), 0, self._field_offset)
+        except ProtobufScanError:
+            # Varint が途中で途切れているだけの可能性があるため、十分なバイト数が揃うまでは判断を保留する
+            if len(self._pending) < _FIELD_HEADER_MAX_SIZE:
+                return None
+            raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+
+    def _start_field(self, field: ProtobufField) -> None:
+        """
+        フィールドのタグと長さを検証し、フィールドの受け取りを開始する内部メソッド
+        """
+
+        self._field_count += 1
+        if self.limits is not None and self._field_count > self.limits.max_protobuf_fields:
+            raise AivmLimitExceededError(
+                f'The number of top-level fields exceeds the limit ({self.limits.max_protobuf_fields}).'
+            )
+
+        # 既知のフィールドのワイヤータイプが ONNX の仕様と一致しない場合は、ONNX ファイルではないとみなす
+        expected_wire_type = _MODEL_PROTO_WIRE_TYPES.get(field.number)
+        if expected_wire_type is not None and field.wire_type != expected_wire_type:
+            raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+
+        # metadata_props は、値を受け取る前に合計サイズを検査した上でバッファリングする
+        if field.number == METADATA_PROPS_FIELD_NUMBER:
+            self._metadata_props_size += field.end - field.offset
+            if self._metadata_props_size > self._max_header_size:
+                raise AivmLimitExceededError(
+                    f'Metadata size ({self._metadata_props_size} bytes) exceeds the limit ({self._max_header_size} bytes).'
+                )
+            self._metadata_props_buffer = bytearray()
+
+        self._field = field
+        self._field_remaining = field.end - field.offset
+
+    def _consume_field(self, data: memoryview) -> None:
+        """
+        受け取り中のフィールドのバイト列を消費する内部メソッド
+        metadata_props はバッファリングし、それ以外のフィールドはハッシュ値を更新して読み捨てる
+        """
+
+        assert self._field is not None
+        self._field_remaining -= len(data)
+        self._field_offset += len(data)
+        if self._metadata_props_buffer is not None:
+            self._metadata_props_buffer += data
+        elif self._payload_hash is not None and self._field.number != METADATA_LOCATOR_FIELD_NUMBER:
+            self._payload_hash.update(data)
+
+        if self._field_remaining > 0:
+            return
+
+        # metadata_props のフィールドを受け取り終えたら、エントリをデコードする
+        if self._metadata_props_buffer is not None:
+            value = bytes(self._metadata_props_buffer[self._field.value_offset - self._field.offset :])
+            try:
+                key, entry_value = decode_string_string_entry(value)
+            except ProtobufScanError:
+                raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+            self._metadata_props[key] = entry_value
+            self._metadata_props_buffer = None
+        self._field = None
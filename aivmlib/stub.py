@@ -0,0 +1,372 @@
+import hashlib
+import io
+import json
+import os
+import struct
+import time
+import urllib.error
+import urllib.request
+from collections.abc import Iterable
+from dataclasses import dataclass
+from http import HTTPStatus
+from pathlib import Path
+from typing import BinaryIO
+from urllib.parse import urlsplit
+
+from aivmlib import AivmValidationError
+from aivmlib.onnx_scanner import STUB_REFERENCE_FIELD_NUMBER, WIRE_TYPE_LEN, encode_varint
+from aivmlib.patch import _get_payload_ranges, _is_sha256, _new_payload_digest, compute_payload_digest
+from aivmlib.schemas.aivm_manifest import ModelFormat
+from aivmlib.utils import get_file_size, pread
+
+
+# AIVM メタデータ (アイコン画像・ボイスサンプル音声を含む) のみを格納し、重み部分は参照情報のみを持つ「スタブファイル」を扱うためのユーティリティ
+# スタブファイルは元のファイルのヘッダー (AIVM) / metadata_props とロケーター (AIVMX) をそのままのバイト列で先頭に格納し、
+# 末尾に重み部分の参照情報 (取得元の URL またはパス・サイズ・SHA-256 ダイジェスト) を追記したもので、
+# read_aivm_metadata() / read_aivmx_metadata() でそのまま AIVM メタデータを読み込める
+# materialize_aivm_stub() で重み部分を取得すると、元のファイルと同一のバイト列のファイルが得られる
+#
+# スタブファイルの構造:
+#   AIVM: [ヘッダーサイズ + ヘッダー JSON] [参照情報の JSON] [フッター]
+#   AIVMX: [metadata_props とロケーターのフィールド] [参照情報のフィールド (値は 参照情報の JSON + フッター)]
+#   フッター (固定長): 参照情報の JSON のバイト数, マジックナンバー
+
+# スタブファイルのマジックナンバーと参照情報のフォーマットバージョン
+STUB_MAGIC = b'AIVMSTUB'
+STUB_FORMAT_VERSION = 1
+
+# 参照情報の JSON のバイト数とマジックナンバーからなるフッター
+_FOOTER_STRUCT = struct.Struct('<Q8s')
+# 参照情報の JSON のバイト数の上限
+_MAX_REFERENCE_SIZE = 1024 * 1024
+
+# 重み部分をダウンロードする際に、1 回に読み取るバイト数
+_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# 重み部分をダウンロードする際の、HTTP リクエストのタイムアウト (秒)
+_DOWNLOAD_TIMEOUT = 30.0
+
+
+@dataclass(frozen=True)
+class AivmPayloadReference:
+    """スタブファイルが参照する、元のファイルの重み部分の情報"""
+
+    # 元のファイルのモデル形式
+    model_format: ModelFormat
+    # 元のファイルの取得元 (HTTP(S) の URL またはファイルパス、相対パスはスタブファイルのディレクトリからの相対パス)
+    source: str
+    # 元のファイル全体のバイト数
+    size: int
+    # 重み部分の SHA-256 ダイジェスト (aivmlib.patch.compute_payload_digest() と同一の値)
+    payload_sha256: str
+    # 元のファイルのうち、スタブファイルの先頭に格納したメタデータ部分のバイト範囲 (オフセット, バイト数) のリスト
+    head_ranges: tuple[tuple[int, int], ...]
+
+    @property
+    def payload_ranges(self) -> list[tuple[int, int]]:
+        """元のファイルのうち、重み部分のバイト範囲 (オフセット, バイト数) のリスト"""
+        return _complement_ranges(self.head_ranges, self.size)
+
+
+def create_aivm_stub(
+    file: BinaryIO,
+    output_file: BinaryIO,
+    model_format: ModelFormat,
+    source: str,
+) -> AivmPayloadReference:
+    """
+    AIVM / AIVMX ファイルから、AIVM メタデータのみを格納したスタブファイルを作成する
+    重み部分のダイジェストを計算するため、元のファイル全体を一度だけ読み取る
+
+    Args:
+        file (BinaryIO): 元の AIVM / AIVMX ファイル
+        output_file (BinaryIO): スタブファイルの書き込み先
+        model_format (ModelFormat): 元のファイルのモデル形式
+        source (str): 元のファイルの取得元 (HTTP(S) の URL またはファイルパス)
+
+    Returns:
+        AivmPayloadReference: スタブファイルに書き込んだ参照情報
+
+    Raises:
+        AivmValidationError: 元のファイルのフォーマットが不正な場合・元のファイル自体がスタブファイルの場合
+    """
+
+    if read_stub_reference(file) is not None:
+        raise AivmValidationError('This file is already a stub file.')
+
+    # 重み部分以外 (AIVM: ヘッダー / AIVMX: metadata_props とロケーター) を、元のファイルのバイト列のまま先頭に格納する
+    size = get_file_size(file)
+    head_ranges = _complement_ranges(_get_payload_ranges(file, model_format), size)
+
+    reference = AivmPayloadReference(
+        model_format=model_format,
+        source=source,
+        size=size,
+        payload_sha256=compute_payload_digest(file, model_format),
+        head_ranges=tuple(head_ranges),
+    )
+    for offset, length in head_ranges:
+        output_file.write(pread(file, length, offset))
+    output_file.write(_encode_reference(reference))
+    return reference
+
+
+def read_stub_reference(file: BinaryIO) -> AivmPayloadReference | None:
+    """
+    スタブファイルの末尾から、重み部分の参照情報を読み込む
+
+    Args:
+        file (BinaryIO): スタブファイル (または通常の AIVM / AIVMX ファイル)
+
+    Returns:
+        AivmPayloadReference | None: 重み部分の参照情報 (スタブファイルでない場合は None)
+
+    Raises:
+        AivmValidationError: スタブファイルの参照情報が不正な場合
+    """
+
+    file_size = get_file_size(file)
+    if file_size < _FOOTER_STRUCT.size:
+        return None
+    reference_size, magic = _FOOTER_STRUCT.unpack(pread(file, _FOOTER_STRUCT.size, file_size - _FOOTER_STRUCT.size))
+    if magic != STUB_MAGIC:
+        return None
+    if reference_size > min(_MAX_REFERENCE_SIZE, file_size - _FOOTER_STRUCT.size):
+        raise AivmValidationError('Invalid stub reference.')
+    reference_offset = file_size - _FOOTER_STRUCT.size - reference_size
+
+    try:
+        raw_reference = json.loads(pread(file, reference_size, reference_offset))
+        reference = AivmPayloadReference(
+            model_format=ModelFormat(raw_reference['model_format']),
+            source=raw_reference['source'],
+            size=raw_reference['size'],
+            payload_sha256=raw_reference['payload_sha256'],
+            head_ranges=tuple((offset, length) for offset, length in raw_reference['head_ranges']),
+        )
+    except (UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise AivmValidationError('Invalid stub reference.')
+    if (
+        raw_reference.get('version') != STUB_FORMAT_VERSION
+        or not isinstance(reference.source, str)
+        or not isinstance(reference.size, int)
+        or not _is_sha256(reference.payload_sha256)
+    ):
+        raise AivmValidationError('Invalid stub reference.')
+
+    # メタデータ部分の範囲が、元のファイル内で昇順に重ならず並んでいて、その合計がスタブファイルの先頭部分と一致することを確認する
+    position = 0
+    for offset, length in reference.head_ranges:
+        if not isinstance(offset, int) or not isinstance(length, int) or offset < position or length < 0:
+            raise AivmValidationError('Invalid stub reference.')
+        position = offset + length
+    head_size = sum(length for _, length in reference.head_ranges)
+    if position > reference.size or head_size != _get_head_size(
+        reference_offset, reference_size, reference.model_format
+    ):
+        raise AivmValidationError('Invalid stub reference.')
+
+    return reference
+
+
+def materialize_aivm_stub(
+    stub_path: Path,
+    output_path: Path,
+    source: str | None = None,
+    max_retries: int = 5,
+) -> None:
+    """
+    スタブファイルが参照する重み部分を取得し、元のファイルと同一の AIVM / AIVMX ファイルを作成する
+    重み部分は必要な範囲のみを Range リクエストで取得し、取得しながら SHA-256 ダイジェストを検証する
+    書き込み途中のファイルは出力先と同じディレクトリに一時ファイルとして残るため、中断した場合も再実行すれば続きから取得する
+    ダイジェストが一致しない場合は、一時ファイルを削除してエラーとする
+
+    Args:
+        stub_path (Path): スタブファイルのパス
+        output_path (Path): 作成するファイルのパス
+        source (str | None): 元のファイルの取得元 (省略時はスタブファイルに記録された取得元)
+        max_retries (int): 通信エラーの際に、続きから取得し直す回数の上限 (取得が進むたびにリセットされる)
+
+    Raises:
+        AivmValidationError: スタブファイルが不正・取得した重み部分のダイジェストが一致しない場合
+        OSError: 元のファイルを取得できなかった場合
+    """
+
+    with stub_path.open('rb') as stub_file:
+        reference = read_stub_reference(stub_file)
+        if reference is None:
+            raise AivmValidationError('This file is not a stub file.')
+        head = pread(stub_file, sum(length for _, length in reference.head_ranges), 0)
+
+    # 取得元の相対パスは、スタブファイルのディレクトリからの相対パスとして解決する
+    source = source or reference.source
+    if urlsplit(source).scheme not in ('http', 'https'):
+        source = str(stub_path.parent / source)
+
+    # 元のファイルのバイト範囲を、スタブファイルから書き込む部分と取得元から取得する部分に分けて先頭から並べる
+    parts: list[tuple[int, int, int | None]] = []
+    head_position = 0
+    for offset, length in reference.head_ranges:
+        parts.append((offset, length, head_position))
+        head_position += length
+    parts += [(offset, length, None) for offset, length in reference.payload_ranges]
+    parts.sort()
+
+    # 前回中断した一時ファイルがあれば、その続きから書き込む
+    # 書き込み済みの重み部分はダイジェストの計算のために読み直し、メタデータ部分はスタブファイルと一致するかを確認する
+    temporary_path = output_path.with_name(f'.{output_path.name}.part')
+    digest = _new_payload_digest(io.BytesIO(head), reference.model_format)
+    with temporary_path.open('ab+') as output_file:
+        written = output_file.tell()
+        if written > reference.size:
+            output_file.truncate(0)
+            written = 0
+        for offset, length, head_offset in parts:
+            if offset >= written:
+                break
+            length = min(length, written - offset)
+            if head_offset is None:
+                _update_digest_from_file(digest, output_file, offset, length)
+            elif pread(output_file, length, offset) != head[head_offset : head_offset + length]:
+                # スタブファイルと一致しないメタデータ部分があれば、その位置から書き込み直す
+                output_file.truncate(offset)
+                written = offset
+                break
+
+        for offset, length, head_offset in parts:
+            end = offset + length
+            if end <= written:
+                continue
+            start = max(offset, written)
+            if head_offset is not None:
+                output_file.write(head[head_offset + start - offset : head_offset + length])
+            else:
+                _download_range(source, start, end, output_file, digest, max_retries)
+            written = end
+
+    if digest.hexdigest() != reference.payload_sha256:
+        temporary_path.unlink()
+        raise AivmValidationError('Payload digest mismatch. The source file does not match the stub file.')
+    os.replace(temporary_path, output_path)
+
+
+def _complement_ranges(ranges: Iterable[tuple[int, int]], size: int) -> list[tuple[int, int]]:
+    """
+    昇順に重ならず並んだバイト範囲 (オフセット, バイト数) の、ファイル全体に対する残りのバイト範囲を列挙する内部メソッド
+    """
+
+    complement: list[tuple[int, int]] = []
+    position = 0
+    for offset, length in ranges:
+        if offset > position:
+            complement.append((position, offset - position))
+        position = offset + length
+    if size > position:
+        complement.append((position, size - position))
+    return complement
+
+
+def _encode_reference(reference: AivmPayloadReference) -> bytes:
+    """
+    参照情報を、スタブファイルの末尾に追記するバイト列にエンコードする内部メソッド
+    """
+
+    reference_bytes = json.dumps(
+        {
+            'version': STUB_FORMAT_VERSION,
+            'model_format': str(reference.model_format),
+            'source': reference.source,
+            'size': reference.size,
+            'payload_sha256': reference.payload_sha256,
+            'head_ranges': [list(head_range) for head_range in reference.head_ranges],
+        },
+        ensure_ascii=False,
+    ).encode('utf-8')
+    trailer = reference_bytes + _FOOTER_STRUCT.pack(len(reference_bytes), STUB_MAGIC)
+
+    # AIVMX の場合は、ModelProto のトップレベルのフィールドとしてエンコードする
+    if reference.model_format == ModelFormat.ONNX:
+        return encode_varint(STUB_REFERENCE_FIELD_NUMBER << 3 | WIRE_TYPE_LEN) + encode_varint(len(trailer)) + trailer
+    return trailer
+
+
+def _get_head_size(reference_offset: int, reference_size: int, model_format: ModelFormat) -> int:
+    """
+    スタブファイルの先頭に格納されたメタデータ部分のバイト数を、参照情報の位置から求める内部メソッド
+    """
+
+    if model_format == ModelFormat.ONNX:
+        trailer_size = reference_size + _FOOTER_STRUCT.size
+        return (
+            reference_offset
+            - len(encode_varint(STUB_REFERENCE_FIELD_NUMBER << 3 | WIRE_TYPE_LEN))
+            - len(encode_varint(trailer_size))
+        )
+    return reference_offset
+
+
+def _update_digest_from_file(digest: 'hashlib._Hash', file: BinaryIO, offset: int, length: int) -> None:
+    """
+    ファイルの指定範囲を読み取り、ダイジェストを更新する内部メソッド
+    """
+
+    end = offset + length
+    while offset < end:
+        chunk = pread(file, min(_DOWNLOAD_CHUNK_SIZE, end - offset), offset)
+        if not chunk:
+            raise AivmValidationError('The partial file was truncated while reading.')
+        digest.update(chunk)
+        offset += len(chunk)
+
+
+def _download_range(
+    source: str,
+    start: int,
+    end: int,
+    output_file: BinaryIO,
+    digest: 'hashlib._Hash',
+    max_retries: int,
+) -> None:
+    """
+    取得元の指定範囲を取得して書き込み、ダイジェストを更新する内部メソッド
+    通信エラーの際は、書き込み済みの位置から取得し直す
+    """
+
+    # ローカルのファイルの場合は、オフセットを指定して読み取る
+    if urlsplit(source).scheme not in ('http', 'https'):
+        with open(source, 'rb') as source_file:
+            while start < end:
+                chunk = pread(source_file, min(_DOWNLOAD_CHUNK_SIZE, end - start), start)
+                if not chunk:
+                    raise AivmValidationError('The source file is shorter than expected.')
+                output_file.write(chunk)
+                digest.update(chunk)
+                start += len(chunk)
+        return
+
+    retries = 0
+    while start < end:
+        try:
+            request = urllib.request.Request(source, headers={'Range': f'bytes={start}-{end - 1}'})
+            with urllib.request.urlopen(request, timeout=_DOWNLOAD_TIMEOUT) as response:
+                # Range リクエストに対応していないサーバーの場合は、ファイル全体のうち先頭から不要な部分を読み捨てる
+                skip = 0 if response.status == HTTPStatus.PARTIAL_CONTENT else start
+                while start < end:
+                    chunk = response.read(min(_DOWNLOAD_CHUNK_SIZE, end - start + skip))
+                    if not chunk:
+                        raise ConnectionError('The connection was closed before the range was fully received.')
+                    if skip > 0:
+                        dropped = min(skip, len(chunk))
+                        chunk = chunk[dropped:]
+                        skip -= dropped
+                    output_file.write(chunk)
+                    digest.update(chunk)
+                    start += len(chunk)
+                    retries = 0
+        except (urllib.error.URLError, ConnectionError, TimeoutError) as ex:
+            # 404 などのクライアントエラーは、取得し直しても解決しないためそのままエラーとする
+            if isinstance(ex, urllib.error.HTTPError) and ex.code < 500:
+                raise
+            retries += 1
+            if retries > max_retries:
+                raise
+            time.sleep(min(2**retries * 0.1, 5.0))
@@ -0,0 +1,233 @@
+import json
+import math
+import re
+import sys
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import BinaryIO
+
+import numpy as np
+
+from aivmlib import AivmValidationError, _read_aivm_header_bytes
+from aivmlib.utils import pread
+from aivmlib.writer import AivmCancellationToken, AivmWritePhase, ProgressCallback, _report
+
+
+if sys.version_info >= (3, 11):
+    from enum import StrEnum
+else:
+    from aivmlib.utils import StrEnum
+
+
+# AIVM ファイル (Safetensors) のテンソルを、ファイル全体をメモリ上に読み込むことなく変換しながら書き出すためのユーティリティ
+# 浮動小数点数のテンソルを半精度 (FP16 / BF16) にキャストし、学習時にのみ必要なテンソル (Discriminator など) を取り除くことで、
+# 推論に必要な情報を保ったまま AIVM ファイルのサイズを最大で半分程度に削減できる
+# テンソルはチャンクごとに読み取り・変換して書き込むため、メモリ使用量はテンソルのサイズによらず一定に保たれる
+
+# 1 回に読み取り・変換するテンソルの要素数
+_CHUNK_ELEMENTS = 1024 * 1024
+
+# Safetensors のデータ型ごとの 1 要素あたりのバイト数
+_DTYPE_SIZES = {
+    'BOOL': 1,
+    'U8': 1,
+    'I8': 1,
+    'F8_E5M2': 1,
+    'F8_E4M3': 1,
+    'I16': 2,
+    'U16': 2,
+    'F16': 2,
+    'BF16': 2,
+    'I32': 4,
+    'U32': 4,
+    'F32': 4,
+    'I64': 8,
+    'U64': 8,
+    'F64': 8,
+}
+
+# 半精度へのキャストの対象とする (単精度以上の) 浮動小数点数のデータ型と、対応する NumPy のデータ型
+_CASTABLE_DTYPES = {'F32': np.dtype('<f4'), 'F64': np.dtype('<f8')}
+
+
+class TensorCastDtype(StrEnum):
+    # IEEE 754 半精度浮動小数点数 (表現できる範囲は ±65504 まで)
+    Float16 = 'fp16'
+    # bfloat16 (単精度と同じ指数部を持ち、表現できる範囲が広い代わりに仮数部の精度が低い)
+    BFloat16 = 'bf16'
+
+
+@dataclass
+class AivmTensorTransformReport:
+    """テンソルの変換の結果"""
+
+    # 変換前の Weight 部分のバイト数
+    payload_size_before: int
+    # 変換後の Weight 部分のバイト数
+    payload_size_after: int
+    # 半精度にキャストしたテンソルの名前のリスト
+    cast_tensors: list[str] = field(default_factory=list)
+    # 取り除いたテンソルの名前のリスト
+    dropped_tensors: list[str] = field(default_factory=list)
+    # 警告メッセージのリスト
+    warnings: list[str] = field(default_factory=list)
+
+
+def transform_aivm_tensors(
+    aivm_file: BinaryIO,
+    output_file: BinaryIO,
+    cast_dtype: TensorCastDtype | None = None,
+    drop_patterns: Iterable[str] = (),
+    progress_callback: ProgressCallback | None = None,
+    cancellation_token: AivmCancellationToken | None = None,
+) -> AivmTensorTransformReport:
+    """
+    AIVM ファイル (または Safetensors ファイル) のテンソルを変換し、出力先に先頭から順に書き込む
+    ヘッダーの __metadata__ (AIVM メタデータ) はそのまま引き継がれる
+    出力先はシーク不可能なストリームでもよい
+
+    Args:
+        aivm_file (BinaryIO): AIVM ファイル (仮想ファイルも指定できる)
+        output_file (BinaryIO): 変換後の AIVM ファイルの書き込み先
+        cast_dtype (TensorCastDtype | None): 指定時、単精度以上の浮動小数点数 (F32 / F64) のテンソルをこのデータ型にキャストする
+        drop_patterns (Iterable[str]): 取り除くテンソルの名前の正規表現のリスト (名前全体に一致したテンソルを取り除く)
+        progress_callback (ProgressCallback | None): 書き込みの進捗を受け取るコールバック関数 (チャンクごとに呼ばれる)
+        cancellation_token (AivmCancellationToken | None): 書き込みをキャンセルするためのトークン (チャンクの境界で確認される)
+
+    Returns:
+        AivmTensorTransformReport: テンソルの変換の結果
+
+    Raises:
+        AivmValidationError: AIVM ファイルのフォーマットが不正な場合
+        AivmWriteCancelledError: 書き込みがキャンセルされた場合 (書き込み途中の出力先の後始末は呼び出し元で行う)
+    """
+
+    _report(progress_callback, cancellation_token, AivmWritePhase.Metadata, 0, 0)
+    header_bytes = _read_aivm_header_bytes(aivm_file)
+    payload_offset = 8 + len(header_bytes)
+    try:
+        header = json.loads(header_bytes)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.')
+    if not isinstance(header, dict):
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVM (Safetensors) file.')
+    try:
+        drop_regexes = [re.compile(pattern) for pattern in drop_patterns]
+    except re.error as ex:
+        raise ValueError(f'Invalid tensor name pattern: {ex}') from ex
+
+    # テンソルを Weight 部分での格納順に並べる
+    tensors: list[tuple[str, str, list[int], int, int]] = []
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+        tensors.append((name, *_parse_tensor_info(name, info)))
+    tensors.sort(key=lambda tensor: tensor[3])
+
+    # 変換後のテンソル情報を構築する (テンソルのデータを読み取らずに、データ型と形状のみから変換後のオフセットを求める)
+    report = AivmTensorTransformReport(
+        payload_size_before=sum(end - begin for *_, begin, end in tensors), payload_size_after=0
+    )
+    new_header: dict = {}
+    if '__metadata__' in header:
+        new_header['__metadata__'] = header['__metadata__']
+    plan: list[tuple[str, str, int, int]] = []
+    offset = 0
+    for name, dtype, shape, begin, end in tensors:
+        if any(regex.fullmatch(name) for regex in drop_regexes):
+            report.dropped_tensors.append(name)
+            continue
+        new_dtype = dtype
+        if cast_dtype is not None and dtype in _CASTABLE_DTYPES:
+            new_dtype = 'F16' if cast_dtype == TensorCastDtype.Float16 else 'BF16'
+            report.cast_tensors.append(name)
+        new_size = (end - begin) // _DTYPE_SIZES[dtype] * _DTYPE_SIZES[new_dtype]
+        new_header[name] = {'dtype': new_dtype, 'shape': shape, 'data_offsets': [offset, offset + new_size]}
+        plan.append((dtype, new_dtype, payload_offset + begin, end - begin))
+        offset += new_size
+    report.payload_size_after = offset
+
+    # Safetensors の慣例に従い、Weight 部分の開始位置が 8 バイト境界に揃うよう、ヘッダー JSON の末尾を空白でパディングする
+    new_header_bytes = json.dumps(new_header).encode('utf-8')
+    new_header_bytes += b' ' * (-len(new_header_bytes) % 8)
+    output_file.write(len(new_header_bytes).to_bytes(8, 'little'))
+    output_file.write(new_header_bytes)
+    bytes_done = 8 + len(new_header_bytes)
+    bytes_total = bytes_done + report.payload_size_after
+    _report(progress_callback, cancellation_token, AivmWritePhase.Payload, bytes_done, bytes_total)
+
+    # テンソルをチャンクごとに読み取り、必要に応じてキャストしながら書き込む
+    overflow_count = 0
+    for dtype, new_dtype, source_offset, size in plan:
+        chunk_size = _CHUNK_ELEMENTS * _DTYPE_SIZES[dtype]
+        position = 0
+        while position < size:
+            chunk = pread(aivm_file, min(chunk_size, size - position), source_offset + position)
+            if not chunk:
+                raise AivmValidationError('The source file was truncated while reading.')
+            position += len(chunk)
+            if new_dtype != dtype:
+                converted, overflows = _cast_chunk(chunk, _CASTABLE_DTYPES[dtype], new_dtype)
+                overflow_count += overflows
+                chunk = converted
+            output_file.write(chunk)
+            bytes_done += len(chunk)
+            _report(progress_callback, cancellation_token, AivmWritePhase.Payload, bytes_done, bytes_total)
+
+    if overflow_count > 0 and cast_dtype == TensorCastDtype.Float16:
+        report.warnings.append(
+            f'FP16 で表現できない大きさの値が {overflow_count} 個あり、無限大に丸められました。BF16 へのキャストを検討してください。'
+        )
+    elif overflow_count > 0:
+        report.warnings.append(f'BF16 で表現できない大きさの値が {overflow_count} 個あり、無限大に丸められました。')
+    return report
+
+
+def _parse_tensor_info(name: str, info: object) -> tuple[str, list[int], int, int]:
+    """
+    ヘッダー JSON のテンソル情報を検証し、(データ型, 形状, 開始オフセット, 終了オフセット) を返す内部メソッド
+    """
+
+    if not isinstance(info, dict):
+        raise AivmValidationError(f'Invalid tensor info: {name}.')
+    dtype = info.get('dtype')
+    shape = info.get('shape')
+    data_offsets = info.get('data_offsets')
+    if (
+        dtype not in _DTYPE_SIZES
+        or not isinstance(shape, list)
+        or not all(isinstance(dimension, int) and dimension >= 0 for dimension in shape)
+        or not isinstance(data_offsets, list)
+        or len(data_offsets) != 2
+        or not all(isinstance(data_offset, int) for data_offset in data_offsets)
+    ):
+        raise AivmValidationError(f'Invalid tensor info: {name}.')
+    begin, end = data_offsets
+    if not 0 <= begin <= end or end - begin != math.prod(shape) * _DTYPE_SIZES[dtype]:
+        raise AivmValidationError(f'Invalid tensor info: {name}.')
+    return dtype, shape, begin, end
+
+
+def _cast_chunk(chunk: bytes, source_dtype: np.dtype, new_dtype: str) -> tuple[bytes, int]:
+    """
+    浮動小数点数のチャンクを半精度にキャストし、キャスト後のバイト列と、オーバーフローして無限大になった要素の数を返す内部メソッド
+    """
+
+    values = np.frombuffer(chunk, dtype=source_dtype)
+    if new_dtype == 'F16':
+        with np.errstate(over='ignore'):
+            converted = values.astype('<f2')
+        overflows = int(np.count_nonzero(np.isinf(converted) & np.isfinite(values)))
+        return converted.tobytes(), overflows
+
+    # BF16: 単精度の上位 16 ビットを、最近接偶数丸めで取り出す (NaN は quiet NaN として保持する)
+    ## 倍精度から単精度への変換と、上位 16 ビットへの丸めのいずれでも、有限の値が無限大になりうる
+    with np.errstate(over='ignore'):
+        bits = values.astype('<f4').view('<u4')
+    rounded = ((bits + 0x7FFF + ((bits >> 16) & 1)) >> 16).astype('<u2')
+    nan_mask = np.isnan(values)
+    if nan_mask.any():
+        rounded[nan_mask] = ((bits[nan_mask] >> 16) | 0x0040).astype('<u2')
+    infinite_mask = (rounded & 0x7FFF) == 0x7F80
+    overflows = int(np.count_nonzero(infinite_mask & np.isfinite(values)))
+    return rounded.tobytes(), overflows
@@ -1,4 +1,9 @@
 import enum
+import io
+import os
+import stat
+import threading
+from typing import BinaryIO
 
 
 class StrEnum(str, enum.Enum):
@@ -33,3 +38,108 @@ class StrEnum(str, enum.Enum):
         Return the lower-cased version of the member name.
         """
         return name.lower()
+
+
+# os.pread() も BytesIO のバッファも利用できないファイルオブジェクトに対する、シークと読み取りを排他するためのロック
+# 読み取り処理の中で別のファイルオブジェクトを読み取るファイルオブジェクト (圧縮コンテナのペイロードなど) もあるため、再入可能なロックとする
+_seek_lock = threading.RLock()
+
+
+def pread(file: BinaryIO, size: int, offset: int) -> bytes:
+    """
+    ファイルオブジェクトのカーソル位置を変更することなく、指定オフセットから指定サイズのバイト列を読み取る
+    ファイルディスクリプタを持つファイルでは os.pread() を、BytesIO では内部バッファを直接参照するため、
+    同一のファイルオブジェクトを複数のスレッドから同時に読み取ってもスレッドセーフに動作する
+
+    Args:
+        file (BinaryIO): 読み取るファイルオブジェクト
+        size (int): 読み取るバイト数
+        offset (int): 読み取りを開始するオフセット
+
+    Returns:
+        bytes: 読み取ったバイト列 (ファイル末尾に達した場合は size より短くなる)
+    """
+
+    if size <= 0:
+        return b''
+
+    # BytesIO の場合、内部バッファのビューからスライスする
+    if isinstance(file, io.BytesIO):
+        with file.getbuffer() as view:
+            return bytes(view[offset : offset + size])
+
+    # ファイルディスクリプタを持つ場合、os.pread() で共有のカーソルを介さずに読み取る
+    fd = _get_fileno(file)
+    if fd is not None and hasattr(os, 'pread'):
+        # 書き込み可能なファイルの場合、バッファに残っている未書き込みのデータをディスクに反映してから読み取る
+        if file.writable():
+            file.flush()
+        chunks: list[bytes] = []
+        remaining = size
+        while remaining > 0:
+            chunk = os.pread(fd, remaining, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+            remaining -= len(chunk)
+        return b''.join(chunks)
+
+    # それ以外の場合、ロックで排他した上でシークして読み取り、カーソルを元の位置に戻す
+    with _seek_lock:
+        position = file.tell()
+        try:
+            file.seek(offset)
+            return file.read(size)
+        finally:
+            file.seek(position)
+
+
+def get_file_size(file: BinaryIO) -> int:
+    """
+    ファイルオブジェクトのカーソル位置を変更することなく、ファイルサイズを取得する
+
+    Args:
+        file (BinaryIO): ファイルオブジェクト
+
+    Returns:
+        int: ファイルサイズ (バイト)
+    """
+
+    # BytesIO の場合、内部バッファのサイズを返す
+    if isinstance(file, io.BytesIO):
+        with file.getbuffer() as view:
+            return view.nbytes
+
+    # ファイルディスクリプタを持つ場合、fstat でサイズを取得する
+    fd = _get_fileno(file)
+    if fd is not None:
+        if file.writable():
+            file.flush()
+        return os.fstat(fd).st_size
+
+    # それ以外の場合、ロックで排他した上で末尾にシークしてサイズを取得し、カーソルを元の位置に戻す
+    with _seek_lock:
+        position = file.tell()
+        try:
+            return file.seek(0, io.SEEK_END)
+        finally:
+            file.seek(position)
+
+
+def _get_fileno(file: BinaryIO) -> int | None:
+    """
+    ファイルオブジェクトのファイルディスクリプタを取得する内部メソッド (通常のファイルでない場合は None を返す)
+    """
+
+    try:
+        fd = file.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    # パイプやソケットなどシーク不可能なファイルには os.pread() を使えない
+    try:
+        if not stat.S_ISREG(os.fstat(fd).st_mode):
+            return None
+    except OSError:
+        return None
+    return fd
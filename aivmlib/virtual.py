@@ -0,0 +1,264 @@
+import bisect
+import io
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import BinaryIO
+
+from aivmlib import AivmValidationError, _build_aivm_header, _prepare_aivm_metadata_for_write
+from aivmlib.onnx_scanner import (
+    METADATA_LOCATOR_FIELD_NUMBER,
+    METADATA_PROPS_FIELD_NUMBER,
+    WIRE_TYPE_LEN,
+    ProtobufScanError,
+    decode_string_string_entry,
+    encode_metadata_locator,
+    encode_metadata_props,
+    read_metadata_prop_key,
+    scan_model_fields,
+)
+from aivmlib.schemas.aivm_manifest import AivmMetadata, ModelFormat
+from aivmlib.utils import get_file_size, pread
+
+
+# AIVM メタデータを書き換えた AIVM / AIVMX ファイルを、ファイル全体をメモリ上に構築することなく提供するためのユーティリティ
+# 新しいヘッダー (AIVMX の場合は新しい metadata_props) のみをメモリ上に保持し、Weight 部分は元のファイルからその都度読み取る
+
+# iter_chunks() で一度に読み取るバイト数の既定値
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class _Segment:
+    """仮想ファイルを構成する 1 つの連続したバイト範囲"""
+
+    # 仮想ファイル内での開始オフセット
+    offset: int
+    # バイト数
+    length: int
+    # メモリ上に保持しているバイト列 (元のファイルから読み取る場合は None)
+    data: bytes | None = None
+    # 元のファイル内での開始オフセット (data が None の場合のみ有効)
+    source_offset: int = 0
+
+
+class AivmVirtualFile(io.RawIOBase):
+    """
+    メモリ上のバイト列と元のファイルのバイト範囲を連結し、1 つの読み取り専用ファイルとして見せる仮想ファイル
+    元のファイルはカーソル位置を変更せずに読み取るため、1 つの元のファイルを複数の仮想ファイル・複数のスレッドで共有できる
+    (ただし、1 つの仮想ファイルのインスタンス自体は自身のカーソル位置を持つため、スレッド間で共有してはならない)
+    """
+
+    def __init__(self, source: BinaryIO, parts: list[bytes | tuple[int, int]]) -> None:
+        """
+        Args:
+            source (BinaryIO): 元のファイル
+            parts (list[bytes | tuple[int, int]]): 仮想ファイルを構成する、メモリ上のバイト列または元のファイルの (オフセット, バイト数) のリスト
+        """
+
+        super().__init__()
+        self._source = source
+        self._segments: list[_Segment] = []
+        offset = 0
+        for part in parts:
+            if isinstance(part, bytes):
+                segment = _Segment(offset=offset, length=len(part), data=part)
+            else:
+                segment = _Segment(offset=offset, length=part[1], source_offset=part[0])
+            if segment.length > 0:
+                self._segments.append(segment)
+                offset += segment.length
+        self._segment_offsets = [segment.offset for segment in self._segments]
+        self._size = offset
+        self._position = 0
+
+    @property
+    def size(self) -> int:
+        """仮想ファイル全体のバイト数"""
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f'Invalid whence: {whence}')
+        if position < 0:
+            raise ValueError(f'Negative seek position: {position}')
+        self._position = position
+        return position
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:  # type: ignore[override]
+        data = self.read_range(self._position, len(buffer))
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = max(self._size - self._position, 0)
+        data = self.read_range(self._position, size)
+        self._position += len(data)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def read_range(self, offset: int, size: int) -> bytes:
+        """
+        カーソル位置を変更せずに、仮想ファイルの指定オフセットから指定サイズのバイト列を読み取る
+
+        Args:
+            offset (int): 読み取りを開始するオフセット
+            size (int): 読み取るバイト数
+
+        Returns:
+            bytes: 読み取ったバイト列 (仮想ファイルの末尾に達した場合は size より短くなる)
+        """
+
+        end = min(offset + size, self._size)
+        if offset >= end:
+            return b''
+        chunks: list[bytes] = []
+        index = bisect.bisect_right(self._segment_offsets, offset) - 1
+        while offset < end:
+            segment = self._segments[index]
+            start_in_segment = offset - segment.offset
+            length = min(segment.length - start_in_segment, end - offset)
+            if segment.data is not None:
+                chunk = segment.data[start_in_segment : start_in_segment + length]
+            else:
+                chunk = pread(self._source, length, segment.source_offset + start_in_segment)
+                if len(chunk) < length:
+                    raise AivmValidationError('The source file was truncated while reading.')
+            chunks.append(chunk)
+            offset += length
+            index += 1
+        return b''.join(chunks)
+
+    def iter_chunks(
+        self, start: int = 0, end: int | None = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> Iterator[bytes]:
+        """
+        仮想ファイルの指定範囲を、チャンクごとに順に読み取るジェネレーター
+        HTTP の Range リクエストへの応答など、ファイル全体をメモリ上に保持せずにストリーミングする用途を想定している
+        カーソル位置は変更しない
+
+        Args:
+            start (int): 読み取りを開始するオフセット
+            end (int | None): 読み取りを終了するオフセット (このオフセット自体は含まない、省略時は仮想ファイルの末尾)
+            chunk_size (int): 1 回に読み取るバイト数の上限
+
+        Yields:
+            bytes: 読み取ったチャンク
+        """
+
+        end = self._size if end is None else min(end, self._size)
+        while start < end:
+            chunk = self.read_range(start, min(chunk_size, end - start))
+            yield chunk
+            start += len(chunk)
+
+
+def create_virtual_aivm_file(aivm_file: BinaryIO, aivm_metadata: AivmMetadata) -> AivmVirtualFile:
+    """
+    AIVM メタデータを書き込んだ AIVM ファイルを、Weight 部分をメモリ上に読み込むことなく仮想ファイルとして構築する
+    write_aivm_metadata() の戻り値と同一のバイト列を、新しいヘッダーと元の AIVM ファイルの Weight 部分の範囲読み取りで提供する
+
+    Args:
+        aivm_file (BinaryIO): AIVM ファイル (仮想ファイルを読み取り終えるまで閉じてはならない)
+        aivm_metadata (AivmMetadata): AIVM メタデータ
+
+    Returns:
+        AivmVirtualFile: AIVM メタデータを書き込んだ AIVM ファイルの仮想ファイル
+
+    Raises:
+        AivmValidationError: AIVM ファイルのフォーマットが不正・スタイルベクトルが未指定の場合
+    """
+
+    raw_metadata = _prepare_aivm_metadata_for_write(aivm_metadata, ModelFormat.Safetensors)
+    return _assemble_virtual_aivm_file(aivm_file, raw_metadata)
+
+
+def create_virtual_aivmx_file(aivmx_file: BinaryIO, aivm_metadata: AivmMetadata) -> AivmVirtualFile:
+    """
+    AIVM メタデータを書き込んだ AIVMX ファイルを、ONNX モデル全体をパース・メモリ上に読み込むことなく仮想ファイルとして構築する
+    元の AIVMX ファイルから書き換え対象のキーの metadata_props のみを取り除き、新しい metadata_props を末尾に追記した形で提供する
+    write_aivmx_metadata() の戻り値とはフィールドの並び順が異なりうるが、ONNX モデルとしては同一の内容となる
+
+    Args:
+        aivmx_file (BinaryIO): AIVMX ファイル (仮想ファイルを読み取り終えるまで閉じてはならない)
+        aivm_metadata (AivmMetadata): AIVM メタデータ
+
+    Returns:
+        AivmVirtualFile: AIVM メタデータを書き込んだ AIVMX ファイルの仮想ファイル
+
+    Raises:
+        AivmValidationError: AIVMX ファイルのフォーマットが不正・スタイルベクトルが未指定の場合
+    """
+
+    # AIVM メタデータをシリアライズした上で、書き込む前にバリデーションを行う
+    raw_metadata = _prepare_aivm_metadata_for_write(aivm_metadata, ModelFormat.ONNX)
+    return _assemble_virtual_aivmx_file(aivmx_file, raw_metadata)
+
+
+def _assemble_virtual_aivm_file(aivm_file: BinaryIO, raw_metadata: dict[str, str]) -> AivmVirtualFile:
+    """
+    シリアライズ済みの AIVM メタデータを書き込んだ AIVM ファイルの仮想ファイルを構築する内部メソッド
+    """
+
+    new_header, payload_offset = _build_aivm_header(aivm_file, raw_metadata)
+    payload_size = get_file_size(aivm_file) - payload_offset
+    return AivmVirtualFile(aivm_file, [new_header, (payload_offset, payload_size)])
+
+
+def _assemble_virtual_aivmx_file(aivmx_file: BinaryIO, raw_metadata: dict[str, str]) -> AivmVirtualFile:
+    """
+    シリアライズ済みの AIVM メタデータを書き込んだ AIVMX ファイルの仮想ファイルを構築する内部メソッド
+    """
+
+    # ModelProto のトップレベルのフィールドを走査し、書き換え対象のキーの metadata_props 以外のバイト範囲を列挙する
+    # ファイル末尾の metadata_props の位置を示すロケーターは、新しい metadata_props の位置と一致しなくなるため取り除く
+    # 隣接するバイト範囲は 1 つにまとめ、元のファイルからの読み取り回数を減らす
+    ranges: list[tuple[int, int]] = []
+    has_other_metadata_props = False
+    try:
+        for field in scan_model_fields(aivmx_file):
+            if field.number == METADATA_LOCATOR_FIELD_NUMBER:
+                continue
+            if field.number == METADATA_PROPS_FIELD_NUMBER and field.wire_type == WIRE_TYPE_LEN:
+                key = read_metadata_prop_key(aivmx_file, field)
+                if key is None:
+                    key, _ = decode_string_string_entry(
+                        pread(aivmx_file, field.end - field.value_offset, field.value_offset)
+                    )
+                if key in raw_metadata:
+                    continue
+                has_other_metadata_props = True
+            if ranges and ranges[-1][0] + ranges[-1][1] == field.offset:
+                ranges[-1] = (ranges[-1][0], field.end - ranges[-1][0])
+            else:
+                ranges.append((field.offset, field.end - field.offset))
+    except ProtobufScanError:
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+
+    # Protobuf の repeated フィールドはメッセージ内のどこに出現してもよいため、新しい metadata_props は末尾に追記する
+    metadata_props_bytes = encode_metadata_props(raw_metadata)
+    parts: list[bytes | tuple[int, int]] = [*ranges, metadata_props_bytes]
+
+    # すべての metadata_props が末尾に集まる場合は、ロケーターを付加してファイル末尾のみで読み込めるようにする
+    if not has_other_metadata_props:
+        metadata_props_offset = sum(length for _, length in ranges)
+        parts.append(encode_metadata_locator(metadata_props_bytes, metadata_props_offset))
+    return AivmVirtualFile(aivmx_file, parts)
@@ -0,0 +1,466 @@
+import os
+import stat
+import sys
+import tempfile
+import threading
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+from aivmlib import (
+    AivmLimitExceededError,
+    AivmValidationError,
+    _prepare_aivm_metadata_for_write,
+    _scan_aivmx_external_data,
+    _validate_aivmx_external_data,
+    read_aivm_metadata,
+    read_aivmx_metadata,
+    update_aivm_metadata,
+)
+from aivmlib.onnx_scanner import (
+    METADATA_LOCATOR_FIELD_NUMBER,
+    METADATA_PROPS_FIELD_NUMBER,
+    ProtobufScanError,
+    encode_metadata_locator,
+    encode_metadata_props,
+    read_metadata_props,
+    scan_model_fields,
+)
+from aivmlib.schemas.aivm_manifest import AivmMetadata, ModelFormat
+from aivmlib.utils import pread
+from aivmlib.virtual import (
+    DEFAULT_CHUNK_SIZE,
+    AivmVirtualFile,
+    _assemble_virtual_aivm_file,
+    _assemble_virtual_aivmx_file,
+)
+
+
+if sys.version_info >= (3, 11):
+    from enum import StrEnum
+else:
+    from aivmlib.utils import StrEnum
+
+
+# 巨大な AIVM / AIVMX ファイルの書き込みを、進捗の通知・キャンセル・メモリ使用量の上限付きで行うためのユーティリティ
+# write_aivm_metadata() / write_aivmx_metadata() はファイル全体をメモリ上に構築して返すため、ピーク時のメモリ使用量がファイルサイズの数倍になる
+# ここでは新しいメタデータ部分のみをメモリ上に保持し、Weight 部分は元のファイルからチャンクごとに読み取って出力先に書き込む
+
+# メモリ使用量の上限を指定した場合に、1 回に読み取り・書き込むバイト数の下限
+MIN_CHUNK_SIZE = 64 * 1024
+
+# AIVM メタデータのシリアライズ・バリデーションと、既存のメタデータ部分のパースで一時的に確保されるメモリの、
+# 書き込むメタデータと既存のメタデータ部分の合計バイト数に対する倍率
+## Pydantic によるシリアライズ・バリデーションと JSON のパース・再エンコードで、合計のおよそ 3 〜 4 倍のメモリが一時的に確保される
+_METADATA_MEMORY_FACTOR = 5
+# AIVM マニフェストのうちアイコン画像・ボイスサンプル音声以外の部分と、ハイパーパラメータのバイト数の見積もり
+_METADATA_BASE_SIZE = 64 * 1024
+
+
+class AivmWritePhase(StrEnum):
+    # AIVM メタデータのシリアライズ・バリデーションと、新しいメタデータ部分の構築
+    Metadata = 'metadata'
+    # 新しいメタデータ部分と Weight 部分の書き込み
+    Payload = 'payload'
+    # 書き込んだファイルのディスクへの反映と、出力先への置き換え
+    Finalize = 'finalize'
+
+
+@dataclass(frozen=True)
+class AivmWriteProgress:
+    """書き込みの進捗"""
+
+    # 現在の処理段階
+    phase: AivmWritePhase
+    # 書き込み済みのバイト数
+    bytes_done: int
+    # 書き込むファイル全体のバイト数
+    bytes_total: int
+
+
+class AivmWriteCancelledError(Exception):
+    """
+    書き込みがキャンセルされたときに発生する例外
+    """
+
+    pass
+
+
+class AivmCancellationToken:
+    """
+    書き込みをキャンセルするためのトークン
+    別スレッドやシグナルハンドラーから cancel() を呼ぶと、書き込み中の処理はチャンクの境界で中断される
+    """
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        """キャンセルが要求されているかどうか"""
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """
+        書き込みのキャンセルを要求する
+        """
+
+        self._event.set()
+
+    def raise_if_cancelled(self) -> None:
+        """
+        キャンセルが要求されていれば AivmWriteCancelledError を送出する
+
+        Raises:
+            AivmWriteCancelledError: キャンセルが要求されている場合
+        """
+
+        if self._event.is_set():
+            raise AivmWriteCancelledError('The write operation was cancelled.')
+
+
+# 書き込みの進捗を受け取るコールバック関数の型
+ProgressCallback = Callable[[AivmWriteProgress], None]
+
+
+@contextmanager
+def atomic_output(output_path: Path) -> Iterator[BinaryIO]:
+    """
+    出力先と同一のディレクトリに一時ファイルを作成し、ブロックを正常に抜けた場合のみ出力先に置き換えるコンテキストマネージャー
+    例外 (キャンセルや KeyboardInterrupt を含む) によってブロックを抜けた場合は、書き込み途中の一時ファイルを削除する
+
+    Args:
+        output_path (Path): 出力先のパス
+
+    Yields:
+        BinaryIO: 書き込み先の一時ファイル
+    """
+
+    with tempfile.NamedTemporaryFile(dir=output_path.parent, prefix=f'.{output_path.name}.', delete=False) as temp:
+        try:
+            yield temp
+            temp.flush()
+            os.fsync(temp.fileno())
+        except BaseException:
+            temp.close()
+            os.unlink(temp.name)
+            raise
+
+    # 一時ファイルは所有者のみ読み書き可能な権限で作成されるため、既存のファイルを置き換える場合はその権限を引き継ぎ、
+    # 新規に作成する場合は通常のファイルと同じ権限 (umask を適用したもの) に揃える
+    if output_path.exists():
+        mode = stat.S_IMODE(os.stat(output_path).st_mode)
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    os.chmod(temp.name, mode)
+    os.replace(temp.name, output_path)
+
+
+def write_aivm_file(
+    aivm_file: BinaryIO,
+    output_path: Path,
+    aivm_metadata: AivmMetadata,
+    progress_callback: ProgressCallback | None = None,
+    cancellation_token: AivmCancellationToken | None = None,
+    max_memory: int | None = None,
+) -> None:
+    """
+    AIVM メタデータを書き込んだ AIVM ファイルを、Weight 部分をメモリ上に読み込むことなく出力先に書き出す
+    write_aivm_metadata() の戻り値と同一のバイト列のファイルが得られる
+
+    Args:
+        aivm_file (BinaryIO): AIVM ファイル (または Safetensors ファイル)
+        output_path (Path): 出力先のパス (書き込み途中のファイルは一時ファイルとして作成され、完了時に置き換えられる)
+        aivm_metadata (AivmMetadata): AIVM メタデータ
+        progress_callback (ProgressCallback | None): 書き込みの進捗を受け取るコールバック関数 (チャンクごとに呼ばれる)
+        cancellation_token (AivmCancellationToken | None): 書き込みをキャンセルするためのトークン (チャンクの境界で確認される)
+        max_memory (int | None): メモリ使用量の上限 (estimate_write_memory() の見積もりが上限を超える場合は、書き込みを始める前にエラーとなる)
+
+    Raises:
+        AivmValidationError: AIVM ファイルのフォーマットが不正・スタイルベクトルが未指定の場合
+        AivmLimitExceededError: メモリ使用量の見積もりが上限を超える場合 (書き込みを始める前に送出される)
+        AivmWriteCancelledError: 書き込みがキャンセルされた場合 (書き込み途中のファイルは削除される)
+    """
+
+    # メモリ使用量の大半を占める AIVM メタデータのシリアライズを始める前に、見積もりが上限に収まるかを検査する
+    _report(progress_callback, cancellation_token, AivmWritePhase.Metadata, 0, 0)
+    required_memory = estimate_write_memory(aivm_file, aivm_metadata, ModelFormat.Safetensors)
+    chunk_size = _get_chunk_size(required_memory, max_memory)
+
+    raw_metadata = _prepare_aivm_metadata_for_write(aivm_metadata, ModelFormat.Safetensors)
+    virtual_file = _assemble_virtual_aivm_file(aivm_file, raw_metadata)
+    _write_virtual_file(virtual_file, output_path, chunk_size, progress_callback, cancellation_token)
+
+
+def write_aivmx_file(
+    aivmx_file: BinaryIO,
+    output_path: Path,
+    aivm_metadata: AivmMetadata,
+    external_data_dir: Path | None = None,
+    tail_metadata: bool = False,
+    progress_callback: ProgressCallback | None = None,
+    cancellation_token: AivmCancellationToken | None = None,
+    max_memory: int | None = None,
+) -> None:
+    """
+    AIVM メタデータを書き込んだ AIVMX ファイルを、ONNX モデル全体をパース・メモリ上に読み込むことなく出力先に書き出す
+    元の AIVMX ファイルから書き換え対象のキーの metadata_props のみを取り除き、新しい metadata_props を末尾に追記する
+    write_aivmx_metadata() の戻り値とはフィールドの並び順が異なりうるが、ONNX モデルとしては同一の内容となる
+
+    Args:
+        aivmx_file (BinaryIO): AIVMX ファイル (または ONNX ファイル)
+        output_path (Path): 出力先のパス (書き込み途中のファイルは一時ファイルとして作成され、完了時に置き換えられる)
+        aivm_metadata (AivmMetadata): AIVM メタデータ
+        external_data_dir (Path | None): 外部データファイルが配置されているディレクトリ
+            (指定時のみ、グラフ内に外部データを参照するテンソルが存在すれば、その参照が正しく解決できるかを検証する)
+            検証はグラフ内のフィールドのヘッダー部分のみを走査して行うため、ONNX モデル全体をメモリ上に読み込むことはない
+        tail_metadata (bool): True の場合、すべての metadata_props をファイル末尾に配置し、その位置を示すロケーターを付加する
+        progress_callback (ProgressCallback | None): 書き込みの進捗を受け取るコールバック関数 (チャンクごとに呼ばれる)
+        cancellation_token (AivmCancellationToken | None): 書き込みをキャンセルするためのトークン (チャンクの境界で確認される)
+        max_memory (int | None): メモリ使用量の上限 (estimate_write_memory() の見積もりが上限を超える場合は、書き込みを始める前にエラーとなる)
+
+    Raises:
+        AivmValidationError: AIVMX ファイルのフォーマットが不正・外部データへの参照を解決できない・スタイルベクトルが未指定の場合
+        AivmLimitExceededError: メモリ使用量の見積もりが上限を超える場合 (書き込みを始める前に送出される)
+        AivmWriteCancelledError: 書き込みがキャンセルされた場合 (書き込み途中のファイルは削除される)
+    """
+
+    # メモリ使用量の大半を占める AIVM メタデータのシリアライズを始める前に、見積もりが上限に収まるかを検査する
+    _report(progress_callback, cancellation_token, AivmWritePhase.Metadata, 0, 0)
+    required_memory = estimate_write_memory(aivmx_file, aivm_metadata, ModelFormat.ONNX)
+    chunk_size = _get_chunk_size(required_memory, max_memory)
+
+    # 外部データへの参照が正しく解決できるかを検証
+    ## グラフ内のフィールドのヘッダー部分のみを走査して参照情報を取り出すため、メモリ使用量はファイルサイズによらず一定に収まる
+    raw_metadata = _prepare_aivm_metadata_for_write(aivm_metadata, ModelFormat.ONNX)
+    if external_data_dir is not None:
+        _validate_aivmx_external_data(_scan_aivmx_external_data(aivmx_file), external_data_dir)
+
+    if tail_metadata:
+        virtual_file = _assemble_tail_metadata_aivmx_file(aivmx_file, raw_metadata)
+    else:
+        virtual_file = _assemble_virtual_aivmx_file(aivmx_file, raw_metadata)
+    _write_virtual_file(virtual_file, output_path, chunk_size, progress_callback, cancellation_token)
+
+
+@dataclass
+class AivmModelReplacementReport:
+    """モデルの差し替えの結果"""
+
+    # 差し替え後のファイルに書き込んだ AIVM メタデータ
+    metadata: AivmMetadata
+    # 既存の AIVM マニフェストと新しいハイパーパラメータのマージで発生した警告メッセージのリスト
+    warnings: list[str]
+
+
+def replace_aivm_model(
+    existing_file: BinaryIO,
+    existing_model_format: ModelFormat,
+    new_model_file: BinaryIO,
+    new_model_format: ModelFormat,
+    output_path: Path,
+    hyper_parameters_file: BinaryIO,
+    style_vectors_file: BinaryIO | None = None,
+    training_epochs: int | None = None,
+    training_steps: int | None = None,
+    external_data_dir: Path | None = None,
+    tail_metadata: bool = False,
+    progress_callback: ProgressCallback | None = None,
+    cancellation_token: AivmCancellationToken | None = None,
+    max_memory: int | None = None,
+) -> AivmModelReplacementReport:
+    """
+    既存の AIVM / AIVMX ファイルの AIVM メタデータを維持したまま、学習し直したモデルの重みに差し替えたファイルを書き出す
+    既存のファイルからはメタデータ部分のみを読み取り、update_aivm_metadata() で新しいハイパーパラメータ・スタイルベクトルとマージした上で、
+    新しいモデルの重みをメモリ上に読み込むことなく、マージした AIVM メタデータとともに出力先に書き込む
+    出力先は一時ファイルを経由して置き換えられるため、既存のファイル自体を出力先に指定して上書きすることもできる
+
+    Args:
+        existing_file (BinaryIO): 既存の AIVM / AIVMX ファイル
+        existing_model_format (ModelFormat): 既存のファイルのモデル形式
+        new_model_file (BinaryIO): 新しいモデルファイル (Safetensors / ONNX)
+        new_model_format (ModelFormat): 新しいモデルファイルのモデル形式 (出力されるファイルのモデル形式)
+        output_path (Path): 出力先のパス
+        hyper_parameters_file (BinaryIO): 新しいハイパーパラメータファイル
+        style_vectors_file (BinaryIO | None): 新しいスタイルベクトルファイル
+        training_epochs (int | None): 新しいモデルの学習エポック数 (省略時は既存の AIVM マニフェストの値を維持する)
+        training_steps (int | None): 新しいモデルの学習ステップ数 (省略時は既存の AIVM マニフェストの値を維持する)
+        external_data_dir (Path | None): 新しい ONNX モデルの外部データファイルが配置されているディレクトリ (指定時のみ参照を検証する)
+        tail_metadata (bool): True の場合、AIVMX ファイルの metadata_props をファイル末尾に配置する (AIVM ファイルの場合は無視される)
+        progress_callback (ProgressCallback | None): 書き込みの進捗を受け取るコールバック関数 (チャンクごとに呼ばれる)
+        cancellation_token (AivmCancellationToken | None): 書き込みをキャンセルするためのトークン (チャンクの境界で確認される)
+        max_memory (int | None): メモリ使用量の上限 (estimate_write_memory() の見積もりが上限を超える場合は、書き込みを始める前にエラーとなる)
+
+    Returns:
+        AivmModelReplacementReport: 書き込んだ AIVM メタデータと、マージで発生した警告メッセージ
+
+    Raises:
+        AivmValidationError: いずれかのファイルのフォーマットが不正・マージ後の AIVM メタデータが不正な場合
+        AivmLimitExceededError: メモリ使用量の見積もりが上限を超える場合 (書き込みを始める前に送出される)
+        AivmWriteCancelledError: 書き込みがキャンセルされた場合 (書き込み途中のファイルは削除され、出力先は変更されない)
+    """
+
+    # 既存のファイルのメタデータ部分のみを読み取り、新しいハイパーパラメータ・スタイルベクトルとマージする
+    if existing_model_format == ModelFormat.Safetensors:
+        existing_metadata = read_aivm_metadata(existing_file)
+    else:
+        existing_metadata = read_aivmx_metadata(existing_file)
+    metadata, warnings = update_aivm_metadata(existing_metadata, hyper_parameters_file, style_vectors_file)
+    if training_epochs is not None:
+        metadata.manifest.training_epochs = training_epochs
+    if training_steps is not None:
+        metadata.manifest.training_steps = training_steps
+
+    # マージした AIVM メタデータとともに、新しいモデルの重みをチャンクごとに書き込む
+    if new_model_format == ModelFormat.Safetensors:
+        write_aivm_file(
+            new_model_file,
+            output_path,
+            metadata,
+            progress_callback=progress_callback,
+            cancellation_token=cancellation_token,
+            max_memory=max_memory,
+        )
+    else:
+        write_aivmx_file(
+            new_model_file,
+            output_path,
+            metadata,
+            external_data_dir=external_data_dir,
+            tail_metadata=tail_metadata,
+            progress_callback=progress_callback,
+            cancellation_token=cancellation_token,
+            max_memory=max_memory,
+        )
+
+    return AivmModelReplacementReport(metadata=metadata, warnings=warnings)
+
+
+def estimate_write_memory(source_file: BinaryIO, aivm_metadata: AivmMetadata, model_format: ModelFormat) -> int:
+    """
+    write_aivm_file() / write_aivmx_file() のピーク時のメモリ使用量を、書き込みを始める前に見積もる
+    メモリ使用量は Weight 部分のサイズによらず、書き込む AIVM メタデータ (アイコン画像・ボイスサンプル音声を含む) と
+    元のファイルのメタデータ部分のサイズにほぼ比例する
+    ジョブスケジューラーなどで、複数の書き込みを同時に実行できるかを判断する用途を想定している
+
+    Args:
+        source_file (BinaryIO): 元の AIVM / AIVMX ファイル
+        aivm_metadata (AivmMetadata): 書き込む AIVM メタデータ
+        model_format (ModelFormat): 元のファイルのモデル形式
+
+    Returns:
+        int: ピーク時のメモリ使用量の見積もり (バイト数、読み取り用のチャンクの最小サイズを含む)
+
+    Raises:
+        AivmValidationError: 元のファイルのフォーマットが不正な場合
+    """
+
+    # 書き込む AIVM メタデータのうち、サイズの大半を占めるアイコン画像・ボイスサンプル音声・スタイルベクトルのバイト数を合計する
+    metadata_size = _METADATA_BASE_SIZE
+    for speaker in aivm_metadata.manifest.speakers:
+        metadata_size += len(speaker.icon)
+        for style in speaker.styles:
+            metadata_size += len(style.icon or '')
+            metadata_size += sum(len(sample.audio) + len(sample.transcript) * 4 for sample in style.voice_samples)
+    if aivm_metadata.style_vectors is not None:
+        metadata_size += len(aivm_metadata.style_vectors) * 4 // 3
+
+    # 元のファイルのメタデータ部分 (AIVM: ヘッダー / AIVMX: metadata_props) は、マージのために読み込まれる
+    if model_format == ModelFormat.Safetensors:
+        header_size_bytes = pread(source_file, 8, 0)
+        if len(header_size_bytes) < 8:
+            raise AivmValidationError('Failed to read header size. This file is not an AIVM (Safetensors) file.')
+        metadata_size += int.from_bytes(header_size_bytes, 'little')
+    else:
+        try:
+            fields = scan_model_fields(source_file)
+        except ProtobufScanError:
+            raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+        metadata_size += sum(
+            field.end - field.offset for field in fields if field.number == METADATA_PROPS_FIELD_NUMBER
+        )
+
+    return metadata_size * _METADATA_MEMORY_FACTOR + MIN_CHUNK_SIZE
+
+
+def _get_chunk_size(required_memory: int, max_memory: int | None) -> int:
+    """
+    メモリ使用量の見積もりが上限に収まることを確認し、残りの予算に収まる読み取り用のチャンクサイズを返す内部メソッド
+    """
+
+    if max_memory is None:
+        return DEFAULT_CHUNK_SIZE
+    if required_memory > max_memory:
+        raise AivmLimitExceededError(
+            f'Writing this file requires about {required_memory} bytes of memory, '
+            f'which exceeds the limit ({max_memory} bytes).'
+        )
+    return max(MIN_CHUNK_SIZE, min(DEFAULT_CHUNK_SIZE, max_memory - required_memory + MIN_CHUNK_SIZE))
+
+
+def _assemble_tail_metadata_aivmx_file(aivmx_file: BinaryIO, raw_metadata: dict[str, str]) -> AivmVirtualFile:
+    """
+    metadata_props 以外のフィールドの後に、既存のものとマージしたすべての metadata_props とロケーターを連結した仮想ファイルを構築する内部メソッド
+    """
+
+    ranges: list[tuple[int, int]] = []
+    try:
+        fields = scan_model_fields(aivmx_file)
+        metadata_props = read_metadata_props(aivmx_file, fields)
+    except ProtobufScanError:
+        raise AivmValidationError('Failed to decode AIVM metadata. This file is not an AIVMX (ONNX) file.')
+    for field in fields:
+        if field.number in (METADATA_PROPS_FIELD_NUMBER, METADATA_LOCATOR_FIELD_NUMBER):
+            continue
+        if ranges and ranges[-1][0] + ranges[-1][1] == field.offset:
+            ranges[-1] = (ranges[-1][0], field.end - ranges[-1][0])
+        else:
+            ranges.append((field.offset, field.end - field.offset))
+
+    metadata_props.update(raw_metadata)
+    metadata_props_bytes = encode_metadata_props(metadata_props)
+    locator_bytes = encode_metadata_locator(metadata_props_bytes, sum(length for _, length in ranges))
+    return AivmVirtualFile(aivmx_file, [*ranges, metadata_props_bytes, locator_bytes])
+
+
+def _write_virtual_file(
+    virtual_file: AivmVirtualFile,
+    output_path: Path,
+    chunk_size: int,
+    progress_callback: ProgressCallback | None,
+    cancellation_token: AivmCancellationToken | None,
+) -> None:
+    """
+    仮想ファイルをチャンクごとに出力先に書き出し、チャンクの境界で進捗の通知とキャンセルの確認を行う内部メソッド
+    """
+
+    bytes_total = virtual_file.size
+    bytes_done = 0
+    with atomic_output(output_path) as output_file:
+        _report(progress_callback, cancellation_token, AivmWritePhase.Payload, bytes_done, bytes_total)
+        for chunk in virtual_file.iter_chunks(chunk_size=chunk_size):
+            output_file.write(chunk)
+            bytes_done += len(chunk)
+            _report(progress_callback, cancellation_token, AivmWritePhase.Payload, bytes_done, bytes_total)
+        _report(progress_callback, cancellation_token, AivmWritePhase.Finalize, bytes_done, bytes_total)
+
+
+def _report(
+    progress_callback: ProgressCallback | None,
+    cancellation_token: AivmCancellationToken | None,
+    phase: AivmWritePhase,
+    bytes_done: int,
+    bytes_total: int,
+) -> None:
+    """
+    キャンセルが要求されていれば中断し、そうでなければ進捗を通知する内部メソッド
+    """
+
+    if cancellation_token is not None:
+        cancellation_token.raise_if_cancelled()
+    if progress_callback is not None:
+        progress_callback(AivmWriteProgress(phase=phase, bytes_done=bytes_done, bytes_total=bytes_total))
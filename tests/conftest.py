@@ -0,0 +1,115 @@
+import io
+import json
+import struct
+from pathlib import Path
+
+import numpy as np
+import onnx
+import pytest
+from onnx import TensorProto, helper, numpy_helper
+
+import aivmlib
+from aivmlib.schemas.aivm_manifest import AivmMetadata, ModelArchitecture
+from aivmlib.schemas.style_bert_vits2 import StyleBertVITS2HyperParameters
+
+
+# テストで使う AIVM / AIVMX ファイルは、小さな Safetensors / ONNX モデルとハイパーパラメータ・スタイルベクトルからその都度生成する
+
+
+def build_safetensors(tensors: dict[str, np.ndarray], indent: int | None = None) -> bytes:
+    """
+    テンソルの辞書から、辞書の順序どおりにテンソルを並べた Safetensors ファイルのバイト列を構築する
+    """
+
+    header: dict[str, object] = {}
+    blobs: list[bytes] = []
+    offset = 0
+    for name, array in tensors.items():
+        blob = array.astype('<f4').tobytes()
+        header[name] = {'dtype': 'F32', 'shape': list(array.shape), 'data_offsets': [offset, offset + len(blob)]}
+        blobs.append(blob)
+        offset += len(blob)
+    header['__metadata__'] = {'format': 'pt'}
+    header_bytes = json.dumps(header, indent=indent).encode('utf-8')
+    return struct.pack('<Q', len(header_bytes)) + header_bytes + b''.join(blobs)
+
+
+def build_onnx_model() -> onnx.ModelProto:
+    """
+    重みを 1 つだけ持つ小さな ONNX モデルを構築する
+    """
+
+    weight = numpy_helper.from_array(np.arange(64 * 64, dtype=np.float32).reshape(64, 64), 'W')
+    graph = helper.make_graph(
+        [helper.make_node('MatMul', ['X', 'W'], ['Y'])],
+        'graph',
+        [helper.make_tensor_value_info('X', TensorProto.FLOAT, [1, 64])],
+        [helper.make_tensor_value_info('Y', TensorProto.FLOAT, [1, 64])],
+        [weight],
+    )
+    return helper.make_model(graph)
+
+
+@pytest.fixture
+def tensors() -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(0)
+    return {f'enc.layer{index}.weight': rng.random(256, dtype=np.float32) for index in range(8)}
+
+
+@pytest.fixture
+def safetensors_bytes(tensors: dict[str, np.ndarray]) -> bytes:
+    return build_safetensors(tensors)
+
+
+@pytest.fixture
+def onnx_bytes() -> bytes:
+    return build_onnx_model().SerializeToString()
+
+
+@pytest.fixture
+def hyper_parameters_bytes() -> bytes:
+    hyper_parameters = StyleBertVITS2HyperParameters()
+    hyper_parameters.model_name = 'TestModel'
+    hyper_parameters.data.spk2id = {'SpeakerA': 0, 'SpeakerB': 1}
+    hyper_parameters.data.style2id = {'Neutral': 0, 'Happy': 1}
+    return hyper_parameters.model_dump_json().encode('utf-8')
+
+
+@pytest.fixture
+def style_vectors_bytes() -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, np.random.default_rng(0).random((2, 256), dtype=np.float32))
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def aivm_metadata(hyper_parameters_bytes: bytes, style_vectors_bytes: bytes) -> AivmMetadata:
+    return aivmlib.generate_aivm_metadata(
+        ModelArchitecture.StyleBertVITS2JPExtra,
+        io.BytesIO(hyper_parameters_bytes),
+        io.BytesIO(style_vectors_bytes),
+    )
+
+
+@pytest.fixture
+def aivm_bytes(safetensors_bytes: bytes, aivm_metadata: AivmMetadata) -> bytes:
+    return aivmlib.write_aivm_metadata(io.BytesIO(safetensors_bytes), aivm_metadata)
+
+
+@pytest.fixture
+def aivmx_bytes(onnx_bytes: bytes, aivm_metadata: AivmMetadata) -> bytes:
+    return aivmlib.write_aivmx_metadata(io.BytesIO(onnx_bytes), aivm_metadata)
+
+
+@pytest.fixture
+def aivm_path(tmp_path: Path, aivm_bytes: bytes) -> Path:
+    path = tmp_path / 'model.aivm'
+    path.write_bytes(aivm_bytes)
+    return path
+
+
+@pytest.fixture
+def aivmx_path(tmp_path: Path, aivmx_bytes: bytes) -> Path:
+    path = tmp_path / 'model.aivmx'
+    path.write_bytes(aivmx_bytes)
+    return path
@@ -0,0 +1,80 @@
+import io
+import json
+import struct
+
+import onnx
+
+import aivmlib
+from aivmlib.schemas.aivm_manifest import AivmMetadata
+
+
+def _reorder_aivm_header(aivm_bytes: bytes) -> bytes:
+    """
+    テンソルの並び順を逆にし、インデント付きでヘッダー JSON を書き直した、論理的に同一の AIVM ファイルを返す
+    """
+
+    header_size = struct.unpack('<Q', aivm_bytes[:8])[0]
+    header = json.loads(aivm_bytes[8 : 8 + header_size])
+    reordered = {name: header[name] for name in reversed(list(header))}
+    header_bytes = json.dumps(reordered, indent=4).encode('utf-8')
+    return struct.pack('<Q', len(header_bytes)) + header_bytes + aivm_bytes[8 + header_size :]
+
+
+def _reorder_onnx_metadata_props(onnx_bytes: bytes) -> bytes:
+    """
+    metadata_props の並び順を逆にした、論理的に同一の ONNX モデルを返す
+    """
+
+    model = onnx.load_from_string(onnx_bytes)
+    props = [(prop.key, prop.value) for prop in model.metadata_props]
+    del model.metadata_props[:]
+    for key, value in reversed(props):
+        model.metadata_props.add(key=key, value=value)
+    return model.SerializeToString()
+
+
+def _reorder_spk2id(aivm_metadata: AivmMetadata) -> AivmMetadata:
+    """
+    spk2id の挿入順を逆にした、論理的に同一の AIVM メタデータを返す
+    """
+
+    hyper_parameters = aivm_metadata.hyper_parameters.model_copy(deep=True)
+    hyper_parameters.data.spk2id = dict(reversed(list(hyper_parameters.data.spk2id.items())))
+    return AivmMetadata(
+        manifest=aivm_metadata.manifest.model_copy(deep=True),
+        hyper_parameters=hyper_parameters,
+        style_vectors=aivm_metadata.style_vectors,
+    )
+
+
+def test_canonical_aivm_is_byte_identical(aivm_bytes: bytes, aivm_metadata: AivmMetadata) -> None:
+    variant_bytes = _reorder_aivm_header(aivm_bytes)
+    variant_metadata = _reorder_spk2id(aivm_metadata)
+    assert variant_bytes != aivm_bytes
+    assert list(variant_metadata.hyper_parameters.data.spk2id) != list(aivm_metadata.hyper_parameters.data.spk2id)
+
+    expected = aivmlib.write_aivm_metadata(io.BytesIO(aivm_bytes), aivm_metadata, canonical=True)
+    actual = aivmlib.write_aivm_metadata(io.BytesIO(variant_bytes), variant_metadata, canonical=True)
+    assert actual == expected
+    assert aivmlib.write_aivm_metadata(io.BytesIO(expected), aivm_metadata, canonical=True) == expected
+
+
+def test_canonical_aivmx_is_byte_identical(aivmx_bytes: bytes, aivm_metadata: AivmMetadata) -> None:
+    model = onnx.load_from_string(aivmx_bytes)
+    model.metadata_props.add(key='author', value='test')
+    base_bytes = model.SerializeToString()
+    variant_bytes = _reorder_onnx_metadata_props(base_bytes)
+    variant_metadata = _reorder_spk2id(aivm_metadata)
+    assert variant_bytes != base_bytes
+
+    expected = aivmlib.write_aivmx_metadata(io.BytesIO(base_bytes), aivm_metadata, canonical=True)
+    actual = aivmlib.write_aivmx_metadata(io.BytesIO(variant_bytes), variant_metadata, canonical=True)
+    assert actual == expected
+    assert aivmlib.write_aivmx_metadata(io.BytesIO(expected), aivm_metadata, canonical=True) == expected
+
+
+def test_non_canonical_output_keeps_input_order(aivm_bytes: bytes, aivm_metadata: AivmMetadata) -> None:
+    variant_bytes = _reorder_aivm_header(aivm_bytes)
+    expected = aivmlib.write_aivm_metadata(io.BytesIO(aivm_bytes), aivm_metadata)
+    actual = aivmlib.write_aivm_metadata(io.BytesIO(variant_bytes), aivm_metadata)
+    assert actual != expected
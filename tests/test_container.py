@@ -0,0 +1,136 @@
+import io
+from pathlib import Path
+
+import pytest
+
+import aivmlib
+from aivmlib import AivmValidationError
+from aivmlib.container import (
+    _FOOTER_STRUCT,
+    _FRAME_HEADER_STRUCT,
+    _INDEX_ENTRY_STRUCT,
+    _PRELUDE_STRUCT,
+    DEFAULT_FRAME_SIZE,
+    AivmContainerReader,
+    ContainerCodec,
+    _ContainerPayloadFile,
+    pack_aivm_container,
+)
+from aivmlib.schemas.aivm_manifest import ModelFormat
+
+
+@pytest.fixture(params=[ModelFormat.Safetensors, ModelFormat.ONNX])
+def model(request: pytest.FixtureRequest, aivm_bytes: bytes, aivmx_bytes: bytes) -> tuple[bytes, ModelFormat]:
+    if request.param == ModelFormat.ONNX:
+        return aivmx_bytes, ModelFormat.ONNX
+    return aivm_bytes, ModelFormat.Safetensors
+
+
+def _pack(data: bytes, model_format: ModelFormat, codec: ContainerCodec, frame_size: int = 4096) -> bytes:
+    output = io.BytesIO()
+    pack_aivm_container(io.BytesIO(data), output, model_format, codec, frame_size)
+    return output.getvalue()
+
+
+def _unpack(container: bytes) -> bytes:
+    output = io.BytesIO()
+    AivmContainerReader(io.BytesIO(container)).unpack(output)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize('codec', list(ContainerCodec))
+@pytest.mark.parametrize('frame_size', [1000, 4096, 10000, DEFAULT_FRAME_SIZE])
+def test_round_trip(model: tuple[bytes, ModelFormat], codec: ContainerCodec, frame_size: int) -> None:
+    data, model_format = model
+    container = _pack(data, model_format, codec, frame_size)
+    assert _unpack(container) == data
+
+    reader = AivmContainerReader(io.BytesIO(container))
+    assert reader.codec == codec
+    assert reader.model_format == model_format
+    assert reader.original_size == len(data)
+    if model_format == ModelFormat.Safetensors:
+        expected = aivmlib.read_aivm_metadata(io.BytesIO(data))
+    else:
+        expected = aivmlib.read_aivmx_metadata(io.BytesIO(data))
+    assert reader.read_metadata().manifest == expected.manifest
+
+    # 仮想ファイルは、フレーム境界をまたぐ任意の位置から元のファイルと同一の内容を読み取れる
+    with reader.open() as virtual_file:
+        for offset in (0, frame_size - 1, len(data) // 2, len(data) - 1):
+            virtual_file.seek(offset)
+            assert virtual_file.read(frame_size + 2) == data[offset : offset + frame_size + 2]
+        virtual_file.seek(len(data) // 3)
+        assert virtual_file.read() == data[len(data) // 3 :]
+
+
+def test_payload_file_reads_to_end(aivm_bytes: bytes) -> None:
+    reader = AivmContainerReader(io.BytesIO(_pack(aivm_bytes, ModelFormat.Safetensors, ContainerCodec.Zlib)))
+    payload_file = _ContainerPayloadFile(reader)
+    payload = payload_file.read()
+    assert len(payload) == reader.original_size - sum(len(data) for _, data in reader._head_parts)
+    assert aivm_bytes.endswith(payload)
+    payload_file.seek(10)
+    assert payload_file.read(-1) == payload[10:]
+    assert payload_file.read() == b''
+
+
+@pytest.mark.parametrize('codec', list(ContainerCodec))
+def test_corrupted_frame_is_rejected(model: tuple[bytes, ModelFormat], codec: ContainerCodec) -> None:
+    data, model_format = model
+    container = bytearray(_pack(data, model_format, codec))
+    reader = AivmContainerReader(io.BytesIO(bytes(container)))
+    index = reader._load_index()
+
+    # 圧縮データの破損 (伸長に失敗する・CRC32 が一致しない)
+    frame_offset, compressed_size, _ = index[len(index) // 2]
+    corrupted = container.copy()
+    corrupted[frame_offset + _FRAME_HEADER_STRUCT.size + compressed_size // 2] ^= 0xFF
+    with pytest.raises(AivmValidationError):
+        _unpack(bytes(corrupted))
+
+    # 伸長後の内容が記録されている CRC32 と一致しない
+    corrupted = container.copy()
+    index_offset = _FOOTER_STRUCT.unpack_from(container, len(container) - _FOOTER_STRUCT.size)[0]
+    corrupted[index_offset + (len(index) // 2) * _INDEX_ENTRY_STRUCT.size + 12] ^= 0xFF
+    with pytest.raises(AivmValidationError):
+        _unpack(bytes(corrupted))
+
+
+def test_corrupted_header_is_rejected(aivm_bytes: bytes) -> None:
+    container = _pack(aivm_bytes, ModelFormat.Safetensors, ContainerCodec.Zlib)
+
+    def corrupt(offset: int) -> bytes:
+        corrupted = bytearray(container)
+        corrupted[offset] ^= 0xFF
+        return bytes(corrupted)
+
+    invalid_containers = [
+        # 圧縮コンテナではない・プレリュードが途中で切れている
+        aivm_bytes,
+        container[: _PRELUDE_STRUCT.size - 1],
+        # マジックナンバー・バージョン・圧縮方式・モデル形式が不正
+        corrupt(0),
+        corrupt(8),
+        corrupt(10),
+        corrupt(11),
+        # ヘッドフレームが破損している・途中で切れている
+        corrupt(_PRELUDE_STRUCT.size + 4),
+        container[: _PRELUDE_STRUCT.size + 4],
+    ]
+    for invalid_container in invalid_containers:
+        with pytest.raises(AivmValidationError):
+            AivmContainerReader(io.BytesIO(invalid_container))
+
+    # フッター・フレームインデックスの不整合は、ペイロードの読み取り時に検出される
+    for invalid_container in (corrupt(len(container) - 1), corrupt(len(container) - 20), container[:-1]):
+        reader = AivmContainerReader(io.BytesIO(invalid_container))
+        reader.read_metadata()
+        with pytest.raises(AivmValidationError):
+            reader.unpack(io.BytesIO())
+
+
+def test_pack_rejects_invalid_frame_size(aivm_path: Path) -> None:
+    for frame_size in (0, -1, 0x100000000):
+        with aivm_path.open('rb') as file, pytest.raises(ValueError):
+            pack_aivm_container(file, io.BytesIO(), ModelFormat.Safetensors, frame_size=frame_size)
@@ -0,0 +1,165 @@
+import io
+from pathlib import Path
+
+import numpy as np
+import onnx
+import onnx.external_data_helper
+import pytest
+from onnx import TensorProto, helper, numpy_helper
+
+import aivmlib
+from aivmlib import AivmLimitExceededError, AivmValidationError
+from aivmlib.onnx_scanner import scan_external_data_tensors
+from aivmlib.schemas.aivm_manifest import AivmMetadata, ModelFormat
+from aivmlib.writer import replace_aivm_model, write_aivmx_file
+
+
+def _build_nested_model() -> onnx.ModelProto:
+    """
+    initializer・ノード属性・サブグラフ内のノード属性にテンソルを持つ ONNX モデルを構築する
+    """
+
+    then_branch = helper.make_graph(
+        [helper.make_node('Constant', [], ['B'], value=numpy_helper.from_array(np.ones(256, np.float32), 'B'))],
+        'then_branch',
+        [],
+        [helper.make_tensor_value_info('B', TensorProto.FLOAT, [256])],
+    )
+    else_branch = helper.make_graph(
+        [helper.make_node('Constant', [], ['C'], value=numpy_helper.from_array(np.zeros(256, np.float32), 'C'))],
+        'else_branch',
+        [],
+        [helper.make_tensor_value_info('C', TensorProto.FLOAT, [256])],
+    )
+    graph = helper.make_graph(
+        [
+            helper.make_node('Constant', [], ['A'], value=numpy_helper.from_array(np.full(256, 2, np.float32), 'A')),
+            helper.make_node('If', ['cond'], ['Y'], then_branch=then_branch, else_branch=else_branch),
+        ],
+        'graph',
+        [helper.make_tensor_value_info('cond', TensorProto.BOOL, [])],
+        [helper.make_tensor_value_info('Y', TensorProto.FLOAT, [256])],
+        [numpy_helper.from_array(np.arange(64 * 64, dtype=np.float32).reshape(64, 64), 'W')],
+    )
+    return helper.make_model(graph)
+
+
+@pytest.fixture
+def external_onnx_path(tmp_path: Path) -> Path:
+    path = tmp_path / 'model.onnx'
+    onnx.save_model(
+        _build_nested_model(),
+        path,
+        save_as_external_data=True,
+        location='model.onnx.data',
+        size_threshold=0,
+        convert_attribute=True,
+    )
+    return path
+
+
+@pytest.fixture
+def no_model_load(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    ONNX モデル全体のパースが行われた場合に失敗させる
+    """
+
+    def fail(*args: object, **kwargs: object) -> None:
+        raise AssertionError('The whole ONNX model must not be parsed.')
+
+    monkeypatch.setattr(onnx, 'load_model_from_string', fail)
+
+
+def test_scan_matches_onnx(external_onnx_path: Path) -> None:
+    model = onnx.load_model(external_onnx_path, load_external_data=False)
+    expected = {
+        tensor.name: onnx.external_data_helper.ExternalDataInfo(tensor)
+        for tensor in onnx.external_data_helper._get_all_tensors(model)
+        if onnx.external_data_helper.uses_external_data(tensor)
+    }
+    assert set(expected) == {'W', 'A', 'B', 'C'}
+
+    with external_onnx_path.open('rb') as file:
+        references = scan_external_data_tensors(file)
+    assert {reference.name for reference in references} == set(expected)
+    for reference in references:
+        assert reference.location == expected[reference.name].location
+        assert reference.offset == (expected[reference.name].offset or 0)
+        assert reference.length == expected[reference.name].length
+
+
+def test_uses_external_data(external_onnx_path: Path, onnx_bytes: bytes, no_model_load: None) -> None:
+    with external_onnx_path.open('rb') as file:
+        assert aivmlib.aivmx_uses_external_data(file)
+    assert not aivmlib.aivmx_uses_external_data(io.BytesIO(onnx_bytes))
+
+
+def test_read_validates_external_data_without_parsing(
+    external_onnx_path: Path, aivm_metadata: AivmMetadata, no_model_load: None
+) -> None:
+    aivmx_path = external_onnx_path.with_suffix('.aivmx')
+    with external_onnx_path.open('rb') as file:
+        write_aivmx_file(file, aivmx_path, aivm_metadata, external_data_dir=external_onnx_path.parent)
+
+    with aivmx_path.open('rb') as file:
+        metadata = aivmlib.read_aivmx_metadata(file, external_data_dir=aivmx_path.parent)
+    assert metadata.manifest.name == aivm_metadata.manifest.name
+
+    # 外部データファイルが切り詰められている場合は、参照を解決できないためエラーとなる
+    data_path = external_onnx_path.parent / 'model.onnx.data'
+    data_path.write_bytes(data_path.read_bytes()[:100])
+    with aivmx_path.open('rb') as file, pytest.raises(AivmValidationError):
+        aivmlib.read_aivmx_metadata(file, external_data_dir=aivmx_path.parent)
+    data_path.unlink()
+    with aivmx_path.open('rb') as file, pytest.raises(AivmValidationError):
+        aivmlib.read_aivmx_metadata(file, external_data_dir=aivmx_path.parent)
+
+
+def test_read_inline_model_with_external_data_dir(aivmx_path: Path, no_model_load: None) -> None:
+    # 外部データを参照していない場合は、外部データファイルが存在しなくても検証は何も行わない
+    with aivmx_path.open('rb') as file:
+        aivmlib.read_aivmx_metadata(file, external_data_dir=aivmx_path.parent / 'missing')
+
+
+def test_external_data_outside_of_directory_is_rejected(tmp_path: Path, external_onnx_path: Path) -> None:
+    model = onnx.load_model(external_onnx_path, load_external_data=False)
+    for tensor in onnx.external_data_helper._get_all_tensors(model):
+        for entry in tensor.external_data:
+            if entry.key == 'location':
+                entry.value = '../model.onnx.data'
+    with pytest.raises(AivmValidationError):
+        aivmlib.read_aivmx_metadata(io.BytesIO(model.SerializeToString()), external_data_dir=tmp_path)
+
+
+def test_scan_respects_field_limit(external_onnx_path: Path) -> None:
+    with external_onnx_path.open('rb') as file, pytest.raises(AivmLimitExceededError):
+        aivmlib.read_aivmx_metadata(
+            file, external_data_dir=external_onnx_path.parent, limits=aivmlib.AivmParseLimits(max_protobuf_fields=10)
+        )
+
+
+def test_replace_model_with_external_data(
+    external_onnx_path: Path,
+    aivmx_path: Path,
+    hyper_parameters_bytes: bytes,
+    style_vectors_bytes: bytes,
+    no_model_load: None,
+) -> None:
+    output_path = external_onnx_path.with_suffix('.aivmx')
+    with external_onnx_path.open('rb') as model_file, aivmx_path.open('rb') as existing_file:
+        assert aivmlib.aivmx_uses_external_data(model_file)
+        replace_aivm_model(
+            existing_file,
+            ModelFormat.ONNX,
+            model_file,
+            ModelFormat.ONNX,
+            output_path,
+            io.BytesIO(hyper_parameters_bytes),
+            io.BytesIO(style_vectors_bytes),
+            external_data_dir=external_onnx_path.parent,
+        )
+
+    # 差し替え後のファイルも外部データへの参照を保持しており、ONNX モデルとして有効である
+    with output_path.open('rb') as file:
+        aivmlib.read_aivmx_metadata(file, external_data_dir=output_path.parent)
+    onnx.checker.check_model(str(output_path))
@@ -0,0 +1,176 @@
+import io
+import json
+import struct
+from pathlib import Path
+
+import numpy as np
+import onnx
+import pytest
+from conftest import build_safetensors
+
+import aivmlib
+from aivmlib import _splice_aivm_header_metadata
+from aivmlib.handle import AivmFile, AivmWriteStrategy, AivmxFile, _AivmFileHandle
+from aivmlib.schemas.aivm_manifest import AivmMetadata
+
+
+def _read_header_text(path: Path) -> str:
+    data = path.read_bytes()
+    header_size = struct.unpack('<Q', data[:8])[0]
+    return data[8 : 8 + header_size].decode('utf-8')
+
+
+def _write_header(path: Path, header_text: str, payload: bytes) -> None:
+    header_bytes = header_text.encode('utf-8')
+    path.write_bytes(struct.pack('<Q', len(header_bytes)) + header_bytes + payload)
+
+
+def test_metadata_is_spliced_at_any_position(aivm_path: Path) -> None:
+    # テスト用の AIVM ファイルは、Safetensors の一般的な書き出し方と同様に __metadata__ が末尾にある
+    header_text = _read_header_text(aivm_path)
+    assert list(json.loads(header_text))[-1] == '__metadata__'
+
+    with AivmFile(aivm_path) as aivm_file:
+        aivm_file.metadata.manifest.name = 'Spliced'
+        assert aivm_file.commit(allow_in_place=False) == AivmWriteStrategy.Splice
+
+    # __metadata__ 以外のテンソル情報は、元の書式のまま保持される
+    new_header_text = _read_header_text(aivm_path)
+    metadata_start = header_text.index('"__metadata__"')
+    assert new_header_text[:metadata_start] == header_text[:metadata_start]
+    assert list(json.loads(new_header_text))[-1] == '__metadata__'
+    with aivm_path.open('rb') as file:
+        assert aivmlib.read_aivm_metadata(file).manifest.name == 'Spliced'
+
+
+@pytest.mark.parametrize(
+    'header_text',
+    [
+        # エスケープされたキーは、デコードすると __metadata__ と重複している
+        '{"\\u005f_metadata__": {"format": "pt"}, "__metadata__": {"format": "pt"}}',
+        '{"__metadata__": {"format": "pt"}, "\\u005f_metadata__": {"format": "pt"}}',
+        # エスケープされたキーのみの場合も、安全側に倒して置き換えない
+        '{"\\u005f_metadata__": {"format": "pt"}}',
+        # キーが重複している
+        '{"__metadata__": {"format": "pt"}, "w": {}, "__metadata__": {}}',
+        # オブジェクトの後ろに余分なデータがある
+        '{"__metadata__": {}} {}',
+    ],
+)
+def test_irregular_header_is_not_spliced(header_text: str) -> None:
+    assert _splice_aivm_header_metadata(header_text, {'key': 'value'}) is None
+
+
+def test_irregular_header_is_rewritten(tmp_path: Path, aivm_bytes: bytes) -> None:
+    header_size = struct.unpack('<Q', aivm_bytes[:8])[0]
+    header = json.loads(aivm_bytes[8 : 8 + header_size])
+    metadata = header.pop('__metadata__')
+    header_text = json.dumps(header)[:-1] + ', "\\u005f_metadata__": ' + json.dumps(metadata) + '}'
+    path = tmp_path / 'escaped.aivm'
+    _write_header(path, header_text, aivm_bytes[8 + header_size :])
+
+    with AivmFile(path) as aivm_file:
+        aivm_file.metadata.manifest.name = 'Rewritten'
+        assert aivm_file.commit(allow_in_place=False) == AivmWriteStrategy.Rewrite
+    with path.open('rb') as file:
+        assert aivmlib.read_aivm_metadata(file).manifest.name == 'Rewritten'
+    assert path.read_bytes().endswith(aivm_bytes[8 + header_size :])
+
+
+def test_write_keeps_tensor_formatting(tensors: dict[str, np.ndarray], aivm_metadata: AivmMetadata) -> None:
+    # write_aivm_metadata() も __metadata__ の位置によらず、テンソル情報の書式 (インデントなど) を保持する
+    safetensors_bytes = build_safetensors(tensors, indent=2)
+    header_size = struct.unpack('<Q', safetensors_bytes[:8])[0]
+    header_text = safetensors_bytes[8 : 8 + header_size].decode('utf-8')
+    aivm_bytes = aivmlib.write_aivm_metadata(io.BytesIO(safetensors_bytes), aivm_metadata)
+    new_header_size = struct.unpack('<Q', aivm_bytes[:8])[0]
+    new_header_text = aivm_bytes[8 : 8 + new_header_size].decode('utf-8')
+    metadata_start = header_text.index('"__metadata__"')
+    assert new_header_text[:metadata_start] == header_text[:metadata_start]
+
+
+def _read_aivm(path: Path) -> AivmMetadata:
+    with path.open('rb') as file:
+        return aivmlib.read_aivm_metadata(file)
+
+
+def _read_aivmx(path: Path) -> AivmMetadata:
+    with path.open('rb') as file:
+        metadata = aivmlib.read_aivmx_metadata(file)
+    onnx.checker.check_model(onnx.load_model_from_string(path.read_bytes()))
+    return metadata
+
+
+def _payload(path: Path) -> bytes:
+    data = path.read_bytes()
+    return data[8 + struct.unpack('<Q', data[:8])[0] :]
+
+
+def test_aivm_commit_strategies(aivm_path: Path) -> None:
+    payload = _payload(aivm_path)
+    with AivmFile(aivm_path) as aivm_file:
+        # 変更がなければ何も書き込まない
+        assert aivm_file.commit() is None
+
+        # 既存のヘッダーに収まる変更は、ヘッダーサイズを変えずにその場で上書きする
+        size = aivm_path.stat().st_size
+        aivm_file.metadata.manifest.name = 'A'
+        assert aivm_file.commit() == AivmWriteStrategy.InPlace
+        assert aivm_path.stat().st_size == size
+        assert _read_aivm(aivm_path).manifest.name == 'A'
+
+        # 収まらない変更は __metadata__ のみを置き換えたファイルに差し替え、以降のために余白を確保する
+        aivm_file.metadata.manifest.description = 'x' * 100
+        assert aivm_file.commit(header_reserve=1024) == AivmWriteStrategy.Splice
+        assert _read_aivm(aivm_path).manifest.description == 'x' * 100
+
+        # 確保した余白に収まる限り、繰り返しの変更はその場での上書きとなる
+        for index in range(10):
+            aivm_file.metadata.manifest.name = f'Name {index}' * (index + 1)
+            assert aivm_file.commit() == AivmWriteStrategy.InPlace
+            assert _read_aivm(aivm_path).manifest.name == f'Name {index}' * (index + 1)
+
+        # 上書きを許可しない場合は、収まる変更でもファイルを置き換える
+        aivm_file.metadata.manifest.name = 'B'
+        assert aivm_file.commit(allow_in_place=False) == AivmWriteStrategy.Splice
+
+        # 正規形で書き込む場合は、ヘッダー JSON 全体を構築し直す
+        assert aivm_file.commit(canonical=True) == AivmWriteStrategy.Rewrite
+
+    assert _read_aivm(aivm_path).manifest.name == 'B'
+    assert _payload(aivm_path) == payload
+
+
+def test_aivmx_commit_strategies(aivmx_path: Path) -> None:
+    # metadata_props の後ろに別のフィールドがあり、metadata_props がファイル末尾にまとまっていない AIVMX ファイル
+    doc_string = b'doc'
+    aivmx_path.write_bytes(aivmx_path.read_bytes() + b'\x32' + bytes([len(doc_string)]) + doc_string)
+    graph = onnx.load_model_from_string(aivmx_path.read_bytes()).graph.SerializeToString()
+
+    with AivmxFile(aivmx_path) as aivmx_file:
+        assert aivmx_file.commit() is None
+
+        # 初回は metadata_props を末尾に集めたファイルに差し替え、ロケーターを付加する
+        aivmx_file.metadata.manifest.name = 'A'
+        assert aivmx_file.commit() == AivmWriteStrategy.Splice
+        assert _read_aivmx(aivmx_path).manifest.name == 'A'
+
+        # 以降はサイズが変わっても、ファイル末尾の metadata_props のみをその場で上書きする
+        for index in range(10):
+            aivmx_file.metadata.manifest.name = f'Name {index}' * (10 - index)
+            assert aivmx_file.commit() == AivmWriteStrategy.InPlace
+            assert _read_aivmx(aivmx_path).manifest.name == f'Name {index}' * (10 - index)
+
+        aivmx_file.metadata.manifest.name = 'B'
+        assert aivmx_file.commit(allow_in_place=False) == AivmWriteStrategy.Splice
+        assert aivmx_file.commit(canonical=True) == AivmWriteStrategy.Rewrite
+
+    model = onnx.load_model_from_string(aivmx_path.read_bytes())
+    assert model.doc_string == 'doc'
+    assert model.graph.SerializeToString() == graph
+    assert _read_aivmx(aivmx_path).manifest.name == 'B'
+
+
+def test_handle_base_is_abstract(aivm_path: Path) -> None:
+    with pytest.raises(TypeError):
+        _AivmFileHandle(aivm_path)  # type: ignore[abstract]
@@ -0,0 +1,28 @@
+import json
+from pathlib import Path
+
+from aivmlib.indexer import INDEX_FORMAT_VERSION, AivmModelIndex
+
+
+def test_refresh_and_reload(aivm_path: Path, aivmx_path: Path, tmp_path: Path) -> None:
+    index = AivmModelIndex(aivm_path.parent)
+    changes = index.refresh()
+    assert sorted(changes.added) == ['model.aivm', 'model.aivmx']
+    index_path = tmp_path / 'index.json'
+    index.save(index_path)
+
+    # 保存した索引を読み込んだ後は、変更のないファイルは読み直されない
+    reloaded = AivmModelIndex(aivm_path.parent)
+    reloaded.load(index_path)
+    assert not reloaded.refresh()
+    assert reloaded.entries['model.aivm'].manifest == index.entries['model.aivm'].manifest
+
+
+def test_load_malformed_index_falls_back_to_full_scan(aivm_path: Path, tmp_path: Path) -> None:
+    index_path = tmp_path / 'index.json'
+    for models in ({'model.aivm': {'size': 1}}, {'model.aivm': [1, 2]}, [1, 2]):
+        index_path.write_text(json.dumps({'version': INDEX_FORMAT_VERSION, 'models': models}), encoding='utf-8')
+        index = AivmModelIndex(aivm_path.parent)
+        index.load(index_path)
+        assert index.entries == {}
+        assert index.refresh().added == ['model.aivm']
@@ -0,0 +1,42 @@
+import json
+import struct
+from pathlib import Path
+
+import pytest
+
+import aivmlib
+from aivmlib import AivmValidationError
+from aivmlib.lazy import read_aivm_metadata_lazy, read_aivmx_metadata_lazy
+
+
+def test_lazy_read_matches_eager_read(aivm_path: Path, aivmx_path: Path) -> None:
+    for path, lazy_reader, reader in (
+        (aivm_path, read_aivm_metadata_lazy, aivmlib.read_aivm_metadata),
+        (aivmx_path, read_aivmx_metadata_lazy, aivmlib.read_aivmx_metadata),
+    ):
+        with path.open('rb') as file:
+            expected = reader(file)
+        metadata = lazy_reader(path)
+        icon = metadata.manifest.speakers[0].icon
+        assert icon is not None
+        assert icon.to_data_url() == expected.manifest.speakers[0].icon
+        assert metadata.hyper_parameters == expected.hyper_parameters
+
+
+@pytest.mark.parametrize('header', [b'[1,2]', b'"text"', b'null', b'{"a":', b'\xff\xfe'])
+def test_lazy_read_rejects_non_object_header(tmp_path: Path, header: bytes) -> None:
+    path = tmp_path / 'bad.aivm'
+    path.write_bytes(struct.pack('<Q', len(header)) + header)
+    with pytest.raises(AivmValidationError):
+        read_aivm_metadata_lazy(path)
+    # 通常の読み込みと同じ例外となる
+    with path.open('rb') as file, pytest.raises(AivmValidationError):
+        aivmlib.read_aivm_metadata(file)
+
+
+def test_lazy_read_rejects_missing_metadata(tmp_path: Path) -> None:
+    header = json.dumps({'weight': {'dtype': 'F32', 'shape': [0], 'data_offsets': [0, 0]}}).encode('utf-8')
+    path = tmp_path / 'bad.aivm'
+    path.write_bytes(struct.pack('<Q', len(header)) + header)
+    with pytest.raises(AivmValidationError):
+        read_aivm_metadata_lazy(path)
@@ -0,0 +1,113 @@
+import io
+import json
+import random
+import struct
+import time
+from collections.abc import Callable
+from typing import Any
+
+import pytest
+
+import aivmlib
+from aivmlib import AivmLimitExceededError, AivmParseLimits, AivmValidationError
+
+
+# 上限の検査は入力の大きさに関係なく、この時間以内に終わることを期待する
+# (CI 環境の揺らぎを考慮して十分に余裕を持たせている)
+TIME_BOUND = 2.0
+
+
+def _wrap_header(header: dict[str, Any]) -> io.BytesIO:
+    header_bytes = json.dumps(header).encode('utf-8')
+    return io.BytesIO(struct.pack('<Q', len(header_bytes)) + header_bytes)
+
+
+def _with_manifest(aivm_bytes: bytes, mutate: Callable[[dict[str, Any]], None]) -> io.BytesIO:
+    header_size = struct.unpack('<Q', aivm_bytes[:8])[0]
+    header = json.loads(aivm_bytes[8 : 8 + header_size])
+    manifest = json.loads(header['__metadata__']['aivm_manifest'])
+    mutate(manifest)
+    header['__metadata__']['aivm_manifest'] = json.dumps(manifest)
+    return _wrap_header(header)
+
+
+def _assert_rejected_in_time(read: Callable[[], object]) -> None:
+    start = time.perf_counter()
+    with pytest.raises(AivmLimitExceededError):
+        read()
+    assert time.perf_counter() - start < TIME_BOUND
+
+
+def test_huge_header_size_is_rejected_before_reading() -> None:
+    file = io.BytesIO(struct.pack('<Q', 90 * 1024 * 1024) + b'{}')
+    _assert_rejected_in_time(lambda: aivmlib.read_aivm_metadata(file, AivmParseLimits()))
+
+
+def test_deeply_nested_header_is_rejected() -> None:
+    header = b'[' * 1_000_000 + b']' * 1_000_000
+    file = io.BytesIO(struct.pack('<Q', len(header)) + header)
+    _assert_rejected_in_time(lambda: aivmlib.read_aivm_metadata(file, AivmParseLimits()))
+
+
+def test_deeply_nested_manifest_is_rejected(aivm_bytes: bytes) -> None:
+    # json.dumps では再帰の上限に達するため、エンコード後のマニフェストの文字列を直接書き換える
+    header_size = struct.unpack('<Q', aivm_bytes[:8])[0]
+    header = json.loads(aivm_bytes[8 : 8 + header_size])
+    manifest = header['__metadata__']['aivm_manifest']
+    header['__metadata__']['aivm_manifest'] = '{"description": ' + '[' * 100_000 + ']' * 100_000 + ', ' + manifest[1:]
+    file = _wrap_header(header)
+    _assert_rejected_in_time(lambda: aivmlib.read_aivm_metadata(file, AivmParseLimits()))
+
+
+def test_huge_speaker_count_is_rejected(aivm_bytes: bytes) -> None:
+    def mutate(manifest: dict[str, Any]) -> None:
+        manifest['speakers'] = manifest['speakers'] * 10_000
+
+    file = _with_manifest(aivm_bytes, mutate)
+    _assert_rejected_in_time(lambda: aivmlib.read_aivm_metadata(file, AivmParseLimits(max_manifest_size=1 << 30)))
+
+
+def test_oversized_data_url_is_rejected(aivm_bytes: bytes) -> None:
+    def mutate(manifest: dict[str, Any]) -> None:
+        manifest['speakers'][0]['icon'] = 'data:image/png;base64,' + 'A' * (8 * 1024 * 1024)
+
+    file = _with_manifest(aivm_bytes, mutate)
+    _assert_rejected_in_time(lambda: aivmlib.read_aivm_metadata(file, AivmParseLimits()))
+
+
+def test_huge_protobuf_field_count_is_rejected() -> None:
+    # ir_version (フィールド番号 1 の varint) を大量に繰り返した ONNX モデル
+    file = io.BytesIO(b'\x08\x01' * 5_000_000)
+    _assert_rejected_in_time(lambda: aivmlib.read_aivmx_metadata(file, limits=AivmParseLimits()))
+
+
+def test_limits_do_not_reject_valid_files(aivm_bytes: bytes, aivmx_bytes: bytes) -> None:
+    limits = AivmParseLimits()
+    expected = aivmlib.read_aivm_metadata(io.BytesIO(aivm_bytes))
+    metadata = aivmlib.read_aivm_metadata(io.BytesIO(aivm_bytes), limits)
+    assert metadata.manifest == expected.manifest
+    assert metadata.hyper_parameters == expected.hyper_parameters
+    expected = aivmlib.read_aivmx_metadata(io.BytesIO(aivmx_bytes))
+    metadata = aivmlib.read_aivmx_metadata(io.BytesIO(aivmx_bytes), limits=limits)
+    assert metadata.manifest == expected.manifest
+    assert metadata.hyper_parameters == expected.hyper_parameters
+
+
+def test_mutated_inputs_fail_in_bounded_time(aivm_bytes: bytes, aivmx_bytes: bytes) -> None:
+    rng = random.Random(0)
+    limits = AivmParseLimits()
+    readers: list[tuple[bytes, Callable[[io.BytesIO], object]]] = [
+        (aivm_bytes, lambda file: aivmlib.read_aivm_metadata(file, limits)),
+        (aivmx_bytes, lambda file: aivmlib.read_aivmx_metadata(file, limits=limits)),
+    ]
+    for data, read in readers:
+        for _ in range(100):
+            mutated = bytearray(data)
+            for _ in range(rng.randint(1, 8)):
+                mutated[rng.randrange(min(len(mutated), 4096))] = rng.randrange(256)
+            start = time.perf_counter()
+            try:
+                read(io.BytesIO(bytes(mutated)))
+            except AivmValidationError:
+                pass
+            assert time.perf_counter() - start < TIME_BOUND
@@ -0,0 +1,99 @@
+import io
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+import aivmlib
+from aivmlib import AivmValidationError
+from aivmlib.lazy import read_aivm_metadata_lazy
+from aivmlib.schemas.aivm_manifest import AivmManifest, AivmMetadata
+from aivmlib.schemas.style_bert_vits2 import StyleBertVITS2HyperParameters
+
+
+@pytest.fixture
+def manifest_validations(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    """
+    AIVM マニフェストのバリデーションの呼び出しを記録する
+    """
+
+    calls: list[str] = []
+    for name in ('model_validate', 'model_validate_json'):
+        original = getattr(AivmManifest, name).__func__
+
+        def wrapper(
+            cls: type[AivmManifest], *args: Any, _name: str = name, _original: Any = original, **kwargs: Any
+        ) -> AivmManifest:
+            calls.append(_name)
+            return _original(cls, *args, **kwargs)
+
+        monkeypatch.setattr(AivmManifest, name, classmethod(wrapper))
+    return calls
+
+
+def test_generated_metadata_is_validated_once(
+    safetensors_bytes: bytes, onnx_bytes: bytes, aivm_metadata: AivmMetadata, manifest_validations: list[str]
+) -> None:
+    assert aivm_metadata._validated_snapshot is not None
+    aivmlib.write_aivm_metadata(io.BytesIO(safetensors_bytes), aivm_metadata)
+    aivmlib.write_aivmx_metadata(io.BytesIO(onnx_bytes), aivm_metadata)
+    assert manifest_validations == []
+
+
+def test_updated_metadata_is_validated_once(
+    aivm_metadata: AivmMetadata,
+    hyper_parameters_bytes: bytes,
+    style_vectors_bytes: bytes,
+    safetensors_bytes: bytes,
+    manifest_validations: list[str],
+) -> None:
+    updated, _ = aivmlib.update_aivm_metadata(
+        aivm_metadata, io.BytesIO(hyper_parameters_bytes), io.BytesIO(style_vectors_bytes)
+    )
+    assert updated._validated_snapshot is not None
+    manifest_validations.clear()
+    aivmlib.write_aivm_metadata(io.BytesIO(safetensors_bytes), updated)
+    assert manifest_validations == []
+
+
+def test_read_metadata_is_not_revalidated(aivm_bytes: bytes, aivm_path: Path, manifest_validations: list[str]) -> None:
+    metadata = aivmlib.read_aivm_metadata(io.BytesIO(aivm_bytes))
+    manifest_validations.clear()
+    output = aivmlib.write_aivm_metadata(io.BytesIO(aivm_bytes), metadata)
+    assert manifest_validations == []
+    assert output == aivm_bytes
+
+    # 遅延読み込みした AIVM マニフェストは型が異なるため、書き込み時に改めてバリデーションされる
+    lazy_metadata = read_aivm_metadata_lazy(aivm_path)
+    manifest_validations.clear()
+    assert aivmlib.write_aivm_metadata(io.BytesIO(aivm_bytes), lazy_metadata) == aivm_bytes
+    assert manifest_validations == ['model_validate']
+
+
+def test_changed_metadata_is_revalidated(safetensors_bytes: bytes, aivm_metadata: AivmMetadata) -> None:
+    aivm_metadata.manifest.description = 'x' * 141
+    with pytest.raises(AivmValidationError):
+        aivmlib.write_aivm_metadata(io.BytesIO(safetensors_bytes), aivm_metadata)
+
+    aivm_metadata.manifest.description = ''
+    aivm_metadata.manifest.speakers[0].icon = 'data:image/gif;base64,AAAA'
+    with pytest.raises(AivmValidationError):
+        aivmlib.write_aivm_metadata(io.BytesIO(safetensors_bytes), aivm_metadata)
+
+
+def test_invalid_generated_metadata_fails_on_write(
+    safetensors_bytes: bytes, hyper_parameters_bytes: bytes, style_vectors_bytes: bytes
+) -> None:
+    # モデル名が長すぎる場合、生成時にはエラーとせず、書き込み時にエラーとする
+    hyper_parameters = StyleBertVITS2HyperParameters.model_validate_json(hyper_parameters_bytes)
+    hyper_parameters.model_name = 'x' * 81
+    metadata = aivmlib.generate_aivm_metadata(
+        aivmlib.ModelArchitecture.StyleBertVITS2JPExtra,
+        io.BytesIO(hyper_parameters.model_dump_json().encode('utf-8')),
+        io.BytesIO(style_vectors_bytes),
+    )
+    assert metadata._validated_snapshot is None
+    with pytest.raises(AivmValidationError):
+        aivmlib.write_aivm_metadata(io.BytesIO(safetensors_bytes), metadata)
+    metadata.manifest.name = 'TestModel'
+    aivmlib.write_aivm_metadata(io.BytesIO(safetensors_bytes), metadata)
@@ -0,0 +1,23 @@
+import io
+
+import aivmlib
+from aivmlib.optimizer import optimize_aivm_metadata
+from aivmlib.schemas.aivm_manifest import AivmMetadata
+
+
+def test_optimize_does_not_modify_input(aivm_metadata: AivmMetadata, safetensors_bytes: bytes) -> None:
+    speaker = aivm_metadata.manifest.speakers[0]
+    speaker.styles[0].icon = speaker.icon
+    manifest_before = aivm_metadata.manifest.model_copy(deep=True)
+    hyper_parameters_before = aivm_metadata.hyper_parameters.model_copy(deep=True)
+
+    optimized_metadata, report = optimize_aivm_metadata(aivm_metadata)
+    assert optimized_metadata.manifest.speakers[0].styles[0].icon is None
+    assert report.total_savings > 0
+
+    # 最適化結果を変更して書き込んでも、引数として渡した AIVM メタデータは変わらない
+    optimized_metadata.manifest.name = 'Changed'
+    aivmlib.write_aivm_metadata(io.BytesIO(safetensors_bytes), optimized_metadata)
+    assert optimized_metadata.hyper_parameters.model_name == 'Changed'
+    assert aivm_metadata.manifest == manifest_before
+    assert aivm_metadata.hyper_parameters == hyper_parameters_before
@@ -0,0 +1,107 @@
+import io
+import json
+import struct
+from pathlib import Path
+
+import numpy as np
+import onnx
+import pytest
+from conftest import build_safetensors
+
+import aivmlib
+from aivmlib import AivmValidationError
+from aivmlib.handle import AivmWriteStrategy
+from aivmlib.patch import _get_payload_ranges, apply_metadata_patch, compute_payload_digest, create_metadata_patch
+from aivmlib.schemas.aivm_manifest import AivmMetadata, ModelFormat
+
+
+def _read_metadata(path: Path, model_format: ModelFormat) -> AivmMetadata:
+    with path.open('rb') as file:
+        if model_format == ModelFormat.Safetensors:
+            return aivmlib.read_aivm_metadata(file)
+        return aivmlib.read_aivmx_metadata(file)
+
+
+@pytest.fixture(params=[ModelFormat.Safetensors, ModelFormat.ONNX])
+def model(request: pytest.FixtureRequest, aivm_path: Path, aivmx_path: Path) -> tuple[Path, ModelFormat]:
+    if request.param == ModelFormat.ONNX:
+        return aivmx_path, ModelFormat.ONNX
+    return aivm_path, ModelFormat.Safetensors
+
+
+def _write_renamed(path: Path, model_format: ModelFormat, output_path: Path, name: str) -> None:
+    metadata = _read_metadata(path, model_format)
+    metadata.manifest.name = name
+    with path.open('rb') as file:
+        if model_format == ModelFormat.Safetensors:
+            output_path.write_bytes(aivmlib.write_aivm_metadata(file, metadata))
+        else:
+            output_path.write_bytes(aivmlib.write_aivmx_metadata(file, metadata))
+
+
+def test_payload_digest_covers_tensor_table(tensors: dict[str, np.ndarray]) -> None:
+    safetensors_bytes = build_safetensors(tensors)
+    digest = compute_payload_digest(io.BytesIO(safetensors_bytes), ModelFormat.Safetensors)
+
+    # ヘッダーの書式・__metadata__ の内容は、ダイジェストに影響しない
+    indented = build_safetensors(tensors, indent=2)
+    assert compute_payload_digest(io.BytesIO(indented), ModelFormat.Safetensors) == digest
+
+    # Weight 部分が同一でも、テンソルの shape が異なればダイジェストも異なる
+    header_size = struct.unpack('<Q', safetensors_bytes[:8])[0]
+    header = json.loads(safetensors_bytes[8 : 8 + header_size])
+    first = next(name for name in header if name != '__metadata__')
+    header[first]['shape'] = [16, 16]
+    header_bytes = json.dumps(header).encode('utf-8')
+    reshaped = struct.pack('<Q', len(header_bytes)) + header_bytes + safetensors_bytes[8 + header_size :]
+    assert compute_payload_digest(io.BytesIO(reshaped), ModelFormat.Safetensors) != digest
+
+
+def test_apply_patch_in_place(tmp_path: Path, model: tuple[Path, ModelFormat]) -> None:
+    path, model_format = model
+    new_path = tmp_path / f'new{path.suffix}'
+    _write_renamed(path, model_format, new_path, 'Patched')
+    with path.open('rb') as old_file, new_path.open('rb') as new_file:
+        patch = create_metadata_patch(old_file, new_file, model_format)
+    patch = type(patch).from_bytes(patch.to_bytes())
+
+    with path.open('rb') as file:
+        digest = compute_payload_digest(file, model_format)
+    strategy = apply_metadata_patch(path, patch)
+    assert strategy in (AivmWriteStrategy.InPlace, AivmWriteStrategy.Splice)
+    assert _read_metadata(path, model_format).manifest.name == 'Patched'
+    with path.open('rb') as file:
+        assert compute_payload_digest(file, model_format) == digest
+    if model_format == ModelFormat.ONNX:
+        onnx.checker.check_model(onnx.load_model_from_string(path.read_bytes()))
+
+
+def test_apply_patch_to_output_path(tmp_path: Path, model: tuple[Path, ModelFormat]) -> None:
+    path, model_format = model
+    new_path = tmp_path / f'new{path.suffix}'
+    _write_renamed(path, model_format, new_path, 'Patched')
+    with path.open('rb') as old_file, new_path.open('rb') as new_file:
+        patch = create_metadata_patch(old_file, new_file, model_format)
+
+    original = path.read_bytes()
+    output_path = tmp_path / f'output{path.suffix}'
+    assert apply_metadata_patch(path, patch, output_path) == AivmWriteStrategy.Splice
+    assert path.read_bytes() == original
+    assert _read_metadata(output_path, model_format).manifest.name == 'Patched'
+
+
+def test_apply_patch_rejects_different_payload(tmp_path: Path, model: tuple[Path, ModelFormat]) -> None:
+    path, model_format = model
+    new_path = tmp_path / f'new{path.suffix}'
+    _write_renamed(path, model_format, new_path, 'Patched')
+    with path.open('rb') as old_file, new_path.open('rb') as new_file:
+        patch = create_metadata_patch(old_file, new_file, model_format)
+
+    # 重み部分を書き換えたファイルには適用できない
+    with path.open('rb') as file:
+        offset, length = max(_get_payload_ranges(file, model_format), key=lambda payload_range: payload_range[1])
+    data = bytearray(path.read_bytes())
+    data[offset + length // 2] ^= 0xFF
+    path.write_bytes(bytes(data))
+    with pytest.raises(AivmValidationError):
+        apply_metadata_patch(path, patch)
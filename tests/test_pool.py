@@ -0,0 +1,76 @@
+import json
+import struct
+import threading
+from pathlib import Path
+
+import pytest
+
+from aivmlib import AivmValidationError
+from aivmlib.pool import AivmModelPool
+
+
+def _write_aivm(path: Path, header: object, payload: bytes = b'\x00' * 16) -> Path:
+    header_bytes = json.dumps(header).encode('utf-8')
+    path.write_bytes(struct.pack('<Q', len(header_bytes)) + header_bytes + payload)
+    return path
+
+
+@pytest.mark.parametrize(
+    'header',
+    [
+        [1, 2],
+        'string',
+        {'weight': {'dtype': 'F32', 'shape': [4], 'data_offsets': ['0', '16']}},
+        {'weight': {'dtype': 'F32', 'shape': [4], 'data_offsets': [16, 0]}},
+        {'weight': {'dtype': 'F32', 'shape': [4], 'data_offsets': [-16, 0]}},
+        {'weight': {'dtype': 'F32', 'shape': [4], 'data_offsets': [False, True]}},
+    ],
+)
+def test_malformed_header_raises_validation_error(tmp_path: Path, header: object, aivm_bytes: bytes) -> None:
+    # 不正なテンソルのエントリのみを検出できるよう、正しい __metadata__ を組み合わせる
+    if isinstance(header, dict):
+        header_size = struct.unpack('<Q', aivm_bytes[:8])[0]
+        header['__metadata__'] = json.loads(aivm_bytes[8 : 8 + header_size])['__metadata__']
+    path = _write_aivm(tmp_path / 'bad.aivm', header)
+    with AivmModelPool(max_resident_bytes=1 << 20) as pool, pytest.raises(AivmValidationError):
+        pool.get(path)
+
+
+def test_prefetch_completes_with_resident_weights(aivm_path: Path, aivmx_path: Path) -> None:
+    with AivmModelPool(max_resident_bytes=1 << 30) as pool:
+        for path in (aivm_path, aivmx_path):
+            model = pool.prefetch(path).result(timeout=10)
+            assert model.payload_size > 0
+            assert pool.get(path) is model
+        stats = pool.stats()
+        assert stats.prefetches == 2
+        assert stats.hits == 2 and stats.misses == 2
+
+
+def test_prefetch_during_concurrent_eviction(tmp_path: Path, aivm_bytes: bytes) -> None:
+    paths = []
+    for index in range(8):
+        path = tmp_path / f'model{index}.aivm'
+        path.write_bytes(aivm_bytes)
+        paths.append(path)
+
+    # 上限を 1 モデル分にして、追加のたびに他のモデルが解放されるようにする
+    errors: list[BaseException] = []
+    with AivmModelPool(max_resident_bytes=1) as pool:
+
+        def worker(offset: int) -> None:
+            try:
+                for round_ in range(50):
+                    path = paths[(offset + round_) % len(paths)]
+                    assert pool.prefetch(path).result(timeout=10).path == path
+                    if round_ % 3 == 0:
+                        pool.evict(path)
+            except BaseException as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert errors == []
@@ -0,0 +1,36 @@
+import uuid
+
+from aivmlib.routing import (
+    SPEAKER_HASH_BITS,
+    STYLE_LOCAL_ID_BITS,
+    AivmRoutingTable,
+    _hash_speaker_uuid,
+    compute_global_style_id,
+)
+from aivmlib.schemas.aivm_manifest import AivmMetadata
+
+
+def test_global_style_id_range() -> None:
+    # グローバルスタイル ID は、JSON 経由でも正確に表現できる 53 ビットに収まる
+    assert SPEAKER_HASH_BITS + STYLE_LOCAL_ID_BITS == 53
+    speaker_uuids = [uuid.UUID(int=index * 0x9E3779B97F4A7C15) for index in range(100000)]
+    global_style_ids = [compute_global_style_id(speaker_uuid, 31) for speaker_uuid in speaker_uuids]
+    assert all(0 <= global_style_id < (1 << 53) for global_style_id in global_style_ids)
+
+    # 10 万話者程度では、話者 UUID のハッシュ値は衝突しない
+    assert len({_hash_speaker_uuid(speaker_uuid) for speaker_uuid in speaker_uuids}) == len(speaker_uuids)
+
+
+def test_routing_table_round_trip(aivm_metadata: AivmMetadata) -> None:
+    table = AivmRoutingTable.from_bytes(AivmRoutingTable.build([aivm_metadata]).to_bytes())
+    assert table.model_count == 1
+    for speaker in aivm_metadata.manifest.speakers:
+        assert table.get_speaker_local_id(speaker.uuid) == speaker.local_id
+        for style in speaker.styles:
+            route = table.resolve(aivm_metadata.manifest.uuid, speaker.uuid, style.local_id)
+            assert route is not None
+            assert route.global_style_id == compute_global_style_id(speaker.uuid, style.local_id)
+            assert table.get_style(route.global_style_id) == route
+    assert len(list(table)) == len(table)
+    assert table.get_style(1 << 53) is None
+    assert table.get_speaker_local_id(uuid.uuid4()) is None
@@ -0,0 +1,121 @@
+import http.client
+import json
+import os
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+import aivmlib
+from aivmlib.extract import decode_data_url
+from aivmlib.schemas.aivm_manifest import AivmMetadata
+from aivmlib.server import AivmMetadataServer, create_metadata_server
+
+
+@pytest.fixture
+def server(aivm_path: Path) -> Iterator[AivmMetadataServer]:
+    server = create_metadata_server(aivm_path.parent, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def request(server: AivmMetadataServer, path: str, headers: dict[str, str] | None = None) -> http.client.HTTPResponse:
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+    connection.request('GET', path, headers=headers or {})
+    response = connection.getresponse()
+    response.body = response.read()  # type: ignore[attr-defined]
+    connection.close()
+    return response
+
+
+def test_manifest_and_conditional_request(server: AivmMetadataServer, aivm_metadata: AivmMetadata) -> None:
+    response = request(server, '/models')
+    assert response.status == 200
+    assert [model['file_name'] for model in json.loads(response.body)] == ['model.aivm']  # type: ignore[attr-defined]
+
+    response = request(server, '/models/model.aivm/manifest')
+    assert response.status == 200
+    assert json.loads(response.body)['name'] == aivm_metadata.manifest.name  # type: ignore[attr-defined]
+    etag = response.getheader('ETag')
+    assert etag is not None
+
+    response = request(server, '/models/model.aivm/manifest', {'If-None-Match': etag})
+    assert response.status == 304
+    assert response.body == b''  # type: ignore[attr-defined]
+
+    assert request(server, '/models/missing.aivm/manifest').status == 404
+    assert request(server, '/models/..%2Fmodel.aivm/manifest').status == 404
+
+
+def test_range_requests(server: AivmMetadataServer, aivm_metadata: AivmMetadata) -> None:
+    speaker = aivm_metadata.manifest.speakers[0]
+    assert speaker.icon is not None
+    _, icon = decode_data_url(speaker.icon)
+    path = f'/models/model.aivm/speakers/{speaker.uuid}/icon'
+
+    response = request(server, path)
+    assert response.status == 200
+    assert response.body == icon  # type: ignore[attr-defined]
+
+    response = request(server, path, {'Range': 'bytes=0-3'})
+    assert response.status == 206
+    assert response.getheader('Content-Range') == f'bytes 0-3/{len(icon)}'
+    assert response.body == icon[:4]  # type: ignore[attr-defined]
+
+    response = request(server, path, {'Range': 'bytes=-2'})
+    assert response.status == 206
+    assert response.body == icon[-2:]  # type: ignore[attr-defined]
+
+    # 範囲の指定自体は正しいが、範囲を満たせない場合は 416 を返す
+    response = request(server, path, {'Range': f'bytes={len(icon)}-'})
+    assert response.status == 416
+    assert response.getheader('Content-Range') == f'bytes */{len(icon)}'
+
+    # 対応していない複数の範囲や、解釈できない Range は無視して全体を返す
+    for range_header in ('bytes=0-1,5-9', 'bytes=5-2', 'items=0-1'):
+        response = request(server, path, {'Range': range_header})
+        assert response.status == 200, range_header
+        assert response.body == icon  # type: ignore[attr-defined]
+
+    # If-Range が ETag と一致しない場合は Range を無視する
+    response = request(server, path, {'Range': 'bytes=0-3', 'If-Range': '"stale"'})
+    assert response.status == 200
+
+
+def test_invalidation_after_file_change(server: AivmMetadataServer, aivm_path: Path) -> None:
+    response = request(server, '/models/model.aivm/manifest')
+    etag = response.getheader('ETag')
+    assert etag is not None
+
+    # ファイルを書き換えると、キャッシュが無効化されて新しい内容と ETag が返る
+    with aivm_path.open('rb') as file:
+        metadata = aivmlib.read_aivm_metadata(file)
+        metadata.manifest.name = 'ChangedModel'
+        new_bytes = aivmlib.write_aivm_metadata(file, metadata)
+    aivm_path.write_bytes(new_bytes)
+    stat = aivm_path.stat()
+    os.utime(aivm_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    response = request(server, '/models/model.aivm/manifest', {'If-None-Match': etag})
+    assert response.status == 200
+    assert response.getheader('ETag') != etag
+    assert json.loads(response.body)['name'] == 'ChangedModel'  # type: ignore[attr-defined]
+
+
+def test_permission_error_returns_forbidden(server: AivmMetadataServer, monkeypatch: pytest.MonkeyPatch) -> None:
+    def raise_permission_error(path: Path) -> None:
+        raise PermissionError(path)
+
+    monkeypatch.setattr(server.cache, 'get', raise_permission_error)
+    assert request(server, '/models/model.aivm/manifest').status == 403
+    # 一覧からは読み取れないファイルを除外する
+    response = request(server, '/models')
+    assert response.status == 200
+    assert json.loads(response.body) == []  # type: ignore[attr-defined]
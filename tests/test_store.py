@@ -0,0 +1,74 @@
+import os
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from aivmlib.schemas.aivm_manifest import ModelFormat
+from aivmlib.store import AivmModelStore, AivmStoreEntry
+
+
+def _age_payload(store: AivmModelStore, entry: AivmStoreEntry, seconds: float) -> Path:
+    payload_path = store._payload_path(entry.payload_sha256)
+    mtime = time.time() - seconds
+    os.utime(payload_path, (mtime, mtime))
+    return payload_path
+
+
+def test_gc_removes_unreferenced_payloads(tmp_path: Path, aivm_path: Path) -> None:
+    store = AivmModelStore(tmp_path / 'store')
+    with aivm_path.open('rb') as file:
+        entry = store.add(file, ModelFormat.Safetensors)
+
+    # 参照されているペイロードは、古くても削除しない
+    payload_path = _age_payload(store, entry, 7200)
+    assert store.gc(min_age=60).removed_payloads == []
+    assert payload_path.exists()
+
+    # 参照されていない新しいペイロードは、格納中の可能性があるため削除しない
+    assert store.remove(entry.entry_id)
+    os.utime(payload_path)
+    assert store.gc(min_age=60).removed_payloads == []
+
+    _age_payload(store, entry, 7200)
+    report = store.gc(min_age=60)
+    assert report.removed_payloads == [entry.payload_sha256]
+    assert report.freed_bytes > 0
+    assert not payload_path.exists()
+
+
+def test_gc_keeps_payload_added_while_counting_references(
+    tmp_path: Path, aivm_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    store = AivmModelStore(tmp_path / 'store')
+    with aivm_path.open('rb') as file:
+        entry = store.add(file, ModelFormat.Safetensors)
+    assert store.remove(entry.entry_id)
+    payload_path = _age_payload(store, entry, 7200)
+
+    # 参照を数え終えた直後に、同一のペイロードを持つファイルが格納された状況を再現する
+    entries = store.entries
+
+    def entries_then_add() -> Iterator[AivmStoreEntry]:
+        yield from entries()
+        with aivm_path.open('rb') as file:
+            store.add(file, ModelFormat.Safetensors)
+
+    monkeypatch.setattr(store, 'entries', entries_then_add)
+    assert store.gc(min_age=60).removed_payloads == []
+    assert payload_path.exists()
+    with store.open(entry.entry_id) as virtual_file:
+        assert virtual_file.read() == aivm_path.read_bytes()
+
+
+def test_add_rewrites_payload_removed_by_gc(tmp_path: Path, aivm_path: Path) -> None:
+    store = AivmModelStore(tmp_path / 'store')
+    with aivm_path.open('rb') as file:
+        entry = store.add(file, ModelFormat.Safetensors)
+    store._payload_path(entry.payload_sha256).unlink()
+
+    with aivm_path.open('rb') as file:
+        store.add(file, ModelFormat.Safetensors)
+    with store.open(entry.entry_id) as virtual_file:
+        assert virtual_file.read() == aivm_path.read_bytes()
@@ -0,0 +1,110 @@
+import io
+from pathlib import Path
+
+import pytest
+
+from aivmlib import AivmLimitExceededError, AivmParseLimits, AivmValidationError
+from aivmlib.handle import AivmxFile
+from aivmlib.patch import compute_payload_digest
+from aivmlib.schemas.aivm_manifest import ModelFormat
+from aivmlib.stream import AivmStreamParser, AivmStreamParseResult
+
+
+@pytest.fixture(params=[ModelFormat.Safetensors, ModelFormat.ONNX])
+def model(request: pytest.FixtureRequest, aivm_bytes: bytes, aivmx_bytes: bytes) -> tuple[bytes, ModelFormat]:
+    if request.param == ModelFormat.ONNX:
+        return aivmx_bytes, ModelFormat.ONNX
+    return aivm_bytes, ModelFormat.Safetensors
+
+
+def _parse(data: bytes, model_format: ModelFormat, chunk_size: int) -> AivmStreamParseResult:
+    parser = AivmStreamParser(model_format, hash_payload=True)
+    for offset in range(0, len(data), chunk_size):
+        parser.feed(data[offset : offset + chunk_size])
+    return parser.close()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4093, 1 << 30])
+def test_parse_in_chunks(model: tuple[bytes, ModelFormat], chunk_size: int) -> None:
+    data, model_format = model
+    result = _parse(data, model_format, chunk_size)
+    assert result.metadata.manifest.name == 'TestModel'
+    assert result.total_size == len(data)
+    assert result.payload_sha256 == compute_payload_digest(io.BytesIO(data), model_format)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4093])
+def test_payload_digest_ignores_locator(aivmx_path: Path, aivmx_bytes: bytes, chunk_size: int) -> None:
+    # 末尾に metadata_props とロケーターを持つ AIVMX ファイルでも、ペイロードのハッシュ値は変わらない
+    doc_string = b'\x32\x03doc'
+    aivmx_path.write_bytes(aivmx_bytes + doc_string)
+    with AivmxFile(aivmx_path) as aivmx_file:
+        aivmx_file.metadata.manifest.name = 'Relocated'
+        aivmx_file.commit()
+    data = aivmx_path.read_bytes()
+
+    result = _parse(data, ModelFormat.ONNX, chunk_size)
+    assert result.metadata.manifest.name == 'Relocated'
+    assert result.payload_sha256 == compute_payload_digest(io.BytesIO(data), ModelFormat.ONNX)
+    expected = compute_payload_digest(io.BytesIO(aivmx_bytes + doc_string), ModelFormat.ONNX)
+    assert result.payload_sha256 == expected
+
+
+def test_metadata_is_available_after_header(aivm_bytes: bytes) -> None:
+    parser = AivmStreamParser(ModelFormat.Safetensors)
+    header_size = int.from_bytes(aivm_bytes[:8], 'little')
+    assert parser.feed(aivm_bytes[: 8 + header_size - 1]) is None
+    assert parser.feed(aivm_bytes[8 + header_size - 1 : 8 + header_size]) is not None
+    assert parser.metadata is not None
+    parser.feed(aivm_bytes[8 + header_size :])
+    assert parser.close().payload_sha256 is None
+
+
+def test_truncated_file_is_rejected(model: tuple[bytes, ModelFormat]) -> None:
+    data, model_format = model
+    for size in (0, 4, len(data) // 2, len(data) - 1):
+        parser = AivmStreamParser(model_format)
+        parser.feed(data[:size])
+        with pytest.raises(AivmValidationError):
+            parser.close()
+
+
+@pytest.mark.parametrize(
+    ('model_format', 'garbage'),
+    [
+        # ヘッダーサイズが大きすぎる
+        (ModelFormat.Safetensors, b'\xff' * 8 + b'{}'),
+        # ヘッダー JSON がオブジェクトではない
+        (ModelFormat.Safetensors, (100).to_bytes(8, 'little') + b'garbage'),
+        # ONNX の既知のフィールドのワイヤータイプが一致しない (graph が Varint)
+        (ModelFormat.ONNX, b'\x38\x01'),
+        # タグの Varint が終端しない
+        (ModelFormat.ONNX, b'\xff' * 16),
+        # metadata_props のエントリをデコードできない
+        (ModelFormat.ONNX, b'\x72\x02\xff\xff'),
+    ],
+)
+def test_garbage_is_rejected_early(model_format: ModelFormat, garbage: bytes) -> None:
+    # 不正な箇所を含む最初のチャンクを渡した時点で拒否され、以降も同じ例外となる
+    parser = AivmStreamParser(model_format)
+    with pytest.raises(AivmValidationError) as exc_info:
+        parser.feed(garbage + b'\x00' * 1024)
+    with pytest.raises(AivmValidationError) as second_exc_info:
+        parser.feed(b'\x00')
+    assert second_exc_info.value is exc_info.value
+    with pytest.raises(AivmValidationError):
+        parser.close()
+
+
+def test_limits_are_enforced_before_buffering(aivm_bytes: bytes, aivmx_bytes: bytes) -> None:
+    # AIVM: ヘッダーサイズは先頭 8 バイトを受け取った時点で検査される
+    parser = AivmStreamParser(ModelFormat.Safetensors, limits=AivmParseLimits(max_header_size=16))
+    with pytest.raises(AivmLimitExceededError):
+        parser.feed(aivm_bytes[:8])
+
+    # AIVMX: metadata_props の合計サイズは、各フィールドの値を受け取る前に検査される
+    parser = AivmStreamParser(ModelFormat.ONNX, limits=AivmParseLimits(max_header_size=16))
+    with pytest.raises(AivmLimitExceededError):
+        for offset in range(len(aivmx_bytes)):
+            parser.feed(aivmx_bytes[offset : offset + 1])
+    assert offset < len(aivmx_bytes) - 16
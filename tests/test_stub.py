@@ -0,0 +1,155 @@
+import http.server
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from aivmlib import AivmValidationError
+from aivmlib.schemas.aivm_manifest import ModelFormat
+from aivmlib.stub import AivmPayloadReference, create_aivm_stub, materialize_aivm_stub
+
+
+class _ModelRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    テスト用の元のファイルを配信する HTTP リクエストハンドラー
+    サーバーの属性で、Range リクエストを無視する・レスポンスの途中で接続を切るといった振る舞いを切り替える
+    """
+
+    server: '_ModelServer'
+
+    def do_GET(self) -> None:
+        data = self.server.data
+        start, end = 0, len(data)
+        range_header = self.headers.get('Range')
+        self.server.ranges.append(range_header)
+        if range_header is not None and not self.server.ignore_range:
+            first, last = range_header.removeprefix('bytes=').split('-')
+            start, end = int(first), int(last) + 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+
+        # drop_after が指定されている場合は、その位置まで送信したところで (1 回だけ) 接続を切る
+        body = data[start:end]
+        if self.server.drop_after is not None:
+            body = body[: self.server.drop_after]
+            self.server.drop_after = None
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+class _ModelServer(http.server.ThreadingHTTPServer):
+    data: bytes = b''
+    ignore_range: bool = False
+    drop_after: int | None = None
+    ranges: list[str | None]
+
+
+@pytest.fixture
+def model_server() -> Iterator[_ModelServer]:
+    server = _ModelServer(('127.0.0.1', 0), _ModelRequestHandler)
+    server.ranges = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _create_stub(
+    tmp_path: Path, source_path: Path, model_format: ModelFormat, server: _ModelServer
+) -> tuple[Path, AivmPayloadReference]:
+    server.data = source_path.read_bytes()
+    stub_path = tmp_path / f'{source_path.name}.stub'
+    with source_path.open('rb') as file, stub_path.open('wb') as output_file:
+        reference = create_aivm_stub(file, output_file, model_format, f'http://127.0.0.1:{server.server_port}/model')
+    return stub_path, reference
+
+
+@pytest.fixture(params=[ModelFormat.Safetensors, ModelFormat.ONNX])
+def source(request: pytest.FixtureRequest, aivm_path: Path, aivmx_path: Path) -> tuple[Path, ModelFormat]:
+    if request.param == ModelFormat.ONNX:
+        return aivmx_path, ModelFormat.ONNX
+    return aivm_path, ModelFormat.Safetensors
+
+
+def test_materialize_over_http(tmp_path: Path, source: tuple[Path, ModelFormat], model_server: _ModelServer) -> None:
+    source_path, model_format = source
+    stub_path, _ = _create_stub(tmp_path, source_path, model_format, model_server)
+    assert stub_path.stat().st_size < source_path.stat().st_size
+
+    output_path = tmp_path / 'output'
+    materialize_aivm_stub(stub_path, output_path)
+    assert output_path.read_bytes() == source_path.read_bytes()
+    assert all(range_header is not None for range_header in model_server.ranges)
+
+
+def test_materialize_retries_after_connection_drop(
+    tmp_path: Path, source: tuple[Path, ModelFormat], model_server: _ModelServer
+) -> None:
+    source_path, model_format = source
+    stub_path, _ = _create_stub(tmp_path, source_path, model_format, model_server)
+    model_server.drop_after = 1000
+
+    output_path = tmp_path / 'output'
+    materialize_aivm_stub(stub_path, output_path)
+    assert output_path.read_bytes() == source_path.read_bytes()
+    # 接続が切れた位置から取得し直している
+    first = int(model_server.ranges[0].removeprefix('bytes=').split('-')[0])
+    second = int(model_server.ranges[1].removeprefix('bytes=').split('-')[0])
+    assert second == first + 1000
+
+
+def test_materialize_from_server_ignoring_range(
+    tmp_path: Path, source: tuple[Path, ModelFormat], model_server: _ModelServer
+) -> None:
+    source_path, model_format = source
+    stub_path, _ = _create_stub(tmp_path, source_path, model_format, model_server)
+    model_server.ignore_range = True
+
+    output_path = tmp_path / 'output'
+    materialize_aivm_stub(stub_path, output_path)
+    assert output_path.read_bytes() == source_path.read_bytes()
+
+
+def test_materialize_resumes_from_part_file(
+    tmp_path: Path, source: tuple[Path, ModelFormat], model_server: _ModelServer
+) -> None:
+    source_path, model_format = source
+    stub_path, _ = _create_stub(tmp_path, source_path, model_format, model_server)
+    original = source_path.read_bytes()
+
+    output_path = tmp_path / 'output'
+    part_path = tmp_path / '.output.part'
+    part_path.write_bytes(original[: len(original) // 2])
+    materialize_aivm_stub(stub_path, output_path)
+    assert output_path.read_bytes() == original
+    assert not part_path.exists()
+    # 一時ファイルに書き込み済みの部分は取得し直さない
+    starts = [int(range_header.removeprefix('bytes=').split('-')[0]) for range_header in model_server.ranges]
+    assert min(starts) >= len(original) // 2
+
+
+def test_materialize_deletes_part_file_on_digest_mismatch(
+    tmp_path: Path, source: tuple[Path, ModelFormat], model_server: _ModelServer
+) -> None:
+    source_path, model_format = source
+    stub_path, reference = _create_stub(tmp_path, source_path, model_format, model_server)
+    # 取得元のファイルの重み部分が、スタブファイルの作成後に書き換えられた状況を再現する
+    corrupted = bytearray(model_server.data)
+    offset, length = reference.payload_ranges[0]
+    corrupted[offset + length // 2] ^= 0xFF
+    model_server.data = bytes(corrupted)
+
+    output_path = tmp_path / 'output'
+    with pytest.raises(AivmValidationError):
+        materialize_aivm_stub(stub_path, output_path)
+    assert not (tmp_path / '.output.part').exists()
+    assert not output_path.exists()
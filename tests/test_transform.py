@@ -0,0 +1,50 @@
+import io
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from aivmlib.transform import TensorCastDtype, _cast_chunk, transform_aivm_tensors
+
+
+def _build_f64_safetensors(values: np.ndarray) -> bytes:
+    blob = values.astype('<f8').tobytes()
+    header = {'weight': {'dtype': 'F64', 'shape': [len(values)], 'data_offsets': [0, len(blob)]}}
+    header_bytes = json.dumps(header).encode('utf-8')
+    return struct.pack('<Q', len(header_bytes)) + header_bytes + blob
+
+
+@pytest.mark.parametrize(
+    ('source_dtype', 'new_dtype', 'values', 'expected'),
+    [
+        # 倍精度から単精度への変換で無限大になる
+        ('<f8', 'BF16', [1e39, -1e39, 1.0, np.inf, np.nan], 2),
+        # 単精度としては有限だが、BF16 への丸めで無限大になる
+        ('<f4', 'BF16', [np.finfo(np.float32).max, -np.finfo(np.float32).max, 1.0, -np.inf], 2),
+        ('<f8', 'F16', [1e39, 70000.0, 1.0, np.inf, np.nan], 2),
+        ('<f4', 'F16', [70000.0, -70000.0, 65504.0, -np.inf], 2),
+    ],
+)
+def test_cast_chunk_counts_overflows(source_dtype: str, new_dtype: str, values: list[float], expected: int) -> None:
+    chunk = np.array(values, dtype=source_dtype).tobytes()
+    _, overflows = _cast_chunk(chunk, np.dtype(source_dtype), new_dtype)
+    assert overflows == expected
+
+
+def test_bf16_cast_rounds_and_keeps_nan() -> None:
+    values = np.array([1.0, -2.5, np.inf, np.nan, 1e39], dtype='<f8')
+    converted, _ = _cast_chunk(values.tobytes(), np.dtype('<f8'), 'BF16')
+    restored = (np.frombuffer(converted, dtype='<u2').astype('<u4') << 16).view('<f4')
+    assert restored[:3].tolist() == [1.0, -2.5, np.inf]
+    assert np.isnan(restored[3])
+    assert restored[4] == np.inf
+
+
+def test_transform_warns_about_bf16_overflow() -> None:
+    source = _build_f64_safetensors(np.array([1e39, 1.0, 2.0, 3.0]))
+    output = io.BytesIO()
+    report = transform_aivm_tensors(io.BytesIO(source), output, cast_dtype=TensorCastDtype.BFloat16)
+    assert report.cast_tensors == ['weight']
+    assert len(report.warnings) == 1
+    assert 'BF16' in report.warnings[0] and '1 個' in report.warnings[0]
@@ -0,0 +1,106 @@
+import io
+import random
+import threading
+from pathlib import Path
+from typing import BinaryIO
+
+import pytest
+
+import aivmlib
+from aivmlib.utils import get_file_size, pread
+
+
+_THREAD_COUNT = 16
+_READS_PER_THREAD = 500
+
+
+class _UnbufferedReader(io.RawIOBase):
+    """ファイルディスクリプタも BytesIO のバッファも持たない、シークと読み取りのみに対応したファイルオブジェクト"""
+
+    def __init__(self, data: bytes) -> None:
+        super().__init__()
+        self._buffer = io.BytesIO(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        return self._buffer.read(size)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._buffer.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._buffer.tell()
+
+
+def _stress_pread(file: BinaryIO, data: bytes) -> None:
+    """
+    複数のスレッドから同一のファイルオブジェクトのランダムな範囲を同時に読み取り、内容と呼び出し元のカーソル位置を検証する
+    """
+
+    file.seek(1234)
+    errors: list[BaseException] = []
+    barrier = threading.Barrier(_THREAD_COUNT)
+
+    def worker(seed: int) -> None:
+        rng = random.Random(seed)
+        try:
+            barrier.wait()
+            for _ in range(_READS_PER_THREAD):
+                offset = rng.randrange(len(data) + 16)
+                size = rng.randrange(1, 8192)
+                assert pread(file, size, offset) == data[offset : offset + size]
+                assert get_file_size(file) == len(data)
+        except BaseException as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(_THREAD_COUNT)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert file.tell() == 1234
+
+
+@pytest.fixture
+def random_bytes() -> bytes:
+    return random.Random(0).randbytes(1024 * 1024)
+
+
+def test_pread_regular_file_from_many_threads(tmp_path: Path, random_bytes: bytes) -> None:
+    path = tmp_path / 'data.bin'
+    path.write_bytes(random_bytes)
+    with path.open('rb') as file:
+        _stress_pread(file, random_bytes)
+
+
+def test_pread_bytesio_from_many_threads(random_bytes: bytes) -> None:
+    _stress_pread(io.BytesIO(random_bytes), random_bytes)
+
+
+def test_pread_seek_fallback_from_many_threads(random_bytes: bytes) -> None:
+    _stress_pread(_UnbufferedReader(random_bytes), random_bytes)  # type: ignore[arg-type]
+
+
+def test_read_metadata_keeps_cursor(aivm_path: Path, aivmx_path: Path) -> None:
+    for path, reader in ((aivm_path, aivmlib.read_aivm_metadata), (aivmx_path, aivmlib.read_aivmx_metadata)):
+        with path.open('rb') as file:
+            file.seek(7)
+            expected = reader(file)
+            assert file.tell() == 7
+
+            # 同一のファイルオブジェクトを複数のスレッドから同時に読み込んでも、同じ結果が得られる
+            results: list[object] = []
+            threads = [threading.Thread(target=lambda: results.append(reader(file))) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert len(results) == 8
+            assert all(result.manifest == expected.manifest for result in results)  # type: ignore[attr-defined]
+            assert file.tell() == 7
@@ -0,0 +1,126 @@
+import io
+import itertools
+from pathlib import Path
+
+import onnx
+import pytest
+
+import aivmlib
+import aivmlib.writer
+from aivmlib import AivmLimitExceededError
+from aivmlib.schemas.aivm_manifest import AivmMetadata, ModelFormat
+from aivmlib.writer import (
+    AivmCancellationToken,
+    AivmWriteCancelledError,
+    AivmWritePhase,
+    AivmWriteProgress,
+    estimate_write_memory,
+    write_aivm_file,
+    write_aivmx_file,
+)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch: pytest.MonkeyPatch) -> None:
+    # テスト用の小さなファイルでも、複数のチャンクに分けて書き込まれるようにする
+    monkeypatch.setattr(aivmlib.writer, 'DEFAULT_CHUNK_SIZE', 1000)
+
+
+def _list_files(directory: Path) -> list[str]:
+    return sorted(path.name for path in directory.iterdir())
+
+
+def test_write_reports_progress(
+    tmp_path: Path, safetensors_bytes: bytes, onnx_bytes: bytes, aivm_metadata: AivmMetadata
+) -> None:
+    events: list[AivmWriteProgress] = []
+    output_path = tmp_path / 'output.aivm'
+    write_aivm_file(io.BytesIO(safetensors_bytes), output_path, aivm_metadata, progress_callback=events.append)
+    assert output_path.read_bytes() == aivmlib.write_aivm_metadata(io.BytesIO(safetensors_bytes), aivm_metadata)
+
+    # Metadata → Payload (チャンクごと) → Finalize の順に通知され、書き込み済みのバイト数は単調に増加する
+    phases = [event.phase for event in events]
+    assert phases[0] == AivmWritePhase.Metadata
+    assert phases[-1] == AivmWritePhase.Finalize
+    assert phases.count(AivmWritePhase.Payload) > 2
+    payload_events = [event for event in events if event.phase == AivmWritePhase.Payload]
+    assert all(a.bytes_done <= b.bytes_done for a, b in itertools.pairwise(payload_events))
+    assert all(event.bytes_total == output_path.stat().st_size for event in payload_events)
+    assert events[-1].bytes_done == events[-1].bytes_total == output_path.stat().st_size
+
+    events.clear()
+    aivmx_output_path = tmp_path / 'output.aivmx'
+    write_aivmx_file(io.BytesIO(onnx_bytes), aivmx_output_path, aivm_metadata, progress_callback=events.append)
+    assert events[-1].bytes_done == aivmx_output_path.stat().st_size
+    with aivmx_output_path.open('rb') as file:
+        assert aivmlib.read_aivmx_metadata(file).manifest.name == aivm_metadata.manifest.name
+    onnx.checker.check_model(onnx.load_model_from_string(aivmx_output_path.read_bytes()))
+
+
+@pytest.mark.parametrize('cancel_at', [0, 1, 3, -1])
+def test_cancel_removes_temporary_file(
+    tmp_path: Path, safetensors_bytes: bytes, aivm_metadata: AivmMetadata, cancel_at: int
+) -> None:
+    # 既存の出力先は、キャンセルされた場合はそのまま残る
+    output_path = tmp_path / 'output.aivm'
+    output_path.write_bytes(b'existing')
+    token = AivmCancellationToken()
+    events: list[AivmWriteProgress] = []
+
+    def on_progress(progress: AivmWriteProgress) -> None:
+        events.append(progress)
+        # -1: Weight 部分をすべて書き込み終え、出力先に置き換える直前
+        if len(events) - 1 == cancel_at or (cancel_at == -1 and progress.bytes_done == progress.bytes_total > 0):
+            token.cancel()
+
+    with pytest.raises(AivmWriteCancelledError):
+        write_aivm_file(
+            io.BytesIO(safetensors_bytes),
+            output_path,
+            aivm_metadata,
+            progress_callback=on_progress,
+            cancellation_token=token,
+        )
+    assert token.cancelled
+    assert output_path.read_bytes() == b'existing'
+    assert _list_files(tmp_path) == ['output.aivm']
+
+
+def test_interrupt_removes_temporary_file(tmp_path: Path, onnx_bytes: bytes, aivm_metadata: AivmMetadata) -> None:
+    output_path = tmp_path / 'output.aivmx'
+
+    def on_progress(progress: AivmWriteProgress) -> None:
+        if progress.phase == AivmWritePhase.Payload and progress.bytes_done > 0:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        write_aivmx_file(io.BytesIO(onnx_bytes), output_path, aivm_metadata, progress_callback=on_progress)
+    assert _list_files(tmp_path) == []
+
+
+def test_max_memory(tmp_path: Path, safetensors_bytes: bytes, onnx_bytes: bytes, aivm_metadata: AivmMetadata) -> None:
+    for source_bytes, model_format, write in (
+        (safetensors_bytes, ModelFormat.Safetensors, write_aivm_file),
+        (onnx_bytes, ModelFormat.ONNX, write_aivmx_file),
+    ):
+        required_memory = estimate_write_memory(io.BytesIO(source_bytes), aivm_metadata, model_format)
+        assert required_memory > aivmlib.writer.MIN_CHUNK_SIZE
+
+        # 見積もりが上限を超える場合は、出力先を作成する前にエラーとなる
+        output_path = tmp_path / f'output.{model_format}'
+        events: list[AivmWriteProgress] = []
+        with pytest.raises(AivmLimitExceededError):
+            write(
+                io.BytesIO(source_bytes),
+                output_path,
+                aivm_metadata,
+                progress_callback=events.append,
+                max_memory=required_memory - 1,
+            )
+        assert [event.phase for event in events] == [AivmWritePhase.Metadata]
+        assert not output_path.exists()
+
+        # 見積もりちょうどの上限であれば書き込める
+        write(io.BytesIO(source_bytes), output_path, aivm_metadata, max_memory=required_memory)
+        assert output_path.exists()
+    assert _list_files(tmp_path) == ['output.ONNX', 'output.Safetensors']